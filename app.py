@@ -9,16 +9,56 @@ Features:
 """
 
 import os
+import copy
+import atexit
+import logging
+import tempfile
+import threading
+from importlib.util import find_spec
 from datetime import datetime, timedelta
-from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from functools import partial, wraps
+from collections import deque
+from flask import (Flask, Response, current_app, render_template, request, redirect, url_for, flash, session,
+                   jsonify, send_file)
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.local import LocalProxy
+import config
+from store import MemoryStore, DuplicateKeyError, PaymentError, TransitionError, SLOT_TIMES, PAYMENT_METHODS
+from metrics import Metrics, CountingStore, SamplingProfiler
+from reference import ReferenceCache
+from search import SearchIndex
+from tasks import TaskQueue, TaskExecutor, TASK_STATUSES
+from receipts import receipt_path, write_receipt
+from audit import AuditLog, AUDIT_ACTIONS, query_directory
+from sweeper import Sweeper
+from exports import EXPORT_DATASETS, EXPORT_FORMATS, export_rows, encode_export
+from importer import IMPORT_KINDS, IMPORT_FORMATS, format_of, open_text, read_records, run_import
+
+# reports.py (and NumPy with it) is imported on the first report request;
+# without NumPy /admin/reports is unavailable
+REPORTS_AVAILABLE = find_spec('numpy') is not None
 
 # ============================================
 # Flask App Configuration
 # ============================================
 
-app = Flask(__name__)
-app.secret_key = 'smart_healthcare_secret_key_2024'
+# The routes and error handlers below, added to every app create_app() builds
+ROUTES = []
+ERROR_HANDLERS = {}
+
+def route(rule, **options):
+    """Decorator like app.route, for the apps create_app() builds"""
+    def register(f):
+        ROUTES.append((rule, f, options))
+        return f
+    return register
+
+def errorhandler(code):
+    """Decorator like app.errorhandler, for the apps create_app() builds"""
+    def register(f):
+        ERROR_HANDLERS[code] = f
+        return f
+    return register
 
 # ============================================
 # Mock Database (Replace with Oracle in production)
@@ -58,37 +98,308 @@ PATIENTS = {
     3: {'user_id': 7, 'name': 'Amit Verma', 'dob': '1995-12-10', 'gender': 'Male', 'phone': '9123456787', 'blood_group': 'O+', 'address': 'Bangalore'},
 }
 
-# Appointments
-APPOINTMENTS = {}
-appointment_counter = 1
+# ============================================
+# Storage Backend
+# ============================================
+
+def create_store(settings):
+    """Build the configured store, seeded with the demo tables above"""
+    backend = settings['STORE_BACKEND']
+    if backend == 'sqlite':
+        from sqlite_store import SqliteStore
+        # Shared even with one worker: importer.py may write to the
+        # database meanwhile, see Services.poll_changes
+        sqlite = SqliteStore(settings['SQLITE_PATH'], shared=True)
+        sqlite.seed(USERS, DEPARTMENTS, DOCTORS, PATIENTS)
+        return sqlite
+    if backend == 'memory':
+        if settings['WORKERS'] > 1:
+            raise ValueError('HEALTHCARE_WORKERS > 1 needs HEALTHCARE_STORE=sqlite: '
+                             'the memory store is private to each process')
+        # Copies, so every store built in this process starts from the demo data
+        memory = MemoryStore(*copy.deepcopy((USERS, DEPARTMENTS, DOCTORS, PATIENTS)))
+        if settings['DATA_DIR']:
+            # Snapshot + journal persistence, see journal.py
+            from journal import Persistence
+            persistence = Persistence(memory, settings['DATA_DIR'],
+                                      sync_interval=settings['JOURNAL_SYNC_INTERVAL'],
+                                      checkpoint_interval=settings['CHECKPOINT_INTERVAL'])
+            persistence.open()
+            atexit.register(persistence.close)
+        return memory
+    raise ValueError(f'Unknown store backend: {backend}')
+
+# ============================================
+# Services
+# ============================================
+
+# Audit logs open in this process by directory: apps with the same
+# settings share one, since two writers would corrupt its segments
+audit_logs = {}
+audit_logs_lock = threading.Lock()
+
+def open_audit_log(directory, flush_interval):
+    with audit_logs_lock:
+        log = audit_logs.get(directory)
+        if log is None:
+            log = audit_logs[directory] = AuditLog(directory, flush_interval=flush_interval)
+            log.start()
+            atexit.register(log.close)
+        return log
+
+class Services:
+    """The store, indexes and background threads of one app (app.extensions['healthcare'])
+
+    Each is built from the app's settings on first use, so creating an app
+    opens nothing: recovering the journal or seeding the database waits
+    for the first request that needs the store. The module globals below
+    (store, audit_log, ...) resolve to the current app's.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        # Request timing and store call counts, see metrics.py
+        self.metrics = Metrics()
+        self.profiler = None
+        # Doctor and department views, rebuilt only after an admin route
+        # changes a doctor or department and calls reference.bump(), see
+        # reference.py
+        self.reference = ReferenceCache()
+        self.sweeper = None
+        self.raw_store = None
+        # Audit trail directory, set with audit_log (which may be in a
+        # subdirectory of it)
+        self.audit_dir = None
+        self._built = {}
+        self._lock = threading.RLock()
 
-# Medical Records
-MEDICAL_RECORDS = {}
-record_counter = 1
+    def _once(self, name, build):
+        try:
+            return self._built[name]
+        except KeyError:
+            with self._lock:
+                if name not in self._built:
+                    self._built[name] = build()
+                return self._built[name]
 
-# Prescriptions
-PRESCRIPTIONS = {}
-prescription_counter = 1
+    # Appointments, records, bills and payments live in the store;
+    # `raw_store` is the store itself, `store` the same counted by metrics
+    @property
+    def store(self):
+        return self._once('store', self._build_store)
 
-# Bills
-BILLS = {}
-bill_counter = 1
+    def _build_store(self):
+        store = self.install_store(create_store(self.settings))
+        self._start_sweeper(store)
+        # Tasks queued before a restart go on now rather than with the next one
+        self.tasks
+        return store
 
-# Payments
-PAYMENTS = {}
-payment_counter = 1
+    def install_store(self, raw_store):
+        """Serve the app from `raw_store`, with new indexes over it"""
+        with self._lock:
+            self.raw_store = raw_store
+            store = CountingStore(raw_store, self.metrics) if self.settings['METRICS_ENABLED'] else raw_store
+            if getattr(raw_store, 'shared', False):
+                # Other processes' admin changes and imports reach this one
+                # through the store
+                store.subscribe(self._reference_changed)
+            self.reference.bump()
+            self._built = {name: service for name, service in self._built.items()
+                           if name not in ('reports', 'search_index')}
+            self._built['store'] = store
+            return store
+
+    def _reference_changed(self, event, *args):
+        if event in ('doctor', 'doctor_available', 'department', 'reset'):
+            self.reference.bump()
+
+    def poll_changes(self):
+        """Feed what other processes (workers, importer.py) committed to the database to this one's caches"""
+        self.store
+        self.raw_store.poll_changes()
+
+    # Columnar copy for /admin/reports (None without NumPy) and the
+    # typeahead indexes, each loaded on its first request
+    @property
+    def reports(self):
+        return self._once('reports', self._build_reports)
+
+    def _build_reports(self):
+        if not REPORTS_AVAILABLE:
+            return None
+        from reports import ReportEngine
+        return ReportEngine(self.store)
+
+    @property
+    def search_index(self):
+        return self._once('search_index', lambda: SearchIndex(self.store))
+
+    # Receipts and e-mails run after the response on a few worker threads,
+    # see tasks.py
+    @property
+    def tasks(self):
+        return self._once('tasks', self._build_tasks)
+
+    def _build_tasks(self):
+        settings = self.settings
+        executor = TaskExecutor(TaskQueue(settings['TASK_QUEUE_PATH']),
+                                workers=settings['TASK_WORKERS'],
+                                max_attempts=settings['TASK_MAX_ATTEMPTS'],
+                                retry_delay=settings['TASK_RETRY_DELAY'],
+                                on_finish=self._task_finished if settings['METRICS_ENABLED'] else None)
+        executor.task('receipt')(partial(receipt_task, self))
+        executor.task('notify')(partial(notify_task, self))
+        executor.start()
+        atexit.register(executor.stop)
+        return executor
+
+    def _task_finished(self, name, outcome, seconds):
+        self.metrics.inc('healthcare_tasks_total', (('task', name), ('outcome', outcome)))
+        self.metrics.observe('healthcare_task_seconds', (('task', name),), seconds)
+
+    # Every read or change of patient data, like PATIENT_AUDIT_LOG;
+    # appending takes no lock and a background thread writes the entries
+    # in batches, see audit.py (one log per worker process, in a
+    # worker-<N> subdirectory; importer.py writes to import-<pid>)
+    @property
+    def audit_log(self):
+        return self._once('audit_log', self._build_audit_log)
+
+    def _build_audit_log(self):
+        settings = self.settings
+        directory = self.audit_dir = settings['AUDIT_DIR'] or tempfile.mkdtemp(prefix='healthcare-audit-')
+        if settings['WORKERS'] > 1:
+            directory = os.path.join(directory, f"worker-{settings['WORKER_ID']}")
+        return open_audit_log(directory, settings['AUDIT_FLUSH_INTERVAL'])
+
+    # Marks past-due appointments NO_SHOW and archives old ones, see
+    # sweeper.py; started with the store (with several workers only the
+    # first one runs it)
+    def _start_sweeper(self, store):
+        if self.settings['WORKER_ID'] != 0:
+            return
+        self.sweeper = Sweeper(store, no_show_after=self.settings['NO_SHOW_AFTER_MINUTES'] * 60,
+                               archive_after_days=self.settings['ARCHIVE_AFTER_DAYS'],
+                               on_close=partial(appointment_closed, self))
+        self.sweeper.start()
+        atexit.register(self.sweeper.stop)
+
+def services():
+    """The current app's Services"""
+    return current_app.extensions['healthcare']
+
+store = LocalProxy(lambda: services().store)
+reports = LocalProxy(lambda: services().reports)
+search_index = LocalProxy(lambda: services().search_index)
+tasks = LocalProxy(lambda: services().tasks)
+audit_log = LocalProxy(lambda: services().audit_log)
+metrics = LocalProxy(lambda: services().metrics)
+reference = LocalProxy(lambda: services().reference)
+
+# ============================================
+# Background Tasks
+# ============================================
+
+mail_log = logging.getLogger('healthcare.mail')
+
+def receipt_task(services, bill_id):
+    """Write the PDF receipt of a bill"""
+    store = services.store
+    bill = store.get_bill(bill_id)
+    if bill is None:
+        raise LookupError(f'Bill #{bill_id} not found')
+    write_receipt(services.settings['RECEIPT_DIR'], bill_id, bill, store.get_patient(bill['patient_id']) or {})
+
+def notify_task(services, patient_id, subject, body):
+    """E-mail a patient (logged only when no SMTP host is configured)"""
+    store, settings = services.store, services.settings
+    patient = store.get_patient(patient_id)
+    user = store.get_user(patient['user_id']) if patient else None
+    if not user or not user.get('email'):
+        return
+    if not settings['SMTP_HOST']:
+        mail_log.info('To %s: %s', user['email'], subject)
+        return
+    # Imported here, as most deployments only log: smtplib and the email
+    # package take longer to import than the rest of this module
+    import smtplib
+    from email.mime.text import MIMEText
+    # MIMEText rather than EmailMessage: a fifth of the CPU time, which the
+    # workers would otherwise take from request threads under the GIL
+    message = MIMEText(body, 'plain', 'utf-8')
+    message['From'] = settings['MAIL_FROM']
+    message['To'] = user['email']
+    message['Subject'] = subject
+    # A refused or unreachable server raises, and the task is retried
+    with smtplib.SMTP(settings['SMTP_HOST'], settings['SMTP_PORT'], timeout=10) as smtp:
+        smtp.sendmail(settings['MAIL_FROM'], [user['email']], message.as_string())
+
+# ============================================
+# Audit Trail
+# ============================================
+
+def audit(action, resource, patient_ids, **detail):
+    """Record that the logged-in user read or changed (READ / CREATE / UPDATE) these patients' data"""
+    changed_by, role = session.get('username'), session.get('role')
+    for patient_id in patient_ids:
+        audit_log.append(patient_id, action, resource, changed_by, role, detail or None)
+
+def appointment_closed(services, apt_id):
+    """Audit an appointment the sweeper marked NO_SHOW"""
+    apt = services.store.get_appointment(apt_id)
+    if apt is not None:
+        services.audit_log.append(apt['patient_id'], 'UPDATE', 'appointment', 'system', 'SYSTEM',
+                                  {'appointment_id': apt_id, 'status': 'NO_SHOW'})
+
+# ============================================
+# Reference Data
+# ============================================
+
+def cached_doctors():
+    """{doctor_id: doctor}"""
+    return reference.get('doctors', store.doctors)
+
+def cached_departments():
+    """{dept_id: department}"""
+    return reference.get('departments', store.departments)
+
+def available_doctors(dept_id):
+    """(doctor_id, doctor) pairs of the available doctors in a department"""
+    def build():
+        by_dept = {}
+        for doc_id, doc in cached_doctors().items():
+            if doc['available']:
+                by_dept.setdefault(doc['dept_id'], []).append((doc_id, doc))
+        return by_dept
+    return reference.get('available_by_department', build).get(dept_id, [])
+
+def cached_json(key, build):
+    """JSON response of a reference view, or 304 if the client's ETag is current"""
+    body, etag = reference.serialized(key, build, current_app.json.dumps)
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 # ============================================
 # Helper Functions
 # ============================================
 
+# Outcome labels of healthcare_auth_checks_total
+AUTH_ALLOWED = (('outcome', 'allowed'),)
+AUTH_LOGIN = (('outcome', 'login_required'),)
+AUTH_DENIED = (('outcome', 'denied'),)
+
 def login_required(f):
     """Decorator to require login"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
+            metrics.inc('healthcare_auth_checks_total', AUTH_LOGIN)
             flash('Please login to access this page', 'error')
             return redirect(url_for('login'))
+        metrics.inc('healthcare_auth_checks_total', AUTH_ALLOWED)
         return f(*args, **kwargs)
     return decorated_function
 
@@ -98,11 +409,30 @@ def role_required(*roles):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             if 'user_id' not in session:
+                metrics.inc('healthcare_auth_checks_total', AUTH_LOGIN)
                 flash('Please login to access this page', 'error')
                 return redirect(url_for('login'))
             if session.get('role') not in roles:
+                metrics.inc('healthcare_auth_checks_total', AUTH_DENIED)
                 flash('You do not have permission to access this page', 'error')
                 return redirect(url_for('dashboard'))
+            metrics.inc('healthcare_auth_checks_total', AUTH_ALLOWED)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def api_role_required(*roles):
+    """Like role_required, but answers with JSON errors instead of redirects"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if 'user_id' not in session:
+                metrics.inc('healthcare_auth_checks_total', AUTH_LOGIN)
+                return jsonify({'error': 'Login required'}), 401
+            if session.get('role') not in roles:
+                metrics.inc('healthcare_auth_checks_total', AUTH_DENIED)
+                return jsonify({'error': 'Permission denied'}), 403
+            metrics.inc('healthcare_auth_checks_total', AUTH_ALLOWED)
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -117,11 +447,194 @@ def get_dashboard_url():
     else:
         return url_for('patient_dashboard')
 
+def parse_iso_date(value):
+    """Validate a YYYY-MM-DD string (None if malformed)"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+def parse_amount(value):
+    """Positive money amount with at most 2 decimals (None if invalid)"""
+    try:
+        amount = round(float(value), 2)
+    except (TypeError, ValueError):
+        return None
+    if not amount > 0:
+        return None
+    return int(amount) if amount.is_integer() else amount
+
+def parse_cursor(value):
+    """'YYYY-MM-DD_<id>' page cursor -> (date, id) (None if missing or malformed)"""
+    date, _, row_id = (value or '').rpartition('_')
+    if parse_iso_date(date) != date or not row_id.isdigit():
+        return None
+    return date, int(row_id)
+
+def format_cursor(cursor):
+    return f'{cursor[0]}_{cursor[1]}' if cursor else None
+
+def page_args():
+    """(limit, before cursor) from the query string"""
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE'], type=int)
+    return min(max(limit, 1), current_app.config['MAX_PAGE_SIZE']), parse_cursor(request.args.get('before'))
+
+def search_args():
+    """(query, limit) from the query string"""
+    limit = request.args.get('limit', current_app.config['SEARCH_LIMIT'], type=int)
+    return request.args.get('q', ''), min(max(limit, 1), current_app.config['MAX_PAGE_SIZE'])
+
+# ============================================
+# Listing Helpers
+# Each returns one page of rows shaped for the templates and the JSON API,
+# newest first, plus the cursor of the next page, and audits the read
+# ============================================
+
+def patient_appointments_page(patient_id, limit, before):
+    doctors = cached_doctors()
+    rows, cursor = store.appointments_page_for_patient(patient_id, limit, before)
+    audit('READ', 'appointments', (patient_id,))
+    appointments = []
+    for apt_id, apt in rows:
+        doctor = doctors.get(apt['doctor_id'], {})
+        appointments.append({
+            'id': apt_id,
+            'doctor_name': doctor.get('name', 'Unknown'),
+            'specialization': doctor.get('specialization', ''),
+            'date': apt['date'],
+            'time': apt['time'],
+            'status': apt['status'],
+            'reason': apt.get('reason', '')
+        })
+    return appointments, format_cursor(cursor)
+
+def doctor_appointments_page(doctor_id, limit, before):
+    rows, cursor = store.appointments_page_for_doctor(doctor_id, limit, before)
+    patients = store.get_patients(apt['patient_id'] for _, apt in rows)
+    audit('READ', 'appointments', patients)
+    appointments = []
+    for apt_id, apt in rows:
+        patient = patients.get(apt['patient_id'], {})
+        appointments.append({
+            'id': apt_id,
+            'patient_name': patient.get('name', 'Unknown'),
+            'patient_phone': patient.get('phone', ''),
+            'date': apt['date'],
+            'time': apt['time'],
+            'status': apt['status'],
+            'reason': apt.get('reason', '')
+        })
+    return appointments, format_cursor(cursor)
+
+def patient_records_page(patient_id, limit, before):
+    doctors = cached_doctors()
+    rows, cursor = store.records_page_for_patient(patient_id, limit, before)
+    audit('READ', 'records', (patient_id,))
+    # Prescriptions of all these records in one lookup
+    prescriptions = store.prescriptions_for_records([rec_id for rec_id, _ in rows])
+    records = []
+    for rec_id, rec in rows:
+        doctor = doctors.get(rec['doctor_id'], {})
+        records.append({
+            'id': rec_id,
+            'date': rec['date'],
+            'doctor_name': doctor.get('name', 'Unknown'),
+            'diagnosis': rec['diagnosis'],
+            'symptoms': rec.get('symptoms', ''),
+            'notes': rec.get('notes', ''),
+            'prescriptions': [dict(p) for p in prescriptions[rec_id]]
+        })
+    return records, format_cursor(cursor)
+
+def patient_bills_page(patient_id, limit, before):
+    rows, cursor = store.bills_page_for_patient(patient_id, limit, before)
+    audit('READ', 'bills', (patient_id,))
+    bills = []
+    for bill_id, bill in rows:
+        bills.append({
+            'id': bill_id,
+            'date': bill['date'],
+            'amount': bill['amount'],
+            'paid': bill['paid'],
+            'due': round(bill['amount'] - bill['paid'], 2),
+            'status': bill['status'],
+            'description': bill.get('description', 'Consultation')
+        })
+    return bills, format_cursor(cursor)
+
+# ============================================
+# Export Helpers
+# ============================================
+
+EXPORT_USAGE = (f"data must be one of {', '.join(EXPORT_DATASETS)} and format one of "
+                f"{', '.join(EXPORT_FORMATS)} (csv needs one dataset, not all); from/to are YYYY-MM-DD")
+
+def export_args():
+    """(data, format, doctor ids or None, from, to) from the query string (None if invalid)"""
+    data = request.args.get('data', 'all')
+    fmt = request.args.get('format', 'ndjson')
+    start, end = request.args.get('from') or None, request.args.get('to') or None
+    doctor_id = request.args.get('doctor_id', type=int)
+    dept_id = request.args.get('dept_id', type=int)
+    if (data not in EXPORT_DATASETS or fmt not in EXPORT_FORMATS or (fmt == 'csv' and data == 'all')
+            or any(d and parse_iso_date(d) != d for d in (start, end))):
+        return None
+    doctor_ids = None
+    if doctor_id is not None or dept_id is not None:
+        doctor_ids = {doc_id for doc_id, doctor in cached_doctors().items()
+                      if (doctor_id is None or doc_id == doctor_id)
+                      and (dept_id is None or doctor['dept_id'] == dept_id)}
+    return data, fmt, doctor_ids, start, end
+
+def export_response(patient_ids, data, fmt, doctor_ids, start, end):
+    """Streamed export of these patients' rows, gzip-compressed if the client accepts it"""
+    changed_by, role = session.get('username'), session.get('role')
+    # The body is produced after the view returns, with no request (or
+    # session, or current app) to resolve them from
+    app_services = services()
+
+    def audited(patient_id):
+        app_services.audit_log.append(patient_id, 'READ', 'export', changed_by, role, {'data': data})
+
+    rows = export_rows(app_services.store, data, patient_ids, cached_doctors(), cached_departments(),
+                       doctor_ids, start, end, on_patient=audited)
+    gzip = 'gzip' in request.accept_encodings
+    response = Response(encode_export(rows, data, fmt, gzip),
+                        mimetype='application/x-ndjson' if fmt == 'ndjson' else 'text/csv')
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename={data}-{datetime.now().strftime("%Y%m%d")}.{fmt}')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# ============================================
+# Import Helpers
+# ============================================
+
+IMPORT_USAGE = (f"POST a CSV or JSONL file as 'file'; kind must be one of {', '.join(IMPORT_KINDS)} "
+                f"and format one of {', '.join(IMPORT_FORMATS)} (default: from the file name)")
+
+def import_records(kind, records, changed_by, role, chunk_rows=None):
+    """Bulk import (line, row) records, see importer.py, auditing every patient created
+
+    `chunk_rows` defaults to the app's IMPORT_CHUNK_ROWS
+    """
+    if chunk_rows is None:
+        chunk_rows = current_app.config['IMPORT_CHUNK_ROWS']
+
+    def created(result):
+        audit_log.append(result[1], 'CREATE', 'patient', changed_by, role, {'import': True})
+
+    report = run_import(store, kind, records, chunk_rows, on_import=created if kind == 'patients' else None)
+    reference.bump()
+    return report
+
 # ============================================
 # Routes - Public
 # ============================================
 
-@app.route('/')
+@route('/')
 def index():
     """Home page"""
     if 'user_id' in session:
@@ -132,7 +645,7 @@ def index():
 # Routes - Authentication
 # ============================================
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     """User login - redirects if already logged in"""
     # Fix: Redirect if already logged in
@@ -147,15 +660,9 @@ def login():
     password = request.form.get('password', '')
     
     # Find user
-    user = None
-    user_id = None
-    for uid, u in USERS.items():
-        if u['username'] == username and u['password'] == password:
-            user = u
-            user_id = uid
-            break
-    
-    if user:
+    user_id, user = store.find_user(username)
+    
+    if user and user['password'] == password:
         session['user_id'] = user_id
         session['username'] = user['username']
         session['role'] = user['role']
@@ -173,18 +680,16 @@ def login():
     flash('Invalid username or password', 'error')
     return redirect(url_for('login'))
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     """User logout"""
     session.clear()
     flash('You have been logged out successfully', 'success')
     return redirect(url_for('index'))
 
-@app.route('/register', methods=['GET', 'POST'])
+@route('/register', methods=['GET', 'POST'])
 def register():
     """Patient registration - redirects if already logged in"""
-    global USERS, PATIENTS
-    
     if 'user_id' in session:
         return redirect(get_dashboard_url())
     
@@ -204,38 +709,31 @@ def register():
     address = request.form.get('address', '').strip()
     city = request.form.get('city', '').strip()
     
-    # Check if username exists
-    for u in USERS.values():
-        if u['username'] == username:
+    # Create new user and patient (the store rejects duplicates)
+    try:
+        _, patient_id = store.register_patient({
+            'username': username,
+            'password': password,
+            'role': 'PATIENT',
+            'name': f"{first_name} {last_name}",
+            'email': email
+        }, {
+            'name': f"{first_name} {last_name}",
+            'dob': dob,
+            'gender': gender,
+            'phone': phone,
+            'blood_group': blood_group,
+            'address': f"{address}, {city}"
+        })
+    except DuplicateKeyError as e:
+        if e.field == 'username':
             flash('Username already exists', 'error')
-            return redirect(url_for('register'))
-        if u['email'] == email:
+        else:
             flash('Email already registered', 'error')
-            return redirect(url_for('register'))
-    
-    # Create new user and patient
-    new_user_id = max(USERS.keys()) + 1
-    new_patient_id = max(PATIENTS.keys()) + 1
-    
-    USERS[new_user_id] = {
-        'username': username,
-        'password': password,
-        'role': 'PATIENT',
-        'name': f"{first_name} {last_name}",
-        'email': email,
-        'patient_id': new_patient_id
-    }
-    
-    PATIENTS[new_patient_id] = {
-        'user_id': new_user_id,
-        'name': f"{first_name} {last_name}",
-        'dob': dob,
-        'gender': gender,
-        'phone': phone,
-        'blood_group': blood_group,
-        'address': f"{address}, {city}"
-    }
+        return redirect(url_for('register'))
     
+    # Nobody is logged in yet, so the entry is made in the new user's name
+    audit_log.append(patient_id, 'CREATE', 'patient', username, 'PATIENT')
     flash('Registration successful! Please login.', 'success')
     return redirect(url_for('login'))
 
@@ -243,7 +741,7 @@ def register():
 # Routes - Dashboard Redirect
 # ============================================
 
-@app.route('/dashboard')
+@route('/dashboard')
 @login_required
 def dashboard():
     """Redirect to role-specific dashboard"""
@@ -253,26 +751,26 @@ def dashboard():
 # Routes - Patient Dashboard
 # ============================================
 
-@app.route('/patient/dashboard')
+@route('/patient/dashboard')
 @role_required('PATIENT')
 def patient_dashboard():
     """Patient dashboard - overview"""
     patient_id = session.get('patient_id')
     
     # Get patient's appointments
+    doctors = cached_doctors()
     my_appointments = []
-    for apt_id, apt in APPOINTMENTS.items():
-        if apt['patient_id'] == patient_id:
-            doctor = DOCTORS.get(apt['doctor_id'], {})
-            my_appointments.append({
-                'id': apt_id,
-                'doctor_name': doctor.get('name', 'Unknown'),
-                'specialization': doctor.get('specialization', ''),
-                'date': apt['date'],
-                'time': apt['time'],
-                'status': apt['status'],
-                'reason': apt.get('reason', '')
-            })
+    for apt_id, apt in store.appointments_for_patient(patient_id):
+        doctor = doctors.get(apt['doctor_id'], {})
+        my_appointments.append({
+            'id': apt_id,
+            'doctor_name': doctor.get('name', 'Unknown'),
+            'specialization': doctor.get('specialization', ''),
+            'date': apt['date'],
+            'time': apt['time'],
+            'status': apt['status'],
+            'reason': apt.get('reason', '')
+        })
     
     # Sort by date
     my_appointments.sort(key=lambda x: x['date'], reverse=True)
@@ -282,13 +780,11 @@ def patient_dashboard():
     completed = [a for a in my_appointments if a['status'] == 'COMPLETED']
     
     # Get pending bills
-    pending_amount = sum(
-        b['amount'] for b in BILLS.values() 
-        if b['patient_id'] == patient_id and b['status'] == 'PENDING'
-    )
+    pending_amount = store.pending_amount(patient_id)
     
     # Get medical records count
-    records_count = sum(1 for r in MEDICAL_RECORDS.values() if r['patient_id'] == patient_id)
+    records_count = store.record_count(patient_id)
+    audit('READ', 'dashboard', (patient_id,))
     
     return render_template('patient/dashboard.html',
         appointments=my_appointments[:5],
@@ -298,84 +794,80 @@ def patient_dashboard():
         records_count=records_count
     )
 
-@app.route('/patient/appointments')
+@route('/patient/appointments')
 @role_required('PATIENT')
 def patient_appointments():
     """Patient - view all appointments"""
-    patient_id = session.get('patient_id')
-    
-    appointments = []
-    for apt_id, apt in APPOINTMENTS.items():
-        if apt['patient_id'] == patient_id:
-            doctor = DOCTORS.get(apt['doctor_id'], {})
-            appointments.append({
-                'id': apt_id,
-                'doctor_name': doctor.get('name', 'Unknown'),
-                'specialization': doctor.get('specialization', ''),
-                'date': apt['date'],
-                'time': apt['time'],
-                'status': apt['status'],
-                'reason': apt.get('reason', '')
-            })
-    
-    appointments.sort(key=lambda x: x['date'], reverse=True)
-    
-    return render_template('patient/appointments.html', appointments=appointments)
+    limit, before = page_args()
+    appointments, next_cursor = patient_appointments_page(session.get('patient_id'), limit, before)
+    return render_template('patient/appointments.html',
+        appointments=appointments,
+        next_cursor=next_cursor,
+        before=before
+    )
 
-@app.route('/patient/book-appointment', methods=['GET', 'POST'])
+@route('/patient/book-appointment', methods=['GET', 'POST'])
 @role_required('PATIENT')
 def book_appointment():
     """Patient - book new appointment"""
     if request.method == 'GET':
         today = datetime.now().strftime('%Y-%m-%d')
         return render_template('patient/book_appointment.html',
-            departments=DEPARTMENTS,
-            doctors=DOCTORS,
+            departments=cached_departments(),
+            doctors=cached_doctors(),
+            slot_times=SLOT_TIMES,
             today=today
         )
     
-    global APPOINTMENTS, appointment_counter
-    
     doctor_id = int(request.form.get('doctor_id'))
-    apt_date = request.form.get('appointment_date')
+    apt_date = parse_iso_date(request.form.get('appointment_date', ''))
     apt_time = request.form.get('appointment_time')
     reason = request.form.get('reason', '')
     
-    # Check for conflicts
-    for apt in APPOINTMENTS.values():
-        if (apt['doctor_id'] == doctor_id and 
-            apt['date'] == apt_date and 
-            apt['time'] == apt_time and 
-            apt['status'] != 'CANCELLED'):
-            flash('This time slot is already booked. Please choose another.', 'error')
-            return redirect(url_for('book_appointment'))
-    
-    # Create appointment
-    APPOINTMENTS[appointment_counter] = {
-        'patient_id': session.get('patient_id'),
-        'doctor_id': doctor_id,
-        'date': apt_date,
-        'time': apt_time,
-        'status': 'SCHEDULED',
-        'reason': reason,
-        'created_at': datetime.now().isoformat()
-    }
-    
-    doctor = DOCTORS.get(doctor_id, {})
+    if apt_date is None:
+        flash('Please choose a valid appointment date.', 'error')
+        return redirect(url_for('book_appointment'))
+    if apt_time not in SLOT_TIMES:
+        flash('Please choose one of the listed time slots.', 'error')
+        return redirect(url_for('book_appointment'))
+    
+    # Create appointment (fails if the slot is already taken)
+    try:
+        apt_id = store.book_appointment({
+            'patient_id': session.get('patient_id'),
+            'doctor_id': doctor_id,
+            'date': apt_date,
+            'time': apt_time,
+            'status': 'SCHEDULED',
+            'reason': reason,
+            'created_at': datetime.now().isoformat()
+        })
+    except DuplicateKeyError:
+        flash('This time slot is already booked. Please choose another.', 'error')
+        return redirect(url_for('book_appointment'))
+    
+    doctor = store.get_doctor(doctor_id) or {}
+    audit('CREATE', 'appointment', (session.get('patient_id'),),
+          appointment_id=apt_id, doctor_id=doctor_id, date=apt_date, time=apt_time)
+    tasks.submit('notify', patient_id=session.get('patient_id'),
+                 subject='Appointment confirmed',
+                 body=f'Your appointment with {doctor.get("name")} on {apt_date} at {apt_time} is confirmed.')
     flash(f'Appointment booked successfully with {doctor.get("name")} on {apt_date} at {apt_time}!', 'success')
-    appointment_counter += 1
     
     return redirect(url_for('patient_appointments'))
 
-@app.route('/patient/cancel-appointment/<int:apt_id>', methods=['POST'])
+@route('/patient/cancel-appointment/<int:apt_id>', methods=['POST'])
 @role_required('PATIENT')
 def cancel_appointment(apt_id):
     """Patient - cancel appointment"""
-    if apt_id in APPOINTMENTS:
-        apt = APPOINTMENTS[apt_id]
+    apt = store.get_appointment(apt_id)
+    if apt is not None:
         if apt['patient_id'] == session.get('patient_id'):
-            if apt['status'] == 'SCHEDULED':
-                apt['status'] = 'CANCELLED'
+            if store.transition_appointment(apt_id, 'CANCELLED', allowed=('SCHEDULED',)):
+                audit('UPDATE', 'appointment', (apt['patient_id'],), appointment_id=apt_id, status='CANCELLED')
+                tasks.submit('notify', patient_id=apt['patient_id'],
+                             subject='Appointment cancelled',
+                             body=f"Your appointment on {apt['date']} at {apt['time']} has been cancelled.")
                 flash('Appointment cancelled successfully', 'success')
             else:
                 flash('Only scheduled appointments can be cancelled', 'error')
@@ -383,56 +875,90 @@ def cancel_appointment(apt_id):
             flash('Unauthorized', 'error')
     return redirect(url_for('patient_appointments'))
 
-@app.route('/patient/records')
+@route('/patient/records')
 @role_required('PATIENT')
 def patient_records():
     """Patient - view medical records"""
-    patient_id = session.get('patient_id')
-    
-    records = []
-    for rec_id, rec in MEDICAL_RECORDS.items():
-        if rec['patient_id'] == patient_id:
-            doctor = DOCTORS.get(rec['doctor_id'], {})
-            # Get prescriptions for this record
-            presc = [p for p in PRESCRIPTIONS.values() if p['record_id'] == rec_id]
-            records.append({
-                'id': rec_id,
-                'date': rec['date'],
-                'doctor_name': doctor.get('name', 'Unknown'),
-                'diagnosis': rec['diagnosis'],
-                'symptoms': rec.get('symptoms', ''),
-                'notes': rec.get('notes', ''),
-                'prescriptions': presc
-            })
-    
-    records.sort(key=lambda x: x['date'], reverse=True)
-    return render_template('patient/records.html', records=records)
+    limit, before = page_args()
+    records, next_cursor = patient_records_page(session.get('patient_id'), limit, before)
+    return render_template('patient/records.html',
+        records=records,
+        next_cursor=next_cursor,
+        before=before
+    )
 
-@app.route('/patient/bills')
+@route('/patient/bills')
 @role_required('PATIENT')
 def patient_bills():
     """Patient - view bills"""
     patient_id = session.get('patient_id')
-    
-    bills = []
-    for bill_id, bill in BILLS.items():
-        if bill['patient_id'] == patient_id:
-            bills.append({
-                'id': bill_id,
-                'date': bill['date'],
-                'amount': bill['amount'],
-                'status': bill['status'],
-                'description': bill.get('description', 'Consultation')
-            })
-    
-    bills.sort(key=lambda x: x['date'], reverse=True)
-    return render_template('patient/bills.html', bills=bills)
+    limit, before = page_args()
+    bills, next_cursor = patient_bills_page(patient_id, limit, before)
+    return render_template('patient/bills.html',
+        bills=bills,
+        next_cursor=next_cursor,
+        before=before,
+        statement=store.statement_for_patient(patient_id),
+        balance=store.pending_amount(patient_id),
+        payment_methods=PAYMENT_METHODS
+    )
+
+@route('/patient/pay-bill/<int:bill_id>', methods=['POST'])
+@role_required('PATIENT')
+def pay_bill(bill_id):
+    """Patient - pay a bill in full or in part"""
+    bill = store.get_bill(bill_id)
+    if bill is None or bill['patient_id'] != session.get('patient_id'):
+        flash('Bill not found', 'error')
+        return redirect(url_for('patient_bills'))
+    
+    amount = parse_amount(request.form.get('amount'))
+    method = request.form.get('method', 'CASH')
+    if amount is None or method not in PAYMENT_METHODS:
+        flash('Please enter a valid amount and payment method.', 'error')
+        return redirect(url_for('patient_bills'))
+    
+    try:
+        store.pay_bill(bill_id, {
+            'amount': amount,
+            'method': method,
+            'date': datetime.now().strftime('%Y-%m-%d'),
+            'reference': request.form.get('reference', '')
+        })
+    except PaymentError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('patient_bills'))
+    
+    bill = store.get_bill(bill_id)
+    audit('UPDATE', 'bill', (bill['patient_id'],), bill_id=bill_id, amount=amount, method=method)
+    if bill['status'] == 'PAID':
+        # Reissue the receipt, now marked paid
+        tasks.submit('receipt', bill_id=bill_id)
+        flash(f'Payment of ₹{amount} received. Bill #{bill_id} is fully paid.', 'success')
+    else:
+        flash(f'Payment of ₹{amount} received. ₹{round(bill["amount"] - bill["paid"], 2)} still due on bill #{bill_id}.', 'success')
+    return redirect(url_for('patient_bills'))
+
+@route('/patient/receipt/<int:bill_id>')
+@role_required('PATIENT')
+def patient_receipt(bill_id):
+    """Patient - download a bill's PDF receipt"""
+    bill = store.get_bill(bill_id)
+    if bill is None or bill['patient_id'] != session.get('patient_id'):
+        flash('Bill not found', 'error')
+        return redirect(url_for('patient_bills'))
+    path = receipt_path(current_app.config['RECEIPT_DIR'], bill_id)
+    if not os.path.exists(path):
+        # Its task has not run yet (or the receipts were cleared)
+        path = write_receipt(current_app.config['RECEIPT_DIR'], bill_id, bill, store.get_patient(bill['patient_id']) or {})
+    audit('READ', 'receipt', (bill['patient_id'],), bill_id=bill_id)
+    return send_file(path, mimetype='application/pdf', download_name=f'bill-{bill_id}.pdf')
 
 # ============================================
 # Routes - Doctor Dashboard
 # ============================================
 
-@app.route('/doctor/dashboard')
+@route('/doctor/dashboard')
 @role_required('DOCTOR')
 def doctor_dashboard():
     """Doctor dashboard - today's appointments"""
@@ -441,12 +967,17 @@ def doctor_dashboard():
     
     # Get today's appointments
     todays_appointments = []
-    all_appointments = []
-    
-    for apt_id, apt in APPOINTMENTS.items():
-        if apt['doctor_id'] == doctor_id:
-            patient = PATIENTS.get(apt['patient_id'], {})
-            apt_data = {
+    completed_today = 0
+    
+    day = store.appointments_for_doctor_on(doctor_id, today)
+    patients = store.get_patients(apt['patient_id'] for _, apt in day)
+    audit('READ', 'appointments', patients)
+    for apt_id, apt in day:
+        if apt['status'] == 'COMPLETED':
+            completed_today += 1
+        if apt['status'] in ['SCHEDULED', 'IN_PROGRESS']:
+            patient = patients.get(apt['patient_id'], {})
+            todays_appointments.append({
                 'id': apt_id,
                 'patient_name': patient.get('name', 'Unknown'),
                 'patient_phone': patient.get('phone', ''),
@@ -456,20 +987,13 @@ def doctor_dashboard():
                 'time': apt['time'],
                 'status': apt['status'],
                 'reason': apt.get('reason', '')
-            }
-            all_appointments.append(apt_data)
-            if apt['date'] == today and apt['status'] in ['SCHEDULED', 'IN_PROGRESS']:
-                todays_appointments.append(apt_data)
+            })
     
     # Sort by time
     todays_appointments.sort(key=lambda x: x['time'])
     
     # Stats
-    total_patients = len(set(a['patient_name'] for a in all_appointments))
-    completed_today = sum(1 for apt in APPOINTMENTS.values() 
-                         if apt['doctor_id'] == doctor_id and 
-                         apt['date'] == today and 
-                         apt['status'] == 'COMPLETED')
+    total_patients = store.doctor_patient_count(doctor_id)
     pending_today = len(todays_appointments)
     
     return render_template('doctor/dashboard.html',
@@ -480,104 +1004,106 @@ def doctor_dashboard():
         today=today
     )
 
-@app.route('/doctor/appointments')
+@route('/doctor/appointments')
 @role_required('DOCTOR')
 def doctor_appointments():
     """Doctor - view all appointments"""
-    doctor_id = session.get('doctor_id')
-    
-    appointments = []
-    for apt_id, apt in APPOINTMENTS.items():
-        if apt['doctor_id'] == doctor_id:
-            patient = PATIENTS.get(apt['patient_id'], {})
-            appointments.append({
-                'id': apt_id,
-                'patient_name': patient.get('name', 'Unknown'),
-                'patient_phone': patient.get('phone', ''),
-                'date': apt['date'],
-                'time': apt['time'],
-                'status': apt['status'],
-                'reason': apt.get('reason', '')
-            })
-    
-    appointments.sort(key=lambda x: x['date'], reverse=True)
-    return render_template('doctor/appointments.html', appointments=appointments)
+    limit, before = page_args()
+    appointments, next_cursor = doctor_appointments_page(session.get('doctor_id'), limit, before)
+    return render_template('doctor/appointments.html',
+        appointments=appointments,
+        next_cursor=next_cursor,
+        before=before
+    )
 
-@app.route('/doctor/consultation/<int:apt_id>', methods=['GET', 'POST'])
+@route('/doctor/consultation/<int:apt_id>', methods=['GET', 'POST'])
 @role_required('DOCTOR')
 def doctor_consultation(apt_id):
     """Doctor - consultation form"""
-    if apt_id not in APPOINTMENTS:
+    apt = store.get_appointment(apt_id)
+    if apt is None:
         flash('Appointment not found', 'error')
         return redirect(url_for('doctor_dashboard'))
     
-    apt = APPOINTMENTS[apt_id]
     if apt['doctor_id'] != session.get('doctor_id'):
         flash('Unauthorized', 'error')
         return redirect(url_for('doctor_dashboard'))
     
-    patient = PATIENTS.get(apt['patient_id'], {})
+    patient = store.get_patient(apt['patient_id']) or {}
     
     if request.method == 'GET':
-        # Mark as in progress
-        apt['status'] = 'IN_PROGRESS'
+        # Mark as in progress (a patient marked NO_SHOW may still turn up;
+        # closed and archived appointments keep their status)
+        store.transition_appointment(apt_id, 'IN_PROGRESS', allowed=('SCHEDULED', 'NO_SHOW'))
+        audit('READ', 'patient', (apt['patient_id'],), appointment_id=apt_id)
         return render_template('doctor/consultation.html',
             appointment=apt,
             apt_id=apt_id,
             patient=patient
         )
     
-    # Process consultation form
-    global MEDICAL_RECORDS, PRESCRIPTIONS, BILLS, record_counter, prescription_counter, bill_counter
-    
     diagnosis = request.form.get('diagnosis', '')
     symptoms = request.form.get('symptoms', '')
     notes = request.form.get('notes', '')
-    
-    # Create medical record
-    MEDICAL_RECORDS[record_counter] = {
-        'appointment_id': apt_id,
-        'patient_id': apt['patient_id'],
-        'doctor_id': session.get('doctor_id'),
-        'date': datetime.now().strftime('%Y-%m-%d'),
-        'diagnosis': diagnosis,
-        'symptoms': symptoms,
-        'notes': notes
-    }
-    current_record_id = record_counter
-    record_counter += 1
-    
-    # Add prescriptions
     medicine_names = request.form.getlist('medicine_name[]')
     dosages = request.form.getlist('dosage[]')
     frequencies = request.form.getlist('frequency[]')
     durations = request.form.getlist('duration[]')
+    doctor = store.get_doctor(session.get('doctor_id')) or {}
+    today = datetime.now().strftime('%Y-%m-%d')
+    
+    # Record, prescriptions, bill and status change are committed together
+    # (or not at all), see UnitOfWork in store.py
+    try:
+        with store.unit_of_work() as uow:
+            # Claim the appointment so a double submit cannot bill twice
+            # (NO_SHOW too: the sweeper may close a consultation running late)
+            uow.transition_appointment(apt_id, 'COMPLETED', allowed=('SCHEDULED', 'IN_PROGRESS', 'NO_SHOW'))
+            
+            # Create medical record
+            record = uow.add_record({
+                'appointment_id': apt_id,
+                'patient_id': apt['patient_id'],
+                'doctor_id': session.get('doctor_id'),
+                'date': today,
+                'diagnosis': diagnosis,
+                'symptoms': symptoms,
+                'notes': notes
+            })
+            
+            # Add prescriptions
+            for i in range(len(medicine_names)):
+                if medicine_names[i].strip():
+                    uow.add_prescription({
+                        'record_id': record,
+                        'medicine': medicine_names[i],
+                        'dosage': dosages[i] if i < len(dosages) else '',
+                        'frequency': frequencies[i] if i < len(frequencies) else '',
+                        'duration': durations[i] if i < len(durations) else ''
+                    })
+            
+            # Create bill
+            bill = uow.add_bill({
+                'appointment_id': apt_id,
+                'patient_id': apt['patient_id'],
+                'date': today,
+                'amount': doctor.get('fee', 500),
+                'status': 'PENDING',
+                'description': f"Consultation with {doctor.get('name', 'Doctor')}"
+            })
+    except TransitionError:
+        flash('This consultation has already been completed', 'error')
+        return redirect(url_for('doctor_dashboard'))
     
-    for i in range(len(medicine_names)):
-        if medicine_names[i].strip():
-            PRESCRIPTIONS[prescription_counter] = {
-                'record_id': current_record_id,
-                'medicine': medicine_names[i],
-                'dosage': dosages[i] if i < len(dosages) else '',
-                'frequency': frequencies[i] if i < len(frequencies) else '',
-                'duration': durations[i] if i < len(durations) else ''
-            }
-            prescription_counter += 1
-    
-    # Create bill
-    doctor = DOCTORS.get(session.get('doctor_id'), {})
-    BILLS[bill_counter] = {
-        'appointment_id': apt_id,
-        'patient_id': apt['patient_id'],
-        'date': datetime.now().strftime('%Y-%m-%d'),
-        'amount': doctor.get('fee', 500),
-        'status': 'PENDING',
-        'description': f"Consultation with {doctor.get('name', 'Doctor')}"
-    }
-    bill_counter += 1
-    
-    # Mark appointment as completed
-    apt['status'] = 'COMPLETED'
+    audit('CREATE', 'record', (apt['patient_id'],), appointment_id=apt_id, record_id=record.id, bill_id=bill.id)
+    
+    # The receipt and e-mail are written in the background, so the
+    # redirect does not wait for them
+    tasks.submit('receipt', bill_id=bill.id)
+    tasks.submit('notify', patient_id=apt['patient_id'],
+                 subject='Your consultation summary',
+                 body=f"Your consultation with {doctor.get('name', 'your doctor')} on {today} is complete. "
+                      f"Diagnosis: {diagnosis}. A bill of Rs. {doctor.get('fee', 500)} has been added to your account.")
     
     flash('Consultation completed! Medical record and bill generated.', 'success')
     return redirect(url_for('doctor_dashboard'))
@@ -586,23 +1112,30 @@ def doctor_consultation(apt_id):
 # Routes - Admin Dashboard
 # ============================================
 
-@app.route('/admin/dashboard')
+@route('/admin/dashboard')
 @role_required('ADMIN')
 def admin_dashboard():
     """Admin dashboard - overview"""
-    total_doctors = len(DOCTORS)
-    total_patients = len(PATIENTS)
-    total_appointments = len(APPOINTMENTS)
+    counts = store.counts()
+    total_doctors = counts['doctors']
+    total_patients = counts['patients']
+    total_appointments = counts['appointments']
     
-    # Revenue
-    total_revenue = sum(b['amount'] for b in BILLS.values() if b['status'] == 'PAID')
-    pending_revenue = sum(b['amount'] for b in BILLS.values() if b['status'] == 'PENDING')
+    # Revenue: what has been paid so far, and what is still due (a partly
+    # paid bill counts in both)
+    revenue = store.revenue()
+    total_revenue = revenue['collected']
+    pending_revenue = revenue['outstanding']
     
     # Recent appointments
+    recent = store.recent_appointments(5)
+    doctors = cached_doctors()
+    patients = store.get_patients(apt['patient_id'] for _, apt in recent)
+    audit('READ', 'appointments', patients)
     recent_appointments = []
-    for apt_id, apt in list(APPOINTMENTS.items())[-5:]:
-        patient = PATIENTS.get(apt['patient_id'], {})
-        doctor = DOCTORS.get(apt['doctor_id'], {})
+    for apt_id, apt in recent:
+        patient = patients.get(apt['patient_id'], {})
+        doctor = doctors.get(apt['doctor_id'], {})
         recent_appointments.append({
             'id': apt_id,
             'patient': patient.get('name', 'Unknown'),
@@ -618,37 +1151,39 @@ def admin_dashboard():
         total_revenue=total_revenue,
         pending_revenue=pending_revenue,
         recent_appointments=recent_appointments,
-        departments=DEPARTMENTS
+        status_counts=store.appointment_status_counts(),
+        departments=cached_departments()
     )
 
-@app.route('/admin/doctors')
+@route('/admin/doctors')
 @role_required('ADMIN')
 def admin_doctors():
     """Admin - manage doctors"""
-    doctors_list = []
-    for doc_id, doc in DOCTORS.items():
-        dept = DEPARTMENTS.get(doc['dept_id'], {})
-        doctors_list.append({
-            'id': doc_id,
-            'name': doc['name'],
-            'specialization': doc['specialization'],
-            'department': dept.get('name', 'Unknown'),
-            'fee': doc['fee'],
-            'phone': doc['phone'],
-            'available': doc['available']
-        })
+    departments = cached_departments()
+    def build():
+        doctors_list = []
+        for doc_id, doc in cached_doctors().items():
+            dept = departments.get(doc['dept_id'], {})
+            doctors_list.append({
+                'id': doc_id,
+                'name': doc['name'],
+                'specialization': doc['specialization'],
+                'department': dept.get('name', 'Unknown'),
+                'fee': doc['fee'],
+                'phone': doc['phone'],
+                'available': doc['available']
+            })
+        return doctors_list
     
     return render_template('admin/doctors.html', 
-        doctors=doctors_list,
-        departments=DEPARTMENTS
+        doctors=reference.get('admin_doctors', build),
+        departments=departments
     )
 
-@app.route('/admin/add-doctor', methods=['POST'])
+@route('/admin/add-doctor', methods=['POST'])
 @role_required('ADMIN')
 def admin_add_doctor():
     """Admin - add new doctor"""
-    global USERS, DOCTORS
-    
     name = request.form.get('name', '').strip()
     email = request.form.get('email', '').strip()
     phone = request.form.get('phone', '').strip()
@@ -659,111 +1194,392 @@ def admin_add_doctor():
     # Create username from name
     username = 'dr_' + name.lower().replace(' ', '_').replace('dr.', '').strip('_')
     
-    # Check if exists
-    for u in USERS.values():
-        if u['email'] == email:
+    # Create user and doctor (the store rejects duplicates)
+    try:
+        store.add_doctor({
+            'username': username,
+            'password': 'doc123',  # Default password
+            'role': 'DOCTOR',
+            'name': name,
+            'email': email
+        }, {
+            'name': name,
+            'specialization': specialization,
+            'dept_id': dept_id,
+            'fee': fee,
+            'phone': phone,
+            'experience': 0,
+            'available': True
+        })
+    except DuplicateKeyError as e:
+        if e.field == 'username':
+            flash(f'Username {username} already exists', 'error')
+        else:
             flash('Email already exists', 'error')
-            return redirect(url_for('admin_doctors'))
-    
-    # Create user and doctor
-    new_user_id = max(USERS.keys()) + 1
-    new_doctor_id = max(DOCTORS.keys()) + 1
-    
-    USERS[new_user_id] = {
-        'username': username,
-        'password': 'doc123',  # Default password
-        'role': 'DOCTOR',
-        'name': name,
-        'email': email,
-        'doctor_id': new_doctor_id
-    }
-    
-    DOCTORS[new_doctor_id] = {
-        'user_id': new_user_id,
-        'name': name,
-        'specialization': specialization,
-        'dept_id': dept_id,
-        'fee': fee,
-        'phone': phone,
-        'experience': 0,
-        'available': True
-    }
+        return redirect(url_for('admin_doctors'))
     
+    reference.bump()
     flash(f'Doctor {name} added successfully! Username: {username}, Password: doc123', 'success')
     return redirect(url_for('admin_doctors'))
 
-@app.route('/admin/toggle-doctor/<int:doc_id>')
+@route('/admin/toggle-doctor/<int:doc_id>')
 @role_required('ADMIN')
 def admin_toggle_doctor(doc_id):
     """Admin - toggle doctor availability"""
-    if doc_id in DOCTORS:
-        DOCTORS[doc_id]['available'] = not DOCTORS[doc_id]['available']
-        status = 'available' if DOCTORS[doc_id]['available'] else 'unavailable'
+    available = store.toggle_doctor(doc_id)
+    if available is not None:
+        reference.bump()
+        status = 'available' if available else 'unavailable'
         flash(f'Doctor marked as {status}', 'success')
     return redirect(url_for('admin_doctors'))
 
-@app.route('/admin/departments')
+@route('/admin/departments')
 @role_required('ADMIN')
 def admin_departments():
     """Admin - manage departments"""
-    dept_list = []
-    for dept_id, dept in DEPARTMENTS.items():
-        doctor_count = sum(1 for d in DOCTORS.values() if d['dept_id'] == dept_id)
-        dept_list.append({
-            'id': dept_id,
-            'name': dept['name'],
-            'description': dept['description'],
-            'location': dept['location'],
-            'doctor_count': doctor_count
-        })
-    return render_template('admin/departments.html', departments=dept_list)
+    def build():
+        doctor_counts = store.doctor_counts()
+        dept_list = []
+        for dept_id, dept in cached_departments().items():
+            doctor_count = doctor_counts.get(dept_id, 0)
+            dept_list.append({
+                'id': dept_id,
+                'name': dept['name'],
+                'description': dept['description'],
+                'location': dept['location'],
+                'doctor_count': doctor_count
+            })
+        return dept_list
+    return render_template('admin/departments.html', departments=reference.get('admin_departments', build))
 
-@app.route('/admin/add-department', methods=['POST'])
+@route('/admin/add-department', methods=['POST'])
 @role_required('ADMIN')
 def admin_add_department():
     """Admin - add new department"""
-    global DEPARTMENTS
-    
     name = request.form.get('name', '').strip()
     description = request.form.get('description', '').strip()
     location = request.form.get('location', '').strip()
     
-    new_dept_id = max(DEPARTMENTS.keys()) + 1
-    DEPARTMENTS[new_dept_id] = {
-        'name': name,
-        'description': description,
-        'location': location
-    }
+    try:
+        store.add_department({
+            'name': name,
+            'description': description,
+            'location': location
+        })
+    except DuplicateKeyError:
+        flash(f'Department {name} already exists', 'error')
+        return redirect(url_for('admin_departments'))
     
+    reference.bump()
     flash(f'Department {name} added successfully!', 'success')
     return redirect(url_for('admin_departments'))
 
+@route('/admin/metrics')
+@role_required('ADMIN')
+def admin_metrics():
+    """Admin - request timing and store call counts (Prometheus text format)"""
+    return metrics.prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@route('/admin/metrics/profile')
+@role_required('ADMIN')
+def admin_metrics_profile():
+    """Admin - sampled request stacks in collapsed (flame graph) format"""
+    profiler = services().profiler
+    if profiler is None:
+        return 'Profiler is off, set HEALTHCARE_PROFILE_INTERVAL to enable it\n', 404, {'Content-Type': 'text/plain'}
+    return profiler.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+def report_args():
+    """(group, from date, to date) from the query string (None if invalid)"""
+    by = request.args.get('by', 'department')
+    start, end = request.args.get('from') or None, request.args.get('to') or None
+    if by not in reports.groups or any(d and parse_iso_date(d) != d for d in (start, end)):
+        return None
+    return by, start, end
+
+@route('/admin/reports')
+@role_required('ADMIN')
+def admin_reports():
+    """Admin - revenue and appointment reports by department, doctor or month"""
+    if services().reports is None:
+        flash('Reports need NumPy: pip install numpy', 'error')
+        return redirect(url_for('admin_dashboard'))
+    args = report_args()
+    if args is None:
+        flash('Invalid report filter', 'error')
+        return redirect(url_for('admin_reports'))
+    by, start, end = args
+    return render_template('admin/reports.html',
+        by=by, start=start or '', end=end or '', groups=reports.groups,
+        revenue=reports.revenue(by, start, end),
+        appointments=reports.appointments_report(by, start, end)
+    )
+
 # ============================================
 # API Routes
 # ============================================
 
-@app.route('/api/doctors-by-department/<int:dept_id>')
+@route('/api/doctors-by-department/<int:dept_id>')
 def api_doctors_by_dept(dept_id):
-    """Get doctors by department"""
-    doctors = [
+    """Get doctors by department (ETag / If-None-Match aware)"""
+    return cached_json(('doctors_by_department', dept_id), lambda: [
         {'id': doc_id, 'name': doc['name'], 'specialization': doc['specialization'], 'fee': doc['fee']}
-        for doc_id, doc in DOCTORS.items()
-        if doc['dept_id'] == dept_id and doc['available']
+        for doc_id, doc in available_doctors(dept_id)
+    ])
+
+@route('/api/available-slots/<int:doctor_id>/<date>')
+def api_available_slots(doctor_id, date):
+    """Get free time slots of one doctor on a date"""
+    apt_date = parse_iso_date(date)
+    if apt_date is None:
+        return jsonify({'error': 'Invalid date, expected YYYY-MM-DD'}), 400
+    if doctor_id not in cached_doctors():
+        return jsonify({'error': 'Doctor not found'}), 404
+    return jsonify(store.free_slots(doctor_id, apt_date))
+
+@route('/api/available-slots/department/<int:dept_id>/<date>')
+def api_available_slots_by_dept(dept_id, date):
+    """Get free time slots of every available doctor in a department"""
+    apt_date = parse_iso_date(date)
+    if apt_date is None:
+        return jsonify({'error': 'Invalid date, expected YYYY-MM-DD'}), 400
+    doctors = [
+        {'id': doc_id, 'name': doc['name'], 'slots': store.free_slots(doc_id, apt_date)}
+        for doc_id, doc in available_doctors(dept_id)
     ]
     return jsonify(doctors)
 
+@route('/api/search/doctors')
+def api_search_doctors():
+    """Typeahead: available doctors by name, specialization or department (?q=)"""
+    query, limit = search_args()
+    doctors, departments = cached_doctors(), cached_departments()
+    # Admins also see doctors marked unavailable
+    where = None if session.get('role') == 'ADMIN' else lambda doc_id: doctors.get(doc_id, {}).get('available')
+    results = []
+    for doc_id in search_index.doctors_matching(query, limit, where):
+        doc = doctors.get(doc_id)
+        if doc is None:
+            continue
+        results.append({
+            'id': doc_id,
+            'name': doc['name'],
+            'specialization': doc['specialization'],
+            'department': departments.get(doc['dept_id'], {}).get('name', 'Unknown'),
+            'dept_id': doc['dept_id'],
+            'fee': doc['fee'],
+            'available': doc['available']
+        })
+    return jsonify(results)
+
+@route('/api/search/patients')
+@api_role_required('DOCTOR', 'ADMIN')
+def api_search_patients():
+    """Typeahead: patients by name or phone number (?q=)"""
+    query, limit = search_args()
+    ids = search_index.patients_matching(query, limit)
+    patients = store.get_patients(ids)
+    audit('READ', 'search', patients)
+    return jsonify([
+        {'id': pid, 'name': patients[pid]['name'], 'phone': patients[pid]['phone'], 'dob': patients[pid]['dob']}
+        for pid in ids if pid in patients
+    ])
+
+@route('/api/patient/appointments')
+@api_role_required('PATIENT')
+def api_patient_appointments():
+    """Current patient's appointments, one page at a time"""
+    limit, before = page_args()
+    items, next_cursor = patient_appointments_page(session.get('patient_id'), limit, before)
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+@route('/api/patient/records')
+@api_role_required('PATIENT')
+def api_patient_records():
+    """Current patient's medical records with prescriptions, one page at a time"""
+    limit, before = page_args()
+    items, next_cursor = patient_records_page(session.get('patient_id'), limit, before)
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+@route('/api/patient/bills')
+@api_role_required('PATIENT')
+def api_patient_bills():
+    """Current patient's bills, one page at a time"""
+    limit, before = page_args()
+    items, next_cursor = patient_bills_page(session.get('patient_id'), limit, before)
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+@route('/api/patient/export')
+@api_role_required('PATIENT')
+def api_patient_export():
+    """Current patient's records and bills as a streamed NDJSON / CSV download
+    (?data=all|records|prescriptions|bills&format=ndjson|csv&from=&to=&doctor_id=&dept_id=)"""
+    args = export_args()
+    if args is None:
+        return jsonify({'error': EXPORT_USAGE}), 400
+    return export_response([session.get('patient_id')], *args)
+
+@route('/api/doctor/appointments')
+@api_role_required('DOCTOR')
+def api_doctor_appointments():
+    """Current doctor's appointments, one page at a time"""
+    limit, before = page_args()
+    items, next_cursor = doctor_appointments_page(session.get('doctor_id'), limit, before)
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+@route('/api/admin/reports/<report>')
+@api_role_required('ADMIN')
+def api_admin_report(report):
+    """Revenue or appointment report as JSON (?by=department|doctor|month&from=&to=)"""
+    if services().reports is None:
+        return jsonify({'error': 'Reports need NumPy'}), 503
+    if report not in ('revenue', 'appointments'):
+        return jsonify({'error': 'Unknown report'}), 404
+    args = report_args()
+    if args is None:
+        return jsonify({'error': f"by must be one of {', '.join(reports.groups)}; from/to are YYYY-MM-DD"}), 400
+    by, start, end = args
+    rows = reports.revenue(by, start, end) if report == 'revenue' else reports.appointments_report(by, start, end)
+    return jsonify({'by': by, 'from': start, 'to': end, 'rows': rows})
+
+@route('/api/admin/audit/<int:patient_id>')
+@api_role_required('ADMIN')
+def api_admin_audit(patient_id):
+    """A patient's audit trail, newest first (?from=&to=&action=&limit=)"""
+    action = request.args.get('action', '').upper() or None
+    if action is not None and action not in AUDIT_ACTIONS:
+        return jsonify({'error': f"action must be one of {', '.join(AUDIT_ACTIONS)}"}), 400
+    start, end = request.args.get('from') or None, request.args.get('to') or None
+    limit, _ = page_args()
+    # Every process's log (other workers, importer.py runs); the others'
+    # entries are there once their flusher has run (AUDIT_FLUSH_INTERVAL)
+    app_services = services()
+    log = app_services.audit_log
+    found = query_directory(app_services.audit_dir, patient_id, start, end, action, log=log)
+    entries = deque(found, maxlen=limit)
+    audit('READ', 'audit', (patient_id,))
+    return jsonify({'patient_id': patient_id, 'entries': list(reversed(entries))})
+
+@route('/api/admin/export')
+@api_role_required('ADMIN')
+def api_admin_export():
+    """Records and bills of one patient or of every patient, streamed as NDJSON / CSV
+    (same arguments as /api/patient/export plus ?patient_id=)"""
+    args = export_args()
+    if args is None:
+        return jsonify({'error': EXPORT_USAGE}), 400
+    patient_id = request.args.get('patient_id', type=int)
+    doctor_ids = args[2]
+    # Only the patients of the selected doctors, when there are any
+    patient_ids = [patient_id] if patient_id is not None else store.patient_ids(doctor_ids)
+    return export_response(patient_ids, *args)
+
+@route('/api/admin/import', methods=['POST'])
+@api_role_required('ADMIN')
+def api_admin_import():
+    """Bulk import of patients, doctors or appointment history from an uploaded
+    CSV / JSONL file (?kind=&format=), returns the per-row error report"""
+    upload = request.files.get('file')
+    kind = request.args.get('kind') or request.form.get('kind')
+    if upload is None or kind not in IMPORT_KINDS:
+        return jsonify({'error': IMPORT_USAGE}), 400
+    fmt = request.args.get('format') or request.form.get('format') or format_of(upload.filename or '')
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({'error': IMPORT_USAGE}), 400
+    try:
+        records = read_records(open_text(upload.stream), fmt, kind)
+    except ValueError as e:
+        # A CSV header without a required column: nothing was imported
+        return jsonify({'error': str(e)}), 400
+    return jsonify(import_records(kind, records, session.get('username'), session.get('role')))
+
+@route('/api/admin/tasks')
+@api_role_required('ADMIN')
+def api_admin_tasks():
+    """Background task counts by status and the newest tasks (?status=&limit=)"""
+    status = request.args.get('status', '').upper() or None
+    if status is not None and status not in TASK_STATUSES:
+        return jsonify({'error': f"status must be one of {', '.join(TASK_STATUSES)}"}), 400
+    limit, _ = page_args()
+    return jsonify({
+        'workers': tasks.workers,
+        'counts': tasks.queue.counts(),
+        'tasks': tasks.queue.recent(limit, status),
+    })
+
+@route('/api/admin/tasks/<int:task_id>')
+@api_role_required('ADMIN')
+def api_admin_task(task_id):
+    """One background task with its attempts and last error"""
+    task = tasks.queue.get(task_id)
+    if task is None:
+        return jsonify({'error': 'Task not found'}), 404
+    return jsonify(task)
+
 # ============================================
 # Error Handlers
 # ============================================
 
-@app.errorhandler(404)
+@errorhandler(404)
 def not_found(e):
     return render_template('error.html', error='Page not found'), 404
 
-@app.errorhandler(500)
+@errorhandler(500)
 def server_error(e):
     return render_template('error.html', error='Server error'), 500
 
+# ============================================
+# App Factory
+# ============================================
+
+def create_app(settings=None):
+    """A Flask app serving the routes above
+
+    `settings` ({NAME: value}) override config.py and end up in
+    app.config; the app's store, indexes and background threads are in
+    app.extensions['healthcare'] (see Services), built when a request
+    first needs them. Apps in one process share nothing but the audit log
+    of a directory.
+    """
+    flask_app = Flask(__name__)
+    flask_app.secret_key = 'smart_healthcare_secret_key_2024'
+    flask_app.config.update(config.settings(settings))
+    services = flask_app.extensions['healthcare'] = Services(flask_app.config)
+    if flask_app.config['TEMPLATE_CACHE']:
+        # Compiled templates are kept on disk, so a new process loads them
+        # instead of compiling each one on its first render
+        cache_dir = flask_app.config['TEMPLATE_CACHE_DIR']
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        flask_app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir or None)
+    for rule, view, options in ROUTES:
+        flask_app.add_url_rule(rule, view_func=view, **options)
+    for code, handler in ERROR_HANDLERS.items():
+        flask_app.register_error_handler(code, handler)
+
+    if flask_app.config['STORE_BACKEND'] == 'sqlite':
+        # Worker processes (see serve.py) and importer.py share the
+        # database; a request first feeds what the others committed to
+        # this process's caches
+        flask_app.before_request(services.poll_changes)
+    if flask_app.config['METRICS_ENABLED']:
+        services.metrics.install(flask_app)
+        if flask_app.config['PROFILE_INTERVAL'] > 0:
+            services.profiler = SamplingProfiler(services.metrics, flask_app.config['PROFILE_INTERVAL'])
+            services.profiler.start()
+    return flask_app
+
+def compile_templates(flask_app):
+    """Compile every template into the app's bytecode cache, return their names"""
+    env = flask_app.jinja_env
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+    return names
+
+# The app of serve.py, `flask run` and the benchmarks
+app = create_app()
+
 # ============================================
 # Main
 # ============================================
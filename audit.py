@@ -0,0 +1,392 @@
+"""
+Smart Healthcare Management System - Audit Trail
+Who read or changed which patient's data, mirroring PATIENT_AUDIT_LOG
+
+- Request handlers append() entries to a ring buffer without taking a lock
+  and carry on; a background thread flushes the buffer in batches
+- Entries are JSON lines in gzip-compressed segment files that are only
+  ever appended to (one gzip member per block of entries), starting a new
+  segment after `segment_bytes`
+- Next to each segment, an index file lists every block's offset, id and
+  time range and the patients it mentions, so a patient's history is read
+  by decompressing only the blocks that mention them
+
+Layout of the audit directory:
+
+    audit.<N>.log.gz    segment N, concatenated gzip members
+    audit.<N>.idx       one JSON line per member of segment N
+    worker-<W>/         the same, per worker process when serve.py runs
+                        several (each process writes its own log)
+    import-<pid>/       the same, per run of the importer.py command line
+
+Querying from the command line:
+
+    python audit.py data/audit --patient 12 [--from 2024-01-01] [--to 2024-12-31]
+"""
+
+import os
+import re
+import json
+import glob
+import gzip
+import time
+import heapq
+import zlib
+import argparse
+import traceback
+import itertools
+import threading
+from datetime import datetime
+from json.encoder import encode_basestring_ascii
+
+AUDIT_ACTIONS = ('READ', 'CREATE', 'UPDATE')
+
+SEGMENT_PATTERN = re.compile(r'audit\.(\d+)\.log\.gz$')
+
+
+def segment_path(directory, number):
+    return os.path.join(directory, f'audit.{number:06d}.log.gz')
+
+
+def index_path(directory, number):
+    return os.path.join(directory, f'audit.{number:06d}.idx')
+
+
+def segment_numbers(directory):
+    numbers = []
+    for path in glob.glob(os.path.join(directory, 'audit.*.log.gz')):
+        match = SEGMENT_PATTERN.search(path)
+        if match:
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+
+# Details that are not JSON types (dates, Decimals) are written as strings
+encode = json.JSONEncoder(separators=(',', ':'), default=str).encode
+
+
+def quote(text):
+    return 'null' if text is None else encode_basestring_ascii(text)
+
+
+def block_lines(first_id, entries):
+    """(JSON lines, earliest change_date, latest change_date) of a block of entries
+
+    Lines are formatted by hand, patient_id first so scans can match the
+    prefix; it is the flusher's main cost and this is ~2.5x faster than
+    json.dumps() of a dict. Appends do not take a lock, so the entries of
+    a block are not necessarily in time order.
+    """
+    lines = []
+    second, stamp = None, ''
+    earliest = latest = None
+    for log_id, (at, patient_id, action, resource, changed_by, role, detail) in enumerate(entries, first_id):
+        if int(at) != second:
+            # Entries of a batch mostly share the second; format it once
+            second = int(at)
+            stamp = datetime.fromtimestamp(second).isoformat()
+        date = f'{stamp}.{int((at - second) * 1000):03d}'
+        lines.append(
+            f'{{"patient_id":{patient_id:d},"log_id":{log_id},"action":{quote(action)},'
+            f'"resource":{quote(resource)},"changed_by":{quote(changed_by)},"role":{quote(role)},'
+            f'"change_date":"{date}","detail":{"null" if detail is None else encode(detail)}}}')
+        if earliest is None or date < earliest:
+            earliest = date
+        if latest is None or date > latest:
+            latest = date
+    return lines, earliest, latest
+
+
+def read_index(path):
+    """Block index entries of one segment (a torn last line is skipped)"""
+    blocks = []
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    block = json.loads(line)
+                except ValueError:
+                    break
+                block['patients'] = frozenset(block['patients'])
+                blocks.append(block)
+    except FileNotFoundError:
+        pass
+    return blocks
+
+
+def split_members(data):
+    """[(offset, length, payload)] of the complete gzip members at the start of data"""
+    members = []
+    offset = 0
+    while offset < len(data):
+        inflater = zlib.decompressobj(wbits=31)
+        try:
+            payload = inflater.decompress(data[offset:])
+        except zlib.error:
+            break
+        if not inflater.eof:
+            break
+        end = len(data) - len(inflater.unused_data)
+        members.append((offset, end - offset, payload))
+        offset = end
+    return members
+
+# ============================================
+# Ring Buffer + Flusher
+# ============================================
+
+class AuditLog:
+    """Append-only audit trail in a directory
+
+    append() claims a sequence number from an itertools.count (atomic
+    under the GIL) and stores the entry in that slot of a fixed list, so
+    concurrent request threads never wait on each other. The flusher
+    reads slots in order and stops at the first one not written yet, so
+    entries reach disk in log_id order. A writer only waits if it would
+    overwrite an entry the flusher has not written yet.
+    """
+
+    def __init__(self, directory, capacity=65536, flush_interval=0.5,
+                 block_entries=1024, segment_bytes=16 * 1024 * 1024):
+        self.directory = directory
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.block_entries = block_entries
+        self.segment_bytes = segment_bytes
+        self._slots = [None] * capacity
+        self._seq = itertools.count()
+        self._flushed = 0          # entries taken from the buffer so far
+        self._high_water = capacity // 2
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._stop = False
+        self._thread = None
+        self.waits = 0             # appends that found the buffer full
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    # Segments
+    def _open(self):
+        numbers = segment_numbers(self.directory)
+        self.segments = {number: read_index(index_path(self.directory, number)) for number in numbers}
+        self.number = numbers[-1] if numbers else 1
+        blocks = self.segments.setdefault(self.number, [])
+        self._recover(blocks)
+        last = next((b for n in reversed(numbers) for b in reversed(self.segments[n])), None)
+        self.base_id = last['last_id'] if last else 0
+        self._segment = open(segment_path(self.directory, self.number), 'ab')
+        self._index = open(index_path(self.directory, self.number), 'a', encoding='utf-8')
+
+    def _recover(self, blocks):
+        """Index members a crash wrote without their index line, cut a torn one off"""
+        path = segment_path(self.directory, self.number)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        while blocks and blocks[-1]['offset'] + blocks[-1]['length'] > size:
+            blocks.pop()
+        end = blocks[-1]['offset'] + blocks[-1]['length'] if blocks else 0
+        if size == end:
+            return
+        with open(path, 'r+b') as f:
+            f.seek(end)
+            for offset, length, payload in split_members(f.read()):
+                entries = [json.loads(line) for line in payload.splitlines()]
+                blocks.append({
+                    'offset': end + offset, 'length': length,
+                    'first_id': entries[0]['log_id'], 'last_id': entries[-1]['log_id'],
+                    'from': min(e['change_date'] for e in entries),
+                    'to': max(e['change_date'] for e in entries),
+                    'patients': frozenset(e['patient_id'] for e in entries),
+                })
+            f.truncate(blocks[-1]['offset'] + blocks[-1]['length'] if blocks else 0)
+        with open(index_path(self.directory, self.number), 'w', encoding='utf-8') as f:
+            for block in blocks:
+                f.write(self._index_line(block))
+
+    @staticmethod
+    def _index_line(block):
+        return json.dumps(dict(block, patients=sorted(block['patients'])), separators=(',', ':')) + '\n'
+
+    def _rotate(self):
+        self._sync()
+        self._segment.close()
+        self._index.close()
+        self.number += 1
+        self.segments[self.number] = []
+        self._segment = open(segment_path(self.directory, self.number), 'ab')
+        self._index = open(index_path(self.directory, self.number), 'a', encoding='utf-8')
+
+    # Writing
+    def append(self, patient_id, action, resource, changed_by, role, detail=None):
+        """Record one access to or change of a patient's data"""
+        seq = next(self._seq)
+        if seq - self._flushed >= self.capacity:
+            self._wait_for_room(seq)
+        # int() so a bad id fails here, in the caller, and not in the flusher
+        self._slots[seq % self.capacity] = (seq, (time.time(), int(patient_id), action, resource,
+                                                  changed_by, role, detail))
+        if seq - self._flushed == self._high_water:
+            self._wake.set()
+
+    def _wait_for_room(self, seq):
+        self.waits += 1
+        while seq - self._flushed >= self.capacity:
+            self._wake.set()
+            time.sleep(0.001)
+
+    def flush(self):
+        """Write every entry appended so far to the current segment"""
+        with self._flush_lock:
+            start = seq = self._flushed
+            slots, capacity = self._slots, self.capacity
+            entries = []
+            while True:
+                slot = slots[seq % capacity]
+                if slot is None or slot[0] != seq:
+                    break  # not written yet (or the buffer is empty)
+                entries.append(slot[1])
+                seq += 1
+            if not entries:
+                return 0
+            for i in range(0, len(entries), self.block_entries):
+                block = entries[i:i + self.block_entries]
+                self._write_block(self.base_id + start + i + 1, block)
+                # Past each written block, so a failed flush is not written twice
+                self._flushed = start + i + len(block)
+            self._sync()
+            return len(entries)
+
+    def _write_block(self, first_id, entries):
+        lines, earliest, latest = block_lines(first_id, entries)
+        member = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'), compresslevel=6, mtime=0)
+        offset = self._segment.tell()
+        self._segment.write(member)
+        block = {
+            'offset': offset, 'length': len(member),
+            'first_id': first_id, 'last_id': first_id + len(entries) - 1,
+            'from': earliest,
+            'to': latest,
+            'patients': frozenset(entry[1] for entry in entries),
+        }
+        self.segments[self.number].append(block)
+        self._index.write(self._index_line(block))
+        if offset + len(member) >= self.segment_bytes:
+            self._rotate()
+
+    def _sync(self):
+        # Segment before index: an index line never points past the data
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+        self._index.flush()
+        os.fsync(self._index.fileno())
+
+    # Flusher thread
+    def start(self):
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='audit-flusher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except OSError:
+                # e.g. disk full: the entries stay in the buffer for the next try
+                traceback.print_exc()
+
+    def close(self):
+        """Stop the flusher, write what is left and close the files"""
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self._segment.close()
+        self._index.close()
+
+    def written(self):
+        """Entries on disk (this run and before)"""
+        return self.base_id + self._flushed
+
+    # Reading
+    def query(self, patient_id, start=None, end=None, action=None):
+        """Entries for one patient in log_id order
+
+        start / end (ISO dates or datetimes) and action narrow them down.
+        Flushes first, so entries appended before the call are included.
+        """
+        self.flush()
+        with self._flush_lock:
+            segments = [(number, list(blocks)) for number, blocks in sorted(self.segments.items())]
+        return scan(self.directory, segments, patient_id, start, end, action)
+
+
+def scan(directory, segments, patient_id, start=None, end=None, action=None):
+    """Entries of `patient_id` in the blocks of [(segment number, block index entries)]"""
+    prefix = b'{"patient_id":%d,' % patient_id
+    end = end + '\uffff' if end else None  # '2024-12-31' includes that whole day
+    for number, blocks in segments:
+        wanted = [b for b in blocks if patient_id in b['patients']
+                  and not (start and b['to'] < start) and not (end and b['from'] > end)]
+        if not wanted:
+            continue
+        with open(segment_path(directory, number), 'rb') as f:
+            for block in wanted:
+                f.seek(block['offset'])
+                for line in gzip.decompress(f.read(block['length'])).splitlines():
+                    if not line.startswith(prefix):
+                        continue
+                    entry = json.loads(line)
+                    if start and entry['change_date'] < start:
+                        continue
+                    if end and entry['change_date'] > end:
+                        continue
+                    if action and entry['action'] != action:
+                        continue
+                    yield entry
+
+
+def worker_directories(directory):
+    return sorted(glob.glob(os.path.join(directory, 'worker-*')) + glob.glob(os.path.join(directory, 'import-*')))
+
+
+def query_directory(directory, patient_id, start=None, end=None, action=None, log=None):
+    """scan() over every segment of an audit directory on disk
+
+    The logs of worker processes (worker-<W>) and command line imports
+    (import-<pid>) in subdirectories are merged in by change_date. `log`,
+    this process's AuditLog on one of these directories, is read with
+    query() instead, its unflushed entries included.
+    """
+    scans = []
+    for path in [directory] + worker_directories(directory):
+        if log is not None and os.path.abspath(path) == os.path.abspath(log.directory):
+            scans.append(log.query(patient_id, start, end, action))
+            continue
+        segments = [(number, read_index(index_path(path, number))) for number in segment_numbers(path)]
+        scans.append(scan(path, segments, patient_id, start, end, action))
+    return scans[0] if len(scans) == 1 else heapq.merge(*scans, key=lambda entry: entry['change_date'])
+
+# ============================================
+# Command Line
+# ============================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Print the audit trail of a patient as JSON lines')
+    parser.add_argument('directory', help='audit directory (HEALTHCARE_AUDIT_DIR)')
+    parser.add_argument('--patient', type=int, required=True)
+    parser.add_argument('--from', dest='start', help='YYYY-MM-DD[THH:MM:SS]')
+    parser.add_argument('--to', dest='end', help='YYYY-MM-DD[THH:MM:SS]')
+    parser.add_argument('--action', choices=AUDIT_ACTIONS)
+    args = parser.parse_args()
+    for entry in query_directory(args.directory, args.patient, args.start, args.end, args.action):
+        print(json.dumps(entry))
+
+
+if __name__ == '__main__':
+    main()
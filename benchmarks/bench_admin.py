@@ -0,0 +1,79 @@
+"""
+Admin dashboard latency benchmark
+
+Seeds the store with an increasing number of appointments (and one bill
+per completed appointment) and times GET /admin/dashboard through the
+Flask test client. With the incrementally maintained totals the latency
+should not grow with the size of the tables. The dashboard numbers are
+checked against totals computed directly from the seeded rows.
+
+Usage:
+    python benchmarks/bench_admin.py [history sizes...] [--store memory|sqlite]
+"""
+
+import time
+import random
+from collections import Counter
+from datetime import date, timedelta
+
+from common import healthcare, fresh_store, parse_args
+from store import SLOT_TIMES
+
+REQUESTS = 200
+
+
+def seed(backend, size):
+    """Install a store with `size` appointments and their bills"""
+    store = fresh_store(backend)
+    rng = random.Random(size)
+    start = date(2015, 1, 1)
+    doctors = list(store.doctors())
+    apts = [{
+        'patient_id': rng.randrange(1, 4),
+        'doctor_id': rng.choice(doctors),
+        'date': (start + timedelta(days=rng.randrange(3000))).isoformat(),
+        'time': rng.choice(SLOT_TIMES),
+        'status': rng.choice(['COMPLETED', 'COMPLETED', 'CANCELLED', 'SCHEDULED']),
+        'reason': '',
+        'created_at': start.isoformat(),
+    } for _ in range(size)]
+    store.add_appointments(apts)
+    revenue = {'collected': 0, 'outstanding': 0}
+    # A fresh store numbers appointments from 1 in insertion order
+    for apt_id, apt in enumerate(apts, 1):
+        if apt['status'] == 'COMPLETED':
+            bill = {
+                'appointment_id': apt_id, 'patient_id': apt['patient_id'], 'date': apt['date'],
+                'amount': 500, 'status': rng.choice(['PAID', 'PENDING']), 'description': 'Consultation',
+            }
+            store.add_bill(bill)
+            revenue['collected' if bill['status'] == 'PAID' else 'outstanding'] += bill['amount']
+    return store, Counter(a['status'] for a in apts), revenue
+
+
+def bench(backend, size):
+    """Average dashboard latency in microseconds with `size` appointments"""
+    store, statuses, revenue = seed(backend, size)
+    assert store.appointment_status_counts() == dict(statuses)
+    assert store.revenue() == revenue
+    client = healthcare.app.test_client()
+    client.post('/login', data={'username': 'admin1', 'password': 'admin123'})
+    elapsed = 0.0
+    for _ in range(REQUESTS):
+        t0 = time.perf_counter()
+        response = client.get('/admin/dashboard')
+        elapsed += time.perf_counter() - t0
+        assert response.status_code == 200
+    return elapsed / REQUESTS * 1e6
+
+
+def main():
+    args = parse_args('Admin dashboard latency benchmark', [1000, 10000, 100000])
+    print(f'store: {args.store}')
+    print(f"{'history':>10}  {'us/dashboard':>12}")
+    for size in args.sizes:
+        print(f"{size:>10}  {bench(args.store, size):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
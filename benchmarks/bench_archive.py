@@ -0,0 +1,136 @@
+"""
+Hot/cold appointment tiering and no-show sweeper benchmark
+
+For each size, loads that many past appointments (COMPLETED, CANCELLED
+and a share left SCHEDULED) into a fresh MemoryStore and measures:
+- sweep: the Sweeper marking the SCHEDULED ones NO_SHOW (including
+  loading its heap), and a later round with nothing due, each against a
+  full table scan doing the same
+- memory: bytes per appointment before and after everything older than
+  a year is archived (rows plus their indexes, tracemalloc)
+- listing: a patient's first page and a page deep in their history
+  (cursor half way back), hot against cold
+
+Usage:
+    python benchmarks/bench_archive.py [appointment counts...]
+"""
+
+import gc
+import time
+import argparse
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from common import fresh_store
+from store import SLOT_TIMES
+from sweeper import Sweeper
+
+# Every appointment loaded is before TODAY, so all SCHEDULED ones are due
+TODAY = date(2030, 1, 1)
+NOW = datetime(2030, 1, 1).timestamp()
+DAYS = 5 * 365
+PAGE = 20
+ROUNDS = 200
+
+
+def load(store, size):
+    statuses = ['COMPLETED'] * 7 + ['CANCELLED'] * 2 + ['SCHEDULED']
+    store.add_appointments({
+        'patient_id': 1 + i % 3,
+        'doctor_id': 1 + i % 3,
+        'date': (TODAY - timedelta(days=DAYS - i * DAYS // size)).isoformat(),
+        'time': SLOT_TIMES[i % len(SLOT_TIMES)],
+        'status': statuses[i % len(statuses)],
+        'reason': 'Follow-up visit',
+        'created_at': '2025-01-01T00:00:00',
+    } for i in range(size))
+
+
+def full_scan(store):
+    """The sweep without the heap: look at every appointment"""
+    closed = 0
+    for apt_id, apt in list(store.appointments.items()):
+        if apt.status in ('SCHEDULED', 'IN_PROGRESS'):
+            closed += store.transition_appointment(apt_id, 'NO_SHOW', ('SCHEDULED', 'IN_PROGRESS'))
+    return closed
+
+
+def page_times(store, size):
+    """ms per first page and per deep page of patient 1"""
+    deep = ((TODAY - timedelta(days=DAYS // 2)).isoformat(), size)
+    timings = []
+    # Like timeit, without a collection of the whole table in the middle
+    gc.disable()
+    for before in (None, deep):
+        store.appointments_page_for_patient(1, PAGE, before)  # warm-up
+        t0 = time.perf_counter()
+        for _ in range(ROUNDS):
+            rows, _ = store.appointments_page_for_patient(1, PAGE, before)
+        assert len(rows) == PAGE
+        timings.append((time.perf_counter() - t0) / ROUNDS * 1e3)
+    gc.enable()
+    return timings
+
+
+def bench(size):
+    store = fresh_store('memory')
+    # Sweep with the heap (loaded from open_appointments, like at startup)
+    load(store, size)
+    sweeper = Sweeper(store, no_show_after=0, archive_after_days=365)
+    t0 = time.perf_counter()
+    swept = sweeper.sweep(NOW)
+    t1 = time.perf_counter()
+    assert sweeper.sweep(NOW) == 0
+    sweep_seconds = (t1 - t0, time.perf_counter() - t1)
+    scan_store = fresh_store('memory')
+    load(scan_store, size)
+    t0 = time.perf_counter()
+    assert full_scan(scan_store) == swept
+    t1 = time.perf_counter()
+    assert full_scan(scan_store) == 0
+    scan_seconds = (t1 - t0, time.perf_counter() - t1)
+    hot_pages = page_times(scan_store, size)
+    del scan_store
+
+    # Memory of the same table hot and archived
+    store = fresh_store('memory')
+    gc.collect()
+    tracemalloc.start()
+    load(store, size)
+    sweeper = Sweeper(store, no_show_after=0, archive_after_days=365)
+    sweeper.sweep(NOW)
+    gc.collect()
+    hot_bytes = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    archived = sweeper.archive(TODAY)
+    archive_seconds = time.perf_counter() - t0
+    gc.collect()
+    cold_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    gc.collect()
+    cold_pages = page_times(store, size)
+    return {
+        'swept': swept, 'sweep': sweep_seconds, 'scan': scan_seconds,
+        'archived': archived, 'archive': archive_seconds,
+        'hot_bytes': hot_bytes / size, 'cold_bytes': cold_bytes / size,
+        'hot_pages': hot_pages, 'cold_pages': cold_pages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hot/cold appointment tiering benchmark')
+    parser.add_argument('sizes', nargs='*', type=int, default=[100000, 1000000])
+    args = parser.parse_args()
+    print(f"{'appts':>8}  {'no-shows':>8}  {'sweep/scan ms':>15}  {'idle sweep/scan ms':>18}  {'archived':>8}"
+          f"  {'archive s':>9}  {'bytes/appt hot/cold':>19}  {'page ms hot/cold':>16}  {'deep page ms hot/cold':>21}")
+    for size in args.sizes:
+        r = bench(size)
+        print(f"{size:>8}  {r['swept']:>8}  {r['sweep'][0] * 1e3:>6.1f} / {r['scan'][0] * 1e3:<6.1f}"
+              f"  {r['sweep'][1] * 1e3:>8.3f} / {r['scan'][1] * 1e3:<7.1f}  {r['archived']:>8}"
+              f"  {r['archive']:>9.2f}  {r['hot_bytes']:>9.0f} / {r['cold_bytes']:<7.0f}"
+              f"  {r['hot_pages'][0]:>7.3f} / {r['cold_pages'][0]:<6.3f}"
+              f"  {r['hot_pages'][1]:>10.3f} / {r['cold_pages'][1]:<8.3f}")
+
+
+if __name__ == '__main__':
+    main()
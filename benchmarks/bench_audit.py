@@ -0,0 +1,110 @@
+"""
+Audit trail benchmark
+
+For each entry count, with entries spread over PATIENTS patients:
+- append: cost of AuditLog.append() in the request thread, from 1 and 8
+  threads (the flusher runs meanwhile)
+- flush: entries written per second by the flusher, and bytes per entry
+  on disk (compressed segments + index)
+- query: one patient's history through the block index, against
+  decompressing and filtering every segment
+
+Usage:
+    python benchmarks/bench_audit.py [entry counts...]
+"""
+
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audit import AuditLog, segment_path, segment_numbers
+
+PATIENTS = 10000
+RESOURCES = ['appointments', 'records', 'bills', 'dashboard', 'patient', 'search']
+QUERIES = 20
+
+
+def append_all(log, count, threads):
+    """Seconds per append() with `threads` threads appending count entries in total"""
+    def work(seed):
+        rng = random.Random(seed)
+        for i in range(count // threads):
+            log.append(rng.randrange(1, PATIENTS + 1), 'READ', rng.choice(RESOURCES),
+                       f'dr_bench_{seed}', 'DOCTOR', {'appointment_id': i} if i % 4 == 0 else None)
+    workers = [threading.Thread(target=work, args=(seed,)) for seed in range(threads)]
+    t0 = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - t0) / count
+
+
+def full_scan(directory, patient_id):
+    """The same query without the index: decompress and parse every segment"""
+    found = []
+    for number in segment_numbers(directory):
+        with gzip.open(segment_path(directory, number), 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['patient_id'] == patient_id:
+                    found.append(entry)
+    return found
+
+
+def bench(count):
+    directory = tempfile.mkdtemp(prefix='healthcare-bench-audit-')
+    try:
+        log = AuditLog(directory)
+        log.start()
+        single = append_all(log, count // 2, 1)
+        multi = append_all(log, count - count // 2, 8)
+        # Time the flusher on a full buffer's worth of entries on its own
+        log.close()
+        log = AuditLog(directory, capacity=count + 1)
+        append_all(log, min(count, 100000), 1)
+        t0 = time.perf_counter()
+        flushed = log.flush()
+        flush_rate = flushed / (time.perf_counter() - t0)
+        log.close()
+        size = sum(os.path.getsize(path) for path in glob.glob(os.path.join(directory, 'audit.*')))
+        rng = random.Random(count)
+        patients = [rng.randrange(1, PATIENTS + 1) for _ in range(QUERIES)]
+        log = AuditLog(directory)
+        t0 = time.perf_counter()
+        found = [list(log.query(patient_id)) for patient_id in patients]
+        indexed = (time.perf_counter() - t0) / QUERIES
+        log.close()
+        t0 = time.perf_counter()
+        assert full_scan(directory, patients[0]) == found[0]
+        scanned = time.perf_counter() - t0
+        return single, multi, flush_rate, size / (count + flushed), indexed, scanned
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit trail benchmark')
+    parser.add_argument('sizes', nargs='*', type=int, default=[100000, 1000000])
+    args = parser.parse_args()
+    print(f'{PATIENTS} patients')
+    print(f"{'entries':>9}  {'append us 1/8 thr':>17}  {'flush/s':>9}  {'bytes/entry':>11}"
+          f"  {'query ms':>8}  {'full scan ms':>12}")
+    for count in args.sizes:
+        single, multi, flush_rate, per_entry, indexed, scanned = bench(count)
+        print(f'{count:>9}  {single * 1e6:>7.2f} / {multi * 1e6:<7.2f}  {flush_rate:>9.0f}  {per_entry:>11.1f}'
+              f'  {indexed * 1e3:>8.2f}  {scanned * 1e3:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
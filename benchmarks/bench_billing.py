@@ -0,0 +1,88 @@
+"""
+Billing ledger benchmark
+
+1. Issues an increasing number of bills, almost all for other patients, and
+   times GET /patient/bills for a patient with a handful of bills. With
+   the per-patient ledger the latency should only depend on that
+   patient's own bills, not on the size of the BILLS table.
+2. Pays a fresh set of bills from a thread pool, several threads per bill, each
+   trying to pay 60% of the amount, and checks that no bill was overpaid
+   and the outstanding balance matches the payments.
+
+Usage:
+    python benchmarks/bench_billing.py [bill counts...] [--store memory|sqlite]
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import healthcare, services, fresh_store, parse_args
+from store import PaymentError
+
+REQUESTS = 200
+PATIENT_BILLS = 5
+THREADS = 16
+CONTENDERS = 4
+
+
+def issue_bills(store, count):
+    """`count` bills, PATIENT_BILLS for patient 1 and the rest for patients 2 and 3"""
+    for i in range(count):
+        patient_id = 1 if i < PATIENT_BILLS else 2 + i % 2
+        store.add_bill({
+            'appointment_id': None, 'patient_id': patient_id, 'date': '2024-01-01',
+            'amount': 500, 'status': 'PENDING', 'description': 'Consultation',
+        })
+
+
+def bench(backend, count):
+    """Average latency (us) of the bills page for a patient with PATIENT_BILLS bills"""
+    store = fresh_store(backend)
+    issue_bills(store, count)
+    assert store.pending_amount(1) == 500 * PATIENT_BILLS
+    client = healthcare.app.test_client()
+    client.post('/login', data={'username': 'patient_raj', 'password': 'pat123'})
+    elapsed = 0.0
+    for _ in range(REQUESTS):
+        t0 = time.perf_counter()
+        response = client.get('/patient/bills')
+        elapsed += time.perf_counter() - t0
+        assert response.status_code == 200
+    return elapsed / REQUESTS * 1e6
+
+
+def pay(bill_id):
+    try:
+        services.store.pay_bill(bill_id, {'amount': 300, 'method': 'CARD', 'date': '2024-01-02'})
+        return 1
+    except PaymentError:
+        return 0
+
+
+def check_concurrent_payments(backend, bills=100):
+    """Two 60% payments can't both go through on a bill"""
+    store = fresh_store(backend)
+    issue_bills(store, bills)
+    bill_ids = [bill_id for p in (1, 2, 3) for bill_id, _ in store.bills_for_patient(p)]
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        accepted = sum(pool.map(pay, [b for b in bill_ids for _ in range(CONTENDERS)]))
+    assert accepted == len(bill_ids), 'a bill took more or fewer than one 60% payment'
+    for bill_id in bill_ids:
+        bill = store.get_bill(bill_id)
+        assert bill['paid'] == 300 and bill['status'] == 'PARTIAL', (bill_id, bill)
+    assert sum(store.pending_amount(p) for p in (1, 2, 3)) == 200 * len(bill_ids)
+    return len(bill_ids)
+
+
+def main():
+    args = parse_args('Billing ledger benchmark', [1000, 10000, 100000])
+    print(f'store: {args.store}')
+    print(f"{'bills':>10}  {'us/bills page':>13}")
+    for count in args.sizes:
+        print(f"{count:>10}  {bench(args.store, count):>13.1f}")
+    bills = check_concurrent_payments(args.store)
+    print(f'concurrent payments: {bills} bills, none overpaid')
+
+
+if __name__ == '__main__':
+    main()
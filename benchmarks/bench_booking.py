@@ -0,0 +1,109 @@
+"""
+Booking latency benchmark
+
+Seeds the appointment store with an increasing amount of history and
+times POST /patient/book-appointment through the Flask test client.
+With the slot-occupancy index the per-booking latency should stay flat
+as the history grows.
+
+It then books the same slots from a thread pool, several threads per slot,
+and checks that every slot was given out exactly once.
+
+Usage:
+    python benchmarks/bench_booking.py [history sizes...] [--store memory|sqlite]
+    python benchmarks/bench_booking.py 1000 10000 100000
+"""
+
+import time
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from common import healthcare, services, fresh_store, parse_args
+from store import SLOT_TIMES
+
+BOOKINGS = 500
+THREADS = 16
+CONTENDERS = 4
+
+
+def seed_history(backend, size):
+    """Install a store holding `size` past appointments"""
+    store = fresh_store(backend)
+    rng = random.Random(size)
+    start = date(2015, 1, 1)
+    doctors = list(store.doctors())
+    patients = [1, 2, 3]
+    store.add_appointments({
+        'patient_id': rng.choice(patients),
+        'doctor_id': rng.choice(doctors),
+        'date': (start + timedelta(days=rng.randrange(3000))).isoformat(),
+        'time': rng.choice(SLOT_TIMES),
+        'status': rng.choice(['COMPLETED', 'COMPLETED', 'CANCELLED', 'SCHEDULED']),
+        'reason': '',
+        'created_at': start.isoformat(),
+    } for _ in range(size))
+    return store
+
+
+def bench(backend, size):
+    """Average booking latency in microseconds for a history of `size`"""
+    store = seed_history(backend, size)
+    client = healthcare.app.test_client()
+    client.post('/login', data={'username': 'patient_raj', 'password': 'pat123'})
+    doctors = list(store.doctors())
+    day = date(2030, 1, 1)
+    elapsed = 0.0
+    for i in range(BOOKINGS):
+        form = {
+            'doctor_id': str(doctors[i % len(doctors)]),
+            'appointment_date': (day + timedelta(days=i // (len(doctors) * len(SLOT_TIMES)))).isoformat(),
+            'appointment_time': SLOT_TIMES[(i // len(doctors)) % len(SLOT_TIMES)],
+            'reason': 'benchmark',
+        }
+        t0 = time.perf_counter()
+        client.post('/patient/book-appointment', data=form)
+        elapsed += time.perf_counter() - t0
+    assert store.counts()['appointments'] == size + BOOKINGS, 'some bookings were rejected'
+    return elapsed / BOOKINGS * 1e6
+
+
+def book_contended(i):
+    client = healthcare.app.test_client()
+    client.post('/login', data={'username': 'patient_priya', 'password': 'pat123'})
+    slot = i // CONTENDERS
+    doctors = len(services.store.doctors())
+    client.post('/patient/book-appointment', data={
+        'doctor_id': str(1 + slot % doctors),
+        'appointment_date': '2031-01-01',
+        'appointment_time': SLOT_TIMES[slot // doctors],
+    })
+
+
+def check_concurrent_bookings(backend):
+    """Every slot requested CONTENDERS times must be booked exactly once"""
+    store = seed_history(backend, 0)
+    doctors = list(store.doctors())
+    slots = len(doctors) * len(SLOT_TIMES)
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(book_contended, range(slots * CONTENDERS)))
+    rows = [row for d in doctors for row in store.appointments_for_doctor(d)]
+    taken = Counter((a['doctor_id'], a['date'], a['time']) for _, a in rows)
+    assert len(taken) == slots and set(taken.values()) == {1}, 'slot booked more than once'
+    assert len(rows) == len({apt_id for apt_id, _ in rows}) == slots
+    return slots
+
+
+def main():
+    args = parse_args('Booking latency benchmark', [1000, 10000, 100000])
+    print(f'store: {args.store}')
+    print(f"{'history':>10}  {'us/booking':>12}")
+    for size in args.sizes:
+        print(f"{size:>10}  {bench(args.store, size):>12.1f}")
+    slots = check_concurrent_bookings(args.store)
+    print(f'concurrent bookings: {slots} slots, each booked exactly once')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Consultation write benchmark
+
+Completes scheduled appointments the way doctor_consultation does -
+status change, medical record, N prescriptions and a bill - and reports
+consultations per second for each prescription count:
+- separate: one store call per write, each taking its own lock or
+  transaction (how the route wrote before the unit of work)
+- unit: the same writes staged in a UnitOfWork and committed together
+
+The memory store is measured twice, the second time with its journal on
+(one journal entry per write vs. one per consultation). Without the
+journal the unit is the slower one, about 0.7-0.8x: staging each write
+and applying it in a second pass costs more than the lock round trips it
+saves. The regression is accepted for the all-or-nothing commit (see
+README.md).
+
+Usage:
+    python benchmarks/bench_consultation.py [prescription counts...] [--store memory|sqlite]
+"""
+
+import time
+import shutil
+import tempfile
+from datetime import date, timedelta
+
+from common import fresh_store, parse_args
+from journal import Persistence
+from store import SLOT_TIMES
+
+CONSULTATIONS = 2000
+
+
+def schedule(store, count):
+    """`count` scheduled appointments in distinct slots, returns their (id, apt) pairs"""
+    first_id = store.counts()['appointments'] + 1
+    apts = []
+    for i in range(count):
+        day, slot = divmod(i, len(SLOT_TIMES))
+        apts.append({
+            'patient_id': 1 + i % 3, 'doctor_id': 1 + i % 3,
+            'date': (date(2030, 1, 1) + timedelta(days=day)).isoformat(), 'time': SLOT_TIMES[slot],
+            'status': 'SCHEDULED', 'reason': 'Checkup', 'created_at': '2030-01-01T00:00:00',
+        })
+    store.add_appointments(apts)
+    return list(enumerate(apts, first_id))
+
+
+def writes(apt_id, apt, prescriptions):
+    record = {'appointment_id': apt_id, 'patient_id': apt['patient_id'], 'doctor_id': apt['doctor_id'],
+              'date': apt['date'], 'diagnosis': 'Flu', 'symptoms': 'Fever', 'notes': ''}
+    medicines = [{'medicine': f'Medicine {i}', 'dosage': '500mg', 'frequency': 'Twice daily', 'duration': '5'}
+                 for i in range(prescriptions)]
+    bill = {'appointment_id': apt_id, 'patient_id': apt['patient_id'], 'date': apt['date'],
+            'amount': 800, 'status': 'PENDING', 'description': 'Consultation'}
+    return record, medicines, bill
+
+
+def separate(store, apt_id, apt, prescriptions):
+    record, medicines, bill = writes(apt_id, apt, prescriptions)
+    store.transition_appointment(apt_id, 'COMPLETED', allowed=('SCHEDULED', 'IN_PROGRESS'))
+    record_id = store.add_record(record)
+    for medicine in medicines:
+        store.add_prescription(dict(medicine, record_id=record_id))
+    store.add_bill(bill)
+
+
+def unit(store, apt_id, apt, prescriptions):
+    record, medicines, bill = writes(apt_id, apt, prescriptions)
+    with store.unit_of_work() as uow:
+        uow.transition_appointment(apt_id, 'COMPLETED', allowed=('SCHEDULED', 'IN_PROGRESS'))
+        record_id = uow.add_record(record)
+        for medicine in medicines:
+            uow.add_prescription(dict(medicine, record_id=record_id))
+        uow.add_bill(bill)
+
+
+def bench(backend, prescriptions, complete, journal=False):
+    store = fresh_store(backend)
+    apts = schedule(store, CONSULTATIONS)
+    if journal:
+        directory = tempfile.mkdtemp(prefix='healthcare-bench-')
+        persistence = Persistence(store, directory)
+        persistence.open()
+    t0 = time.perf_counter()
+    for apt_id, apt in apts:
+        complete(store, apt_id, apt, prescriptions)
+    elapsed = time.perf_counter() - t0
+    if journal:
+        persistence.close()
+        shutil.rmtree(directory)
+    return CONSULTATIONS / elapsed
+
+
+def main():
+    args = parse_args('Consultation write benchmark', [1, 5, 20])
+    modes = [(args.store, False)] + ([('memory+journal', True)] if args.store == 'memory' else [])
+    print(f'{CONSULTATIONS} consultations')
+    print(f"{'store':>14}  {'prescriptions':>13}  {'separate/s':>10}  {'unit/s':>9}  {'speedup':>7}")
+    for name, journal in modes:
+        for prescriptions in args.sizes:
+            before = bench(args.store, prescriptions, separate, journal)
+            after = bench(args.store, prescriptions, unit, journal)
+            print(f'{name:>14}  {prescriptions:>13}  {before:>10.0f}  {after:>9.0f}  {after / before:>6.2f}x')
+
+
+if __name__ == '__main__':
+    main()
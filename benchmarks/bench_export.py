@@ -0,0 +1,96 @@
+"""
+Streaming export benchmark
+
+Loads `size` medical records (one prescription each) and as many bills
+over PATIENTS patients, then downloads GET /api/admin/export as:
+- ndjson, csv (records) and ndjson gzip-compressed on the fly
+- list: the same rows built as one list and sent as a single JSON
+  document, the way the export would look without streaming
+
+For each: rows per second, bytes sent, and the peak memory the request
+allocated on top of the loaded store (tracemalloc, in a second run).
+
+Usage:
+    python benchmarks/bench_export.py [record counts...] [--store memory|sqlite]
+"""
+
+import json
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from common import fresh_store, healthcare, parse_args
+from exports import export_rows
+from store import SLOT_TIMES
+
+PATIENTS = 3  # the demo patients
+MODES = {
+    'ndjson': ('/api/admin/export', {}),
+    'csv': ('/api/admin/export?data=records&format=csv', {}),
+    'ndjson gzip': ('/api/admin/export', {'Accept-Encoding': 'gzip'}),
+}
+
+
+def load(store, size):
+    def day(i):
+        return (date(2015, 1, 1) + timedelta(days=i // 20)).isoformat()
+    store.add_appointments({'patient_id': 1 + i % PATIENTS, 'doctor_id': 1 + i % 3, 'date': day(i),
+                            'time': SLOT_TIMES[i % len(SLOT_TIMES)], 'status': 'COMPLETED',
+                            'reason': 'Checkup', 'created_at': '2015-01-01T00:00:00'} for i in range(size))
+    for i in range(size):
+        patient_id, doctor_id = 1 + i % PATIENTS, 1 + i % 3
+        record_id = store.add_record({'appointment_id': i + 1, 'patient_id': patient_id, 'doctor_id': doctor_id,
+                                      'date': day(i), 'diagnosis': 'Seasonal flu', 'symptoms': 'Fever, cough',
+                                      'notes': 'Rest and fluids'})
+        store.add_prescription({'record_id': record_id, 'medicine': 'Paracetamol', 'dosage': '500mg',
+                                'frequency': 'Twice daily', 'duration': '5 days'})
+        store.add_bill({'appointment_id': i + 1, 'patient_id': patient_id, 'date': day(i), 'amount': 500,
+                        'status': 'PENDING', 'description': 'Consultation'})
+
+
+def download(client, path, headers):
+    """Bytes received, reading the body chunk by chunk like a client would"""
+    response = client.get(path, headers=headers, buffered=False)
+    assert response.status_code == 200, response.status_code
+    received = sum(len(chunk) for chunk in response.response)
+    response.close()
+    return received
+
+
+def as_list():
+    """The export built in memory first, then sent as one document"""
+    with healthcare.app.app_context():
+        rows = [row for _, row in export_rows(healthcare.store, 'all', healthcare.store.patient_ids(),
+                                              healthcare.cached_doctors(), healthcare.cached_departments())]
+    return len(json.dumps(rows).encode())
+
+
+def measure(run, *args):
+    t0 = time.perf_counter()
+    sent = run(*args)
+    seconds = time.perf_counter() - t0
+    tracemalloc.start()
+    run(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, sent, peak
+
+
+def main():
+    args = parse_args('Streaming export benchmark', [10000, 100000])
+    print(f'store: {args.store}')
+    print(f"{'records':>8}  {'mode':<12} {'rows/s':>9}  {'MB sent':>8}  {'peak MB':>8}")
+    for size in args.sizes:
+        store = fresh_store(args.store)
+        load(store, size)
+        client = healthcare.app.test_client()
+        client.post('/login', data={'username': 'admin1', 'password': 'admin123'})
+        rows = {'ndjson': 2 * size, 'csv': size, 'ndjson gzip': 2 * size, 'list': 2 * size}
+        results = {mode: measure(download, client, path, headers) for mode, (path, headers) in MODES.items()}
+        results['list'] = measure(as_list)
+        for mode, (seconds, sent, peak) in results.items():
+            print(f'{size:>8}  {mode:<12} {rows[mode] / seconds:>9.0f}  {sent / 1e6:>8.1f}  {peak / 1e6:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Bulk import benchmark
+
+For each size, writes a fixture to a temporary directory: DOCTORS doctors,
+size // 20 patients and `size` appointments over ten years, as CSV files
+referring to each other by username. The files are then imported into a
+fresh store with importer.run_import, and rows per second are reported
+for each, reading and validating the file included.
+
+The appointment rows are also inserted on their own, already validated,
+to compare:
+- bulk: import_rows() chunks inside bulk_import(), indexes built once
+  at the end
+- per row: the same chunks through add_appointments() (memory: an event
+  and an index insort per row; sqlite: every index updated on each insert)
+
+Usage:
+    python benchmarks/bench_import.py [appointment counts...] [--store memory|sqlite]
+"""
+
+import os
+import gc
+import csv
+import time
+import shutil
+import tempfile
+from datetime import date, timedelta
+
+from common import fresh_store, parse_args
+from importer import CHUNK_ROWS, References, appointment_row, read_records, run_import
+from store import SLOT_TIMES
+
+DOCTORS = 200
+FIRST_DAY = date(2015, 1, 1)
+DAYS = 10 * 365
+STATUSES = ['COMPLETED'] * 7 + ['CANCELLED', 'NO_SHOW', 'SCHEDULED']
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def write_fixture(directory, size):
+    """Paths of the doctors, patients and appointments files"""
+    patients = max(1, size // 20)
+    paths = [os.path.join(directory, f'{kind}.csv') for kind in ('doctors', 'patients', 'appointments')]
+    write_csv(paths[0], ['username', 'name', 'email', 'specialization', 'department', 'fee', 'phone', 'experience'],
+              ([f'imp_dr_{i}', f'Dr. Import {i}', f'imp_dr_{i}@hospital.com', 'General', 'General Medicine',
+                500 + i % 4 * 100, f'98{i:08d}', i % 30] for i in range(DOCTORS)))
+    write_csv(paths[1], ['username', 'password', 'email', 'first_name', 'last_name', 'dob', 'gender', 'phone',
+                         'blood_group', 'address', 'city'],
+              ([f'imp_pat_{i}', 'imp123', f'imp_pat_{i}@email.com', 'Import', f'Patient{i}',
+                (date(1950, 1, 1) + timedelta(days=i % 20000)).isoformat(), ('Male', 'Female')[i % 2],
+                f'90{i:08d}', 'O+', f'{i} Main Road', 'Pune'] for i in range(patients)))
+    write_csv(paths[2], ['patient_username', 'doctor_username', 'date', 'time', 'status', 'reason'],
+              ([f'imp_pat_{i % patients}', f'imp_dr_{i % DOCTORS}',
+                (FIRST_DAY + timedelta(days=i * DAYS // size)).isoformat(), SLOT_TIMES[i % len(SLOT_TIMES)],
+                STATUSES[i % len(STATUSES)], 'Follow-up visit'] for i in range(size)))
+    return paths
+
+
+def import_file(store, kind, path):
+    with open(path, newline='') as f:
+        report = run_import(store, kind, read_records(f, 'csv', kind))
+    assert report['rejected'] == 0, report['errors'][:5]
+    return report
+
+
+def validated(store, path):
+    """The appointment file's rows as import_rows() takes them"""
+    refs = References(store)
+    with open(path, newline='') as f:
+        return [appointment_row(row, refs) for _, row in read_records(f, 'csv', 'appointments')]
+
+
+def insert_time(store, rows, bulk):
+    gc.collect()
+    t0 = time.perf_counter()
+    if bulk:
+        with store.bulk_import():
+            for start in range(0, len(rows), CHUNK_ROWS):
+                store.import_rows('appointments', rows[start:start + CHUNK_ROWS])
+    else:
+        for start in range(0, len(rows), CHUNK_ROWS):
+            store.add_appointments(rows[start:start + CHUNK_ROWS])
+    return time.perf_counter() - t0
+
+
+def bench(backend, size, directory):
+    doctors_csv, patients_csv, appointments_csv = write_fixture(directory, size)
+    store = fresh_store(backend)
+    reports = [import_file(store, kind, path) for kind, path in
+               (('doctors', doctors_csv), ('patients', patients_csv), ('appointments', appointments_csv))]
+    # Every patient has 20 appointments, listed newest first
+    patient_id = store.find_user('imp_pat_0')[1]['patient_id']
+    page, _ = store.appointments_page_for_patient(patient_id, 20)
+    assert len(page) == 20 and page[0][1]['date'] > page[-1][1]['date']
+
+    # Insert only, bulk and per row, each into its own store
+    rows = validated(store, appointments_csv)
+    del store
+    seconds = {}
+    for bulk in (True, False):
+        store = fresh_store(backend)
+        for kind, path in (('doctors', doctors_csv), ('patients', patients_csv)):
+            import_file(store, kind, path)
+        seconds[bulk] = insert_time(store, rows, bulk)
+        del store
+    return reports, len(rows) / seconds[True], len(rows) / seconds[False]
+
+
+def main():
+    args = parse_args('Bulk import benchmark', [100000, 1000000])
+    print(f'store: {args.store}, chunks of {CHUNK_ROWS} rows')
+    print(f"{'appts':>8}  {'doctors/s':>9}  {'patients/s':>10}  {'appts/s':>8}"
+          f"  {'insert only rows/s: bulk':>24}  {'per row':>8}")
+    for size in args.sizes:
+        directory = tempfile.mkdtemp(prefix='healthcare-bench-import-')
+        try:
+            reports, bulk_rate, row_rate = bench(args.store, size, directory)
+        finally:
+            shutil.rmtree(directory)
+        doctors, patients, appointments = (r['rows'] / r['seconds'] for r in reports)
+        print(f'{size:>8}  {doctors:>9.0f}  {patients:>10.0f}  {appointments:>8.0f}'
+              f'  {bulk_rate:>24.0f}  {row_rate:>8.0f}')
+
+
+if __name__ == '__main__':
+    main()
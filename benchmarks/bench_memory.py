@@ -0,0 +1,96 @@
+"""
+Per-row memory of the in-memory tables
+
+Loads `size` appointments into a fresh MemoryStore, then a medical
+record, a prescription and a bill for each of them, and measures with
+tracemalloc how much memory each table grew by (rows plus their
+indexes) divided by the number of rows. The input dicts are built inside
+each step, so whatever the store keeps of them is counted.
+
+Usage:
+    python benchmarks/bench_memory.py [row counts...]
+"""
+
+import gc
+import argparse
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from common import fresh_store
+from store import SLOT_TIMES
+
+FIRST_DAY = date(2015, 1, 1)
+
+
+def appointments(store, size):
+    store.add_appointments({
+        'patient_id': 1 + i % 3,
+        'doctor_id': 1 + i % 3,
+        'date': (FIRST_DAY + timedelta(days=i // 50)).isoformat(),
+        'time': SLOT_TIMES[i % len(SLOT_TIMES)],
+        'status': 'COMPLETED',
+        'reason': 'Follow-up visit',
+        'created_at': (datetime(2015, 1, 1) + timedelta(seconds=i * 37)).isoformat(),
+    } for i in range(size))
+
+
+def records(store, size):
+    for i in range(size):
+        store.add_record({
+            'appointment_id': i + 1, 'patient_id': 1 + i % 3, 'doctor_id': 1 + i % 3,
+            'date': (FIRST_DAY + timedelta(days=i // 50)).isoformat(),
+            'diagnosis': 'Seasonal flu', 'symptoms': 'Fever', 'notes': '',
+        })
+
+
+def prescriptions(store, size):
+    for i in range(size):
+        store.add_prescription({
+            'record_id': i + 1, 'medicine': 'Paracetamol', 'dosage': '500mg',
+            'frequency': 'Twice daily', 'duration': '5 days',
+        })
+
+
+def bills(store, size):
+    for i in range(size):
+        store.add_bill({
+            'appointment_id': i + 1, 'patient_id': 1 + i % 3,
+            'date': (FIRST_DAY + timedelta(days=i // 50)).isoformat(),
+            'amount': 500, 'status': 'PENDING', 'description': 'Consultation',
+        })
+
+
+STEPS = [('appointments', appointments), ('medical records', records),
+         ('prescriptions', prescriptions), ('bills', bills)]
+
+
+def measure(size):
+    """{table: bytes per row} for `size` rows in every table"""
+    store = fresh_store('memory')
+    results = {}
+    tracemalloc.start()
+    for table, fill in STEPS:
+        gc.collect()
+        before = tracemalloc.get_traced_memory()[0]
+        fill(store, size)
+        gc.collect()
+        results[table] = (tracemalloc.get_traced_memory()[0] - before) / size
+    tracemalloc.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-row memory of the in-memory tables')
+    parser.add_argument('sizes', nargs='*', type=int, default=[100000])
+    args = parser.parse_args()
+    for size in args.sizes:
+        results = measure(size)
+        print(f'{size} rows per table')
+        print(f"{'table':<16} {'bytes/row':>10}")
+        for table, per_row in results.items():
+            print(f'{table:<16} {per_row:>10.0f}')
+        print(f"{'total':<16} {sum(results.values()):>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
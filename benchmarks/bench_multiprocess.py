@@ -0,0 +1,216 @@
+"""
+Multi-process benchmark and consistency check
+
+For each worker count, starts serve.py workers on a fresh SQLite database
+and runs:
+- book: CLIENTS client processes all try to book every slot of the three
+  doctors over SLOT_DAYS days, each in its own random order, at once;
+  then checks that every slot was booked exactly once
+- read: the same clients fetch the patient appointment list
+- caches: a doctor added and a patient registered through one worker
+  show up on every worker's next request (reference cache, search
+  index), and after bookings, cancellations and a consultation made on
+  random workers every worker renders the same admin report
+
+Fails (AssertionError) on a double booking or a stale cache.
+
+Usage:
+    python benchmarks/bench_multiprocess.py [worker counts...]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+import http.client
+import multiprocessing
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serve import spawn_worker, stop_workers
+from store import SLOT_TIMES
+
+CLIENTS = 8
+SLOT_DAYS = 10
+READS = 200  # per client
+FIRST_DAY = date(2031, 1, 1)
+FORM = {'diagnosis': 'Flu', 'symptoms': 'Fever', 'notes': '',
+        'medicine_name[]': ['Paracetamol'], 'dosage[]': ['500mg'],
+        'frequency[]': ['Twice daily'], 'duration[]': ['5 days']}
+
+
+class Client:
+    """One logged-in user; every request is a new connection, so the
+    workers take turns serving them"""
+
+    def __init__(self, port, username=None, password=None):
+        self.port = port
+        self.cookie = ''
+        if username:
+            response, _ = self.request('POST', '/login', {'username': username, 'password': password})
+            # Later Set-Cookies (flash messages) are ignored, so every
+            # request sends the same small session
+            self.cookie = response.getheader('Set-Cookie').split(';')[0]
+
+    def request(self, method, path, form=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        headers = {'Cookie': self.cookie}
+        body = None
+        if form is not None:
+            body = urlencode(form, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+        return response, data
+
+    def from_every_worker(self, path, workers):
+        """{worker: body} of GET `path` until every worker has answered once"""
+        bodies = {}
+        for _ in range(200 * workers):
+            response, data = self.request('GET', path)
+            assert response.status == 200, (path, response.status)
+            bodies.setdefault(response.getheader('X-Worker'), data)
+            if len(bodies) == workers:
+                return bodies
+        raise AssertionError(f'only workers {sorted(bodies)} of {workers} answered {path}')
+
+
+def slots():
+    return [(doctor_id, (FIRST_DAY + timedelta(days=day)).isoformat(), slot_time)
+            for doctor_id in (1, 2, 3) for day in range(SLOT_DAYS) for slot_time in SLOT_TIMES]
+
+
+def book_all(port, seed):
+    """Client process: try every slot in random order, return the number booked"""
+    client = Client(port, 'patient_raj', 'pat123')
+    order = slots()
+    random.Random(seed).shuffle(order)
+    booked = 0
+    for doctor_id, day, slot_time in order:
+        response, _ = client.request('POST', '/patient/book-appointment', {
+            'doctor_id': doctor_id, 'appointment_date': day, 'appointment_time': slot_time, 'reason': 'Checkup'})
+        assert response.status == 302, response.status
+        booked += response.getheader('Location').endswith('/patient/appointments')
+    return booked
+
+
+def read_all(port, seed):
+    client = Client(port, 'patient_raj', 'pat123')
+    for _ in range(READS):
+        response, _ = client.request('GET', '/patient/appointments')
+        assert response.status == 200, response.status
+
+
+def run_clients(pool, target, port):
+    t0 = time.perf_counter()
+    results = pool.starmap(target, [(port, seed) for seed in range(CLIENTS)])
+    return results, time.perf_counter() - t0
+
+
+def check_bookings(path, booked):
+    with sqlite3.connect(path) as conn:
+        doubles = conn.execute(
+            """SELECT doctor_id, appointment_date, appointment_time, COUNT(*) FROM APPOINTMENTS
+               WHERE status != 'CANCELLED' AND appointment_date >= ?
+               GROUP BY doctor_id, appointment_date, appointment_time HAVING COUNT(*) > 1""",
+            (FIRST_DAY.isoformat(),)).fetchall()
+        total = conn.execute('SELECT COUNT(*) FROM APPOINTMENTS WHERE appointment_date >= ?',
+                             (FIRST_DAY.isoformat(),)).fetchone()[0]
+    assert not doubles, f'double bookings: {doubles[:5]}'
+    assert total == len(slots()) == sum(booked), (total, len(slots()), sum(booked))
+
+
+def check_caches(port, workers, path):
+    """Changes made through one worker are seen by all of them"""
+    admin = Client(port, 'admin1', 'admin123')
+    doctor = Client(port, 'dr_sharma', 'doc123')
+    patient = Client(port, 'patient_raj', 'pat123')
+    # Every worker builds its views first, so a missed change would show
+    doctors_path, search_path = '/api/doctors-by-department/1', '/api/search/patients?q=Meera'
+    admin.from_every_worker(doctors_path, workers)
+    doctor.from_every_worker(search_path, workers)
+    admin.from_every_worker('/admin/reports?by=doctor', workers)
+
+    admin.request('POST', '/admin/add-doctor', {'name': 'Dr. Kiran Rao', 'email': 'rao@hospital.com',
+                                                'phone': '9876500000', 'specialization': 'Cardiologist',
+                                                'dept_id': 1, 'fee': 900})
+    for worker, body in admin.from_every_worker(doctors_path, workers).items():
+        assert 'Dr. Kiran Rao' in [d['name'] for d in json.loads(body)], f'worker {worker}: stale doctors'
+
+    Client(port).request('POST', '/register', {
+        'username': 'meera', 'password': 'pat123', 'email': 'meera@email.com', 'first_name': 'Meera',
+        'last_name': 'Iyer', 'dob': '1992-03-04', 'gender': 'Female', 'phone': '9000000001',
+        'blood_group': 'AB+', 'address': 'Chennai', 'city': 'Chennai'})
+    for worker, body in doctor.from_every_worker(search_path, workers).items():
+        assert [p['name'] for p in json.loads(body)] == ['Meera Iyer'], f'worker {worker}: stale search index'
+
+    with sqlite3.connect(path) as conn:
+        apt_ids = [row[0] for row in conn.execute(
+            "SELECT appointment_id FROM APPOINTMENTS WHERE doctor_id = 1 AND status = 'SCHEDULED' "
+            'ORDER BY appointment_id LIMIT 6')]
+    for apt_id in apt_ids[:5]:
+        patient.request('POST', f'/patient/cancel-appointment/{apt_id}')
+    response, _ = doctor.request('POST', f'/doctor/consultation/{apt_ids[5]}', FORM)
+    assert response.status == 302, response.status
+    reports = admin.from_every_worker('/admin/reports?by=doctor', workers)
+    assert len(set(reports.values())) == 1, 'workers render different reports'
+
+
+def bench(workers, pool):
+    directory = tempfile.mkdtemp(prefix='healthcare-bench-multiprocess-')
+    path = os.path.join(directory, 'healthcare.db')
+    env = dict(os.environ, HEALTHCARE_STORE='sqlite', HEALTHCARE_SQLITE_PATH=path,
+               HEALTHCARE_AUDIT_DIR=os.path.join(directory, 'audit'),
+               HEALTHCARE_RECEIPT_DIR=os.path.join(directory, 'receipts'))
+    env.pop('HEALTHCARE_DATA_DIR', None)
+    sock = socket.create_server(('127.0.0.1', 0), backlog=128)
+    port = sock.getsockname()[1]
+    log = open(os.path.join(directory, 'workers.log'), 'w')
+    processes = [spawn_worker(sock, worker_id, workers, env, stdout=subprocess.PIPE, stderr=log, text=True)
+                 for worker_id in range(workers)]
+    try:
+        for process in processes:
+            line = process.stdout.readline()
+            assert 'ready' in line, f'worker did not start, see {log.name}'
+        booked, book_seconds = run_clients(pool, book_all, port)
+        check_bookings(path, booked)
+        _, read_seconds = run_clients(pool, read_all, port)
+        check_caches(port, workers, path)
+        return CLIENTS * len(slots()) / book_seconds, CLIENTS * READS / read_seconds
+    except BaseException:
+        log.flush()
+        with open(log.name) as f:
+            sys.stderr.writelines(f.readlines()[-20:])
+        raise
+    finally:
+        stop_workers(processes)
+        sock.close()
+        log.close()
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-process benchmark and consistency check')
+    parser.add_argument('workers', nargs='*', type=int, default=[1, 2, 4])
+    args = parser.parse_args()
+    print(f'{CLIENTS} clients, {len(slots())} slots, {os.cpu_count()} CPUs')
+    print(f"{'workers':>7}  {'book attempts/s':>15}  {'reads/s':>8}  checks")
+    with multiprocessing.get_context('fork').Pool(CLIENTS) as pool:
+        for workers in args.workers:
+            book_rate, read_rate = bench(workers, pool)
+            print(f'{workers:>7}  {book_rate:>15.0f}  {read_rate:>8.0f}  ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Keyset pagination benchmark
+
+Gives one patient an increasing number of appointments and times the
+first page and a page deep in the history (the cursor of the middle
+appointment) of GET /api/patient/appointments. With the (date, id)
+keyset index a page costs a binary search plus the page itself, so both
+latencies must stay flat as the history grows. It also walks every page
+and checks each appointment comes back exactly once, newest first.
+
+Usage:
+    python benchmarks/bench_pagination.py [history sizes...] [--store memory|sqlite]
+"""
+
+import time
+import random
+from datetime import date, timedelta
+
+from common import healthcare, fresh_store, parse_args
+from store import SLOT_TIMES
+
+REQUESTS = 200
+LIMIT = 20
+MAX_SLOWDOWN = 3.0
+
+
+def seed(backend, size):
+    store = fresh_store(backend)
+    rng = random.Random(size)
+    start = date(2015, 1, 1)
+    doctors = list(store.doctors())
+    store.add_appointments({
+        'patient_id': 1,
+        'doctor_id': rng.choice(doctors),
+        'date': (start + timedelta(days=rng.randrange(3000))).isoformat(),
+        'time': rng.choice(SLOT_TIMES),
+        'status': 'COMPLETED',
+        'reason': '',
+        'created_at': start.isoformat(),
+    } for _ in range(size))
+    return store
+
+
+def timed(client, url):
+    """Average latency (us) of GET url"""
+    elapsed = 0.0
+    for _ in range(REQUESTS):
+        t0 = time.perf_counter()
+        response = client.get(url)
+        elapsed += time.perf_counter() - t0
+        assert response.status_code == 200
+    return elapsed / REQUESTS * 1e6
+
+
+def walk(client, total):
+    """Follow next_cursor to the end and check order and completeness"""
+    seen, cursor = [], None
+    while True:
+        url = '/api/patient/appointments?limit=100' + (f'&before={cursor}' if cursor else '')
+        page = client.get(url).get_json()
+        seen += [(apt['date'], apt['id']) for apt in page['items']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert len(seen) == total and len(set(seen)) == total, 'pages skipped or repeated appointments'
+    assert seen == sorted(seen, reverse=True), 'pages out of order'
+    return seen
+
+
+def bench(backend, size):
+    store = seed(backend, size)
+    client = healthcare.app.test_client()
+    client.post('/login', data={'username': 'patient_raj', 'password': 'pat123'})
+    seen = walk(client, len(list(store.appointments_for_patient(1))))
+    middle_date, middle_id = seen[len(seen) // 2]
+    first = timed(client, f'/api/patient/appointments?limit={LIMIT}')
+    deep = timed(client, f'/api/patient/appointments?limit={LIMIT}&before={middle_date}_{middle_id}')
+    return first, deep
+
+
+def main():
+    args = parse_args('Keyset pagination benchmark', [1000, 10000, 100000])
+    print(f'store: {args.store}')
+    print(f"{'history':>10}  {'us/first page':>13}  {'us/middle page':>14}")
+    results = []
+    for size in args.sizes:
+        results.append(bench(args.store, size))
+        print(f"{size:>10}  {results[-1][0]:>13.1f}  {results[-1][1]:>14.1f}")
+    slowdown = max(max(r) / min(results[0]) for r in results)
+    assert slowdown <= MAX_SLOWDOWN, f'pages are {slowdown:.1f}x slower at the largest size'
+    print(f'slowdown at the largest size: {slowdown:.2f}x (limit {MAX_SLOWDOWN}x)')
+
+
+if __name__ == '__main__':
+    main()
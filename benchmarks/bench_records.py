@@ -0,0 +1,77 @@
+"""
+Medical records page regression benchmark
+
+Fills the store with an increasing number of medical records (three
+prescriptions each) for other patients and times GET /patient/records
+for a patient with a fixed history of RECORDS records. With records
+grouped by patient and prescriptions grouped by record the page only
+touches that patient's rows, so the latency must stay flat as the
+hospital grows. The run fails if the largest size is more than
+MAX_SLOWDOWN times slower than the smallest, or if a record is shown
+with the wrong prescriptions.
+
+Usage:
+    python benchmarks/bench_records.py [record counts...] [--store memory|sqlite]
+"""
+
+import re
+import time
+
+from common import healthcare, fresh_store, parse_args
+
+REQUESTS = 100
+RECORDS = 20
+MAX_SLOWDOWN = 3.0
+
+
+def add_record(store, patient_id, n):
+    record_id = store.add_record({
+        'appointment_id': None, 'patient_id': patient_id, 'doctor_id': 1 + n % 3,
+        'date': f'2024-{1 + n % 12:02d}-{1 + n % 28:02d}',
+        'diagnosis': f'Diagnosis {n}', 'symptoms': '', 'notes': '',
+    })
+    for i in range(3):
+        store.add_prescription({
+            'record_id': record_id, 'medicine': f'Medicine {n}-{i}',
+            'dosage': '1', 'frequency': '1x', 'duration': '5',
+        })
+
+
+def bench(backend, total):
+    """Average records page latency (us) with `total` records in the hospital"""
+    store = fresh_store(backend)
+    # Patient 1's records are spread evenly through the table
+    step = total // RECORDS
+    for n in range(total):
+        mine = n % step == 0 and n < step * RECORDS
+        add_record(store, 1 if mine else 2 + n % 2, n)
+    client = healthcare.app.test_client()
+    client.post('/login', data={'username': 'patient_raj', 'password': 'pat123'})
+    elapsed = 0.0
+    for _ in range(REQUESTS):
+        t0 = time.perf_counter()
+        response = client.get('/patient/records')
+        elapsed += time.perf_counter() - t0
+    page = response.get_data(as_text=True)
+    diagnoses = set(re.findall(r'Diagnosis (\d+)', page))
+    medicines = re.findall(r'Medicine (\d+)-\d', page)
+    assert len(diagnoses) == RECORDS, 'wrong records on the page'
+    assert len(medicines) == 3 * RECORDS and set(medicines) == diagnoses, 'prescriptions under the wrong record'
+    return elapsed / REQUESTS * 1e6
+
+
+def main():
+    args = parse_args('Medical records page regression benchmark', [1000, 10000, 100000])
+    print(f'store: {args.store}')
+    print(f"{'records':>10}  {'us/records page':>15}")
+    results = []
+    for total in args.sizes:
+        results.append(bench(args.store, total))
+        print(f"{total:>10}  {results[-1]:>15.1f}")
+    slowdown = max(results) / results[0]
+    assert slowdown <= MAX_SLOWDOWN, f'records page is {slowdown:.1f}x slower at the largest size'
+    print(f'slowdown at the largest size: {slowdown:.2f}x (limit {MAX_SLOWDOWN}x)')
+
+
+if __name__ == '__main__':
+    main()
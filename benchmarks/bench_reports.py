@@ -0,0 +1,99 @@
+"""
+Admin reports benchmark
+
+Builds a synthetic hospital and times, for each size:
+- load: the first report request, which copies the appointments and
+  bills into NumPy columns
+- report: GET /api/admin/reports/... for every report and grouping once
+  the columns are loaded
+- refresh: the same requests after 1,000 new bookings, cancellations and
+  payments, which are folded in from the change events
+- loop: the revenue-by-doctor report computed by looping over the rows
+  in Python, for comparison
+
+Usage:
+    python benchmarks/bench_reports.py [appointment counts...] [--store memory|sqlite]
+"""
+
+import time
+import random
+from collections import defaultdict
+
+from common import healthcare, parse_args
+from hospital import build
+from store import DuplicateKeyError, SLOT_TIMES
+
+REPORTS = [f'/api/admin/reports/{report}?by={by}'
+           for report in ('revenue', 'appointments') for by in ('department', 'doctor', 'month')]
+CHANGES = 1000
+
+
+def get_all(client):
+    t0 = time.perf_counter()
+    for url in REPORTS:
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+    return (time.perf_counter() - t0) / len(REPORTS)
+
+
+def make_changes(hospital, count):
+    store, rng = hospital.store, random.Random(count)
+    booked = []
+    for _ in range(count):
+        try:
+            booked.append(store.book_appointment({
+                'patient_id': rng.choice(hospital.patients), 'doctor_id': rng.choice(hospital.doctors),
+                'date': f'2032-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}', 'time': rng.choice(SLOT_TIMES),
+                'status': 'SCHEDULED', 'reason': '', 'created_at': '2032-01-01T00:00:00',
+            }))
+        except DuplicateKeyError:
+            pass
+    for apt_id in booked[::2]:
+        store.transition_appointment(apt_id, 'CANCELLED', allowed=('SCHEDULED',))
+    for bills in list(hospital.bills_by_patient.values())[:count // 4]:
+        bill = store.get_bill(bills[0])
+        store.pay_bill(bills[0], {'amount': round(bill['amount'] - bill['paid'], 2), 'method': 'CASH',
+                                  'date': '2032-01-01', 'reference': ''})
+
+
+def python_loop(store):
+    """Revenue by doctor the way a loop over the tables would compute it"""
+    rows = store.report_rows()
+    apts, bills = rows['appointments'], rows['bills']
+    doctor_of = dict(zip(apts['id'], apts['doctor_id']))
+    totals = defaultdict(lambda: [0, 0.0, 0.0])
+    for apt_id, amount, paid in zip(bills['appointment_id'], bills['amount'], bills['paid']):
+        total = totals[doctor_of.get(apt_id, -1)]
+        total[0] += 1
+        total[1] += amount
+        total[2] += paid
+    return totals
+
+
+def bench(backend, size):
+    hospital = build(backend, size)
+    client = healthcare.app.test_client()
+    client.post('/login', data={'username': 'admin1', 'password': 'admin123'})
+    t0 = time.perf_counter()
+    assert client.get(REPORTS[0]).status_code == 200
+    load = time.perf_counter() - t0
+    report = get_all(client)
+    make_changes(hospital, CHANGES)
+    refresh = get_all(client)
+    t0 = time.perf_counter()
+    python_loop(hospital.store)
+    loop = time.perf_counter() - t0
+    return load, report, refresh, loop
+
+
+def main():
+    args = parse_args('Admin reports benchmark', [10000, 100000, 1000000])
+    print(f'store: {args.store}')
+    print(f"{'appointments':>12}  {'load ms':>9}  {'report ms':>9}  {'refresh ms':>10}  {'loop ms':>9}")
+    for size in args.sizes:
+        load, report, refresh, loop = bench(args.store, size)
+        print(f'{size:>12}  {load * 1e3:>9.1f}  {report * 1e3:>9.2f}  {refresh * 1e3:>10.2f}  {loop * 1e3:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Warm restart benchmark for the memory store's snapshot + journal
+
+For each size it fills a journaled MemoryStore with `size` appointments,
+takes a snapshot, journals a tail of further bookings and cancellations,
+then times recovery into a fresh store (mmap snapshot load + tail replay)
+and checks the recovered tables match the original. "blocked s" is the
+part of the checkpoint writers wait for: copying the store's state under
+its write barrier (the copy is pickled and written after).
+
+Usage:
+    python benchmarks/bench_restart.py [appointment counts...] [--tail N]
+    python benchmarks/bench_restart.py 100000 1000000
+"""
+
+import os
+import copy
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+from common import DEMO_TABLES
+from store import MemoryStore, SLOT_TIMES
+from journal import Persistence, SNAPSHOT_NAME
+
+
+def demo_store():
+    return MemoryStore(*copy.deepcopy(DEMO_TABLES))
+
+
+def fill(store, size, seed):
+    rng = random.Random(seed)
+    start = date(2015, 1, 1)
+    doctors = list(store.doctors())
+    store.add_appointments({
+        'patient_id': rng.randrange(1, 4),
+        'doctor_id': rng.choice(doctors),
+        'date': (start + timedelta(days=rng.randrange(3000))).isoformat(),
+        'time': rng.choice(SLOT_TIMES),
+        'status': rng.choice(['COMPLETED', 'COMPLETED', 'CANCELLED', 'SCHEDULED']),
+        'reason': '',
+        'created_at': start.isoformat(),
+    } for _ in range(size))
+
+
+def journal_tail(store, count):
+    """Book `count` future slots and cancel every other one"""
+    doctors = list(store.doctors())
+    day = date(2030, 1, 1)
+    for i in range(count):
+        apt_id = store.book_appointment({
+            'patient_id': 1 + i % 3,
+            'doctor_id': doctors[i % len(doctors)],
+            'date': (day + timedelta(days=i // (len(doctors) * len(SLOT_TIMES)))).isoformat(),
+            'time': SLOT_TIMES[(i // len(doctors)) % len(SLOT_TIMES)],
+            'status': 'SCHEDULED',
+            'reason': '',
+            'created_at': day.isoformat(),
+        })
+        if i % 2:
+            store.transition_appointment(apt_id, 'CANCELLED', allowed=('SCHEDULED',))
+
+
+def bench(size, tail):
+    directory = tempfile.mkdtemp(prefix='healthcare-restart-')
+    try:
+        original = demo_store()
+        persistence = Persistence(original, directory)
+        persistence.open()
+        fill(original, size, size)
+        t0 = time.perf_counter()
+        persistence.checkpoint()
+        checkpoint = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        with original.write_barrier():
+            original.snapshot_state()
+        blocked = time.perf_counter() - t0
+        journal_tail(original, tail)
+        persistence.close()
+
+        restored = demo_store()
+        t0 = time.perf_counter()
+        replayed = Persistence(restored, directory).recover()
+        restart = time.perf_counter() - t0
+
+        assert replayed == tail + tail // 2
+        expected, actual = original.snapshot_state(), restored.snapshot_state()
+        for table in expected:
+            assert expected[table] == actual[table], f'{table} differs after restart'
+        snapshot_mb = os.path.getsize(os.path.join(directory, SNAPSHOT_NAME)) / 1e6
+        return checkpoint, blocked, snapshot_mb, restart
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm restart benchmark')
+    parser.add_argument('sizes', nargs='*', type=int, default=[10000, 100000, 1000000])
+    parser.add_argument('--tail', type=int, default=1000, help='bookings journaled after the snapshot')
+    args = parser.parse_args()
+    print(f"{'appointments':>12}  {'checkpoint s':>12}  {'blocked s':>9}  {'snapshot MB':>11}  {'restart s':>9}")
+    for size in args.sizes:
+        checkpoint, blocked, snapshot_mb, restart = bench(size, args.tail)
+        print(f"{size:>12}  {checkpoint:>12.2f}  {blocked:>9.2f}  {snapshot_mb:>11.1f}  {restart:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
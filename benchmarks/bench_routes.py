@@ -0,0 +1,427 @@
+"""
+Route load test: latency percentiles and throughput for every route
+
+Builds a synthetic hospital (see hospital.py) for each size, then drives
+each route of app.py through the Flask test client: REQUESTS requests
+split over THREADS worker threads, every thread with its own logged-in
+clients (a few patients, a few doctors and the admin). For each route it
+reports p50/p95/p99 latency, throughput and the number of failed
+responses: any status other than the route's expected one (see
+EXPECTED), a redirect somewhere else than where the route goes when it
+works, or a redirect that flashed an error. Anonymous requests go
+through a client without cookies, so a POST /login does not log the
+next anonymous request in.
+
+Write routes change the hospital as they go: bookings take new slots,
+cancellations and consultations use up scheduled appointments, payments
+pay 1.00 off a pending bill. Every run starts from a freshly built store.
+Once a client's patient or doctor has no scheduled appointment left, its
+cancellations and consultations fail and are counted as such.
+
+--json writes the results (and the settings they were taken with) to a
+file; --compare prints the change against an earlier --json file, e.g.
+
+    python benchmarks/bench_routes.py 10000 --threads 1 8 --json before.json
+    ... make the change ...
+    python benchmarks/bench_routes.py 10000 --threads 1 8 --compare before.json
+
+Usage:
+    python benchmarks/bench_routes.py [appointment counts...] [--store memory|sqlite]
+        [--threads N...] [--requests N] [--routes SUBSTRING...]
+        [--patients N] [--doctors N] [--seed N] [--json FILE] [--compare FILE]
+"""
+
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import itertools
+import threading
+import subprocess
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from common import ROOT, healthcare
+from store import SLOT_TIMES
+import hospital
+from hospital import PASSWORD, TODAY
+
+PATIENT_CLIENTS = 4
+DOCTOR_CLIENTS = 4
+# Bookings go into a year nobody has appointments in yet
+BOOKING_DAY = TODAY + timedelta(days=2 * 365)
+unique = itertools.count()
+# Patients per uploaded import file
+IMPORT_ROWS = 10
+
+
+# ============================================
+# Routes
+# ============================================
+# Each route is (name, role, request) where request(h, rng, user_id)
+# returns (method, url, form data). role picks the client: None for an
+# anonymous client, or a PATIENT / DOCTOR / ADMIN client logged in as
+# user_id (a patient_id or doctor_id).
+
+def future_date(rng):
+    return (BOOKING_DAY + timedelta(days=rng.randrange(365))).isoformat()
+
+
+def cursor(h, rng):
+    """A before= cursor in the middle of the hospital's history"""
+    day = hospital.FIRST_DAY + timedelta(days=rng.randrange(hospital.DAYS))
+    return f'{day.isoformat()}_{h.appointments}'
+
+
+def open_appointment(pool, owner):
+    """Pop a SCHEDULED appointment of owner, 0 (not found) once they run out"""
+    try:
+        return pool[owner].pop()
+    except IndexError:
+        return 0
+
+
+def book(h, rng, patient_id):
+    return 'POST', '/patient/book-appointment', {
+        'doctor_id': str(rng.choice(h.doctors)),
+        'appointment_date': future_date(rng),
+        'appointment_time': rng.choice(SLOT_TIMES),
+        'reason': 'Benchmark',
+    }
+
+
+def register(h, rng, user_id):
+    n = next(unique)
+    return 'POST', '/register', {
+        'username': f'bench_new_{n}', 'password': PASSWORD, 'email': f'bench_new_{n}@email.com',
+        'first_name': 'New', 'last_name': f'Patient{n}', 'dob': '1990-01-01', 'gender': 'Male',
+        'phone': '9000000000', 'blood_group': 'O+', 'address': 'Street', 'city': 'Pune',
+    }
+
+
+def pay(h, rng, patient_id):
+    bills = h.bills_by_patient.get(patient_id)
+    bill_id = rng.choice(bills) if bills else 0
+    return 'POST', f'/patient/pay-bill/{bill_id}', {'amount': '1', 'method': 'CARD'}
+
+
+def receipt(h, rng, patient_id):
+    bills = h.bills_by_patient.get(patient_id)
+    return 'GET', f'/patient/receipt/{rng.choice(bills) if bills else 0}', None
+
+
+def consult(h, rng, doctor_id):
+    apt_id = open_appointment(h.open_by_doctor, doctor_id)
+    return 'POST', f'/doctor/consultation/{apt_id}', {
+        'diagnosis': 'Benchmark', 'symptoms': '', 'notes': '',
+        'medicine_name[]': ['Paracetamol'], 'dosage[]': ['500mg'],
+        'frequency[]': ['Twice daily'], 'duration[]': ['5 days'],
+    }
+
+
+def add_doctor(h, rng, user_id):
+    n = next(unique)
+    return 'POST', '/admin/add-doctor', {
+        'name': f'Dr New {n}', 'email': f'dr_new_{n}@hospital.com', 'phone': '9800000000',
+        'specialization': 'General', 'dept_id': str(rng.choice(h.departments)), 'fee': '500',
+    }
+
+
+def add_department(h, rng, user_id):
+    n = next(unique)
+    return 'POST', '/admin/add-department', {
+        'name': f'Department {n}', 'description': 'Benchmark', 'location': 'Annex',
+    }
+
+
+def import_patients(h, rng, user_id):
+    n = next(unique)
+    lines = ['username,password,first_name,last_name,dob,phone']
+    lines += [f'bench_import_{n}_{i},{PASSWORD},Imported,Patient{n},1990-01-01,9000000000' for i in range(IMPORT_ROWS)]
+    data = io.BytesIO('\n'.join(lines).encode())
+    return 'POST', '/api/admin/import?kind=patients', {'file': (data, 'patients.csv')}
+
+
+ROUTES = [
+    ('GET /', None, lambda h, rng, u: ('GET', '/', None)),
+    ('GET /login', None, lambda h, rng, u: ('GET', '/login', None)),
+    ('POST /login', None, lambda h, rng, u: ('POST', '/login', {'username': h.patient()[0], 'password': PASSWORD})),
+    ('GET /register', None, lambda h, rng, u: ('GET', '/register', None)),
+    ('POST /register', None, register),
+    ('GET /logout', None, lambda h, rng, u: ('GET', '/logout', None)),
+    ('GET /dashboard', 'PATIENT', lambda h, rng, u: ('GET', '/dashboard', None)),
+
+    ('GET /patient/dashboard', 'PATIENT', lambda h, rng, u: ('GET', '/patient/dashboard', None)),
+    ('GET /patient/appointments', 'PATIENT', lambda h, rng, u: ('GET', '/patient/appointments', None)),
+    ('GET /patient/appointments?before', 'PATIENT',
+     lambda h, rng, u: ('GET', f'/patient/appointments?before={cursor(h, rng)}', None)),
+    ('GET /patient/book-appointment', 'PATIENT', lambda h, rng, u: ('GET', '/patient/book-appointment', None)),
+    ('POST /patient/book-appointment', 'PATIENT', book),
+    ('POST /patient/cancel-appointment', 'PATIENT',
+     lambda h, rng, u: ('POST', f'/patient/cancel-appointment/{open_appointment(h.open_by_patient, u)}', None)),
+    ('GET /patient/records', 'PATIENT', lambda h, rng, u: ('GET', '/patient/records', None)),
+    ('GET /patient/bills', 'PATIENT', lambda h, rng, u: ('GET', '/patient/bills', None)),
+    ('POST /patient/pay-bill', 'PATIENT', pay),
+    ('GET /patient/receipt', 'PATIENT', receipt),
+
+    ('GET /doctor/dashboard', 'DOCTOR', lambda h, rng, u: ('GET', '/doctor/dashboard', None)),
+    ('GET /doctor/appointments', 'DOCTOR', lambda h, rng, u: ('GET', '/doctor/appointments', None)),
+    ('GET /doctor/appointments?before', 'DOCTOR',
+     lambda h, rng, u: ('GET', f'/doctor/appointments?before={cursor(h, rng)}', None)),
+    ('GET /doctor/consultation', 'DOCTOR',
+     lambda h, rng, u: ('GET', f'/doctor/consultation/{(h.open_by_doctor.get(u) or [0])[0]}', None)),
+    ('POST /doctor/consultation', 'DOCTOR', consult),
+
+    ('GET /admin/dashboard', 'ADMIN', lambda h, rng, u: ('GET', '/admin/dashboard', None)),
+    ('GET /admin/doctors', 'ADMIN', lambda h, rng, u: ('GET', '/admin/doctors', None)),
+    ('POST /admin/add-doctor', 'ADMIN', add_doctor),
+    ('GET /admin/toggle-doctor', 'ADMIN', lambda h, rng, u: ('GET', f'/admin/toggle-doctor/{rng.choice(h.doctors)}', None)),
+    ('GET /admin/departments', 'ADMIN', lambda h, rng, u: ('GET', '/admin/departments', None)),
+    ('POST /admin/add-department', 'ADMIN', add_department),
+    ('GET /admin/metrics', 'ADMIN', lambda h, rng, u: ('GET', '/admin/metrics', None)),
+    ('GET /admin/reports', 'ADMIN',
+     lambda h, rng, u: ('GET', f"/admin/reports?by={rng.choice(['department', 'doctor', 'month'])}", None)),
+
+    ('GET /api/doctors-by-department', None,
+     lambda h, rng, u: ('GET', f'/api/doctors-by-department/{rng.choice(h.departments)}', None)),
+    ('GET /api/available-slots', None,
+     lambda h, rng, u: ('GET', f'/api/available-slots/{rng.choice(h.doctors)}/{future_date(rng)}', None)),
+    ('GET /api/available-slots/department', None,
+     lambda h, rng, u: ('GET', f'/api/available-slots/department/{rng.choice(h.departments)}/{future_date(rng)}', None)),
+    ('GET /api/search/doctors', 'PATIENT',
+     lambda h, rng, u: ('GET', f"/api/search/doctors?q={rng.choice(['bench', 'gen', 'card', 'ne', 'or'])}", None)),
+    ('GET /api/search/patients', 'DOCTOR',
+     lambda h, rng, u: ('GET', f'/api/search/patients?q=bench+patient+{rng.randrange(100)}', None)),
+    ('GET /api/patient/appointments', 'PATIENT', lambda h, rng, u: ('GET', '/api/patient/appointments', None)),
+    ('GET /api/patient/records', 'PATIENT', lambda h, rng, u: ('GET', '/api/patient/records', None)),
+    ('GET /api/patient/bills', 'PATIENT', lambda h, rng, u: ('GET', '/api/patient/bills', None)),
+    ('GET /api/patient/export', 'PATIENT', lambda h, rng, u: ('GET', '/api/patient/export', None)),
+    ('GET /api/doctor/appointments', 'DOCTOR', lambda h, rng, u: ('GET', '/api/doctor/appointments', None)),
+    ('GET /api/admin/reports', 'ADMIN',
+     lambda h, rng, u: ('GET', f"/api/admin/reports/{rng.choice(['revenue', 'appointments'])}?by=month", None)),
+    ('GET /api/admin/audit', 'ADMIN',
+     lambda h, rng, u: ('GET', f'/api/admin/audit/{rng.choice(h.patients)}', None)),
+    ('GET /api/admin/export', 'ADMIN',
+     lambda h, rng, u: ('GET', f'/api/admin/export?patient_id={rng.choice(h.patients)}&format=csv&data=bills', None)),
+    ('POST /api/admin/import', 'ADMIN', import_patients),
+    ('GET /api/admin/tasks', 'ADMIN', lambda h, rng, u: ('GET', '/api/admin/tasks', None)),
+]
+
+
+# (status, Location) each route answers with when the request did what it
+# asked; routes not listed answer 200. Error paths of the same routes
+# redirect to the login page, to the form again or flash an error.
+EXPECTED = {
+    'POST /login': (302, '/patient/dashboard'),
+    'POST /register': (302, '/login'),
+    'GET /logout': (302, '/'),
+    'GET /dashboard': (302, '/patient/dashboard'),
+    'POST /patient/book-appointment': (302, '/patient/appointments'),
+    'POST /patient/cancel-appointment': (302, '/patient/appointments'),
+    'POST /patient/pay-bill': (302, '/patient/bills'),
+    'POST /doctor/consultation': (302, '/doctor/dashboard'),
+    'POST /admin/add-doctor': (302, '/admin/doctors'),
+    'GET /admin/toggle-doctor': (302, '/admin/doctors'),
+    'POST /admin/add-department': (302, '/admin/departments'),
+}
+
+
+# Endpoints that are not benchmarked: the profile is only served while
+# the sampling profiler runs
+UNBENCHMARKED = {'static', 'admin_metrics_profile'}
+
+
+def check_coverage():
+    """Every URL rule of the app must have at least one benchmarked route"""
+    covered = {name.split()[1].split('?')[0] for name, _, _ in ROUTES}
+    missing = []
+    for rule in healthcare.app.url_map.iter_rules():
+        if rule.endpoint in UNBENCHMARKED:
+            continue
+        prefix = rule.rule.split('/<')[0]
+        if prefix not in covered:
+            missing.append(rule.rule)
+    assert not missing, f'routes without a benchmark: {missing}'
+
+
+# ============================================
+# Clients
+# ============================================
+
+def login(username, password=PASSWORD):
+    client = healthcare.app.test_client()
+    response = client.post('/login', data={'username': username, 'password': password})
+    assert response.status_code == 302 and 'login' not in response.headers['Location'], f'login failed for {username}'
+    return client
+
+
+def make_clients(h):
+    """One worker thread's clients: {role: [(client, user_id)]}
+
+    Patients and doctors are picked among those with scheduled
+    appointments, so cancellations and consultations have work to do,
+    and patients among those with bills too, so payments and receipts
+    find one.
+    """
+    patients = ([p for p in h.patient_logins if h.open_by_patient.get(p[1]) and h.bills_by_patient.get(p[1])]
+                or [p for p in h.patient_logins if h.open_by_patient.get(p[1])] or h.patient_logins)
+    doctors = [d for d in h.doctor_logins if h.open_by_doctor.get(d[1])] or h.doctor_logins
+    return {
+        None: [(healthcare.app.test_client(use_cookies=False), None)],
+        'PATIENT': [(login(name), patient_id) for name, patient_id in h.rng.sample(patients, PATIENT_CLIENTS)],
+        'DOCTOR': [(login(name), doctor_id) for name, doctor_id in h.rng.sample(doctors, DOCTOR_CLIENTS)],
+        'ADMIN': [(login('admin1', 'admin123'), None)],
+    }
+
+
+# ============================================
+# Measurement
+# ============================================
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of a sorted list"""
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def failed(client, role, response, expected):
+    """Whether a response is not what the route answers when it works"""
+    status, location = expected
+    if response.status_code != status or response.headers.get('Location') != location:
+        return True
+    if status != 302 or role is None:
+        # Anonymous clients keep no session to flash into
+        return False
+    # Same page either way: only the flashed message tells (taken off so it is not counted twice)
+    with client.session_transaction() as session:
+        return any(category == 'error' for category, _ in session.pop('_flashes', []))
+
+
+def worker(h, clients, route, count, seed, start):
+    """Send one thread's share of a route: (latencies, failures, began, ended)"""
+    name, role, make_request = route
+    expected = EXPECTED.get(name, (200, None))
+    rng = random.Random(seed)
+    latencies, failures = [], 0
+    start.wait()
+    began = time.perf_counter()
+    for _ in range(count):
+        client, user_id = rng.choice(clients[role])
+        method, url, data = make_request(h, rng, user_id)
+        t0 = time.perf_counter()
+        response = client.open(url, method=method, data=data)
+        latencies.append(time.perf_counter() - t0)
+        if failed(client, role, response, expected):
+            failures += 1
+    return latencies, failures, began, time.perf_counter()
+
+
+def run_route(h, pool, clients, route, requests, threads):
+    """Drive one route from every worker thread, return its result row"""
+    start = threading.Barrier(threads)
+    counts = [requests // threads + (i < requests % threads) for i in range(threads)]
+    futures = [pool.submit(worker, h, clients[i], route, counts[i], i, start) for i in range(threads)]
+    results = [future.result() for future in futures]
+    # From the first worker starting to the last one finishing
+    wall = max(ended for *_, ended in results) - min(began for _, _, began, _ in results)
+    latencies = sorted(latency for thread, *_ in results for latency in thread)
+    return {
+        'route': route[0],
+        'requests': len(latencies),
+        'failures': sum(failures for _, failures, *_ in results),
+        'mean_ms': sum(latencies) / len(latencies) * 1e3,
+        'p50_ms': percentile(latencies, 50) * 1e3,
+        'p95_ms': percentile(latencies, 95) * 1e3,
+        'p99_ms': percentile(latencies, 99) * 1e3,
+        'max_ms': latencies[-1] * 1e3,
+        'throughput_rps': len(latencies) / wall,
+    }
+
+
+def run(args, size, threads, routes):
+    t0 = time.perf_counter()
+    h = hospital.build(args.store, size, args.patients, args.doctors, args.seed)
+    seed_seconds = time.perf_counter() - t0
+    clients = [make_clients(h) for _ in range(threads)]
+    print(f'\n{size} appointments, {len(h.patients)} patients, {len(h.doctors)} doctors, '
+          f'{threads} thread(s), store: {args.store} (seeded in {seed_seconds:.1f}s)')
+    print(f"{'route':<40} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>9} {'fail':>5}")
+    rows = []
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for route in routes:
+            row = run_route(h, pool, clients, route, args.requests, threads)
+            row.update(appointments=size, threads=threads)
+            rows.append(row)
+            print(f"{row['route']:<40} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+                  f"{row['throughput_rps']:>9.0f} {row['failures']:>5}")
+    return {
+        'appointments': size, 'threads': threads, 'patients': len(h.patients),
+        'doctors': len(h.doctors), 'seed_seconds': seed_seconds, 'routes': rows,
+    }
+
+
+# ============================================
+# Reporting
+# ============================================
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(runs, path):
+    """Print the change of each route against an earlier --json file"""
+    with open(path) as f:
+        before = {(r['appointments'], r['threads'], r['route']): r
+                  for run in json.load(f)['runs'] for r in run['routes']}
+    print(f'\nchange against {path} (negative latency / positive req/s is better)')
+    print(f"{'route':<40} {'size':>8} {'thr':>3} {'p50':>8} {'p99':>8} {'req/s':>8}")
+    for run in runs:
+        for row in run['routes']:
+            old = before.get((row['appointments'], row['threads'], row['route']))
+            if old is None:
+                continue
+            change = lambda key: f"{(row[key] / old[key] - 1) * 100:+7.1f}%"
+            print(f"{row['route']:<40} {row['appointments']:>8} {row['threads']:>3} "
+                  f"{change('p50_ms')} {change('p99_ms')} {change('throughput_rps')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Route latency and throughput benchmark')
+    parser.add_argument('sizes', nargs='*', type=int, default=[1000, 10000], help='appointments in the hospital')
+    parser.add_argument('--store', choices=['memory', 'sqlite'], default='memory')
+    parser.add_argument('--threads', nargs='+', type=int, default=[1], help='worker threads (one run each)')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--routes', nargs='+', default=[], help='only routes whose name contains one of these')
+    parser.add_argument('--patients', type=int, help='default: appointments / 10, at least 1000')
+    parser.add_argument('--doctors', type=int, help='default: appointments / 2000, 20 to 500')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='compare with the results in this --json file')
+    args = parser.parse_args()
+
+    check_coverage()
+    routes = [r for r in ROUTES if not args.routes or any(s in r[0] for s in args.routes)]
+    runs = [run(args, size, threads, routes) for size in args.sizes for threads in args.threads]
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'settings': {
+                    'store': args.store, 'requests': args.requests, 'seed': args.seed,
+                    'revision': git_revision(), 'python': sys.version.split()[0],
+                    'platform': platform.platform(), 'date': datetime.now().isoformat(timespec='seconds'),
+                },
+                'runs': runs,
+            }, f, indent=2)
+        print(f'\nresults written to {args.json}')
+    if args.compare:
+        compare(runs, args.compare)
+
+
+if __name__ == '__main__':
+    main()
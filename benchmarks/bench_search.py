@@ -0,0 +1,126 @@
+"""
+Typeahead search benchmark
+
+Registers patients with random names and phone numbers and times, for
+each size:
+- load: the first search, which builds the prefix indexes from the store
+- patients: GET /api/search/patients for 1-4 letter name prefixes and
+  phone prefixes (p50 / p99)
+- doctors: GET /api/search/doctors the same way
+- register: one more registration with the index loaded, which adds its
+  name and phone to the index on the next search
+- scan: the same patient lookup done by scanning every patient row, for
+  comparison
+
+Usage:
+    python benchmarks/bench_search.py [patient counts...] [--store memory|sqlite]
+"""
+
+import time
+import random
+
+from common import fresh_store, healthcare, parse_args
+
+FIRST_NAMES = ['Raj', 'Priya', 'Amit', 'Neha', 'Rahul', 'Anita', 'Vikram', 'Sunita', 'Arjun', 'Kavya',
+               'Rohan', 'Meera', 'Sanjay', 'Pooja', 'Karan', 'Divya', 'Aditya', 'Sneha', 'Manoj', 'Lakshmi']
+LAST_NAMES = ['Kumar', 'Singh', 'Verma', 'Sharma', 'Patel', 'Gupta', 'Reddy', 'Iyer', 'Nair', 'Das',
+              'Mehta', 'Joshi', 'Rao', 'Chopra', 'Bose', 'Malhotra', 'Pillai', 'Kapoor', 'Menon', 'Ghosh']
+SPECIALIZATIONS = ['Cardiologist', 'Orthopedic Surgeon', 'Neurologist', 'Pediatrician', 'General Physician']
+QUERIES = 500
+
+
+def register(store, rng, i):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    username = f'search_patient_{i}'
+    store.register_patient({
+        'username': username, 'password': 'bench123', 'role': 'PATIENT',
+        'name': f'{first} {last}', 'email': f'{username}@email.com',
+    }, {
+        'name': f'{first} {last}', 'dob': '1990-01-01', 'gender': 'Male',
+        'phone': f'9{rng.randrange(10 ** 9):09d}', 'blood_group': 'O+', 'address': 'Mumbai',
+    })
+
+
+def populate(backend, patients, rng):
+    store = fresh_store(backend)
+    for i in range(max(20, patients // 500)):
+        username = f'search_dr_{i}'
+        name = f'Dr. {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        store.add_doctor({'username': username, 'password': 'bench123', 'role': 'DOCTOR',
+                          'name': name, 'email': f'{username}@hospital.com'},
+                         {'name': name, 'specialization': rng.choice(SPECIALIZATIONS),
+                          'dept_id': rng.choice(list(store.departments())), 'fee': 500,
+                          'phone': f'98{i:08d}', 'experience': 5, 'available': True})
+    for i in range(patients):
+        register(store, rng, i)
+    return store
+
+
+def query(rng, names):
+    if rng.random() < 0.25:
+        return str(rng.randrange(90, 100))
+    return rng.choice(names)[:rng.randint(1, 4)].lower()
+
+
+def percentile(timings, p):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+
+def time_queries(client, url, queries):
+    timings = []
+    for q in queries:
+        t0 = time.perf_counter()
+        response = client.get(url, query_string={'q': q})
+        timings.append(time.perf_counter() - t0)
+        assert response.status_code == 200, (url, response.status_code)
+    return percentile(timings, 0.5), percentile(timings, 0.99)
+
+
+def scan(store, prefix, limit=10):
+    """Name-prefix lookup the way a loop over the patient rows would do it"""
+    patients = store.get_patients(range(1, store.counts()['patients'] + 1))
+    found = []
+    for patient_id, patient in patients.items():
+        if any(word.lower().startswith(prefix) for word in patient['name'].split()):
+            found.append(patient_id)
+            if len(found) == limit:
+                break
+    return found
+
+
+def bench(backend, size):
+    rng = random.Random(size)
+    store = populate(backend, size, rng)
+    client = healthcare.app.test_client()
+    client.post('/login', data={'username': 'admin1', 'password': 'admin123'})
+    t0 = time.perf_counter()
+    assert client.get('/api/search/patients?q=a').status_code == 200
+    load = time.perf_counter() - t0
+    patients = time_queries(client, '/api/search/patients', [query(rng, FIRST_NAMES + LAST_NAMES)
+                                                             for _ in range(QUERIES)])
+    doctors = time_queries(client, '/api/search/doctors', [query(rng, FIRST_NAMES + SPECIALIZATIONS)
+                                                           for _ in range(QUERIES)])
+    t0 = time.perf_counter()
+    register(store, rng, size)
+    client.get('/api/search/patients?q=zz')
+    added = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    scan(store, 'zz')
+    scanned = time.perf_counter() - t0
+    return load, patients, doctors, added, scanned
+
+
+def main():
+    args = parse_args('Typeahead search benchmark', [10000, 100000])
+    print(f'store: {args.store}')
+    print(f"{'patients':>9}  {'load ms':>8}  {'patients p50/p99 ms':>20}  {'doctors p50/p99 ms':>19}"
+          f"  {'register ms':>11}  {'scan ms':>8}")
+    for size in args.sizes:
+        load, patients, doctors, added, scanned = bench(args.store, size)
+        print(f'{size:>9}  {load * 1e3:>8.1f}  {patients[0] * 1e3:>9.3f} / {patients[1] * 1e3:<8.3f}'
+              f'  {doctors[0] * 1e3:>8.3f} / {doctors[1] * 1e3:<8.3f}  {added * 1e3:>11.2f}  {scanned * 1e3:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Cold start benchmark
+
+Starts a new Python process RUNS times and times, in each:
+- import: `import app` (Flask, the modules of this repo, create_app())
+- first page: GET /login, rendering its templates for the first time
+- first login: POST /login as a patient and the dashboard it redirects
+  to, which opens the store and starts the background threads
+
+once with templates compiled on their first render and once loaded from
+the bytecode cache (HEALTHCARE_TEMPLATE_CACHE), reporting the medians.
+The modules taking longest to import (python -X importtime) are listed
+below, to show what a new dependency added.
+
+Exits with status 1 if import + first page + first login takes longer
+than the budget, so a CI job can keep cold start from creeping up.
+
+Usage:
+    python benchmarks/bench_startup.py [--store memory|sqlite] [--runs N] [--budget MS]
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUNS = 7
+BUDGET_MS = 600
+SLOWEST = 8
+
+CHILD = '''
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+client = app.app.test_client()
+assert client.get('/login').status_code == 200
+t2 = time.perf_counter()
+response = client.post('/login', data={'username': 'patient_raj', 'password': 'pat123'}, follow_redirects=True)
+assert response.status_code == 200 and response.request.path == '/patient/dashboard', response.request.path
+t3 = time.perf_counter()
+print(json.dumps([t1 - t0, t2 - t1, t3 - t2]))
+'''
+
+
+def child_env(store, directory, template_cache):
+    env = dict(os.environ,
+               HEALTHCARE_STORE=store,
+               HEALTHCARE_SQLITE_PATH=os.path.join(directory, 'healthcare.db'),
+               HEALTHCARE_AUDIT_DIR=os.path.join(directory, 'audit'),
+               HEALTHCARE_RECEIPT_DIR=os.path.join(directory, 'receipts'),
+               HEALTHCARE_TEMPLATE_CACHE='1' if template_cache else '0',
+               HEALTHCARE_TEMPLATE_CACHE_DIR=os.path.join(directory, 'templates'))
+    env.pop('HEALTHCARE_DATA_DIR', None)
+    return env
+
+
+def start(env, *flags):
+    """(seconds per phase, stderr) of one new process"""
+    result = subprocess.run([sys.executable, *flags, '-c', CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def medians(env, runs):
+    timings = [start(env)[0] for _ in range(runs)]
+    return [statistics.median(phase) for phase in zip(*timings)]
+
+
+def slowest_imports(env, count):
+    """(module, cumulative ms) of the modules taking longest to import, below app"""
+    _, stderr = start(env, '-X', 'importtime')
+    # A module's imports are listed before it, one level deeper
+    nested = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            nested.append((name.strip(), int(cumulative) / 1e3))
+        elif depth == 0:
+            if name.strip() == 'app':
+                return sorted(nested, key=lambda m: -m[1])[:count]
+            nested = []
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark')
+    parser.add_argument('--store', choices=['memory', 'sqlite'], default='memory')
+    parser.add_argument('--runs', type=int, default=RUNS)
+    parser.add_argument('--budget', type=float, default=BUDGET_MS, help='ms for import + first page + first login')
+    args = parser.parse_args()
+    print(f'store: {args.store}, median of {args.runs} new processes, budget {args.budget:.0f} ms')
+    print(f"{'templates':<10}  {'import ms':>9}  {'first page ms':>13}  {'first login ms':>14}  {'total ms':>8}")
+    totals = {}
+    for template_cache in (False, True):
+        directory = tempfile.mkdtemp(prefix='healthcare-bench-startup-')
+        try:
+            env = child_env(args.store, directory, template_cache)
+            if template_cache:
+                start(env)  # fills the cache, like the first worker to start
+            phases = medians(env, args.runs)
+            if template_cache:
+                imports = slowest_imports(env, SLOWEST)
+        finally:
+            shutil.rmtree(directory)
+        mode = 'cached' if template_cache else 'compiled'
+        totals[mode] = sum(phases) * 1e3
+        print(f'{mode:<10}  {phases[0] * 1e3:>9.1f}  {phases[1] * 1e3:>13.1f}  {phases[2] * 1e3:>14.1f}'
+              f'  {totals[mode]:>8.1f}')
+    print('slowest imports of app.py (ms, cumulative):')
+    for name, ms in imports:
+        print(f'  {name:<20} {ms:>7.1f}')
+    if totals['cached'] > args.budget:
+        print(f"over budget: {totals['cached']:.0f} ms > {args.budget:.0f} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
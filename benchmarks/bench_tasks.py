@@ -0,0 +1,127 @@
+"""
+Background task benchmark
+
+Times POST /doctor/consultation with its side effects (PDF receipt and
+e-mail to the patient) done three ways, interleaved request by
+request so all three see the same store:
+- none: side effects skipped, the floor of the route
+- inline: run by the request before it redirects
+- background: queued for the task workers (how the route runs them)
+
+E-mails go to a local SMTP sink that waits `delay` ms before greeting,
+standing in for a mail server across the network.
+
+Usage:
+    python benchmarks/bench_tasks.py [SMTP delays in ms...] [--store memory|sqlite]
+"""
+
+import time
+import threading
+import socketserver
+from datetime import date, timedelta
+
+from common import fresh_store, healthcare, parse_args, services
+from store import SLOT_TIMES
+
+CONSULTATIONS = 300  # per mode
+FORM = {'diagnosis': 'Flu', 'symptoms': 'Fever', 'notes': '',
+        'medicine_name[]': ['Paracetamol'], 'dosage[]': ['500mg'],
+        'frequency[]': ['Twice daily'], 'duration[]': ['5 days']}
+
+
+class SmtpSink(socketserver.StreamRequestHandler):
+    """Accepts every message and throws it away"""
+
+    delay = 0.0
+
+    def handle(self):
+        time.sleep(self.delay)
+        self.reply('220 sink')
+        in_data = False
+        for line in self.rfile:
+            if in_data:
+                if line == b'.\r\n':
+                    in_data = False
+                    self.reply('250 queued')
+            elif line[:4].upper() == b'DATA':
+                in_data = True
+                self.reply('354 go ahead')
+            elif line[:4].upper() == b'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+    def reply(self, text):
+        self.wfile.write(text.encode() + b'\r\n')
+
+
+def start_sink():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SmtpSink)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    healthcare.app.config['SMTP_HOST'], healthcare.app.config['SMTP_PORT'] = server.server_address
+
+
+def schedule(store, count):
+    """`count` scheduled appointments with doctor 1, returns their ids"""
+    first_id = store.counts()['appointments'] + 1
+    store.add_appointments([{
+        'patient_id': 1 + i % 3, 'doctor_id': 1,
+        'date': (date(2030, 1, 1) + timedelta(days=i // len(SLOT_TIMES))).isoformat(),
+        'time': SLOT_TIMES[i % len(SLOT_TIMES)],
+        'status': 'SCHEDULED', 'reason': 'Checkup', 'created_at': '2030-01-01T00:00:00',
+    } for i in range(count)])
+    return range(first_id, first_id + count)
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return timings[len(timings) // 2] * 1e3, timings[int(len(timings) * 0.99)] * 1e3
+
+
+def bench(backend, delay_ms):
+    SmtpSink.delay = delay_ms / 1e3
+    store = fresh_store(backend)
+    client = healthcare.app.test_client()
+    client.post('/login', data={'username': 'dr_sharma', 'password': 'doc123'})
+    submit = services.tasks.submit
+    modes = {
+        'none': lambda name, delay=0, **args: None,
+        'inline': lambda name, delay=0, **args: services.tasks.handlers[name](**args),
+        'background': submit,
+    }
+    timings = {mode: [] for mode in modes}
+    try:
+        for i, apt_id in enumerate(schedule(store, CONSULTATIONS * len(modes))):
+            mode = list(modes)[i % len(modes)]
+            services.tasks.submit = modes[mode]
+            t0 = time.perf_counter()
+            response = client.post(f'/doctor/consultation/{apt_id}', data=FORM)
+            timings[mode].append(time.perf_counter() - t0)
+            assert response.status_code == 302, response.status_code
+            # The redirect is not followed, so drop its flash message
+            # before it piles up in the session cookie
+            with client.session_transaction() as session:
+                session.pop('_flashes', None)
+    finally:
+        services.tasks.submit = submit
+    t0 = time.perf_counter()
+    assert services.tasks.drain(60), 'background tasks did not finish'
+    return {mode: percentiles(t) for mode, t in timings.items()}, time.perf_counter() - t0
+
+
+def main():
+    args = parse_args('Background task benchmark', [0, 20])
+    start_sink()
+    print(f'store: {args.store}, {CONSULTATIONS} consultations per mode')
+    print(f"{'smtp ms':>7}  {'none p50/p99 ms':>16}  {'inline p50/p99 ms':>18}  {'background p50/p99 ms':>22}"
+          f"  {'drain s':>7}")
+    for delay_ms in args.sizes:
+        results, drained = bench(args.store, delay_ms)
+        cells = [f'{p50:>7.2f} / {p99:<7.2f}' for p50, p99 in results.values()]
+        print(f'{delay_ms:>7}  {cells[0]:>16}  {cells[1]:>18}  {cells[2]:>22}  {drained:>7.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Login latency and concurrent registration benchmark
+
+1. Seeds the user store with an increasing number of patients and times
+   POST /login through the Flask test client. With the username index the
+   latency should not depend on the number of users.
+2. Fires registrations from a thread pool where every username and email
+   is requested by several threads at once, then checks that each one was
+   accepted exactly once.
+
+Usage:
+    python benchmarks/bench_users.py [user counts...] [--store memory|sqlite]
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import healthcare, fresh_store, parse_args
+
+LOGINS = 500
+THREADS = 16
+CONTENDERS = 4
+
+
+def seed_users(backend, count):
+    """Install a store holding the demo users plus `count` patients"""
+    store = fresh_store(backend)
+    for i in range(count):
+        store.register_patient({
+            'username': f'bench_patient_{i}',
+            'password': 'pat123',
+            'role': 'PATIENT',
+            'name': f'Bench Patient{i}',
+            'email': f'bench{i}@email.com',
+        }, {
+            'name': f'Bench Patient{i}', 'dob': '1990-01-01', 'gender': 'Other',
+            'phone': '9000000000', 'blood_group': 'O+', 'address': 'Pune',
+        })
+    return store
+
+
+def bench_login(backend, count):
+    """Average login latency in microseconds with `count` patients"""
+    seed_users(backend, count)
+    client = healthcare.app.test_client()
+    username = f'bench_patient_{count - 1}'
+    elapsed = 0.0
+    for _ in range(LOGINS):
+        t0 = time.perf_counter()
+        response = client.post('/login', data={'username': username, 'password': 'pat123'})
+        elapsed += time.perf_counter() - t0
+        assert response.status_code == 302 and '/patient/' in response.location
+        client.get('/logout')
+    return elapsed / LOGINS * 1e6
+
+
+def register(i):
+    client = healthcare.app.test_client()
+    n = i // CONTENDERS
+    client.post('/register', data={
+        'username': f'race_user_{n}', 'password': 'x', 'email': f'race{n}@email.com',
+        'first_name': 'Race', 'last_name': str(n), 'dob': '2000-01-01', 'gender': 'Other',
+        'phone': '9000000000', 'blood_group': 'O+', 'address': 'Pune', 'city': 'Pune',
+    })
+
+
+def check_concurrent_registrations(backend, attempts=400):
+    """Every username/email requested CONTENDERS times must exist once"""
+    store = seed_users(backend, 0)
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(register, range(attempts)))
+    expected = attempts // CONTENDERS
+    patient_ids = set()
+    for n in range(expected):
+        user_id, user = store.find_user(f'race_user_{n}')
+        assert user is not None, f'race_user_{n} was not created'
+        assert user['email'] == f'race{n}@email.com'
+        patient_ids.add(user['patient_id'])
+    assert len(patient_ids) == expected, 'two users share a patient id'
+    assert store.counts()['patients'] == 3 + expected, 'duplicate registrations were stored'
+    return expected
+
+
+def main():
+    args = parse_args('Login latency and concurrent registration benchmark', [1000, 10000, 100000])
+    print(f'store: {args.store}')
+    print(f"{'users':>10}  {'us/login':>10}")
+    for count in args.sizes:
+        print(f"{count:>10}  {bench_login(args.store, count):>10.1f}")
+    created = check_concurrent_registrations(args.store)
+    print(f'concurrent registrations: {created} unique users, no duplicates')
+
+
+if __name__ == '__main__':
+    main()
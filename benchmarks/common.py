@@ -0,0 +1,69 @@
+"""
+Shared helpers for the benchmark scripts
+"""
+
+import os
+import sys
+import copy
+import glob
+import atexit
+import shutil
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Audit entries made by the benchmarked requests are thrown away (the
+# audit log is opened with the first one, in the directory config.py
+# reads when it is imported)
+AUDIT_DIR = os.environ.setdefault('HEALTHCARE_AUDIT_DIR', tempfile.mkdtemp(prefix='healthcare-bench-audit-'))
+
+import app as healthcare
+from store import MemoryStore
+
+# The store, task workers and audit log of healthcare.app
+services = healthcare.app.extensions['healthcare']
+
+DEMO_TABLES = copy.deepcopy((healthcare.USERS, healthcare.DEPARTMENTS, healthcare.DOCTORS, healthcare.PATIENTS))
+TEMP_DATABASES = []
+# Receipts written by the benchmarked consultations are thrown away
+RECEIPT_DIR = healthcare.app.config['RECEIPT_DIR'] = tempfile.mkdtemp(prefix='healthcare-bench-receipts-')
+
+
+@atexit.register
+def remove_temp_databases():
+    for path in TEMP_DATABASES:
+        for name in glob.glob(path + '*'):
+            os.remove(name)
+    shutil.rmtree(RECEIPT_DIR, ignore_errors=True)
+    # (the audit log, opened after this was registered, is closed by now)
+    if AUDIT_DIR.startswith(os.path.join(tempfile.gettempdir(), 'healthcare-bench-audit-')):
+        shutil.rmtree(AUDIT_DIR, ignore_errors=True)
+
+
+def fresh_store(backend='memory'):
+    """Install a new store seeded with the demo tables into healthcare.app"""
+    # Background tasks queued by the previous run finish against its store
+    services.tasks.drain()
+    users, departments, doctors, patients = copy.deepcopy(DEMO_TABLES)
+    if backend == 'sqlite':
+        from sqlite_store import SqliteStore
+        fd, path = tempfile.mkstemp(prefix='healthcare-bench-', suffix='.db')
+        os.close(fd)
+        TEMP_DATABASES.append(path)
+        store = SqliteStore(path)
+        store.seed(users, departments, doctors, patients)
+    else:
+        store = MemoryStore(users, departments, doctors, patients)
+    # Same wrapping as app.py, so the routes are measured as they run in production
+    services.install_store(store)
+    return store
+
+
+def parse_args(description, default_sizes):
+    """`[sizes...] [--store memory|sqlite]` command line"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('sizes', nargs='*', type=int, default=default_sizes)
+    parser.add_argument('--store', choices=['memory', 'sqlite'], default='memory')
+    return parser.parse_args()
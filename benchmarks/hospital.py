@@ -0,0 +1,163 @@
+"""
+Synthetic hospital for the benchmarks
+
+build() installs a fresh store (see common.fresh_store) and fills it with
+departments, doctors and patients (each with a login), a history of
+appointments spread over the doctors' slots, and a medical record, a
+prescription and a bill for every completed appointment. The returned
+Hospital remembers the ids the route benchmarks need: which appointments
+are still open for each patient and doctor, and which bills can be paid.
+
+Sizes scale from the number of appointments unless given explicitly:
+1k appointments -> 1,000 patients and 20 doctors, 1M -> 100,000 patients
+and 500 doctors.
+"""
+
+import random
+from collections import defaultdict
+from datetime import date, timedelta
+
+from common import fresh_store
+from store import SLOT_TIMES
+
+PASSWORD = 'bench123'
+FIRST_DAY = date(2015, 1, 1)
+DAYS = 16 * 365
+# Appointments before this day are history, the rest are still scheduled
+TODAY = FIRST_DAY + timedelta(days=DAYS - 365)
+DEPARTMENTS = ['Cardiology', 'Orthopedics', 'Neurology', 'Pediatrics', 'General Medicine',
+               'Dermatology', 'Oncology', 'Radiology', 'Psychiatry', 'ENT', 'Urology', 'Gastroenterology']
+MEDICINES = ['Paracetamol', 'Amoxicillin', 'Ibuprofen', 'Metformin', 'Atorvastatin', 'Omeprazole']
+
+
+def default_patients(appointments):
+    return max(1000, appointments // 10)
+
+
+def default_doctors(appointments):
+    return max(20, min(500, appointments // 2000))
+
+
+class Hospital:
+    """A seeded store plus the ids the route benchmarks pick from"""
+
+    def __init__(self, store, rng):
+        self.store = store
+        self.rng = rng
+        self.departments = []
+        self.doctors = []
+        self.patients = []
+        # Logins, as (username, patient_id / doctor_id)
+        self.patient_logins = []
+        self.doctor_logins = []
+        # Appointments that are still SCHEDULED, by patient and by doctor;
+        # route benchmarks pop() from these so each one is used once
+        self.open_by_patient = defaultdict(list)
+        self.open_by_doctor = defaultdict(list)
+        self.bills_by_patient = defaultdict(list)
+        self.appointments = 0
+
+    def patient(self):
+        return self.rng.choice(self.patient_logins)
+
+    def doctor(self):
+        return self.rng.choice(self.doctor_logins)
+
+
+def add_people(hospital, patients, doctors):
+    store, rng = hospital.store, hospital.rng
+    for name in DEPARTMENTS:
+        if not any(d['name'] == name for d in store.departments().values()):
+            store.add_department({'name': name, 'description': f'{name} department', 'location': 'Main Building'})
+    hospital.departments = list(store.departments())
+    for i in range(doctors):
+        username = f'bench_dr_{i}'
+        _, doctor_id = store.add_doctor({
+            'username': username, 'password': PASSWORD, 'role': 'DOCTOR',
+            'name': f'Dr. Bench {i}', 'email': f'{username}@hospital.com',
+        }, {
+            'name': f'Dr. Bench {i}', 'specialization': 'General', 'dept_id': rng.choice(hospital.departments),
+            'fee': rng.choice([500, 600, 750, 800]), 'phone': f'98{i:08d}', 'experience': rng.randrange(30),
+            'available': True,
+        })
+        hospital.doctor_logins.append((username, doctor_id))
+    for i in range(patients):
+        username = f'bench_patient_{i}'
+        _, patient_id = store.register_patient({
+            'username': username, 'password': PASSWORD, 'role': 'PATIENT',
+            'name': f'Bench Patient {i}', 'email': f'{username}@email.com',
+        }, {
+            'name': f'Bench Patient {i}', 'dob': '1990-01-01', 'gender': rng.choice(['Male', 'Female']),
+            'phone': f'91{i:08d}', 'blood_group': rng.choice(['A+', 'B+', 'O+', 'AB+']), 'address': 'Mumbai',
+        })
+        hospital.patient_logins.append((username, patient_id))
+    hospital.doctors = [doctor_id for _, doctor_id in hospital.doctor_logins]
+    hospital.patients = [patient_id for _, patient_id in hospital.patient_logins]
+
+
+def add_appointments(hospital, count):
+    """`count` appointments in distinct slots, history before TODAY and scheduled after"""
+    store, rng = hospital.store, hospital.rng
+    doctors, patients = hospital.doctors, hospital.patients
+    slots_per_doctor = DAYS * len(SLOT_TIMES)
+    first_id = store.counts()['appointments'] + 1
+    apts = []
+    for slot in rng.sample(range(len(doctors) * slots_per_doctor), count):
+        doctor, slot = divmod(slot, slots_per_doctor)
+        day, time = divmod(slot, len(SLOT_TIMES))
+        apt_date = FIRST_DAY + timedelta(days=day)
+        if apt_date >= TODAY:
+            status = 'SCHEDULED'
+        else:
+            status = rng.choice(['COMPLETED', 'COMPLETED', 'COMPLETED', 'CANCELLED'])
+        apts.append({
+            'patient_id': rng.choice(patients),
+            'doctor_id': doctors[doctor],
+            'date': apt_date.isoformat(),
+            'time': SLOT_TIMES[time],
+            'status': status,
+            'reason': 'Checkup',
+            'created_at': FIRST_DAY.isoformat(),
+        })
+    # Insert in date order, like a real history
+    apts.sort(key=lambda a: (a['date'], a['time']))
+    store.add_appointments(apts)
+    hospital.appointments += count
+    return list(enumerate(apts, first_id))
+
+
+def add_clinical_history(hospital, apts):
+    """Record, prescription and bill for every completed appointment"""
+    store, rng = hospital.store, hospital.rng
+    fees = {doctor_id: doctor['fee'] for doctor_id, doctor in store.doctors().items()}
+    for apt_id, apt in apts:
+        if apt['status'] == 'SCHEDULED':
+            hospital.open_by_patient[apt['patient_id']].append(apt_id)
+            hospital.open_by_doctor[apt['doctor_id']].append(apt_id)
+        if apt['status'] != 'COMPLETED':
+            continue
+        record_id = store.add_record({
+            'appointment_id': apt_id, 'patient_id': apt['patient_id'], 'doctor_id': apt['doctor_id'],
+            'date': apt['date'], 'diagnosis': 'Routine checkup', 'symptoms': '', 'notes': '',
+        })
+        store.add_prescription({
+            'record_id': record_id, 'medicine': rng.choice(MEDICINES),
+            'dosage': '500mg', 'frequency': 'Twice daily', 'duration': '5 days',
+        })
+        status = rng.choice(['PAID', 'PAID', 'PENDING'])
+        bill_id = store.add_bill({
+            'appointment_id': apt_id, 'patient_id': apt['patient_id'], 'date': apt['date'],
+            'amount': fees.get(apt['doctor_id'], 500), 'status': status, 'description': 'Consultation',
+        })
+        if status == 'PENDING':
+            hospital.bills_by_patient[apt['patient_id']].append(bill_id)
+
+
+def build(backend, appointments, patients=None, doctors=None, seed=0):
+    """Install and return a synthetic Hospital with `appointments` appointments"""
+    hospital = Hospital(fresh_store(backend), random.Random(seed))
+    add_people(hospital,
+               patients if patients is not None else default_patients(appointments),
+               doctors if doctors is not None else default_doctors(appointments))
+    add_clinical_history(hospital, add_appointments(hospital, appointments))
+    return hospital
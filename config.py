@@ -0,0 +1,134 @@
+"""
+Smart Healthcare Management System - Configuration
+Values can be overridden with environment variables
+"""
+
+import os
+import tempfile
+
+# Storage backend: 'memory' (mock dict tables) or 'sqlite'
+STORE_BACKEND = os.environ.get('HEALTHCARE_STORE', 'memory')
+
+# SQLite database file (used when STORE_BACKEND = 'sqlite')
+SQLITE_PATH = os.environ.get('HEALTHCARE_SQLITE_PATH', 'healthcare.db')
+
+# Worker processes serving the app, see serve.py. More than one needs the
+# sqlite backend: the workers share its database file and each replays the
+# others' changes into its own caches
+WORKERS = int(os.environ.get('HEALTHCARE_WORKERS', '1'))
+# Which of them this process is (set by serve.py)
+WORKER_ID = int(os.environ.get('HEALTHCARE_WORKER_ID', '0'))
+
+# Data directory for the memory backend's snapshot + journal
+# (empty = nothing is persisted, the demo data resets on restart)
+DATA_DIR = os.environ.get('HEALTHCARE_DATA_DIR', '')
+
+
+def data_paths(data_dir, store_backend, sqlite_path):
+    """Default locations of the files kept with the data, by setting name
+
+    In DATA_DIR when there is one; otherwise the audit trail goes next to
+    the SQLite database, and is empty for the memory store (which keeps
+    nothing), meaning a private temporary directory per process.
+    """
+    return {
+        'TEMPLATE_CACHE_DIR': os.path.join(data_dir, 'templates') if data_dir else '',
+        'TASK_QUEUE_PATH': os.path.join(data_dir, 'tasks.db') if data_dir else ':memory:',
+        'RECEIPT_DIR': (os.path.join(data_dir, 'receipts') if data_dir
+                        else os.path.join(tempfile.gettempdir(), 'healthcare-receipts')),
+        'AUDIT_DIR': (os.path.join(data_dir, 'audit') if data_dir
+                      else os.path.splitext(sqlite_path)[0] + '-audit' if store_backend == 'sqlite' else ''),
+    }
+
+# Environment variables setting those paths
+DATA_PATH_VARIABLES = {
+    'TEMPLATE_CACHE_DIR': 'HEALTHCARE_TEMPLATE_CACHE_DIR',
+    'TASK_QUEUE_PATH': 'HEALTHCARE_TASK_QUEUE',
+    'RECEIPT_DIR': 'HEALTHCARE_RECEIPT_DIR',
+    'AUDIT_DIR': 'HEALTHCARE_AUDIT_DIR',
+}
+DEFAULT_PATHS = data_paths(DATA_DIR, STORE_BACKEND, SQLITE_PATH)
+
+# Seconds between batched journal fsyncs
+JOURNAL_SYNC_INTERVAL = float(os.environ.get('HEALTHCARE_JOURNAL_SYNC_INTERVAL', '0.05'))
+
+# Seconds between snapshots (only taken if something changed)
+CHECKPOINT_INTERVAL = float(os.environ.get('HEALTHCARE_CHECKPOINT_INTERVAL', '300'))
+
+# Rows per page on the appointment, record and bill listings (?limit= can
+# ask for up to MAX_PAGE_SIZE)
+PAGE_SIZE = int(os.environ.get('HEALTHCARE_PAGE_SIZE', '20'))
+MAX_PAGE_SIZE = 100
+
+# Matches returned by the typeahead search APIs (?limit= can ask for up to
+# MAX_PAGE_SIZE)
+SEARCH_LIMIT = int(os.environ.get('HEALTHCARE_SEARCH_LIMIT', '10'))
+
+# Compiled Jinja templates are cached on disk, so a new worker process
+# loads them instead of compiling each on its first render. The default
+# directory is in DATA_DIR, or without one a private per-user directory
+# Jinja makes under the system temp directory
+TEMPLATE_CACHE = os.environ.get('HEALTHCARE_TEMPLATE_CACHE', '1') != '0'
+TEMPLATE_CACHE_DIR = os.environ.get('HEALTHCARE_TEMPLATE_CACHE_DIR', DEFAULT_PATHS['TEMPLATE_CACHE_DIR'])
+
+# Request timing and store call counts, served at /admin/metrics
+METRICS_ENABLED = os.environ.get('HEALTHCARE_METRICS', '1') != '0'
+
+# Seconds between stack samples of busy request threads, served at
+# /admin/metrics/profile (0 = profiler off)
+PROFILE_INTERVAL = float(os.environ.get('HEALTHCARE_PROFILE_INTERVAL', '0'))
+
+# Background tasks (receipts, audit entries, e-mails), see tasks.py. The
+# queue lives in DATA_DIR so pending tasks survive a restart; without a
+# data directory it is kept in memory
+TASK_QUEUE_PATH = os.environ.get('HEALTHCARE_TASK_QUEUE', DEFAULT_PATHS['TASK_QUEUE_PATH'])
+TASK_WORKERS = int(os.environ.get('HEALTHCARE_TASK_WORKERS', '2'))
+TASK_MAX_ATTEMPTS = int(os.environ.get('HEALTHCARE_TASK_MAX_ATTEMPTS', '5'))
+# Seconds before the first retry, doubled on each further attempt
+TASK_RETRY_DELAY = float(os.environ.get('HEALTHCARE_TASK_RETRY_DELAY', '2'))
+
+# Directory for the PDF bill receipts
+RECEIPT_DIR = os.environ.get('HEALTHCARE_RECEIPT_DIR', DEFAULT_PATHS['RECEIPT_DIR'])
+
+# Outgoing mail server for notifications (empty = e-mails are only logged);
+# the default port is the one local debugging SMTP sinks listen on
+SMTP_HOST = os.environ.get('HEALTHCARE_SMTP_HOST', '')
+SMTP_PORT = int(os.environ.get('HEALTHCARE_SMTP_PORT', '1025'))
+MAIL_FROM = os.environ.get('HEALTHCARE_MAIL_FROM', 'noreply@hospital.com')
+
+# Audit trail of patient data reads and changes, see audit.py, kept with
+# the data it audits (see data_paths)
+AUDIT_DIR = os.environ.get('HEALTHCARE_AUDIT_DIR', DEFAULT_PATHS['AUDIT_DIR'])
+# Seconds between audit flushes (a flush also starts when the buffer is half full)
+AUDIT_FLUSH_INTERVAL = float(os.environ.get('HEALTHCARE_AUDIT_FLUSH_INTERVAL', '0.5'))
+
+# Appointment sweeper, see sweeper.py: minutes after its slot before an
+# open appointment is marked NO_SHOW, and age in days after which closed
+# appointments move to the compressed cold segment (0 = never)
+NO_SHOW_AFTER_MINUTES = int(os.environ.get('HEALTHCARE_NO_SHOW_AFTER', '120'))
+ARCHIVE_AFTER_DAYS = int(os.environ.get('HEALTHCARE_ARCHIVE_AFTER_DAYS', '365'))
+
+# Rows validated and inserted per transaction by a bulk import, see
+# importer.py
+IMPORT_CHUNK_ROWS = int(os.environ.get('HEALTHCARE_IMPORT_CHUNK_ROWS', '1000'))
+
+
+def settings(overrides=None):
+    """The settings above as {NAME: value}, with `overrides` applied
+
+    The paths kept with the data follow an overridden DATA_DIR,
+    STORE_BACKEND or SQLITE_PATH, unless set themselves (by override or
+    environment variable).
+    """
+    values = {name: value for name, value in globals().items()
+              if name.isupper() and name not in ('DATA_PATH_VARIABLES', 'DEFAULT_PATHS')}
+    overrides = dict(overrides or {})
+    unknown = sorted(set(overrides) - set(values))
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(unknown)}")
+    values.update(overrides)
+    paths = data_paths(values['DATA_DIR'], values['STORE_BACKEND'], values['SQLITE_PATH'])
+    for name, variable in DATA_PATH_VARIABLES.items():
+        if name not in overrides and variable not in os.environ:
+            values[name] = paths[name]
+    return values
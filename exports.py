@@ -0,0 +1,169 @@
+"""
+Smart Healthcare Management System - Data Exports
+Streaming NDJSON / CSV exports of medical records, prescriptions and bills
+
+Rows are read one page at a time through the same keyset-paged store
+methods the patient records and bills pages use, and every line is
+handed on as soon as it is encoded, so an export of any size holds about
+one page in memory. Output is batched into chunks of CHUNK_BYTES and can
+be gzip-compressed on the fly.
+"""
+
+import io
+import csv
+import json
+import zlib
+from datetime import date, timedelta
+
+# 'all' is one NDJSON line per record (prescriptions nested) and per bill;
+# CSV needs one flat dataset
+EXPORT_DATASETS = ('all', 'records', 'prescriptions', 'bills')
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+COLUMNS = {
+    'records': ('record_id', 'patient_id', 'patient_name', 'date', 'doctor_id', 'doctor_name', 'department',
+                'appointment_id', 'diagnosis', 'symptoms', 'notes'),
+    'prescriptions': ('record_id', 'patient_id', 'date', 'doctor_id', 'medicine', 'dosage', 'frequency',
+                      'duration'),
+    'bills': ('bill_id', 'patient_id', 'patient_name', 'date', 'doctor_id', 'doctor_name', 'department',
+              'appointment_id', 'amount', 'paid', 'due', 'status', 'description'),
+}
+
+PAGE_ROWS = 500
+CHUNK_BYTES = 64 * 1024
+
+
+def pages(page, owner_id, start=None, end=None, limit=PAGE_ROWS):
+    """Pages of an owner's (id, row) pairs dated start..end, newest first"""
+    before = None if end is None else ((date.fromisoformat(end) + timedelta(days=1)).isoformat(), 0)
+    while True:
+        rows, before = page(owner_id, limit, before)
+        if start is not None and rows and rows[-1][1]['date'] < start:
+            rows = [(row_id, row) for row_id, row in rows if row['date'] >= start]
+            before = None
+        if rows:
+            yield rows
+        if before is None:
+            return
+
+
+def export_rows(store, data, patient_ids, doctors, departments, doctor_ids=None, start=None, end=None,
+                on_patient=None):
+    """(dataset, row dict) of every selected record, prescription and bill
+
+    patient_ids is iterated lazily; doctor_ids (a set) keeps only the rows
+    of those doctors. on_patient(patient_id) is called before a patient's
+    rows, e.g. to audit the read.
+    """
+    def doctor_of(doctor_id):
+        doctor = doctors.get(doctor_id) or {}
+        return doctor.get('name', ''), departments.get(doctor.get('dept_id'), {}).get('name', '')
+
+    for patient_id in patient_ids:
+        patient = store.get_patient(patient_id)
+        if patient is None:
+            continue
+        if on_patient is not None:
+            on_patient(patient_id)
+        name = patient.get('name', '')
+        if data != 'bills':
+            for rows in pages(store.records_page_for_patient, patient_id, start, end):
+                if doctor_ids is not None:
+                    rows = [(rec_id, rec) for rec_id, rec in rows if rec['doctor_id'] in doctor_ids]
+                prescriptions = store.prescriptions_for_records([rec_id for rec_id, _ in rows])
+                for rec_id, rec in rows:
+                    doctor_name, department = doctor_of(rec['doctor_id'])
+                    if data == 'prescriptions':
+                        for p in prescriptions[rec_id]:
+                            yield 'prescriptions', {
+                                'record_id': rec_id, 'patient_id': patient_id, 'date': rec['date'],
+                                'doctor_id': rec['doctor_id'], 'medicine': p['medicine'], 'dosage': p['dosage'],
+                                'frequency': p['frequency'], 'duration': p['duration'],
+                            }
+                        continue
+                    record = {
+                        'record_id': rec_id, 'patient_id': patient_id, 'patient_name': name,
+                        'date': rec['date'], 'doctor_id': rec['doctor_id'], 'doctor_name': doctor_name,
+                        'department': department, 'appointment_id': rec['appointment_id'],
+                        'diagnosis': rec['diagnosis'], 'symptoms': rec.get('symptoms', ''),
+                        'notes': rec.get('notes', ''),
+                    }
+                    if data == 'all':
+                        record['type'] = 'record'
+                        record['prescriptions'] = [
+                            {'medicine': p['medicine'], 'dosage': p['dosage'], 'frequency': p['frequency'],
+                             'duration': p['duration']} for p in prescriptions[rec_id]]
+                    yield 'records', record
+        if data in ('all', 'bills'):
+            for rows in pages(store.bills_page_for_patient, patient_id, start, end):
+                for bill_id, bill in rows:
+                    apt = store.get_appointment(bill['appointment_id']) if bill['appointment_id'] else None
+                    doctor_id = apt['doctor_id'] if apt else None
+                    if doctor_ids is not None and doctor_id not in doctor_ids:
+                        continue
+                    doctor_name, department = doctor_of(doctor_id)
+                    row = {
+                        'bill_id': bill_id, 'patient_id': patient_id, 'patient_name': name,
+                        'date': bill['date'], 'doctor_id': doctor_id, 'doctor_name': doctor_name,
+                        'department': department, 'appointment_id': bill['appointment_id'],
+                        'amount': bill['amount'], 'paid': bill['paid'],
+                        'due': round(bill['amount'] - bill['paid'], 2), 'status': bill['status'],
+                        'description': bill.get('description', 'Consultation'),
+                    }
+                    if data == 'all':
+                        row['type'] = 'bill'
+                    yield 'bills', row
+
+# ============================================
+# Encoding
+# ============================================
+
+def ndjson_lines(rows):
+    encode = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=str).encode
+    for _, row in rows:
+        yield encode(row) + '\n'
+
+
+def csv_lines(rows, dataset):
+    """CSV text of one dataset, header first (values as the store holds them)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    columns = COLUMNS[dataset]
+    writer.writerow(columns)
+    for _, row in rows:
+        writer.writerow([row[column] for column in columns])
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def chunks(lines, size=CHUNK_BYTES):
+    """Text lines joined into UTF-8 chunks of about `size` bytes"""
+    batch, length = [], 0
+    for line in lines:
+        batch.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(batch).encode('utf-8')
+            batch, length = [], 0
+    if batch:
+        yield ''.join(batch).encode('utf-8')
+
+
+def gzipped(chunks, level=6):
+    """The same bytes as one gzip stream, compressed as they arrive"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def encode_export(rows, data, fmt, gzip=False):
+    """Response body chunks of an export in `fmt` (CSV needs one dataset, not 'all')"""
+    lines = ndjson_lines(rows) if fmt == 'ndjson' else csv_lines(rows, data)
+    body = chunks(lines)
+    return gzipped(body) if gzip else body
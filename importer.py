@@ -0,0 +1,411 @@
+"""
+Smart Healthcare Management System - Bulk Import
+Loading patients, doctors and appointment history from CSV / JSONL files
+
+Rows are read one at a time from the stream, validated and converted in
+chunks of CHUNK_ROWS, and each chunk is inserted with one
+store.import_rows() call (one transaction, one journal entry) instead of
+a register / add per row. The store's secondary indexes are not kept up
+to date chunk by chunk: Store.bulk_import() builds them once at the end.
+
+A row that fails validation or hits a taken username / email is skipped
+and reported with its line number; the other rows are imported. So is an
+appointment (unless CANCELLED) whose doctor already has one in its slot,
+in the store or earlier in the file.
+
+Columns (CSV header or JSONL keys), * = required:
+- patients: username*, password*, email, first_name*, last_name*, dob*
+  (YYYY-MM-DD), gender (Male / Female / Other), phone*, blood_group,
+  address, city
+- doctors: name*, specialization*, phone*, dept_id* or department*
+  (name), fee*, experience, email, username (default dr_<name>, as
+  /admin/add-doctor makes it), password (default doc123), available
+- appointments: patient_username* or patient_id*, doctor_username* or
+  doctor_id*, date*, time* (one of the booking form's slots, as 09:30 AM
+  or 09:30), status (default
+  COMPLETED), reason, created_at
+
+Usage (imports into the configured store; with the memory store it needs
+HEALTHCARE_DATA_DIR, and the server must not be running meanwhile; a
+server on the SQLite store picks the import up as it runs):
+    python importer.py patients patients.csv
+    python importer.py appointments history.jsonl --chunk 5000
+"""
+
+import io
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from datetime import date, datetime
+from itertools import islice
+
+from store import APPOINTMENT_STATUSES, SLOT_INDEX, DuplicateKeyError
+
+IMPORT_KINDS = ('patients', 'doctors', 'appointments')
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+CHUNK_ROWS = 1000
+# Rejected rows listed in a report (all of them are counted)
+MAX_ERRORS = 1000
+
+# Columns every row needs; a tuple lists alternatives
+REQUIRED = {
+    'patients': ('username', 'password', 'first_name', 'last_name', 'dob', 'phone'),
+    'doctors': ('name', 'specialization', 'phone', ('dept_id', 'department'), 'fee'),
+    'appointments': (('patient_username', 'patient_id'), ('doctor_username', 'doctor_id'), 'date', 'time'),
+}
+
+GENDERS = ('Male', 'Female', 'Other')
+BLOOD_GROUPS = ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+DEFAULT_DOCTOR_PASSWORD = 'doc123'
+
+# ============================================
+# Reading
+# ============================================
+
+def missing_columns(kind, columns):
+    """Required columns of `kind` not among `columns`"""
+    columns = set(columns)
+    missing = []
+    for names in REQUIRED[kind]:
+        names = names if isinstance(names, tuple) else (names,)
+        if not columns.intersection(names):
+            missing.append(' or '.join(names))
+    return missing
+
+
+def read_csv(stream, kind):
+    """(line number, row dict) of a CSV file with a header line
+
+    Raises ValueError if the header lacks a required column.
+    """
+    reader = csv.DictReader(stream)
+    missing = missing_columns(kind, reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"CSV header is missing {', '.join(missing)}")
+    return _csv_rows(reader)
+
+
+def _csv_rows(reader):
+    line = reader.line_num
+    for row in reader:
+        yield line + 1, row
+        # Past the row's last line (a quoted value can span several)
+        line = reader.line_num
+
+
+def read_jsonl(stream):
+    """(line number, text) of every non-blank line of a JSONL file (parsed by the validators)"""
+    for line, text in enumerate(stream, 1):
+        if text.strip():
+            yield line, text
+
+
+def read_records(stream, fmt, kind):
+    return read_csv(stream, kind) if fmt == 'csv' else read_jsonl(stream)
+
+
+def format_of(filename):
+    """'csv' or 'jsonl' from a file name, None if it is neither"""
+    extension = filename.rsplit('.', 1)[-1].lower()
+    return {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}.get(extension)
+
+# ============================================
+# Validation
+# ============================================
+
+def text(row, name, required=False, limit=None):
+    value = row.get(name)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f'{name} is required')
+    if limit and len(value) > limit:
+        raise ValueError(f'{name} is longer than {limit} characters')
+    return value
+
+
+def iso_date(row, name):
+    value = text(row, name, required=True)
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f'{name} is not a YYYY-MM-DD date: {value}') from None
+
+
+def number(row, name, cast=float, required=True):
+    value = text(row, name, required)
+    if not value:
+        return cast(0)
+    try:
+        value = cast(value)
+    except ValueError:
+        raise ValueError(f'{name} is not a number: {value}') from None
+    if value < 0:
+        raise ValueError(f'{name} is negative: {value}')
+    return value
+
+
+_TIMES = {}
+
+def slot_time(row, name):
+    """'9:30 am' / '09:30' / '14:30' -> '09:30 AM' / '02:30 PM', the booking form's format"""
+    value = text(row, name, required=True)
+    normalized = _TIMES.get(value)
+    if normalized is None:
+        for pattern in ('%I:%M %p', '%H:%M', '%H:%M:%S'):
+            try:
+                normalized = datetime.strptime(value.upper(), pattern).strftime('%I:%M %p')
+                break
+            except ValueError:
+                pass
+        else:
+            raise ValueError(f'{name} is not a time like 09:30 AM: {value}')
+        _TIMES[value] = normalized
+    return normalized
+
+
+class References:
+    """Departments, patients and doctors the rows refer to, each looked up once"""
+
+    def __init__(self, store):
+        self.store = store
+        departments = store.departments()
+        self.dept_ids = set(departments)
+        self.dept_names = {dept['name'].lower(): dept_id for dept_id, dept in departments.items()}
+        self._found = {}
+
+    def department(self, row):
+        if text(row, 'dept_id'):
+            dept_id = number(row, 'dept_id', int)
+            if dept_id not in self.dept_ids:
+                raise ValueError(f'no department {dept_id}')
+            return dept_id
+        name = text(row, 'department', required=True)
+        if name.lower() not in self.dept_names:
+            raise ValueError(f'no department named {name}')
+        return self.dept_names[name.lower()]
+
+    def owner(self, row, role):
+        """patient / doctor id of a row's <role>_username or <role>_id"""
+        username = text(row, f'{role}_username')
+        key = ('username', role, username) if username else ('id', role, number(row, f'{role}_id', int))
+        if key not in self._found:
+            self._found[key] = self._lookup(*key)
+        if self._found[key] is None:
+            raise ValueError(f'no {role} {key[2]}')
+        return self._found[key]
+
+    def _lookup(self, by, role, value):
+        if by == 'username':
+            _, user = self.store.find_user(value)
+            return user.get(f'{role}_id') if user else None
+        get = self.store.get_patient if role == 'patient' else self.store.get_doctor
+        return value if get(value) is not None else None
+
+
+def patient_row(row, refs):
+    """(user, patient) as register_patient() takes them"""
+    name = f"{text(row, 'first_name', True, 50)} {text(row, 'last_name', True, 50)}"
+    gender = text(row, 'gender')
+    if gender and gender not in GENDERS:
+        raise ValueError(f"gender must be one of {', '.join(GENDERS)}: {gender}")
+    blood_group = text(row, 'blood_group').upper()
+    if blood_group and blood_group not in BLOOD_GROUPS:
+        raise ValueError(f'unknown blood group: {blood_group}')
+    dob = iso_date(row, 'dob')
+    if dob > date.today().isoformat():
+        raise ValueError(f'dob is in the future: {dob}')
+    email = text(row, 'email', limit=100)
+    if email and '@' not in email:
+        raise ValueError(f'email is not an address: {email}')
+    address, city = text(row, 'address'), text(row, 'city')
+    return {
+        'username': text(row, 'username', True, 50),
+        'password': text(row, 'password', True),
+        'role': 'PATIENT',
+        'name': name,
+        'email': email,
+    }, {
+        'name': name,
+        'dob': dob,
+        'gender': gender,
+        'phone': text(row, 'phone', True, 15),
+        'blood_group': blood_group,
+        'address': f'{address}, {city}' if address and city else address or city,
+    }
+
+
+def doctor_row(row, refs):
+    """(user, doctor) as add_doctor() takes them"""
+    name = text(row, 'name', True, 100)
+    email = text(row, 'email', limit=100)
+    if email and '@' not in email:
+        raise ValueError(f'email is not an address: {email}')
+    available = text(row, 'available').lower()
+    if available not in ('', 'y', 'n', 'yes', 'no', 'true', 'false', '1', '0'):
+        raise ValueError(f'available must be Y or N: {available}')
+    return {
+        'username': (text(row, 'username', limit=50)
+                     or 'dr_' + name.lower().replace(' ', '_').replace('dr.', '').strip('_')),
+        'password': text(row, 'password') or DEFAULT_DOCTOR_PASSWORD,
+        'role': 'DOCTOR',
+        'name': name,
+        'email': email,
+    }, {
+        'name': name,
+        'specialization': text(row, 'specialization', True, 100),
+        'dept_id': refs.department(row),
+        'fee': number(row, 'fee'),
+        'phone': text(row, 'phone', True, 15),
+        'experience': number(row, 'experience', int, required=False),
+        'available': available not in ('n', 'no', 'false', '0'),
+    }
+
+
+def appointment_row(row, refs):
+    """Appointment dict as add_appointments() takes it"""
+    day = iso_date(row, 'date')
+    status = text(row, 'status').upper() or 'COMPLETED'
+    if status not in APPOINTMENT_STATUSES:
+        raise ValueError(f"status must be one of {', '.join(APPOINTMENT_STATUSES)}: {status}")
+    created_at = text(row, 'created_at')
+    try:
+        created_at = datetime.fromisoformat(created_at).isoformat() if created_at else f'{day}T00:00:00'
+    except ValueError:
+        raise ValueError(f'created_at is not an ISO timestamp: {created_at}') from None
+    time = slot_time(row, 'time')
+    if time not in SLOT_INDEX:
+        raise ValueError(f'time is not one of the bookable slots: {time}')
+    return {
+        'patient_id': refs.owner(row, 'patient'),
+        'doctor_id': refs.owner(row, 'doctor'),
+        'date': day,
+        'time': time,
+        'status': status,
+        'reason': text(row, 'reason', limit=500),
+        'created_at': created_at,
+    }
+
+
+VALIDATORS = {'patients': patient_row, 'doctors': doctor_row, 'appointments': appointment_row}
+
+# ============================================
+# Import
+# ============================================
+
+def run_import(store, kind, records, chunk_rows=CHUNK_ROWS, on_import=None, max_errors=MAX_ERRORS):
+    """Validate and insert (line number, row) records in chunks, return a report dict
+
+    on_import(result) is called for each row inserted, with its
+    import_rows() result, e.g. to audit it. The report has the number of
+    rows read, imported and rejected, the first `max_errors` errors as
+    {'line', 'error'} and the seconds taken; if the file could not be read
+    to the end (bad encoding, broken CSV quoting), 'stopped' says why and
+    the rows before that point are imported.
+    """
+    validate = VALIDATORS[kind]
+    refs = References(store)
+    report = {'kind': kind, 'rows': 0, 'imported': 0, 'rejected': 0, 'errors': []}
+
+    t0 = time.perf_counter()
+    records = iter(records)
+    with store.bulk_import():
+        while True:
+            try:
+                chunk = list(islice(records, chunk_rows))
+            except (ValueError, csv.Error) as e:
+                report['stopped'] = f'after row {report["rows"]}: {e}'
+                break
+            if not chunk:
+                break
+            report['rows'] += len(chunk)
+            lines, rows, errors = [], [], []
+            for line, row in chunk:
+                try:
+                    if isinstance(row, str):
+                        row = json.loads(row)
+                        if not isinstance(row, dict):
+                            raise ValueError('not a JSON object')
+                    rows.append(validate(row, refs))
+                    lines.append(line)
+                except ValueError as e:
+                    errors.append((line, str(e)))
+            for line, result in zip(lines, store.import_rows(kind, rows) if rows else ()):
+                if isinstance(result, DuplicateKeyError):
+                    errors.append((line, str(result)))
+                    continue
+                report['imported'] += 1
+                if on_import is not None:
+                    on_import(result)
+            report['rejected'] += len(errors)
+            report['errors'].extend({'line': line, 'error': error}
+                                    for line, error in sorted(errors)[:max_errors - len(report['errors'])])
+    report['seconds'] = round(time.perf_counter() - t0, 3)
+    return report
+
+
+def open_text(stream):
+    """Text view of a binary upload / file (UTF-8, a BOM skipped)"""
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import of patients, doctors or appointment history')
+    parser.add_argument('kind', choices=IMPORT_KINDS)
+    parser.add_argument('path', help='CSV or JSONL file, - for stdin')
+    parser.add_argument('--format', choices=IMPORT_FORMATS, help='default: from the file extension')
+    parser.add_argument('--chunk', type=int, default=None, help='rows per insert')
+    args = parser.parse_args(argv)
+    fmt = args.format or format_of(args.path)
+    if fmt is None:
+        parser.error('cannot tell the format from the file name, pass --format')
+
+    import config
+    settings = config.settings()
+    if settings['STORE_BACKEND'] == 'memory' and not settings['DATA_DIR']:
+        parser.error('the memory store keeps nothing after exit: set HEALTHCARE_DATA_DIR or HEALTHCARE_STORE=sqlite')
+    if not settings['AUDIT_DIR']:
+        parser.error('imported patients are audited: set HEALTHCARE_AUDIT_DIR')
+    # Only the configured store (journal recovered, demo data seeded): a
+    # server may be running on the same database, and the sweeper, task
+    # workers and audit log are its own
+    from app import create_store
+    from audit import AuditLog
+    store = create_store(settings)
+    audit_log = created = None
+    if args.kind == 'patients':
+        # A log of this process's own, merged in by the server's audit queries
+        audit_log = AuditLog(os.path.join(settings['AUDIT_DIR'], f'import-{os.getpid()}'),
+                             flush_interval=settings['AUDIT_FLUSH_INTERVAL'])
+        audit_log.start()
+
+        def created(result):
+            audit_log.append(result[1], 'CREATE', 'patient', 'import', 'SYSTEM', {'import': True})
+
+    stream = sys.stdin.buffer if args.path == '-' else open(args.path, 'rb')
+    try:
+        report = run_import(store, args.kind, read_records(open_text(stream), fmt, args.kind),
+                            args.chunk or settings['IMPORT_CHUNK_ROWS'], on_import=created)
+    except ValueError as e:
+        parser.exit(2, f'{parser.prog}: {e}\n')
+    finally:
+        stream.close()
+        if audit_log is not None:
+            audit_log.close()
+    if 'stopped' in report:
+        print(f"stopped reading the file {report['stopped']}", file=sys.stderr)
+    for error in report['errors']:
+        print(f"line {error['line']}: {error['error']}", file=sys.stderr)
+    if report['rejected'] > len(report['errors']):
+        print(f"... {report['rejected'] - len(report['errors'])} more", file=sys.stderr)
+    rate = report['rows'] / report['seconds'] if report['seconds'] else 0
+    print(f"{report['kind']}: {report['imported']} imported, {report['rejected']} rejected "
+          f"of {report['rows']} rows in {report['seconds']:.1f}s ({rate:.0f} rows/s)")
+    return 1 if report['rejected'] or 'stopped' in report else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
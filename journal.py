@@ -0,0 +1,254 @@
+"""
+Smart Healthcare Management System - Persistence
+Append-only journal + snapshots for the in-memory store
+
+Layout of the data directory:
+
+    snapshot.pickle     last checkpoint of every table (and the appointment
+                        indexes), written to a temp file and renamed into place
+    journal.<N>.log     change events since snapshot generation N
+
+Each journal entry is framed as [payload length][crc32][pickled event].
+MemoryStore hands the event to the journal while it holds its write lock,
+so entries are in apply order. Entries go straight to the OS; a background
+thread fsyncs them in batches (group commit), so a request never waits on
+the disk and a power loss costs at most `sync_interval` seconds of changes.
+
+Startup loads the snapshot through mmap and replays only the journal
+files that follow it. A torn entry at the end of the last journal (crash
+mid-write) is cut off.
+"""
+
+import gc
+import os
+import glob
+import mmap
+import time
+import zlib
+import pickle
+import struct
+import threading
+
+HEADER = struct.Struct('<II')
+SNAPSHOT_NAME = 'snapshot.pickle'
+SNAPSHOT_VERSION = 1
+
+
+def journal_path(directory, generation):
+    return os.path.join(directory, f'journal.{generation}.log')
+
+
+def journal_generations(directory):
+    """Generations of the journal files present, oldest first"""
+    names = glob.glob(os.path.join(directory, 'journal.*.log'))
+    return sorted(int(os.path.basename(name).split('.')[1]) for name in names)
+
+
+def fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# ============================================
+# Journal
+# ============================================
+
+class Journal:
+    """Append-only binary log of change events"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._file = open(path, 'ab', buffering=0)
+        self._dirty = False
+        # Appended to this file, counted under the lock (writers of
+        # different doctors append from several threads at once)
+        self.entries = 0
+
+    def append(self, entry):
+        payload = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        frame = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            self._file.write(frame)
+            self._dirty = True
+            self.entries += 1
+
+    def sync(self):
+        """fsync everything appended so far (no-op if nothing new)"""
+        with self.lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            fd = self._file.fileno()
+        os.fsync(fd)
+
+    def rotate(self, path):
+        """Switch to a new file (caller holds the write barrier)"""
+        with self.lock:
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self.path = path
+            self._file = open(path, 'ab', buffering=0)
+            self._dirty = False
+            self.entries = 0
+
+    def close(self):
+        with self.lock:
+            if not self._file.closed:
+                os.fsync(self._file.fileno())
+                self._file.close()
+
+    @staticmethod
+    def read(path):
+        """Yield (entry, end offset) for each entry of a journal file
+
+        Reading stops at the first truncated or corrupt entry.
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            length, crc = HEADER.unpack_from(data, offset)
+            start = offset + HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            offset = start + length
+            yield pickle.loads(payload), offset
+
+# ============================================
+# Snapshots
+# ============================================
+
+def encode_snapshot(generation, state):
+    snapshot = {'version': SNAPSHOT_VERSION, 'generation': generation, 'state': state}
+    return pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def write_snapshot(directory, data):
+    """Atomically replace the snapshot file with `data`"""
+    path = os.path.join(directory, SNAPSHOT_NAME)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fsync_directory(directory)
+
+
+def read_snapshot(directory):
+    """(generation, state) of the last snapshot, or (0, None) if there is none"""
+    path = os.path.join(directory, SNAPSHOT_NAME)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0, None
+    # Millions of new dicts would trigger many useless GC passes
+    gc.disable()
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            snapshot = pickle.loads(data)
+    finally:
+        gc.enable()
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f'unsupported snapshot version in {path}')
+    return snapshot['generation'], snapshot['state']
+
+# ============================================
+# Store Persistence
+# ============================================
+
+class Persistence:
+    """Keeps a MemoryStore durable in `directory`
+
+    open() recovers the store (snapshot + journal tail) and then journals
+    every change. A background thread fsyncs the journal every
+    `sync_interval` seconds and writes a new snapshot every
+    `checkpoint_interval` seconds if anything changed.
+    """
+
+    def __init__(self, store, directory, sync_interval=0.05, checkpoint_interval=300):
+        self.store = store
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.generation = 0
+        self.journal = None
+        self.replayed = 0
+        self._checkpoint_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        replayed = self.recover()
+        generations = journal_generations(self.directory)
+        self.generation = max(generations[-1:] + [self.generation])
+        self.journal = Journal(journal_path(self.directory, self.generation))
+        self.store.subscribe(self.record)
+        self._thread = threading.Thread(target=self._run, name='journal-sync', daemon=True)
+        self._thread.start()
+        return replayed
+
+    def recover(self):
+        """Load the snapshot and replay the journals after it, return #events"""
+        self.generation, state = read_snapshot(self.directory)
+        if state is not None:
+            self.store.restore(state)
+        replayed = 0
+        for generation in journal_generations(self.directory):
+            if generation < self.generation:
+                continue
+            path = journal_path(self.directory, generation)
+            valid = 0
+            for (event, args), valid in Journal.read(path):
+                self.store.apply(event, *args)
+                replayed += 1
+            if valid < os.path.getsize(path):
+                # Torn write at the end of the log
+                with open(path, 'r+b') as f:
+                    f.truncate(valid)
+        self.replayed = replayed
+        return replayed
+
+    @property
+    def changes(self):
+        """Changes since the last snapshot: replayed at startup and journaled since"""
+        return self.replayed + (self.journal.entries if self.journal is not None else 0)
+
+    def record(self, event, *args):
+        self.journal.append((event, args))
+
+    def checkpoint(self):
+        """Write a snapshot and start a new journal generation
+
+        Writers wait only while the journal is rotated and the store's
+        state is copied; the copy is pickled and written after that.
+        """
+        with self._checkpoint_lock:
+            with self.store.write_barrier():
+                generation = self.generation + 1
+                self.journal.rotate(journal_path(self.directory, generation))
+                state = self.store.snapshot_state()
+                self.generation = generation
+                self.replayed = 0
+            write_snapshot(self.directory, encode_snapshot(generation, state))
+            for old in journal_generations(self.directory):
+                if old < generation:
+                    os.remove(journal_path(self.directory, old))
+
+    def _run(self):
+        last_checkpoint = time.monotonic()
+        while not self._stop.wait(self.sync_interval):
+            self.journal.sync()
+            if self.changes and time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                self.checkpoint()
+                last_checkpoint = time.monotonic()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.journal is not None:
+            self.journal.close()
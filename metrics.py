@@ -0,0 +1,282 @@
+"""
+Smart Healthcare Management System - Request Metrics
+Latency histograms and counters, exposed in Prometheus text format
+
+- Every request records its total time, the time spent rendering
+  templates and the handler time (the rest), its response size and how
+  many store operations it made, per endpoint
+- Store calls are counted per operation by wrapping the store
+- Each thread records into its own shard, so recording takes no lock;
+  a scrape adds the shards up
+- SamplingProfiler optionally samples the stacks of threads that are
+  serving a request, for flame graphs
+"""
+
+import sys
+import time
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import request, before_render_template, template_rendered
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'healthcare_requests_total': ('counter', 'Requests by endpoint, method and status', None),
+    'healthcare_request_seconds': ('histogram', 'Total request time by endpoint', LATENCY_BUCKETS),
+    'healthcare_handler_seconds': ('histogram', 'Request time outside template rendering by endpoint', LATENCY_BUCKETS),
+    'healthcare_template_seconds': ('histogram', 'Template rendering time by template', LATENCY_BUCKETS),
+    'healthcare_response_bytes': ('histogram', 'Response body size by endpoint', SIZE_BUCKETS),
+    'healthcare_store_calls_per_request': ('histogram', 'Store operations made by one request, by endpoint', COUNT_BUCKETS),
+    'healthcare_store_operations_total': ('counter', 'Store operations by name', None),
+    'healthcare_auth_checks_total': ('counter', 'Login / role checks by outcome', None),
+    'healthcare_tasks_total': ('counter', 'Background tasks finished by name and outcome', None),
+    'healthcare_task_seconds': ('histogram', 'Background task run time by name', LATENCY_BUCKETS),
+}
+
+# ============================================
+# Recording
+# ============================================
+
+class Shard:
+    """One thread's counters, histograms and in-flight request"""
+
+    def __init__(self, thread):
+        self.thread = thread
+        # (name, labels) -> value
+        self.counters = defaultdict(int)
+        # (name, labels) -> [count per bucket..., count above the last, sum]
+        self.histograms = {}
+        self.request_start = None
+        self.template_start = 0.0
+        self.template_seconds = 0.0
+        self.store_calls = 0
+
+    def merge(self, other):
+        for key, value in other.counters.items():
+            self.counters[key] += value
+        for key, values in other.histograms.items():
+            mine = self.histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                mine[i] += value
+
+
+class Metrics:
+    """Per-thread counters and histograms with a Prometheus text export"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        # Totals of threads that have exited
+        self._retired = Shard(None)
+
+    def shard(self):
+        """This thread's shard (created on first use)"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = Shard(threading.current_thread())
+            with self._lock:
+                self._retire_dead()
+                self._shards.append(shard)
+            return shard
+
+    def _retire_dead(self):
+        # A thread-per-request server would otherwise grow the list forever
+        alive = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                alive.append(shard)
+            else:
+                self._retired.merge(shard)
+        self._shards = alive
+
+    def inc(self, name, labels=(), value=1):
+        self.shard().counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        histograms = self.shard().histograms
+        histogram = histograms.get((name, labels))
+        if histogram is None:
+            histogram = histograms[(name, labels)] = [0] * (len(buckets) + 1) + [0.0]
+        histogram[bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+    def store_call(self, operation):
+        shard = self.shard()
+        shard.counters[('healthcare_store_operations_total', (('operation', operation),))] += 1
+        shard.store_calls += 1
+
+    # Flask hooks
+    def install(self, app):
+        """Time every request of `app` and the templates it renders"""
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_template, app)
+        template_rendered.connect(self._after_template, app)
+
+    def _before_request(self):
+        shard = self.shard()
+        shard.template_seconds = 0.0
+        shard.store_calls = 0
+        shard.request_start = time.perf_counter()
+
+    def _before_template(self, sender, template, context, **extra):
+        self.shard().template_start = time.perf_counter()
+
+    def _after_template(self, sender, template, context, **extra):
+        shard = self.shard()
+        elapsed = time.perf_counter() - shard.template_start
+        shard.template_seconds += elapsed
+        self.observe('healthcare_template_seconds', (('template', template.name or ''),), elapsed)
+
+    def _after_request(self, response):
+        shard = self.shard()
+        if shard.request_start is None:
+            return response
+        elapsed = time.perf_counter() - shard.request_start
+        shard.request_start = None
+        endpoint = (('endpoint', request.endpoint or 'none'),)
+        self.inc('healthcare_requests_total',
+                 endpoint + (('method', request.method), ('status', str(response.status_code))))
+        self.observe('healthcare_request_seconds', endpoint, elapsed)
+        self.observe('healthcare_handler_seconds', endpoint, elapsed - shard.template_seconds)
+        self.observe('healthcare_store_calls_per_request', endpoint, shard.store_calls)
+        if response.content_length is not None:
+            self.observe('healthcare_response_bytes', endpoint, response.content_length)
+        return response
+
+    # Export
+    def snapshot(self):
+        """All shards added up into one Shard"""
+        total = Shard(None)
+        with self._lock:
+            self._retire_dead()
+            total.merge(self._retired)
+            shards = list(self._shards)
+        for shard in shards:
+            # Copies first: the owning thread may be adding keys meanwhile
+            copy = Shard(None)
+            copy.counters = dict(shard.counters)
+            copy.histograms = {key: list(values) for key, values in list(shard.histograms.items())}
+            total.merge(copy)
+        return total
+
+    def prometheus(self):
+        """Everything recorded so far, in Prometheus text exposition format"""
+        total = self.snapshot()
+        by_name = defaultdict(list)
+        for (name, labels), value in total.counters.items():
+            by_name[name].append((labels, value))
+        for (name, labels), values in total.histograms.items():
+            by_name[name].append((labels, values))
+        lines = []
+        for name in sorted(by_name):
+            kind, help_text, buckets = METRICS[name]
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(by_name[name]):
+                if kind == 'counter':
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {float(value[-1])!r}')
+                lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+class CountingStore:
+    """Wraps a store and counts every method call in `metrics`
+
+    Wrapped methods are cached on the instance, so after the first call
+    an operation costs one extra Python call and a counter increment.
+    Other attributes are read through from the store.
+    """
+
+    def __init__(self, store, metrics):
+        self.__dict__['_store'] = store
+        self.__dict__['_metrics'] = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._store, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        store_call = self._metrics.store_call
+
+        def counted(*args, **kwargs):
+            store_call(name)
+            return attr(*args, **kwargs)
+        self.__dict__[name] = counted
+        return counted
+
+    def __setattr__(self, name, value):
+        setattr(self._store, name, value)
+
+# ============================================
+# Sampling Profiler
+# ============================================
+
+class SamplingProfiler:
+    """Samples the stacks of threads serving a request every `interval` seconds
+
+    Stacks are counted in the collapsed format used by flamegraph.pl and
+    speedscope ('file:function;file:function count'), outermost frame first.
+    """
+
+    MAX_DEPTH = 64
+
+    def __init__(self, metrics, interval):
+        self.metrics = metrics
+        self.interval = interval
+        self.stacks = defaultdict(int)
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.metrics._lock:
+                busy = {s.thread.ident for s in self.metrics._shards if s.request_start is not None}
+            frames = sys._current_frames()
+            for ident in busy:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[collapse(frame, self.MAX_DEPTH)] += 1
+                    self.samples += 1
+
+    def collapsed(self):
+        """Sampled stacks, most frequent first, one 'stack count' line each"""
+        stacks = sorted(dict(self.stacks).items(), key=lambda item: -item[1])
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+
+def collapse(frame, max_depth):
+    names = []
+    while frame is not None and len(names) < max_depth:
+        code = frame.f_code
+        names.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
@@ -0,0 +1,82 @@
+"""
+Smart Healthcare Management System - Bill Receipts
+One-page PDF receipts, written by a background task after a consultation
+
+The PDF is built by hand (one page of Helvetica text lines), so no PDF
+library is needed.
+"""
+
+import os
+import tempfile
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 56
+LINE_HEIGHT = 18
+
+
+def pdf_text(text):
+    """Text as a PDF string literal (Latin-1, unknown characters as '?')"""
+    text = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return '(' + text.encode('latin-1', 'replace').decode('latin-1') + ')'
+
+
+def text_pdf(title, lines):
+    """Bytes of a one-page PDF with a bold title followed by text lines"""
+    y = PAGE_HEIGHT - MARGIN
+    ops = [f'BT /F2 16 Tf {MARGIN} {y} Td {pdf_text(title)} Tj ET']
+    y -= 2 * LINE_HEIGHT
+    for line in lines:
+        ops.append(f'BT /F1 11 Tf {MARGIN} {y} Td {pdf_text(line)} Tj ET')
+        y -= LINE_HEIGHT
+    content = '\n'.join(ops).encode('latin-1')
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        (f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+         f'/Resources << /Font << /F1 4 0 R /F2 5 0 R >> >> /Contents 6 0 R >>').encode(),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold >>',
+        b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream',
+    ]
+    pdf = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(pdf)
+    pdf += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b'%010d 00000 n \n' % offset
+    pdf += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+def receipt_path(directory, bill_id):
+    return os.path.join(directory, f'bill-{bill_id}.pdf')
+
+
+def write_receipt(directory, bill_id, bill, patient):
+    """Write the receipt of a bill, return its path
+
+    Written to a temp file and renamed, so a half-written receipt is
+    never served and a newer receipt simply replaces it.
+    """
+    lines = [
+        f'Receipt for bill #{bill_id}',
+        '',
+        f"Patient: {patient.get('name', '')}",
+        f"Date: {bill['date']}",
+        f"Description: {bill.get('description', 'Consultation')}",
+        f"Amount: Rs. {bill['amount']:,.2f}",
+        f"Paid: Rs. {bill['paid']:,.2f}",
+        f"Status: {bill['status']}",
+        '',
+        'Thank you for visiting Smart Healthcare.',
+    ]
+    os.makedirs(directory, exist_ok=True)
+    path = receipt_path(directory, bill_id)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(text_pdf('Smart Healthcare - Bill Receipt', lines))
+    os.replace(tmp, path)
+    return path
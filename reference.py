@@ -0,0 +1,52 @@
+"""
+Smart Healthcare Management System - Reference Data Cache
+Doctor and department views built once per version instead of per request
+
+Doctors and departments change only through a few admin actions, while
+every booking page and lookup API reads them. The views derived from
+them (doctors per department, the admin tables, their JSON) are kept
+here under a version number; the admin routes bump the version after a
+change, which drops every view so the next request rebuilds it.
+
+Serialized views carry an ETag computed from their bytes, so a client
+that already has the current data gets a 304 without a body.
+"""
+
+import hashlib
+import threading
+
+MISSING = object()
+
+
+class ReferenceCache:
+    """Views keyed by name, valid until the next bump()"""
+
+    def __init__(self):
+        self.version = 0
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def bump(self):
+        """Drop every view (call after adding or changing a doctor or department)"""
+        with self._lock:
+            self.version += 1
+            self._views = {}
+
+    def get(self, key, build):
+        """View `key` of the current version, calling build() on a miss"""
+        value = self._views.get(key, MISSING)
+        if value is MISSING:
+            version = self.version
+            value = build()
+            with self._lock:
+                # Not kept if a bump() happened while it was being built
+                if self.version == version:
+                    self._views[key] = value
+        return value
+
+    def serialized(self, key, build, dumps):
+        """(body, etag) of view `key` serialized with dumps()"""
+        def serialize():
+            body = dumps(build()).encode()
+            return body, hashlib.sha1(body).hexdigest()[:20]
+        return self.get(('serialized', key), serialize)
@@ -0,0 +1,307 @@
+"""
+Smart Healthcare Management System - Admin Reports
+Columnar copy of the appointments and bills tables for group-by reports
+
+- Every column the reports need (doctor, day, month, status, amount,
+  paid) is a NumPy array, so a report is a few vectorized passes
+  (np.unique + np.bincount) instead of a Python loop over every row
+- The copy is loaded from the store on first use and then kept current
+  from the store's change events: new rows are appended and status or
+  payment changes patched in place, in one batch per report request
+"""
+
+import threading
+from collections import deque
+from datetime import date
+
+import numpy as np
+
+from store import AppointmentStatus, BillStatus, day_number
+
+REPORT_GROUPS = ('department', 'doctor', 'month')
+
+# Day ordinal of 1970-01-01, where numpy's datetime64 counts from
+EPOCH_DAY = date(1970, 1, 1).toordinal()
+
+APPOINTMENT_COLUMNS = {'id': np.int64, 'doctor': np.int64, 'day': np.int32, 'month': np.int32, 'state': np.int8}
+BILL_COLUMNS = {'id': np.int64, 'doctor': np.int64, 'day': np.int32, 'month': np.int32, 'state': np.int8,
+                'amount': np.float64, 'paid': np.float64}
+
+
+def months_of(days):
+    """Day ordinals -> months since 1970-01"""
+    return (np.asarray(days, np.int64) - EPOCH_DAY).astype('datetime64[D]').astype('datetime64[M]').astype(np.int32)
+
+
+def month_label(month):
+    return f'{1970 + month // 12}-{month % 12 + 1:02d}'
+
+
+def bill_paid(bill):
+    """Amount paid on a bill row (rows without 'paid' count PAID bills as paid in full)"""
+    paid = bill.get('paid')
+    if paid is None:
+        paid = bill['amount'] if bill['status'] == 'PAID' else 0
+    return paid
+
+# ============================================
+# Columns
+# ============================================
+
+class Columns:
+    """Equal-length NumPy columns sorted by 'id', grown by doubling"""
+
+    def __init__(self, dtypes):
+        self.size = 0
+        self.data = {name: np.empty(0, dtype) for name, dtype in dtypes.items()}
+
+    def __getitem__(self, name):
+        return self.data[name][:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def append(self, values):
+        """Append {column: array}; rows of one batch may arrive out of id order"""
+        count = len(values['id'])
+        if not count:
+            return
+        start, end = self.size, self.size + count
+        for name, column in self.data.items():
+            if end > len(column):
+                grown = np.empty(max(end, 2 * len(column), 1024), column.dtype)
+                grown[:start] = column[:start]
+                self.data[name] = column = grown
+            column[start:end] = values[name]
+        self.size = end
+        ids = self['id']
+        if np.any(ids[max(start - 1, 0):end - 1] > ids[max(start, 1):end]):
+            # Concurrent writers publish their events in lock order, not id order
+            order = np.argsort(ids, kind='stable')
+            for name in self.data:
+                self.data[name][:end] = self[name][order]
+
+    def find(self, ids):
+        """(positions, found mask) of the given ids"""
+        ids = np.asarray(ids, np.int64)
+        own = self['id']
+        positions = np.minimum(np.searchsorted(own, ids), max(self.size - 1, 0))
+        found = own[positions] == ids if self.size else np.zeros(len(ids), bool)
+        return positions, found
+
+# ============================================
+# Report Engine
+# ============================================
+
+class ReportEngine:
+    """Revenue and appointment reports grouped by department, doctor or month
+
+    Store listeners run inside the writers' locks, so the listener only
+    copies the few values a report needs into a queue. Reading a report
+    first folds the queued changes into the columns in one batch.
+    """
+
+    groups = REPORT_GROUPS
+
+    def __init__(self, store):
+        self.store = store
+        self.appointments = None
+        self.bills = None
+        self._changes = deque()
+        self._lock = threading.Lock()
+        self._subscribed = False
+        self._stale = False
+
+    # Loading and change events
+    def _load(self):
+        # Subscribe first so no change is missed; rows the load already
+        # has are recognized by id and skipped when their events arrive
+        if not self._subscribed:
+            self.store.subscribe(self._on_change)
+            self._subscribed = True
+        rows = self.store.report_rows()
+        apts, bills = rows['appointments'], rows['bills']
+        days = np.array(apts['day'], np.int64)
+        self.appointments = Columns(APPOINTMENT_COLUMNS)
+        self.appointments.append({
+            'id': np.array(apts['id'], np.int64), 'doctor': np.array(apts['doctor_id'], np.int64),
+            'day': days, 'month': months_of(days), 'state': np.array(apts['state'], np.int8),
+        })
+        self.bills = Columns(BILL_COLUMNS)
+        self._append_bills(np.array(bills['id'], np.int64), np.array(bills['appointment_id'], np.int64),
+                           np.array(bills['day'], np.int64), np.array(bills['amount'], np.float64),
+                           np.array(bills['paid'], np.float64), np.array(bills['state'], np.int8))
+        self._loaded = {
+            'appointment': int(self.appointments['id'].max(initial=0)),
+            'bill': int(self.bills['id'].max(initial=0)),
+            'payment': rows['last_payment'],
+        }
+
+    def _on_change(self, event, *args):
+        if event == 'batch':
+            for change in args[0]:
+                self._on_change(change[0], *change[1])
+        elif event == 'appointment':
+            apt_id, apt = args
+            self._changes.append((event, apt_id, (apt['doctor_id'], day_number(apt['date']),
+                                                  AppointmentStatus[apt['status']])))
+        elif event == 'appointment_status':
+            self._changes.append((event, args[0], AppointmentStatus[args[2]]))
+        elif event == 'bill':
+            bill_id, bill = args
+            self._changes.append((event, bill_id, (bill['appointment_id'] or 0, day_number(bill['date']),
+                                                   bill['amount'], bill_paid(bill), BillStatus[bill['status']])))
+        elif event == 'payment':
+            payment_id, payment = args
+            self._changes.append((event, payment_id, (payment['bill_id'], payment['amount'])))
+        elif event == 'bill_status':
+            self._changes.append((event, args[0], BillStatus[args[2]]))
+        elif event == 'reset':
+            self._stale = True
+
+    def refresh(self):
+        """Fold the changes queued since the last refresh into the columns"""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        if self._stale:
+            # The store missed changes (see Store.subscribe): load afresh
+            self._stale = False
+            self._changes.clear()
+            self.appointments = None
+        if self.appointments is None:
+            self._load()
+        loaded = self._loaded
+        new_apts, new_bills, payments = [], [], []
+        apt_states, bill_states = {}, {}
+        changes = self._changes
+        while changes:
+            event, row_id, values = changes.popleft()
+            if event == 'appointment_status':
+                apt_states[row_id] = values
+            elif event == 'bill_status':
+                bill_states[row_id] = values
+            elif row_id > loaded[event]:
+                (new_apts if event == 'appointment' else new_bills if event == 'bill' else payments).append(
+                    (row_id,) + values)
+        if new_apts:
+            ids, doctors, days, states = np.array(new_apts, np.int64).T
+            self.appointments.append({'id': ids, 'doctor': doctors, 'day': days,
+                                      'month': months_of(days), 'state': states})
+        if new_bills:
+            ids, apt_ids, days, amounts, paid, states = np.array(new_bills, np.float64).T
+            self._append_bills(ids.astype(np.int64), apt_ids.astype(np.int64), days.astype(np.int64),
+                               amounts, paid, states)
+        self._patch(self.appointments, 'state', apt_states)
+        self._patch(self.bills, 'state', bill_states)
+        if payments:
+            bill_ids, amounts = np.array([p[1:] for p in payments], np.float64).T
+            positions, found = self.bills.find(bill_ids.astype(np.int64))
+            np.add.at(self.bills['paid'], positions[found], amounts[found])
+
+    def _append_bills(self, ids, apt_ids, days, amounts, paid, states):
+        # A bill's doctor is the doctor of its appointment (-1 if it has none)
+        positions, found = self.appointments.find(apt_ids)
+        doctors = np.where(found, self.appointments['doctor'][positions] if len(self.appointments) else -1, -1)
+        self.bills.append({'id': ids, 'doctor': doctors, 'day': days, 'month': months_of(days),
+                           'state': states, 'amount': amounts, 'paid': paid})
+
+    @staticmethod
+    def _patch(columns, name, values):
+        if values:
+            positions, found = columns.find(list(values))
+            columns[name][positions[found]] = np.array(list(values.values()), np.int8)[found]
+
+    # Reports
+    def _group(self, columns, by, start, end):
+        """(group keys, group index of each selected row, row selection)
+
+        Rows are selected by date between start and end (inclusive).
+        """
+        days = columns['day']
+        selection = slice(None)
+        if start is not None or end is not None:
+            selection = np.ones(len(days), bool)
+            if start is not None:
+                selection &= days >= day_number(start)
+            if end is not None:
+                selection &= days <= day_number(end)
+        if by == 'month':
+            keys = columns['month'][selection]
+        elif by == 'doctor':
+            keys = columns['doctor'][selection]
+        else:
+            keys = self._departments(columns['doctor'][selection])
+        if not len(keys):
+            return keys, keys, selection
+        low = int(keys.min())
+        span = int(keys.max()) - low + 1
+        if span > 4 * len(keys) + 1024:
+            groups, inverse = np.unique(keys, return_inverse=True)
+            return groups, inverse.reshape(-1), selection
+        # Doctor ids, departments and months span a small range: counting
+        # into it is O(n), where np.unique would sort every row
+        offsets = keys - low
+        present = np.flatnonzero(np.bincount(offsets, minlength=span))
+        index = np.zeros(span, np.int64)
+        index[present] = np.arange(len(present))
+        return present + low, index[offsets], selection
+
+    def _departments(self, doctors):
+        dept_of = self.store.doctors()
+        lookup = np.full(max(max(dept_of, default=0), int(doctors.max(initial=0))) + 2, -1, np.int64)
+        for doctor_id, doctor in dept_of.items():
+            lookup[doctor_id + 1] = doctor['dept_id']
+        return lookup[doctors + 1]
+
+    def _labels(self, by, groups):
+        if by == 'month':
+            return [month_label(int(g)) for g in groups]
+        names = self.store.doctors() if by == 'doctor' else self.store.departments()
+        return [names.get(int(g), {}).get('name', 'Unknown') for g in groups]
+
+    def revenue(self, by, start=None, end=None):
+        """Billed, collected and outstanding amounts per group
+
+        `by` is one of REPORT_GROUPS; start and end are optional
+        'YYYY-MM-DD' bounds (inclusive) on the bill date.
+        """
+        with self._lock:
+            self._refresh()
+            bills = self.bills
+            groups, inverse, selection = self._group(bills, by, start, end)
+            size = len(groups)
+            count = np.bincount(inverse, minlength=size)
+            billed = np.bincount(inverse, bills['amount'][selection], minlength=size)
+            collected = np.bincount(inverse, bills['paid'][selection], minlength=size)
+        rows = [{
+            'key': int(g), 'label': label, 'bills': int(n),
+            'billed': round(float(b), 2), 'collected': round(float(c), 2),
+            'outstanding': round(float(b - c), 2),
+        } for g, label, n, b, c in zip(groups, self._labels(by, groups), count, billed, collected)]
+        if by != 'month':
+            rows.sort(key=lambda r: -r['billed'])
+        return rows
+
+    def appointments_report(self, by, start=None, end=None):
+        """Appointment counts per status, cancellation and no-show rates per group"""
+        statuses = len(AppointmentStatus)
+        with self._lock:
+            self._refresh()
+            apts = self.appointments
+            groups, inverse, selection = self._group(apts, by, start, end)
+            counts = np.bincount(inverse * statuses + apts['state'][selection],
+                                 minlength=len(groups) * statuses).reshape(-1, statuses)
+        rows = []
+        for g, label, row in zip(groups, self._labels(by, groups), counts):
+            total = int(row.sum())
+            rows.append(dict(
+                {'key': int(g), 'label': label, 'total': total},
+                **{status.name: int(row[status]) for status in AppointmentStatus},
+                cancellation_rate=round(float(row[AppointmentStatus.CANCELLED]) / total, 4),
+                no_show_rate=round(float(row[AppointmentStatus.NO_SHOW]) / total, 4),
+            ))
+        if by != 'month':
+            rows.sort(key=lambda r: -r['total'])
+        return rows
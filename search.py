@@ -0,0 +1,150 @@
+"""
+Smart Healthcare Management System - Typeahead Search
+Prefix indexes over patient and doctor names for the search APIs
+
+- Patients are found by name or phone number, like idx_patient_name and
+  idx_patient_phone in sql/01_create_tables.sql; doctors by name,
+  specialization or department
+- A row is indexed under every tail of its text that starts at a word
+  ('raj kumar' -> 'raj kumar', 'kumar'), so both 'raj ku' and 'kum' find it
+- The indexes are loaded from the store on first use and then kept current
+  from the store's change events (registration, new doctors and
+  departments), folded in on the next search
+"""
+
+import re
+import threading
+from collections import deque
+
+from store import PrefixIndex
+
+PHONE_CHARS = set('0123456789+-() ')
+
+
+def words(text, doctor=False):
+    """Lowercased words of a name ('Dr.' dropped from doctor names)"""
+    parts = text.casefold().split()
+    if doctor and parts and parts[0] in ('dr', 'dr.'):
+        parts = parts[1:]
+    return parts
+
+
+def word_tails(text, doctor=False):
+    """'Raj Kumar' -> ['raj kumar', 'kumar']"""
+    parts = words(text, doctor)
+    return [' '.join(parts[i:]) for i in range(len(parts))]
+
+
+def digits(phone):
+    phone = phone or ''
+    return phone if phone.isdigit() else re.sub(r'\D', '', phone)
+
+
+def query_term(query, doctor=False):
+    """Search box text -> the prefix to look up ('' matches nothing)"""
+    query = query.strip()
+    if query and set(query) <= PHONE_CHARS:
+        return digits(query)
+    return ' '.join(words(query, doctor))
+
+
+class SearchIndex:
+    """Patient and doctor prefix indexes over a store"""
+
+    def __init__(self, store):
+        self.store = store
+        self.patients = None
+        self.doctors = None
+        self.departments = {}
+        self._changes = deque()
+        self._lock = threading.Lock()
+        self._subscribed = False
+        self._stale = False
+
+    # Loading and change events
+    def _load(self):
+        # Subscribe first so no change is missed; changes queued before the
+        # read finished may already be in it and are skipped by id
+        if not self._subscribed:
+            self.store.subscribe(self._on_change)
+            self._subscribed = True
+        rows = self.store.search_rows()
+        pending = len(self._changes)
+        patients, doctors = rows['patients'], rows['doctors']
+        self.departments = dict(rows['departments'])
+        self.patients = PrefixIndex()
+        self.patients.extend(
+            (term, patient_id)
+            for patient_id, name, phone in zip(patients['id'], patients['name'], patients['phone'])
+            for term in self._patient_terms(name, phone))
+        self.doctors = PrefixIndex()
+        self.doctors.extend(
+            (term, doctor_id)
+            for doctor_id, name, specialization, dept_id in zip(
+                doctors['id'], doctors['name'], doctors['specialization'], doctors['dept_id'])
+            for term in self._doctor_terms(name, specialization, dept_id))
+        if pending:
+            self._fold(pending, {'patient': set(patients['id']), 'doctor': set(doctors['id'])})
+
+    def _on_change(self, event, *args):
+        if event == 'batch':
+            for change in args[0]:
+                self._on_change(change[0], *change[1])
+        elif event in ('patient', 'doctor', 'department'):
+            self._changes.append((event, args[0], args[1]))
+        elif event == 'reset':
+            self._stale = True
+
+    def _fold(self, count=None, loaded=None):
+        changes = self._changes
+        for _ in range(len(changes) if count is None else count):
+            event, row_id, row = changes.popleft()
+            if event == 'department':
+                self.departments[row_id] = row['name']
+            elif loaded and row_id in loaded[event]:
+                continue
+            elif event == 'patient':
+                self.patients.add(self._patient_terms(row['name'], row.get('phone')), row_id)
+            else:
+                self.doctors.add(self._doctor_terms(row['name'], row['specialization'], row['dept_id']), row_id)
+
+    def _refresh(self):
+        if self._stale:
+            # The store missed changes (see Store.subscribe): load afresh
+            self._stale = False
+            self._changes.clear()
+            self.patients = None
+        if self.patients is None:
+            self._load()
+        self._fold()
+
+    @staticmethod
+    def _patient_terms(name, phone):
+        terms = word_tails(name)
+        phone = digits(phone)
+        if phone:
+            terms.append(phone)
+        return terms
+
+    def _doctor_terms(self, name, specialization, dept_id):
+        return (word_tails(name, doctor=True) + word_tails(specialization)
+                + word_tails(self.departments.get(dept_id, '')))
+
+    # Search
+    def patients_matching(self, query, limit):
+        """Ids of up to `limit` patients whose name or phone matches `query`"""
+        term = query_term(query)
+        with self._lock:
+            self._refresh()
+            return self.patients.search(term, limit) if term else []
+
+    def doctors_matching(self, query, limit, where=None):
+        """Ids of up to `limit` doctors whose name, specialization or department matches `query`
+
+        where(doctor_id), if given, filters the matches before the limit
+        is applied.
+        """
+        term = query_term(query, doctor=True)
+        with self._lock:
+            self._refresh()
+            return self.doctors.search(term, limit, where) if term else []
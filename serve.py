@@ -0,0 +1,124 @@
+"""
+Smart Healthcare Management System - Multi-Process Server
+Serves app.py from several worker processes on one port
+
+    HEALTHCARE_STORE=sqlite python serve.py --workers 4 --port 5000
+
+The parent binds the listening socket and starts each worker as a new
+Python process (not a fork, so no thread, lock or connection of the
+parent is inherited). Workers accept connections from the shared socket
+and serve them on threads, so requests use every core.
+
+All workers open the SQLite database at HEALTHCARE_SQLITE_PATH. Each keeps
+its own caches (reference data, search index, reports) and brings them up
+to date from the database's change feed at the start of every request,
+see SqliteStore.poll_changes. A worker that exits is started again.
+Templates are compiled into the bytecode cache before the workers start.
+
+Responses carry an X-Worker header naming the worker that served them.
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import subprocess
+
+import config
+
+
+def with_worker_header(wsgi_app, worker_id):
+    header = ('X-Worker', str(worker_id))
+
+    def app(environ, start_response):
+        def start(status, headers, exc_info=None):
+            return start_response(status, headers + [header], exc_info)
+        return wsgi_app(environ, start)
+    return app
+
+
+def run_worker(fd, host, worker_id):
+    """Body of a worker process: serve the app on the inherited socket"""
+    from werkzeug.serving import make_server
+    import app as healthcare
+    server = make_server(host, 0, with_worker_header(healthcare.app, worker_id), threaded=True, fd=fd)
+    # SystemExit unwinds serve_forever(), so the atexit handlers (task
+    # workers, audit log) run
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f'Worker {worker_id} (pid {os.getpid()}) ready', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def spawn_worker(sock, worker_id, workers, env=None, **popen_args):
+    """Start worker process `worker_id` of `workers` serving on `sock`"""
+    env = dict(os.environ if env is None else env,
+               HEALTHCARE_WORKERS=str(workers), HEALTHCARE_WORKER_ID=str(worker_id))
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--fd', str(sock.fileno()),
+         '--host', sock.getsockname()[0], '--worker-id', str(worker_id)],
+        env=env, pass_fds=[sock.fileno()], **popen_args)
+
+
+def stop_workers(processes, timeout=10.0):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        try:
+            process.wait(max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the app from several worker processes')
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('HEALTHCARE_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--fd', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-id', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.fd is not None:
+        run_worker(args.fd, args.host, args.worker_id)
+        return
+    if args.workers > 1 and config.STORE_BACKEND != 'sqlite':
+        parser.error('several workers need HEALTHCARE_STORE=sqlite (the memory store is private to each process)')
+
+    if config.TEMPLATE_CACHE:
+        # Compiled once here, so the workers load every template from the
+        # cache (importing the app opens no store, see create_app)
+        import app as healthcare
+        healthcare.compile_templates(healthcare.app)
+
+    sock = socket.create_server((args.host, args.port), backlog=128)
+    processes = [spawn_worker(sock, worker_id, args.workers) for worker_id in range(args.workers)]
+    print(f'Serving on http://{args.host}:{args.port} with {args.workers} workers '
+          f'({config.SQLITE_PATH if config.STORE_BACKEND == "sqlite" else "memory store"})', flush=True)
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    try:
+        while not stopping:
+            time.sleep(0.5)
+            for worker_id, process in enumerate(processes):
+                if process.poll() is not None and not stopping:
+                    print(f'Worker {worker_id} exited with {process.returncode}, restarting', flush=True)
+                    processes[worker_id] = spawn_worker(sock, worker_id, args.workers)
+    except KeyboardInterrupt:
+        pass  # Ctrl-C reaches the workers too
+    finally:
+        stop_workers(processes)
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
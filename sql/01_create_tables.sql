@@ -140,7 +140,7 @@ CREATE TABLE APPOINTMENTS (
     appointment_time VARCHAR2(10) NOT NULL,
     status          VARCHAR2(20) DEFAULT 'SCHEDULED'
                     CONSTRAINT chk_appt_status
-                    CHECK (status IN ('SCHEDULED', 'COMPLETED', 'CANCELLED', 'NO_SHOW')),
+                    CHECK (status IN ('SCHEDULED', 'IN_PROGRESS', 'COMPLETED', 'CANCELLED', 'NO_SHOW')),
     reason          VARCHAR2(500),
     created_at      DATE DEFAULT SYSDATE
 );
@@ -268,6 +268,14 @@ CREATE INDEX idx_patient_name ON PATIENTS(last_name, first_name);
 CREATE INDEX idx_doctor_specialization ON DOCTORS(specialization);
 CREATE INDEX idx_bill_status ON BILLS(status);
 
+-- Foreign-key indexes for per-patient / per-record lookups
+CREATE INDEX idx_appointment_patient ON APPOINTMENTS(patient_id, appointment_date);
+CREATE INDEX idx_appointment_doctor ON APPOINTMENTS(doctor_id, appointment_date);
+CREATE INDEX idx_record_patient ON MEDICAL_RECORDS(patient_id, record_date);
+CREATE INDEX idx_prescription_record ON PRESCRIPTIONS(record_id);
+CREATE INDEX idx_bill_patient ON BILLS(patient_id, bill_date);
+CREATE INDEX idx_payment_bill ON PAYMENTS(bill_id);
+
 -- ============================================
 -- Verification Queries
 -- ============================================
@@ -0,0 +1,1013 @@
+"""
+Smart Healthcare Management System - SQLite Backend
+Store implementation on top of the shipped schema
+
+Applies the tables and indexes from sql/01_create_tables.sql to an SQLite
+database (translating the few Oracle-only pieces) and implements the Store
+interface from store.py against it.
+
+- Each thread gets its own connection from a thread-local pool
+- The database runs in WAL mode, so readers never block the writer
+- Every query is a constant SQL string with bound parameters, so the
+  per-connection statement cache reuses the prepared statement
+- Check-then-insert operations run in BEGIN IMMEDIATE transactions, which
+  makes them atomic across threads and across worker processes
+- Opened with shared=True (worker processes and importer.py on one file), change
+  events also go to a CHANGES table in the writing transaction; each
+  process replays that feed into its listeners, in commit order, after its
+  own commits and whenever poll_changes() sees another connection wrote
+"""
+
+import os
+import re
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from store import (Store, DuplicateKeyError, PaymentError, TransitionError, SLOT_TIMES, APPOINTMENT_STATUSES,
+                   AppointmentStatus, BillStatus, bill_status, day_number, resolved)
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql', '01_create_tables.sql')
+
+# ============================================
+# Schema
+# ============================================
+
+def translate_schema(ddl):
+    """Turn the Oracle DDL script into SQLite CREATE TABLE/INDEX statements
+
+    Sequences, COMMENT ON and verification queries are skipped.
+    `NUMBER PRIMARY KEY` becomes `INTEGER PRIMARY KEY` so ids are handed
+    out by SQLite like a sequence, and SYSDATE becomes CURRENT_DATE.
+    """
+    ddl = re.sub(r'/\*.*?\*/', '', ddl, flags=re.S)
+    ddl = re.sub(r'--[^\n]*', '', ddl)
+    statements = []
+    for stmt in ddl.split(';'):
+        stmt = stmt.strip()
+        if not re.match(r'CREATE\s+(UNIQUE\s+)?(TABLE|INDEX)\b', stmt, re.I):
+            continue
+        stmt = re.sub(r'^CREATE\s+(UNIQUE\s+)?(TABLE|INDEX)\s+',
+                      lambda m: m.group(0) + 'IF NOT EXISTS ', stmt, flags=re.I)
+        stmt = re.sub(r'\bNUMBER\s+PRIMARY\s+KEY\b', 'INTEGER PRIMARY KEY', stmt, flags=re.I)
+        stmt = re.sub(r'\bSYSDATE\b', 'CURRENT_DATE', stmt, flags=re.I)
+        statements.append(stmt)
+    return statements
+
+def split_name(name):
+    """'Dr. Amit Sharma' -> ('Amit', 'Sharma')"""
+    name = name.strip()
+    if name.lower().startswith('dr.'):
+        name = name[3:].strip()
+    first, _, last = name.rpartition(' ')
+    return (first, last) if first else (last, '')
+
+def join_name(first, last, doctor=False):
+    name = ' '.join(part for part in (first, last) if part)
+    return f'Dr. {name}' if doctor else name
+
+# ============================================
+# Connection Pool
+# ============================================
+
+class ConnectionPool:
+    """Thread-local SQLite connections (one per worker thread)"""
+
+    def __init__(self, path, statement_cache=256):
+        self.path = path
+        self.statement_cache = statement_cache
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30,
+            isolation_level=None,  # explicit BEGIN/COMMIT
+            check_same_thread=False,
+            cached_statements=self.statement_cache,
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    def get(self):
+        """Connection owned by the calling thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+# ============================================
+# Queries
+# ============================================
+
+USER_SELECT = '''
+    SELECT u.user_id, u.username, u.password_hash, u.email, u.role,
+           p.patient_id, p.first_name, p.last_name,
+           d.doctor_id, d.first_name, d.last_name
+    FROM USERS u
+    LEFT JOIN PATIENTS p ON p.user_id = u.user_id
+    LEFT JOIN DOCTORS d ON d.user_id = u.user_id
+'''
+
+DOCTOR_SELECT = '''
+    SELECT doctor_id, user_id, dept_id, first_name, last_name, specialization,
+           phone, experience_years, consultation_fee, available
+    FROM DOCTORS
+'''
+
+PATIENT_SELECT = '''
+    SELECT patient_id, user_id, first_name, last_name, date_of_birth,
+           gender, phone, blood_group, address
+    FROM PATIENTS
+'''
+
+APPOINTMENT_SELECT = '''
+    SELECT appointment_id, patient_id, doctor_id, appointment_date,
+           appointment_time, status, reason, created_at
+    FROM APPOINTMENTS
+'''
+
+RECORD_SELECT = '''
+    SELECT record_id, appointment_id, patient_id, doctor_id, record_date,
+           diagnosis, symptoms, notes
+    FROM MEDICAL_RECORDS
+'''
+
+PRESCRIPTION_SELECT = '''
+    SELECT record_id, medicine_name, dosage, frequency, duration_days
+    FROM PRESCRIPTIONS
+'''
+
+# Amount paid so far; a bill stored as PAID without payments counts as paid in full
+BILL_PAID = '''CASE b.status WHEN 'PAID' THEN b.final_amount
+    ELSE COALESCE((SELECT SUM(p.amount_paid) FROM PAYMENTS p WHERE p.bill_id = b.bill_id), 0) END'''
+
+BILL_SELECT = f'''
+    SELECT b.bill_id, b.appointment_id, b.patient_id, b.bill_date,
+           b.final_amount, b.status, d.first_name, d.last_name, {BILL_PAID}
+    FROM BILLS b
+    LEFT JOIN APPOINTMENTS a ON a.appointment_id = b.appointment_id
+    LEFT JOIN DOCTORS d ON d.doctor_id = a.doctor_id
+'''
+
+def user_row(row):
+    user_id, username, password, email, role, patient_id, p_first, p_last, doctor_id, d_first, d_last = row
+    user = {'username': username, 'password': password, 'role': role, 'email': email or ''}
+    if role == 'PATIENT':
+        user['name'] = join_name(p_first, p_last)
+        user['patient_id'] = patient_id
+    elif role == 'DOCTOR':
+        user['name'] = join_name(d_first, d_last, doctor=True)
+        user['doctor_id'] = doctor_id
+    else:
+        user['name'] = username
+    return user_id, user
+
+def doctor_row(row):
+    doctor_id, user_id, dept_id, first, last, specialization, phone, experience, fee, available = row
+    return doctor_id, {
+        'user_id': user_id,
+        'name': join_name(first, last, doctor=True),
+        'specialization': specialization,
+        'dept_id': dept_id,
+        'fee': fee,
+        'phone': phone,
+        'experience': experience or 0,
+        'available': available == 'Y',
+    }
+
+def patient_row(row):
+    patient_id, user_id, first, last, dob, gender, phone, blood_group, address = row
+    return patient_id, {
+        'user_id': user_id,
+        'name': join_name(first, last),
+        'dob': dob,
+        'gender': gender or '',
+        'phone': phone,
+        'blood_group': blood_group or '',
+        'address': address or '',
+    }
+
+def appointment_row(row):
+    apt_id, patient_id, doctor_id, date, time, status, reason, created_at = row
+    return apt_id, {
+        'patient_id': patient_id,
+        'doctor_id': doctor_id,
+        'date': date,
+        'time': time,
+        'status': status,
+        'reason': reason or '',
+        'created_at': created_at,
+    }
+
+def record_row(row):
+    record_id, apt_id, patient_id, doctor_id, date, diagnosis, symptoms, notes = row
+    return record_id, {
+        'appointment_id': apt_id,
+        'patient_id': patient_id,
+        'doctor_id': doctor_id,
+        'date': date,
+        'diagnosis': diagnosis or '',
+        'symptoms': symptoms or '',
+        'notes': notes or '',
+    }
+
+PAYMENT_SELECT = '''
+    SELECT p.payment_id, p.bill_id, b.patient_id, p.amount_paid, p.payment_date,
+           p.payment_method, p.transaction_ref
+    FROM PAYMENTS p
+    JOIN BILLS b ON b.bill_id = p.bill_id
+'''
+
+def prescription_row(row):
+    record_id, medicine, dosage, frequency, duration = row
+    return {'record_id': record_id, 'medicine': medicine, 'dosage': dosage or '',
+            'frequency': frequency or '', 'duration': duration or ''}
+
+def bill_row(row):
+    bill_id, apt_id, patient_id, date, amount, status, d_first, d_last, paid = row
+    return bill_id, {
+        'appointment_id': apt_id,
+        'patient_id': patient_id,
+        'date': date,
+        'amount': amount,
+        'paid': paid,
+        'status': status,
+        'description': f"Consultation with {join_name(d_first, d_last, doctor=True)}" if d_last else 'Consultation',
+    }
+
+def payment_row(row):
+    payment_id, bill_id, patient_id, amount, date, method, reference = row
+    return payment_id, {
+        'bill_id': bill_id,
+        'patient_id': patient_id,
+        'amount': amount,
+        'date': date,
+        'method': method,
+        'reference': reference or '',
+    }
+
+# ============================================
+# Dashboard Totals
+# ============================================
+
+# Materialized aggregates for the admin dashboard, kept current by triggers:
+# ('rows', table) -> row count, ('appointment_status', status) -> count,
+# ('billing', 'COLLECTED' / 'OUTSTANDING') -> amount paid so far / still due
+TOTALS_TABLE = '''CREATE TABLE DASHBOARD_TOTALS (
+    name VARCHAR2(30) NOT NULL,
+    key VARCHAR2(30) NOT NULL,
+    value NUMBER DEFAULT 0 NOT NULL,
+    PRIMARY KEY (name, key)
+)'''
+
+def _bump(name, key, delta):
+    return (f"INSERT INTO DASHBOARD_TOTALS (name, key, value) VALUES ('{name}', {key}, {delta}) "
+            f"ON CONFLICT (name, key) DO UPDATE SET value = value + excluded.value;")
+
+# A bill inserted as PAID counts as paid in full (see BILL_PAID); after
+# that only payments move money from outstanding to collected
+BILLING_TRIGGERS = [
+    f'''CREATE TRIGGER trg_totals_bill_insert AFTER INSERT ON BILLS BEGIN
+        {_bump('billing', "'COLLECTED'", "CASE NEW.status WHEN 'PAID' THEN NEW.final_amount ELSE 0 END")}
+        {_bump('billing', "'OUTSTANDING'", "CASE NEW.status WHEN 'PAID' THEN 0 ELSE NEW.final_amount END")}
+    END''',
+    f'''CREATE TRIGGER trg_totals_bill_amount AFTER UPDATE OF final_amount ON BILLS BEGIN
+        {_bump('billing', "'OUTSTANDING'", 'NEW.final_amount - OLD.final_amount')}
+    END''',
+    f'''CREATE TRIGGER trg_totals_payment_insert AFTER INSERT ON PAYMENTS BEGIN
+        {_bump('billing', "'COLLECTED'", 'NEW.amount_paid')}
+        {_bump('billing', "'OUTSTANDING'", '-NEW.amount_paid')}
+    END''',
+]
+
+TOTALS_TRIGGERS = [
+    f'''CREATE TRIGGER trg_totals_doctor_insert AFTER INSERT ON DOCTORS BEGIN
+        {_bump('rows', "'DOCTORS'", 1)}
+    END''',
+    f'''CREATE TRIGGER trg_totals_patient_insert AFTER INSERT ON PATIENTS BEGIN
+        {_bump('rows', "'PATIENTS'", 1)}
+    END''',
+    f'''CREATE TRIGGER trg_totals_appointment_insert AFTER INSERT ON APPOINTMENTS BEGIN
+        {_bump('rows', "'APPOINTMENTS'", 1)}
+        {_bump('appointment_status', 'NEW.status', 1)}
+    END''',
+    f'''CREATE TRIGGER trg_totals_appointment_status AFTER UPDATE OF status ON APPOINTMENTS
+    WHEN OLD.status <> NEW.status BEGIN
+        {_bump('appointment_status', 'OLD.status', -1)}
+        {_bump('appointment_status', 'NEW.status', 1)}
+    END''',
+] + BILLING_TRIGGERS
+
+BILLING_BACKFILL = [
+    f"""INSERT INTO DASHBOARD_TOTALS SELECT 'billing', 'COLLECTED', COALESCE(SUM({BILL_PAID}), 0) FROM BILLS b""",
+    f"""INSERT INTO DASHBOARD_TOTALS
+        SELECT 'billing', 'OUTSTANDING', COALESCE(SUM(b.final_amount - {BILL_PAID}), 0) FROM BILLS b""",
+]
+
+# Totals of a database from when bill amounts were totalled per status
+BILLING_MIGRATION = [
+    'DROP TRIGGER IF EXISTS trg_totals_bill_insert',
+    'DROP TRIGGER IF EXISTS trg_totals_bill_update',
+    "DELETE FROM DASHBOARD_TOTALS WHERE name = 'bill_total'",
+] + BILLING_TRIGGERS + BILLING_BACKFILL
+
+# Fills the totals for a database created before the table existed
+TOTALS_BACKFILL = [
+    """INSERT INTO DASHBOARD_TOTALS SELECT 'rows', 'DOCTORS', COUNT(*) FROM DOCTORS""",
+    """INSERT INTO DASHBOARD_TOTALS SELECT 'rows', 'PATIENTS', COUNT(*) FROM PATIENTS""",
+    """INSERT INTO DASHBOARD_TOTALS SELECT 'rows', 'APPOINTMENTS', COUNT(*) FROM APPOINTMENTS""",
+    """INSERT INTO DASHBOARD_TOTALS
+       SELECT 'appointment_status', status, COUNT(*) FROM APPOINTMENTS GROUP BY status""",
+] + BILLING_BACKFILL
+
+# Change feed of a database shared by several worker processes: every
+# published event, pickled, numbered in commit order (writers hold the
+# database lock, so seq order is commit order)
+CHANGES_TABLE = '''CREATE TABLE IF NOT EXISTS CHANGES (
+    seq   INTEGER PRIMARY KEY,
+    event TEXT NOT NULL,
+    args  BLOB NOT NULL
+)'''
+
+# Secondary indexes of the tables a bulk import fills: dropped while it
+# runs and built again, each in one pass over the table, at its end. The
+# slot index stays, as the import checks every appointment's slot
+IMPORT_TABLES = ('USERS', 'PATIENTS', 'DOCTORS', 'APPOINTMENTS')
+IMPORT_KEPT_INDEXES = ('idx_appointment_slot',)
+
+def import_indexes(statements):
+    """(name, CREATE INDEX statement) of the schema's indexes on IMPORT_TABLES"""
+    indexes = []
+    for stmt in statements:
+        m = re.match(r'CREATE\s+INDEX\s+IF\s+NOT\s+EXISTS\s+(\w+)\s+ON\s+(\w+)', stmt, re.I)
+        if m and m.group(2).upper() in IMPORT_TABLES and m.group(1) not in IMPORT_KEPT_INDEXES:
+            indexes.append((m.group(1), stmt))
+    return indexes
+
+# Changes kept for workers that have not caught up yet, pruned every
+# CHANGES_PRUNE_EVERY changes; a worker further behind gets a 'reset'
+CHANGES_KEPT = 100000
+CHANGES_PRUNE_EVERY = 1000
+
+# ============================================
+# SQLite Store
+# ============================================
+
+class SqliteStore(Store):
+    """Store backed by an SQLite database file using the shipped schema"""
+
+    name = 'sqlite'
+
+    def __init__(self, path, schema_path=SCHEMA_PATH, shared=False):
+        if path == ':memory:':
+            raise ValueError('SqliteStore needs a database file: every thread opens its own connection')
+        self.pool = ConnectionPool(path)
+        self.listeners = []
+        self.shared = shared
+        self._seen = 0                      # last change fed to the listeners
+        self._feed_lock = threading.Lock()
+        self._data_version = threading.local()
+        with open(schema_path) as f:
+            statements = translate_schema(f.read())
+        self.import_indexes = import_indexes(statements)
+        with self.transaction() as conn:
+            for stmt in statements:
+                conn.execute(stmt)
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'DASHBOARD_TOTALS'").fetchone():
+                for stmt in [TOTALS_TABLE] + TOTALS_TRIGGERS + TOTALS_BACKFILL:
+                    conn.execute(stmt)
+            elif not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'trg_totals_payment_insert'").fetchone():
+                for stmt in BILLING_MIGRATION:
+                    conn.execute(stmt)
+            conn.execute(CHANGES_TABLE)
+            # Changes made before this process started are already in the tables
+            self._seen = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM CHANGES').fetchone()[0]
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT on this thread's connection (ROLLBACK on error)"""
+        conn = self.pool.get()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        if self.shared:
+            self._feed()
+
+    @contextmanager
+    def snapshot(self):
+        """Deferred BEGIN ... COMMIT: consistent reads (WAL) without the write lock"""
+        conn = self.pool.get()
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.execute('COMMIT')
+
+    def _all(self, sql, params=()):
+        return self.pool.get().execute(sql, params).fetchall()
+
+    def _one(self, sql, params=()):
+        return self.pool.get().execute(sql, params).fetchone()
+
+    def _page(self, select, owner, date, key, to_row, owner_id, limit, before):
+        """Keyset page over an (owner, date) index, newest first
+
+        Walks the index backwards from the (date, id) cursor and reads one
+        extra row to know whether there is a next page.
+        """
+        order = f' ORDER BY {date} DESC, {key} DESC LIMIT ?'
+        if before is None:
+            rows = self._all(f'{select} WHERE {owner} = ?{order}', (owner_id, limit + 1))
+        else:
+            rows = self._all(f'{select} WHERE {owner} = ? AND ({date}, {key}) < (?, ?){order}',
+                             (owner_id, before[0], before[1], limit + 1))
+        page = [to_row(r) for r in rows[:limit]]
+        cursor = (page[-1][1]['date'], page[-1][0]) if len(rows) > limit else None
+        return page, cursor
+
+    def close(self):
+        self.pool.close()
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _publish(self, event, *args):
+        if self.shared:
+            # Fed to the listeners after the commit, in seq order with the
+            # other workers' changes
+            conn = self.pool.get()
+            seq = conn.execute('INSERT INTO CHANGES (event, args) VALUES (?, ?)',
+                               (event, pickle.dumps(args, pickle.HIGHEST_PROTOCOL))).lastrowid
+            if seq % CHANGES_PRUNE_EVERY == 0:
+                conn.execute('DELETE FROM CHANGES WHERE seq <= ?', (seq - CHANGES_KEPT,))
+            return
+        # Called inside the write transaction, so events come in commit order
+        for listener in self.listeners:
+            listener(event, *args)
+
+    def poll_changes(self):
+        if not self.shared:
+            return 0
+        # data_version changes when another connection commits, so while
+        # nothing changed a poll costs one pragma and no query
+        version = self.pool.get().execute('PRAGMA data_version').fetchone()[0]
+        if version == getattr(self._data_version, 'value', None):
+            return 0
+        self._data_version.value = version
+        return self._feed()
+
+    def _feed(self):
+        """Pass the changes committed since the last feed to the listeners"""
+        with self._feed_lock:
+            rows = self._all('SELECT seq, event, args FROM CHANGES WHERE seq > ? ORDER BY seq', (self._seen,))
+            if rows and rows[0][0] != self._seen + 1:
+                # Pruned before this process read them: listeners reload
+                for listener in self.listeners:
+                    listener('reset')
+            for seq, event, args in rows:
+                args = pickle.loads(args)
+                for listener in self.listeners:
+                    listener(event, *args)
+            if rows:
+                self._seen = rows[-1][0]
+        return len(rows)
+
+    def seed(self, users, departments, doctors, patients):
+        """Load the demo tables from app.py into an empty database"""
+        with self.transaction() as conn:
+            # Checked in the transaction: worker processes starting together
+            # would otherwise all find the database empty
+            if conn.execute('SELECT 1 FROM USERS LIMIT 1').fetchone():
+                return
+            for user_id, u in users.items():
+                conn.execute(
+                    'INSERT INTO USERS (user_id, username, password_hash, email, role) VALUES (?, ?, ?, ?, ?)',
+                    (user_id, u['username'], u['password'], u.get('email') or None, u['role']))
+            for dept_id, d in departments.items():
+                conn.execute(
+                    'INSERT INTO DEPARTMENTS (dept_id, dept_name, description, location) VALUES (?, ?, ?, ?)',
+                    (dept_id, d['name'], d['description'], d['location']))
+            for doctor_id, d in doctors.items():
+                self._insert_doctor(conn, d['user_id'], d, doctor_id)
+            for patient_id, p in patients.items():
+                self._insert_patient(conn, p['user_id'], p, patient_id)
+
+    # Users
+    def find_user(self, username):
+        row = self._one(USER_SELECT + ' WHERE u.username = ?', (username,))
+        return user_row(row) if row else (None, None)
+
+    def get_user(self, user_id):
+        row = self._one(USER_SELECT + ' WHERE u.user_id = ?', (user_id,))
+        return user_row(row)[1] if row else None
+
+    def _insert_user(self, conn, user):
+        if conn.execute('SELECT 1 FROM USERS WHERE username = ?', (user['username'],)).fetchone():
+            raise DuplicateKeyError('username', user['username'])
+        email = user.get('email') or None
+        if email and conn.execute('SELECT 1 FROM USERS WHERE email = ?', (email,)).fetchone():
+            raise DuplicateKeyError('email', email)
+        cur = conn.execute(
+            'INSERT INTO USERS (username, password_hash, email, role) VALUES (?, ?, ?, ?)',
+            (user['username'], user['password'], email, user['role']))
+        return cur.lastrowid
+
+    def _insert_patient(self, conn, user_id, patient, patient_id=None):
+        first, last = split_name(patient['name'])
+        cur = conn.execute(
+            '''INSERT INTO PATIENTS (patient_id, user_id, first_name, last_name, date_of_birth,
+                                     gender, phone, address, blood_group)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            (patient_id, user_id, first, last, patient.get('dob', ''), patient.get('gender') or None,
+             patient.get('phone', ''), patient.get('address'), patient.get('blood_group') or None))
+        return cur.lastrowid
+
+    def _insert_doctor(self, conn, user_id, doctor, doctor_id=None):
+        first, last = split_name(doctor['name'])
+        cur = conn.execute(
+            '''INSERT INTO DOCTORS (doctor_id, user_id, dept_id, first_name, last_name, specialization,
+                                    phone, experience_years, consultation_fee, available)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            (doctor_id, user_id, doctor['dept_id'], first, last, doctor['specialization'],
+             doctor['phone'], doctor.get('experience', 0), doctor['fee'],
+             'Y' if doctor.get('available', True) else 'N'))
+        return cur.lastrowid
+
+    def register_patient(self, user, patient):
+        with self.transaction() as conn:
+            user_id = self._insert_user(conn, user)
+            patient_id = self._insert_patient(conn, user_id, patient)
+            self._publish('patient', patient_id, dict(patient, user_id=user_id))
+        return user_id, patient_id
+
+    def add_doctor(self, user, doctor):
+        with self.transaction() as conn:
+            user_id = self._insert_user(conn, user)
+            doctor_id = self._insert_doctor(conn, user_id, doctor)
+            self._publish('doctor', doctor_id, dict(doctor, user_id=user_id))
+        return user_id, doctor_id
+
+    # Reference data
+    def departments(self):
+        rows = self._all('SELECT dept_id, dept_name, description, location FROM DEPARTMENTS ORDER BY dept_id')
+        return {r[0]: {'name': r[1], 'description': r[2] or '', 'location': r[3] or ''} for r in rows}
+
+    def add_department(self, dept):
+        with self.transaction() as conn:
+            if conn.execute('SELECT 1 FROM DEPARTMENTS WHERE dept_name = ?', (dept['name'],)).fetchone():
+                raise DuplicateKeyError('department', dept['name'])
+            cur = conn.execute(
+                'INSERT INTO DEPARTMENTS (dept_name, description, location) VALUES (?, ?, ?)',
+                (dept['name'], dept['description'], dept['location']))
+            self._publish('department', cur.lastrowid, dept)
+        return cur.lastrowid
+
+    def doctors(self):
+        return dict(doctor_row(r) for r in self._all(DOCTOR_SELECT + ' ORDER BY doctor_id'))
+
+    def get_doctor(self, doctor_id):
+        row = self._one(DOCTOR_SELECT + ' WHERE doctor_id = ?', (doctor_id,))
+        return doctor_row(row)[1] if row else None
+
+    def toggle_doctor(self, doctor_id):
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE DOCTORS SET available = CASE available WHEN 'Y' THEN 'N' ELSE 'Y' END WHERE doctor_id = ?",
+                (doctor_id,))
+            row = conn.execute('SELECT available FROM DOCTORS WHERE doctor_id = ?', (doctor_id,)).fetchone()
+            if row:
+                self._publish('doctor_available', doctor_id, row[0] == 'Y')
+        return row[0] == 'Y' if row else None
+
+    def doctor_counts(self):
+        return dict(self._all('SELECT dept_id, COUNT(*) FROM DOCTORS GROUP BY dept_id'))
+
+    def get_patient(self, patient_id):
+        row = self._one(PATIENT_SELECT + ' WHERE patient_id = ?', (patient_id,))
+        return patient_row(row)[1] if row else None
+
+    def get_patients(self, patient_ids):
+        ids = list(set(patient_ids))
+        patients = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            patients.update(patient_row(r) for r in self._all(
+                PATIENT_SELECT + f' WHERE patient_id IN ({marks})', chunk))
+        return patients
+
+    def patient_ids(self, doctor_ids=None):
+        if doctor_ids is None:
+            return [r[0] for r in self._all('SELECT patient_id FROM PATIENTS ORDER BY patient_id')]
+        found = set()
+        doctor_ids = list(doctor_ids)
+        for start in range(0, len(doctor_ids), 500):
+            chunk = doctor_ids[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            found.update(r[0] for r in self._all(
+                f'SELECT DISTINCT patient_id FROM APPOINTMENTS WHERE doctor_id IN ({marks})', chunk))
+        return sorted(found)
+
+    # Appointments
+    def get_appointment(self, apt_id):
+        row = self._one(APPOINTMENT_SELECT + ' WHERE appointment_id = ?', (apt_id,))
+        return appointment_row(row)[1] if row else None
+
+    def book_appointment(self, apt):
+        with self.transaction() as conn:
+            taken = conn.execute(
+                '''SELECT 1 FROM APPOINTMENTS
+                   WHERE doctor_id = ? AND appointment_date = ? AND appointment_time = ?
+                     AND status != 'CANCELLED' LIMIT 1''',
+                (apt['doctor_id'], apt['date'], apt['time'])).fetchone()
+            if taken:
+                raise DuplicateKeyError('slot', (apt['doctor_id'], apt['date'], apt['time']))
+            cur = conn.execute(
+                '''INSERT INTO APPOINTMENTS (patient_id, doctor_id, appointment_date, appointment_time,
+                                            status, reason, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (apt['patient_id'], apt['doctor_id'], apt['date'], apt['time'],
+                 apt['status'], apt.get('reason', ''), apt['created_at']))
+            self._publish('appointment', cur.lastrowid, apt)
+        return cur.lastrowid
+
+    def add_appointments(self, apts):
+        with self.transaction() as conn:
+            last = conn.execute('SELECT COALESCE(MAX(appointment_id), 0) FROM APPOINTMENTS').fetchone()[0]
+            conn.executemany(
+                '''INSERT INTO APPOINTMENTS (patient_id, doctor_id, appointment_date, appointment_time,
+                                            status, reason, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                ((a['patient_id'], a['doctor_id'], a['date'], a['time'], a['status'],
+                  a.get('reason', ''), a['created_at']) for a in apts))
+            if self.listeners or self.shared:
+                for apt_id, apt in map(appointment_row, conn.execute(
+                        APPOINTMENT_SELECT + ' WHERE appointment_id > ? ORDER BY appointment_id', (last,))):
+                    self._publish('appointment', apt_id, apt)
+
+    def set_appointment_status(self, apt_id, status):
+        self.transition_appointment(apt_id, status, APPOINTMENT_STATUSES)
+
+    def transition_appointment(self, apt_id, status, allowed):
+        with self.transaction() as conn:
+            row = conn.execute('SELECT status FROM APPOINTMENTS WHERE appointment_id = ?', (apt_id,)).fetchone()
+            if row is None or row[0] not in allowed:
+                return False
+            conn.execute('UPDATE APPOINTMENTS SET status = ? WHERE appointment_id = ?', (status, apt_id))
+            self._publish('appointment_status', apt_id, row[0], status)
+        return True
+
+    def appointments_for_patient(self, patient_id):
+        return [appointment_row(r) for r in self._all(
+            APPOINTMENT_SELECT + ' WHERE patient_id = ?', (patient_id,))]
+
+    def appointments_for_doctor(self, doctor_id):
+        return [appointment_row(r) for r in self._all(
+            APPOINTMENT_SELECT + ' WHERE doctor_id = ?', (doctor_id,))]
+
+    def appointments_page_for_patient(self, patient_id, limit, before=None):
+        return self._page(APPOINTMENT_SELECT, 'patient_id', 'appointment_date', 'appointment_id',
+                          appointment_row, patient_id, limit, before)
+
+    def appointments_page_for_doctor(self, doctor_id, limit, before=None):
+        return self._page(APPOINTMENT_SELECT, 'doctor_id', 'appointment_date', 'appointment_id',
+                          appointment_row, doctor_id, limit, before)
+
+    def appointments_for_doctor_on(self, doctor_id, date):
+        return [appointment_row(r) for r in self._all(
+            APPOINTMENT_SELECT + ' WHERE doctor_id = ? AND appointment_date = ?', (doctor_id, date))]
+
+    def doctor_patient_count(self, doctor_id):
+        return self._one('SELECT COUNT(DISTINCT patient_id) FROM APPOINTMENTS WHERE doctor_id = ?',
+                         (doctor_id,))[0]
+
+    def free_slots(self, doctor_id, date):
+        taken = {r[0] for r in self._all(
+            '''SELECT appointment_time FROM APPOINTMENTS
+               WHERE doctor_id = ? AND appointment_date = ? AND status != 'CANCELLED' ''',
+            (doctor_id, date))}
+        return [t for t in SLOT_TIMES if t not in taken]
+
+    def recent_appointments(self, limit):
+        rows = self._all(APPOINTMENT_SELECT + ' ORDER BY appointment_id DESC LIMIT ?', (limit,))
+        return [appointment_row(r) for r in reversed(rows)]
+
+    def _totals(self, name):
+        return dict(self._all('SELECT key, value FROM DASHBOARD_TOTALS WHERE name = ? AND value <> 0', (name,)))
+
+    def appointment_status_counts(self):
+        return self._totals('appointment_status')
+
+    # Housekeeping
+    def open_appointments(self):
+        return self._all("SELECT appointment_id, appointment_date, appointment_time FROM APPOINTMENTS "
+                         "WHERE status IN ('SCHEDULED', 'IN_PROGRESS')")
+
+    def archive_appointments(self, before):
+        # Rows are on disk already and only the pages a query touches are
+        # read, so old appointments cost no memory here; moving them to
+        # another table would only break the RECORDS / BILLS references
+        return 0
+
+    # Bulk import
+    def import_rows(self, kind, rows):
+        with self.transaction() as conn:
+            if kind == 'appointments':
+                return self._import_appointments(conn, rows)
+            insert = self._insert_patient if kind == 'patients' else self._insert_doctor
+            results = []
+            for user, row in rows:
+                try:
+                    user_id = self._insert_user(conn, user)
+                except DuplicateKeyError as e:
+                    results.append(e)
+                    continue
+                results.append((user_id, insert(conn, user_id, row)))
+        return results
+
+    def _import_appointments(self, conn, rows):
+        # A non-cancelled row needs its slot free of the table's appointments
+        # (earlier chunks' included) and of the rows before it
+        taken, added, results = {}, [], []
+        for apt in rows:
+            if apt['status'] != 'CANCELLED':
+                key = (apt['doctor_id'], apt['date'])
+                if key not in taken:
+                    taken[key] = {time for time, in conn.execute(
+                        '''SELECT appointment_time FROM APPOINTMENTS
+                           WHERE doctor_id = ? AND appointment_date = ? AND status != 'CANCELLED' ''', key)}
+                if apt['time'] in taken[key]:
+                    results.append(DuplicateKeyError('slot', (apt['doctor_id'], apt['date'], apt['time'])))
+                    continue
+                taken[key].add(apt['time'])
+            added.append(apt)
+            results.append(None)
+        last = conn.execute('SELECT COALESCE(MAX(appointment_id), 0) FROM APPOINTMENTS').fetchone()[0]
+        conn.executemany(
+            '''INSERT INTO APPOINTMENTS (patient_id, doctor_id, appointment_date, appointment_time,
+                                        status, reason, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            ((a['patient_id'], a['doctor_id'], a['date'], a['time'], a['status'],
+              a.get('reason', ''), a['created_at']) for a in added))
+        ids = iter(range(last + 1, last + 1 + len(added)))
+        return [next(ids) if result is None else result for result in results]
+
+    @contextmanager
+    def bulk_import(self):
+        # Meanwhile queries on these tables scan them, other workers' too
+        with self.transaction() as conn:
+            for name, _ in self.import_indexes:
+                conn.execute(f'DROP INDEX IF EXISTS {name}')
+        try:
+            yield self
+        finally:
+            with self.transaction() as conn:
+                for _, stmt in self.import_indexes:
+                    conn.execute(stmt)
+                self._publish('reset')
+
+    # Unit of work
+    def commit_unit(self, ops):
+        inserts = {'record': self._insert_record, 'prescription': self._insert_prescription,
+                   'bill': self._insert_bill}
+        with self.transaction() as conn:
+            changes = []
+            for op in ops:
+                if op[0] == 'appointment_status':
+                    _, apt_id, status, allowed = op
+                    row = conn.execute('SELECT status FROM APPOINTMENTS WHERE appointment_id = ?',
+                                       (apt_id,)).fetchone()
+                    if row is None or row[0] not in allowed:
+                        raise TransitionError(apt_id, row[0] if row else None, status)
+                    conn.execute('UPDATE APPOINTMENTS SET status = ? WHERE appointment_id = ?', (status, apt_id))
+                    changes.append(('appointment_status', (apt_id, row[0], status)))
+                else:
+                    table, ref, row = op
+                    row = resolved(row)
+                    ref.id = inserts[table](conn, row)
+                    changes.append((table, (ref.id, row)))
+            if changes:
+                self._publish('batch', changes)
+
+    # Medical records
+    def _insert_record(self, conn, record):
+        cur = conn.execute(
+            '''INSERT INTO MEDICAL_RECORDS (appointment_id, patient_id, doctor_id, diagnosis,
+                                           symptoms, notes, record_date)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            (record['appointment_id'], record['patient_id'], record['doctor_id'],
+             record['diagnosis'], record['symptoms'], record['notes'], record['date']))
+        return cur.lastrowid
+
+    def _insert_prescription(self, conn, prescription):
+        cur = conn.execute(
+            '''INSERT INTO PRESCRIPTIONS (record_id, medicine_name, dosage, frequency, duration_days)
+               VALUES (?, ?, ?, ?, ?)''',
+            (prescription['record_id'], prescription['medicine'], prescription['dosage'],
+             prescription['frequency'], prescription['duration'] or None))
+        return cur.lastrowid
+
+    def add_record(self, record):
+        with self.transaction() as conn:
+            record_id = self._insert_record(conn, record)
+            self._publish('record', record_id, record)
+        return record_id
+
+    def add_prescription(self, prescription):
+        with self.transaction() as conn:
+            prescription_id = self._insert_prescription(conn, prescription)
+            self._publish('prescription', prescription_id, prescription)
+        return prescription_id
+
+    def records_for_patient(self, patient_id):
+        return [record_row(r) for r in self._all(RECORD_SELECT + ' WHERE patient_id = ?', (patient_id,))]
+
+    def records_page_for_patient(self, patient_id, limit, before=None):
+        return self._page(RECORD_SELECT, 'patient_id', 'record_date', 'record_id',
+                          record_row, patient_id, limit, before)
+
+    def record_count(self, patient_id):
+        return self._one('SELECT COUNT(*) FROM MEDICAL_RECORDS WHERE patient_id = ?', (patient_id,))[0]
+
+    def prescriptions_for_record(self, record_id):
+        return [prescription_row(r) for r in self._all(PRESCRIPTION_SELECT + ' WHERE record_id = ?', (record_id,))]
+
+    def prescriptions_for_records(self, record_ids):
+        grouped = {rec_id: [] for rec_id in record_ids}
+        ids = list(grouped)
+        # One query per chunk instead of one per record (SQLite caps bound parameters)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            for r in self._all(PRESCRIPTION_SELECT + f' WHERE record_id IN ({marks}) ORDER BY prescription_id', chunk):
+                grouped[r[0]].append(prescription_row(r))
+        return grouped
+
+    # Bills
+    def _insert_bill(self, conn, bill):
+        cur = conn.execute(
+            '''INSERT INTO BILLS (appointment_id, patient_id, consultation_fee, total_amount,
+                                 final_amount, bill_date, status)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            (bill['appointment_id'], bill['patient_id'], bill['amount'], bill['amount'],
+             bill['amount'], bill['date'], bill['status']))
+        return cur.lastrowid
+
+    def add_bill(self, bill):
+        with self.transaction() as conn:
+            bill_id = self._insert_bill(conn, bill)
+            self._publish('bill', bill_id, bill)
+        return bill_id
+
+    def bills_for_patient(self, patient_id):
+        return [bill_row(r) for r in self._all(BILL_SELECT + ' WHERE b.patient_id = ?', (patient_id,))]
+
+    def bills_page_for_patient(self, patient_id, limit, before=None):
+        return self._page(BILL_SELECT, 'b.patient_id', 'b.bill_date', 'b.bill_id',
+                          bill_row, patient_id, limit, before)
+
+    def get_bill(self, bill_id):
+        row = self._one(BILL_SELECT + ' WHERE b.bill_id = ?', (bill_id,))
+        return bill_row(row)[1] if row else None
+
+    def pending_amount(self, patient_id):
+        # Only this patient's bills, through idx_bill_patient
+        return self._one(
+            f"""SELECT COALESCE(SUM(b.final_amount - {BILL_PAID}), 0) FROM BILLS b
+                WHERE b.patient_id = ? AND b.status IN ('PENDING', 'PARTIAL')""",
+            (patient_id,))[0]
+
+    def pay_bill(self, bill_id, payment):
+        with self.transaction() as conn:
+            row = conn.execute(f'SELECT b.final_amount, b.status, {BILL_PAID} FROM BILLS b WHERE b.bill_id = ?',
+                               (bill_id,)).fetchone()
+            if row is None:
+                raise PaymentError(f'Bill #{bill_id} not found')
+            amount, old_status, paid = row
+            due = round(amount - paid, 2)
+            if due <= 0:
+                raise PaymentError(f'Bill #{bill_id} is already paid')
+            if not 0 < payment['amount'] <= due:
+                raise PaymentError(f'Amount must be more than 0 and at most {due}')
+            cur = conn.execute(
+                '''INSERT INTO PAYMENTS (bill_id, amount_paid, payment_date, payment_method, transaction_ref)
+                   VALUES (?, ?, ?, ?, ?)''',
+                (bill_id, payment['amount'], payment['date'], payment['method'], payment.get('reference')))
+            self._publish('payment', cur.lastrowid, dict(payment, bill_id=bill_id))
+            status = bill_status(amount, round(paid + payment['amount'], 2))
+            if status != old_status:
+                conn.execute('UPDATE BILLS SET status = ? WHERE bill_id = ?', (status, bill_id))
+                self._publish('bill_status', bill_id, old_status, status, amount)
+        return cur.lastrowid
+
+    def payments_for_bill(self, bill_id):
+        return [payment_row(r) for r in self._all(
+            PAYMENT_SELECT + ' WHERE p.bill_id = ? ORDER BY p.payment_id', (bill_id,))]
+
+    def statement_for_patient(self, patient_id):
+        payments = [payment_row(r) for r in self._all(
+            PAYMENT_SELECT + ' WHERE b.patient_id = ? ORDER BY p.payment_id', (patient_id,))]
+        paid_later = {}
+        for _, payment in payments:
+            paid_later[payment['bill_id']] = paid_later.get(payment['bill_id'], 0) + payment['amount']
+        entries = []
+        for bill_id, bill in self.bills_for_patient(patient_id):
+            entries.append((bill['date'], 0, bill_id, {
+                'date': bill['date'], 'bill_id': bill_id, 'description': bill['description'],
+                'charge': bill['amount'], 'payment': round(bill['paid'] - paid_later.get(bill_id, 0), 2),
+            }))
+        for payment_id, payment in payments:
+            entries.append((payment['date'], 1, payment_id, {
+                'date': payment['date'], 'bill_id': payment['bill_id'],
+                'description': f"Payment ({payment['method']})", 'charge': 0, 'payment': payment['amount'],
+            }))
+        entries.sort(key=lambda e: e[:3])
+        balance = 0
+        statement = []
+        for _, _, _, line in entries:
+            balance = round(balance + line['charge'] - line['payment'], 2)
+            line['balance'] = balance
+            statement.append(line)
+        return statement
+
+    # Admin totals
+    def counts(self):
+        rows = self._totals('rows')
+        return {
+            'doctors': rows.get('DOCTORS', 0),
+            'patients': rows.get('PATIENTS', 0),
+            'appointments': rows.get('APPOINTMENTS', 0),
+        }
+
+    def revenue(self):
+        totals = self._totals('billing')
+        return {'collected': round(totals.get('COLLECTED', 0), 2),
+                'outstanding': round(totals.get('OUTSTANDING', 0), 2)}
+
+    # Reports
+    def report_rows(self):
+        # One read transaction keeps the three reads consistent with each
+        # other, while writers carry on
+        with self.snapshot() as conn:
+            apts = conn.execute('SELECT appointment_id, doctor_id, appointment_date, status FROM APPOINTMENTS').fetchall()
+            bills = conn.execute(f"""SELECT b.bill_id, COALESCE(b.appointment_id, 0), b.bill_date,
+                                            b.final_amount, {BILL_PAID}, b.status FROM BILLS b""").fetchall()
+            last_payment = conn.execute('SELECT COALESCE(MAX(payment_id), 0) FROM PAYMENTS').fetchone()[0]
+        apt_columns = list(zip(*apts)) or [()] * 4
+        bill_columns = list(zip(*bills)) or [()] * 6
+        return {
+            'appointments': {
+                'id': apt_columns[0], 'doctor_id': apt_columns[1],
+                'day': [day_number(d) for d in apt_columns[2]],
+                'state': [AppointmentStatus[s] for s in apt_columns[3]],
+            },
+            'bills': {
+                'id': bill_columns[0], 'appointment_id': bill_columns[1],
+                'day': [day_number(d) for d in bill_columns[2]],
+                'amount': bill_columns[3], 'paid': bill_columns[4],
+                'state': [BillStatus[s] for s in bill_columns[5]],
+            },
+            'last_payment': last_payment,
+        }
+
+    # Search
+    def search_rows(self):
+        with self.snapshot() as conn:
+            patients = conn.execute('SELECT patient_id, first_name, last_name, phone FROM PATIENTS').fetchall()
+            doctors = conn.execute(
+                'SELECT doctor_id, first_name, last_name, specialization, dept_id FROM DOCTORS').fetchall()
+            departments = dict(conn.execute('SELECT dept_id, dept_name FROM DEPARTMENTS'))
+        return {
+            'patients': {
+                'id': [r[0] for r in patients],
+                'name': [join_name(r[1], r[2]) for r in patients],
+                'phone': [r[3] for r in patients],
+            },
+            'doctors': {
+                'id': [r[0] for r in doctors],
+                'name': [join_name(r[1], r[2], doctor=True) for r in doctors],
+                'specialization': [r[3] for r in doctors],
+                'dept_id': [r[4] for r in doctors],
+            },
+            'departments': departments,
+        }
@@ -0,0 +1,2176 @@
+"""
+Smart Healthcare Management System - In-Memory Store
+Secondary indexes over the mock tables used by app.py
+
+The mock tables are plain dicts keyed by id. The repositories below keep
+those dicts as the primary copy and maintain extra lookup structures next
+to them, much like the indexes declared in sql/01_create_tables.sql, so
+that a patient or doctor view only touches that user's own rows.
+"""
+
+import zlib
+import heapq
+import pickle
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from enum import IntEnum
+from itertools import islice
+from operator import attrgetter, itemgetter
+
+# Bookable time slots (same list as the booking form)
+SLOT_TIMES = [
+    '09:00 AM', '09:30 AM', '10:00 AM', '10:30 AM', '11:00 AM', '11:30 AM', '12:00 PM',
+    '02:00 PM', '02:30 PM', '03:00 PM', '03:30 PM', '04:00 PM', '04:30 PM', '05:00 PM',
+]
+SLOT_INDEX = {t: i for i, t in enumerate(SLOT_TIMES)}
+ALL_SLOTS = (1 << len(SLOT_TIMES)) - 1
+
+# ============================================
+# Primitives
+# ============================================
+
+class DuplicateKeyError(Exception):
+    """Raised when an insert would break a unique key"""
+
+    def __init__(self, field, value):
+        super().__init__(f'{field} already exists: {value}')
+        self.field = field
+        self.value = value
+
+
+class Sequence:
+    """Thread-safe id generator, like an Oracle SEQUENCE"""
+
+    def __init__(self, start=1):
+        self._next = start
+        self._lock = threading.Lock()
+
+    @classmethod
+    def after(cls, rows):
+        """Sequence continuing after the highest id already in a table"""
+        return cls(max(rows, default=0) + 1)
+
+    def nextval(self):
+        with self._lock:
+            value = self._next
+            self._next += 1
+        return value
+
+    def advance_past(self, value):
+        """Make sure later ids are above `value` (used when replaying inserts)"""
+        with self._lock:
+            if value >= self._next:
+                self._next = value + 1
+
+
+class LockStripes:
+    """Fixed pool of locks picked by key hash (lock striping)
+
+    Writers that touch the same key serialize on the same lock, while
+    writers for different keys usually get different locks and run in
+    parallel.
+    """
+
+    def __init__(self, count=64):
+        self._locks = [threading.Lock() for _ in range(count)]
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    def all(self):
+        """Every lock in the pool, always in the same order"""
+        return list(self._locks)
+
+    def ordered(self, keys):
+        """The locks of several keys, each once, in the same order as all()"""
+        count = len(self._locks)
+        return [self._locks[i] for i in sorted({hash(key) % count for key in keys})]
+
+
+def copy_lists(index):
+    """Copy of a defaultdict of lists (or sets) with every list copied too"""
+    return defaultdict(index.default_factory, {key: values.copy() for key, values in index.items()})
+
+
+class KeysetIndex:
+    """Per-owner (date, id) keys kept sorted, for keyset pagination
+
+    Like an index on (owner_id, date) whose entries end with the row id.
+    Rows usually arrive in date order, so insort is mostly an append. A
+    page of the newest rows before a cursor takes one binary search and a
+    slice - O(log n + page size) for any page, with no sorting per request.
+    """
+
+    def __init__(self):
+        self.keys = defaultdict(list)
+
+    def __eq__(self, other):
+        return type(other) is KeysetIndex and self.keys == other.keys
+
+    def copy(self):
+        """Copy that later add() calls do not change (for snapshots)"""
+        index = KeysetIndex()
+        index.keys = copy_lists(self.keys)
+        return index
+
+    def add(self, owner, date, row_id):
+        insort(self.keys[owner], (date, row_id))
+
+    def extend(self, entries):
+        """Add many (owner, date, id) entries at once (one sort per owner instead of an insort each)"""
+        added = defaultdict(list)
+        for owner, date, row_id in entries:
+            added[owner].append((date, row_id))
+        for owner, keys in added.items():
+            # A new list, so a reader paging meanwhile sees the old one whole
+            keys.extend(self.keys.get(owner, ()))
+            keys.sort()
+            self.keys[owner] = keys
+
+    def count(self, owner):
+        return len(self.keys.get(owner, ()))
+
+    def ids(self, owner):
+        """All row ids of an owner, oldest first"""
+        return [row_id for _, row_id in self.keys.get(owner, ())]
+
+    def newest(self, owner, limit, before=None):
+        """Keys of up to `limit` rows older than the `before` key, newest first,
+        and whether there are older ones"""
+        keys = self.keys.get(owner, ())
+        end = len(keys) if before is None else bisect_left(keys, tuple(before))
+        start = max(0, end - limit)
+        return keys[start:end][::-1], start > 0
+
+    def page(self, owner, limit, before=None):
+        """Ids of up to `limit` rows older than the `before` key, newest first
+
+        Returns (ids, cursor); pass the cursor as `before` to get the next
+        page. The cursor is None on the last page.
+        """
+        page, more = self.newest(owner, limit, before)
+        return [row_id for _, row_id in page], page[-1] if more else None
+
+    def discard(self, owner, row_ids):
+        """Drop an owner's keys of the given row ids"""
+        # A new list, so a reader paging meanwhile sees the old one whole
+        keys = [key for key in self.keys.get(owner, ()) if key[1] not in row_ids]
+        if keys:
+            self.keys[owner] = keys
+        else:
+            self.keys.pop(owner, None)
+
+
+class PrefixIndex:
+    """Sorted (term, id) entries for prefix lookups (typeahead search)
+
+    Like a B-tree index on a text column queried with LIKE 'abc%': the
+    terms are kept in one sorted list with the row ids in a parallel list,
+    so a prefix is one binary search plus a scan of the matching run.
+    Adding a row costs one insort per term.
+    """
+
+    def __init__(self):
+        self.terms = []
+        self.ids = []
+
+    def add(self, terms, row_id):
+        for term in terms:
+            pos = bisect_right(self.terms, term)
+            self.terms.insert(pos, term)
+            self.ids.insert(pos, row_id)
+
+    def extend(self, entries):
+        """Add many (term, id) pairs at once (one sort instead of an insort each)"""
+        terms, ids = list(self.terms), list(self.ids)
+        for term, row_id in entries:
+            terms.append(term)
+            ids.append(row_id)
+        # Sorting positions by term alone skips the tuple comparisons
+        order = sorted(range(len(terms)), key=terms.__getitem__)
+        self.terms = [terms[i] for i in order]
+        self.ids = [ids[i] for i in order]
+
+    def __len__(self):
+        return len(self.terms)
+
+    def search(self, prefix, limit, where=None):
+        """Ids of up to `limit` rows with a term starting with `prefix`, in term order
+
+        Rows for which where(id) is false are skipped.
+        """
+        terms, ids = self.terms, self.ids
+        found = {}
+        pos = bisect_left(terms, prefix)
+        while pos < len(terms) and len(found) < limit and terms[pos].startswith(prefix):
+            row_id = ids[pos]
+            if where is None or where(row_id):
+                found[row_id] = None
+            pos += 1
+        return list(found)
+
+# ============================================
+# Row Types
+# ============================================
+
+class AppointmentStatus(IntEnum):
+    SCHEDULED = 0
+    IN_PROGRESS = 1
+    COMPLETED = 2
+    CANCELLED = 3
+    NO_SHOW = 4
+
+
+class BillStatus(IntEnum):
+    PENDING = 0
+    PARTIAL = 1
+    PAID = 2
+
+
+APPOINTMENT_STATUSES = tuple(s.name for s in AppointmentStatus)
+BILL_STATUSES = tuple(s.name for s in BillStatus)
+
+# Day ordinal <-> 'YYYY-MM-DD', cached so all rows of one day share the
+# same int and str objects
+_DAY_NUMBERS = {}
+_DAY_STRINGS = {}
+
+
+def day_number(iso):
+    """'YYYY-MM-DD' -> date ordinal (ValueError if malformed)"""
+    day = _DAY_NUMBERS.get(iso)
+    if day is None:
+        day = date.fromisoformat(iso).toordinal()
+        _DAY_STRINGS.setdefault(day, date.fromordinal(day).isoformat())
+        day = _DAY_NUMBERS.setdefault(iso, day)
+    return day
+
+
+def day_string(day):
+    """Date ordinal -> 'YYYY-MM-DD'"""
+    iso = _DAY_STRINGS.get(day)
+    if iso is None:
+        iso = _DAY_STRINGS.setdefault(day, date.fromordinal(day).isoformat())
+    return iso
+
+
+def timestamp_number(iso):
+    """ISO datetime -> microseconds since 0001-01-01
+
+    Anything that would not come back as the same string (None, a bare
+    date, other formats) is kept as it is.
+    """
+    try:
+        t = datetime.fromisoformat(iso)
+    except (TypeError, ValueError):
+        return iso
+    number = ((t.toordinal() * 86400 + t.hour * 3600 + t.minute * 60 + t.second) * 1000000
+              + t.microsecond)
+    # timestamp_string(number) gives back t.isoformat()
+    return number if t.tzinfo is None and t.isoformat() == iso else iso
+
+
+def timestamp_string(number):
+    if type(number) is not int:
+        return number
+    seconds, microseconds = divmod(number, 1000000)
+    day, seconds = divmod(seconds, 86400)
+    return (datetime.fromordinal(day) + timedelta(seconds=seconds, microseconds=microseconds)).isoformat()
+
+
+def day_key(cursor):
+    """('YYYY-MM-DD', id) page cursor -> (day ordinal, id) index key"""
+    return None if cursor is None else (day_number(cursor[0]), cursor[1])
+
+
+def day_cursor(key):
+    return None if key is None else (day_string(key[0]), key[1])
+
+
+class Row:
+    """Compact table row that reads like the dict it replaces
+
+    Subclasses keep their columns in __slots__, so a row has no dict of
+    its own, with dates stored as day ordinals, statuses as small enums
+    and standard slot times as an index into SLOT_TIMES. Properties give
+    the encoded columns back under their original names, so row['date'],
+    row.get('reason', ''), dict(row) and {{ row.date }} in a template see
+    the same strings the dict rows had.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+    DEFAULTS = {}
+
+    def __init_subclass__(cls):
+        cls.FIELD_SET = frozenset(cls.FIELDS)
+        cls.SLOT_VALUES = attrgetter(*cls.__slots__)
+
+    @classmethod
+    def from_dict(cls, values):
+        row = cls.__new__(cls)
+        defaults = cls.DEFAULTS
+        for name in cls.FIELDS:
+            setattr(row, name, values[name] if name in values else defaults[name])
+        return row
+
+    def __getitem__(self, name):
+        if name not in self.FIELD_SET:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        if name not in self.FIELD_SET:
+            raise KeyError(name)
+        setattr(self, name, value)
+
+    def get(self, name, default=None):
+        return getattr(self, name) if name in self.FIELD_SET else default
+
+    def __contains__(self, name):
+        return name in self.FIELD_SET
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def keys(self):
+        return self.FIELDS
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.FIELDS]
+
+    # Pickled (journal, snapshot) and compared as the tuple of raw slots
+    def __getstate__(self):
+        return self.SLOT_VALUES(self)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self.__getstate__() == other.__getstate__()
+
+    def copy(self):
+        row = type(self).__new__(type(self))
+        row.__setstate__(self.SLOT_VALUES(self))
+        return row
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+
+def as_row(cls, row):
+    """`row` as a `cls` row (dicts from callers and older journals are converted)"""
+    return row if type(row) is cls else cls.from_dict(row)
+
+
+class Appointment(Row):
+    __slots__ = ('patient_id', 'doctor_id', 'day', 'slot', 'state', 'reason', 'created')
+    FIELDS = ('patient_id', 'doctor_id', 'date', 'time', 'status', 'reason', 'created_at')
+    DEFAULTS = {'reason': '', 'created_at': None}
+
+    @property
+    def date(self):
+        return day_string(self.day)
+
+    @date.setter
+    def date(self, value):
+        self.day = day_number(value)
+
+    @property
+    def time(self):
+        slot = self.slot
+        return SLOT_TIMES[slot] if type(slot) is int else slot
+
+    @time.setter
+    def time(self, value):
+        # Times outside SLOT_TIMES are kept as they are
+        self.slot = SLOT_INDEX.get(value, value)
+
+    @property
+    def status(self):
+        return APPOINTMENT_STATUSES[self.state]
+
+    @status.setter
+    def status(self, value):
+        self.state = AppointmentStatus[value]
+
+    @property
+    def created_at(self):
+        return timestamp_string(self.created)
+
+    @created_at.setter
+    def created_at(self, value):
+        self.created = timestamp_number(value)
+
+
+class MedicalRecord(Row):
+    __slots__ = ('appointment_id', 'patient_id', 'doctor_id', 'day', 'diagnosis', 'symptoms', 'notes')
+    FIELDS = ('appointment_id', 'patient_id', 'doctor_id', 'date', 'diagnosis', 'symptoms', 'notes')
+    DEFAULTS = {'appointment_id': None, 'symptoms': '', 'notes': ''}
+
+    @property
+    def date(self):
+        return day_string(self.day)
+
+    @date.setter
+    def date(self, value):
+        self.day = day_number(value)
+
+
+class Prescription(Row):
+    __slots__ = ('record_id', 'medicine', 'dosage', 'frequency', 'duration')
+    FIELDS = __slots__
+    DEFAULTS = {'dosage': '', 'frequency': '', 'duration': ''}
+
+
+class Bill(Row):
+    __slots__ = ('appointment_id', 'patient_id', 'day', 'amount', 'state', 'description', 'paid')
+    FIELDS = ('appointment_id', 'patient_id', 'date', 'amount', 'status', 'description', 'paid')
+    DEFAULTS = {'appointment_id': None, 'description': 'Consultation'}
+
+    @classmethod
+    def from_dict(cls, values):
+        if 'paid' not in values:
+            # Bills imported as already PAID count as paid in full
+            values = dict(values, paid=values['amount'] if values['status'] == 'PAID' else 0)
+        return super().from_dict(values)
+
+    @property
+    def date(self):
+        return day_string(self.day)
+
+    @date.setter
+    def date(self, value):
+        self.day = day_number(value)
+
+    @property
+    def status(self):
+        return BILL_STATUSES[self.state]
+
+    @status.setter
+    def status(self, value):
+        self.state = BillStatus[value]
+
+# ============================================
+# Cold Appointments
+# ============================================
+
+# Statuses an appointment does not leave again, so it can be archived
+CLOSED_STATES = frozenset((AppointmentStatus.COMPLETED, AppointmentStatus.CANCELLED, AppointmentStatus.NO_SHOW))
+
+
+def pack_key(key):
+    """(day, id) -> day << 32 | id, one int that sorts the same way"""
+    return key[0] << 32 | key[1]
+
+
+def unpack_key(packed):
+    return packed >> 32, packed & 0xFFFFFFFF
+
+
+class ColdAppointments:
+    """Closed appointments moved out of the hot table: compressed, read-only
+
+    Rows are pickled BLOCK_ROWS at a time in id order and zlib-compressed;
+    the parallel `ids` / `block_of` arrays find the block of a row. The
+    (day, id) keys the listings page over are packed into one sorted
+    array('q') per patient and per doctor, 8 bytes a key instead of a
+    tuple in a list. A few recently read blocks are kept decompressed.
+
+    add() builds new arrays and swaps them in, so readers never see a
+    half-added batch and need no lock.
+    """
+
+    BLOCK_ROWS = 256
+    CACHED_BLOCKS = 16
+
+    def __init__(self):
+        self.segment = (array('q'), array('i'), [])   # ids, block_of, blocks
+        self.by_patient = {}
+        self.by_doctor = {}
+        self._init_cache()
+
+    def _init_cache(self):
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
+    # Saved with a snapshot without the decompressed blocks
+    def __getstate__(self):
+        return self.segment, self.by_patient, self.by_doctor
+
+    def __setstate__(self, state):
+        self.segment, self.by_patient, self.by_doctor = state
+        self._init_cache()
+
+    # Equal when the decoded rows and the key indexes are, however the blocks were cut
+    def __eq__(self, other):
+        return (type(other) is ColdAppointments
+                and self.by_patient == other.by_patient and self.by_doctor == other.by_doctor
+                and list(self.items()) == list(other.items()))
+
+    def __len__(self):
+        return len(self.segment[0])
+
+    def copy(self):
+        """Copy sharing the arrays and blocks, which add() never changes in place"""
+        cold = ColdAppointments.__new__(ColdAppointments)
+        cold.__setstate__(self.__getstate__())
+        return cold
+
+    def add(self, rows):
+        """Store [(apt_id, appointment)] pairs not stored yet"""
+        rows = sorted(rows, key=lambda row: row[0])
+        ids, block_of, blocks = self.segment
+        blocks = list(blocks)
+        new_ids, new_blocks = array('q'), array('i')
+        # Same tuple as Appointment.__getstate__(), a third of the cost
+        state = attrgetter(*Appointment.__slots__)
+        for start in range(0, len(rows), self.BLOCK_ROWS):
+            chunk = rows[start:start + self.BLOCK_ROWS]
+            states = [(apt_id, state(apt)) for apt_id, apt in chunk]
+            new_ids.extend(apt_id for apt_id, _ in chunk)
+            new_blocks.extend([len(blocks)] * len(chunk))
+            blocks.append(zlib.compress(pickle.dumps(states, pickle.HIGHEST_PROTOCOL), 6))
+        if ids and new_ids[0] < ids[-1]:
+            merged = sorted(zip(ids + new_ids, block_of + new_blocks))
+            new_ids, new_blocks = array('q', [i for i, _ in merged]), array('i', [b for _, b in merged])
+        else:
+            new_ids, new_blocks = ids + new_ids, block_of + new_blocks
+        by_patient = self._merge_keys(self.by_patient, rows, 'patient_id')
+        by_doctor = self._merge_keys(self.by_doctor, rows, 'doctor_id')
+        self.segment = (new_ids, new_blocks, blocks)
+        self.by_patient, self.by_doctor = by_patient, by_doctor
+
+    @staticmethod
+    def _merge_keys(keys, rows, owner):
+        added = defaultdict(list)
+        for apt_id, apt in rows:
+            added[getattr(apt, owner)].append(apt.day << 32 | apt_id)
+        keys = dict(keys)
+        for owner_id, packed in added.items():
+            keys[owner_id] = array('q', sorted(keys.get(owner_id, array('q')) + array('q', packed)))
+        return keys
+
+    def _block(self, number, blocks):
+        rows = self._cache.get(number)
+        if rows is None:
+            rows = {}
+            for apt_id, state in pickle.loads(zlib.decompress(blocks[number])):
+                apt = rows[apt_id] = Appointment.__new__(Appointment)
+                apt.__setstate__(state)
+            with self._cache_lock:
+                if len(self._cache) >= self.CACHED_BLOCKS:
+                    del self._cache[next(iter(self._cache))]
+                self._cache[number] = rows
+        return rows
+
+    def get(self, apt_id):
+        """Archived appointment by id (None if it is not archived)"""
+        ids, block_of, blocks = self.segment
+        pos = bisect_left(ids, apt_id)
+        if pos == len(ids) or ids[pos] != apt_id:
+            return None
+        return self._block(block_of[pos], blocks)[apt_id]
+
+    def items(self):
+        """Every (apt_id, appointment), block by block (not cached)"""
+        for data in self.segment[2]:
+            for apt_id, state in pickle.loads(zlib.decompress(data)):
+                apt = Appointment.__new__(Appointment)
+                apt.__setstate__(state)
+                yield apt_id, apt
+
+    def keys(self, index, owner):
+        """An owner's (day, id) keys, oldest first"""
+        return [unpack_key(packed) for packed in index.get(owner, ())]
+
+    def newest(self, index, owner, limit, before=None):
+        """Same as KeysetIndex.newest() over a packed key array"""
+        keys = index.get(owner, ())
+        end = len(keys) if before is None else bisect_left(keys, pack_key(before))
+        start = max(0, end - limit)
+        return [unpack_key(keys[i]) for i in range(end - 1, start - 1, -1)], start > 0
+
+    def last_id(self):
+        ids = self.segment[0]
+        return ids[-1] if ids else 0
+
+    def on_day(self, doctor_id, day):
+        """Ids of a doctor's archived appointments on a day"""
+        keys = self.by_doctor.get(doctor_id, ())
+        start, end = bisect_left(keys, day << 32), bisect_left(keys, (day + 1) << 32)
+        return [keys[i] & 0xFFFFFFFF for i in range(start, end)]
+
+
+# ============================================
+# Appointments
+# ============================================
+
+class AppointmentRepository:
+    """Appointments table with indexes by patient, doctor and (doctor, date)
+
+    Rows are Appointment objects; dicts passed in are converted. The
+    indexes are keyed by day ordinal rather than by date string.
+
+    Also keeps a slot-occupancy bitmap mirroring idx_appointment_slot:
+    (doctor_id, day) -> int where bit i is set while SLOT_TIMES[i] is held
+    by a non-cancelled appointment. A conflict check is one dict lookup and
+    one bit test, and a whole day's free slots come from a single integer.
+
+    Writes are serialized per doctor through lock stripes, so bookings
+    for different doctors never wait on each other. Changes are made by
+    passing an event to `commit` under that lock; MemoryStore uses this
+    hook to update its aggregates and journal the change.
+
+    archive() moves closed appointments before a day out of `rows` and the
+    key indexes into `cold` (ColdAppointments); lookups and listings read
+    both, so archived history still shows up, just no longer takes hot
+    memory. The occupancy bitmaps and patients_by_doctor keep their entries.
+
+    load() takes a bulk import's rows without sorting them into the key
+    indexes: their ids wait in `pending` until build_keys() adds them all
+    with one sort per patient and doctor.
+    """
+
+    def __init__(self, rows=None, seq=None, stripes=None, commit=None, cold=None):
+        self.rows = rows if rows is not None else {}
+        self.cold = cold if cold is not None else ColdAppointments()
+        self.seq = seq or Sequence(max(max(self.rows, default=0), self.cold.last_id()) + 1)
+        self.lock_for = stripes or LockStripes()
+        self.commit = commit or self.apply
+        self.by_patient = KeysetIndex()
+        self.by_doctor = KeysetIndex()
+        self.by_doctor_date = defaultdict(list)
+        self.patients_by_doctor = defaultdict(set)
+        self.occupancy = {}
+        self.pending = []
+        for apt_id, apt in self.rows.items():
+            apt = self.rows[apt_id] = as_row(Appointment, apt)
+            self._index(apt_id, apt)
+
+    def _index(self, apt_id, apt):
+        """Add one appointment to every secondary index"""
+        self.by_patient.add(apt.patient_id, apt.day, apt_id)
+        self.by_doctor.add(apt.doctor_id, apt.day, apt_id)
+        self.by_doctor_date[(apt.doctor_id, apt.day)].append(apt_id)
+        self.patients_by_doctor[apt.doctor_id].add(apt.patient_id)
+        if apt.state != AppointmentStatus.CANCELLED:
+            self._occupy(apt, True)
+
+    def _occupy(self, apt, taken):
+        """Set or clear the appointment's bit in its doctor/day bitmap"""
+        slot = apt.slot
+        if type(slot) is not int:
+            return
+        key = (apt.doctor_id, apt.day)
+        mask = self.occupancy.get(key, 0)
+        if taken:
+            mask |= 1 << slot
+        else:
+            mask &= ~(1 << slot)
+        if mask:
+            self.occupancy[key] = mask
+        else:
+            self.occupancy.pop(key, None)
+
+    def __contains__(self, apt_id):
+        return apt_id in self.rows or self.cold.get(apt_id) is not None
+
+    def __len__(self):
+        return len(self.rows) + len(self.cold)
+
+    def get(self, apt_id):
+        """Get appointment by id (None if missing)"""
+        apt = self.rows.get(apt_id)
+        return apt if apt is not None else self.cold.get(apt_id)
+
+    def items(self):
+        """Every (apt_id, appointment) in id (booking) order"""
+        archived = sorted(self.cold.items(), key=itemgetter(0))
+        return heapq.merge(archived, self.rows.items(), key=itemgetter(0)) if archived else iter(self.rows.items())
+
+    def apply(self, event, apt_id, *args):
+        """Apply an 'appointment' or 'appointment_status' event"""
+        if event == 'appointment':
+            self.insert(apt_id, *args)
+        else:
+            old, new = args
+            self._set_status(self.rows[apt_id], new)
+
+    def insert(self, apt_id, apt):
+        """Store and index an appointment with a known id (no lock, no event)"""
+        apt = as_row(Appointment, apt)
+        self.rows[apt_id] = apt
+        self._index(apt_id, apt)
+        self.seq.advance_past(apt_id)
+
+    def load(self, rows):
+        """Store (apt_id, appointment) pairs of a bulk import (no lock, no event)
+
+        Every index but by_patient / by_doctor is updated; the ids wait in
+        `pending` for build_keys().
+        """
+        for apt_id, apt in rows:
+            apt = self.rows[apt_id] = as_row(Appointment, apt)
+            self.by_doctor_date[(apt.doctor_id, apt.day)].append(apt_id)
+            self.patients_by_doctor[apt.doctor_id].add(apt.patient_id)
+            if apt.state != AppointmentStatus.CANCELLED:
+                self._occupy(apt, True)
+            self.pending.append(apt_id)
+        if rows:
+            self.seq.advance_past(rows[-1][0])
+
+    def build_keys(self):
+        """Add the pending appointments to the key indexes"""
+        pending, self.pending = self.pending, []
+        # Archived meanwhile: the cold segment has its own keys
+        apts = [(apt_id, apt) for apt_id, apt in zip(pending, map(self.rows.get, pending)) if apt is not None]
+        self.by_patient.extend((apt.patient_id, apt.day, apt_id) for apt_id, apt in apts)
+        self.by_doctor.extend((apt.doctor_id, apt.day, apt_id) for apt_id, apt in apts)
+        return len(apts)
+
+    def add(self, apt):
+        """Insert an appointment without a slot check and return its id"""
+        apt = as_row(Appointment, apt)
+        with self.lock_for(apt.doctor_id):
+            apt_id = self.seq.nextval()
+            self.commit('appointment', apt_id, apt)
+        return apt_id
+
+    def book(self, apt):
+        """Insert a new appointment if its slot is free and return its id
+
+        The slot check and the insert happen under the doctor's lock, so
+        two concurrent bookings cannot both get the same slot. Raises
+        DuplicateKeyError('slot', ...) if the slot is taken.
+        """
+        apt = as_row(Appointment, apt)
+        with self.lock_for(apt.doctor_id):
+            if not self._slot_free(apt.doctor_id, apt.day, apt.slot):
+                raise DuplicateKeyError('slot', (apt.doctor_id, apt.date, apt.time))
+            apt_id = self.seq.nextval()
+            self.commit('appointment', apt_id, apt)
+        return apt_id
+
+    def _set_status(self, apt, status):
+        state = AppointmentStatus[status]
+        if state == AppointmentStatus.CANCELLED and apt.state != AppointmentStatus.CANCELLED:
+            # Cancelling frees the slot for the next booking
+            self._occupy(apt, False)
+        apt.state = state
+
+    def _hot(self, apt_id, status):
+        """Row of a non-archived appointment (TransitionError if it is archived)"""
+        apt = self.rows.get(apt_id)
+        if apt is None:
+            archived = self.cold.get(apt_id)
+            if archived is None:
+                raise KeyError(apt_id)
+            raise TransitionError(apt_id, archived.status, status)
+        return apt
+
+    def set_status(self, apt_id, status):
+        """Change appointment status (book, cancel, consultation)"""
+        apt = self._hot(apt_id, status)
+        with self.lock_for(apt.doctor_id):
+            self.commit('appointment_status', apt_id, apt.status, status)
+
+    def transition(self, apt_id, status, allowed):
+        """Atomically move to `status` if the current status is in `allowed`
+
+        Returns False (and changes nothing) otherwise, e.g. when a second
+        request tries to cancel or complete the same appointment.
+        Archived appointments are closed; one whose status is in `allowed`
+        raises TransitionError.
+        """
+        apt = self.rows.get(apt_id)
+        if apt is None:
+            archived = self.cold.get(apt_id)
+            if archived is None:
+                raise KeyError(apt_id)
+            if archived.status not in allowed:
+                return False
+            raise TransitionError(apt_id, archived.status, status)
+        with self.lock_for(apt.doctor_id):
+            if apt.status not in allowed:
+                return False
+            self.commit('appointment_status', apt_id, apt.status, status)
+        return True
+
+    def is_slot_free(self, doctor_id, date, time):
+        """Check whether a doctor's time slot is free - O(1)"""
+        return self._slot_free(doctor_id, day_number(date), SLOT_INDEX.get(time))
+
+    def _slot_free(self, doctor_id, day, slot):
+        if type(slot) is not int:
+            return False
+        return not self.occupancy.get((doctor_id, day), 0) >> slot & 1
+
+    def free_slots(self, doctor_id, date):
+        """List of free slot times for a doctor on a date"""
+        free = ALL_SLOTS & ~self.occupancy.get((doctor_id, day_number(date)), 0)
+        return [t for i, t in enumerate(SLOT_TIMES) if free >> i & 1]
+
+    def _fetch(self, ids):
+        rows, cold = self.rows, self.cold
+        fetched = []
+        for apt_id in ids:
+            apt = rows.get(apt_id)
+            # Archived, or moved to the cold segment since the ids were read
+            fetched.append((apt_id, apt if apt is not None else cold.get(apt_id)))
+        return fetched
+
+    def _all(self, index, cold_index, owner):
+        if owner not in cold_index:
+            return self._fetch(index.ids(owner))
+        # A row being archived can be in both for a moment, hence the set
+        keys = sorted(set(index.keys.get(owner, ())).union(self.cold.keys(cold_index, owner)))
+        return self._fetch([row_id for _, row_id in keys])
+
+    def _page(self, index, cold_index, owner, limit, before):
+        before = day_key(before)
+        if owner not in cold_index:
+            ids, key = index.page(owner, limit, before)
+            return self._fetch(ids), day_cursor(key)
+        hot, hot_more = index.newest(owner, limit, before)
+        cold, cold_more = self.cold.newest(cold_index, owner, limit, before)
+        keys = sorted(set(hot).union(cold), reverse=True)
+        page = keys[:limit]
+        more = hot_more or cold_more or len(keys) > limit
+        return self._fetch([row_id for _, row_id in page]), day_cursor(page[-1] if more else None)
+
+    def for_patient(self, patient_id):
+        """All (id, appointment) pairs of one patient"""
+        return self._all(self.by_patient, self.cold.by_patient, patient_id)
+
+    def for_doctor(self, doctor_id):
+        """All (id, appointment) pairs of one doctor"""
+        return self._all(self.by_doctor, self.cold.by_doctor, doctor_id)
+
+    def page_for_patient(self, patient_id, limit, before=None):
+        """One page of a patient's appointments, newest date first, and the next cursor"""
+        return self._page(self.by_patient, self.cold.by_patient, patient_id, limit, before)
+
+    def page_for_doctor(self, doctor_id, limit, before=None):
+        """One page of a doctor's appointments, newest date first, and the next cursor"""
+        return self._page(self.by_doctor, self.cold.by_doctor, doctor_id, limit, before)
+
+    def for_doctor_on(self, doctor_id, date):
+        """All (id, appointment) pairs of one doctor on a given date"""
+        day = day_number(date)
+        ids = self.by_doctor_date.get((doctor_id, day), ())
+        if doctor_id in self.cold.by_doctor:
+            ids = sorted(set(ids).union(self.cold.on_day(doctor_id, day)))
+        return self._fetch(ids)
+
+    def open_appointments(self):
+        """(apt_id, date, time) of every SCHEDULED or IN_PROGRESS appointment"""
+        return [(apt_id, apt.date, apt.time) for apt_id, apt in list(self.rows.items())
+                if apt.state not in CLOSED_STATES]
+
+    def archive(self, before_day):
+        """Move closed appointments dated before `before_day` to the cold segment
+
+        Caller holds every lock stripe. Returns how many were moved.
+        """
+        moved = [(apt_id, apt) for apt_id, apt in self.rows.items()
+                 if apt.day < before_day and apt.state in CLOSED_STATES]
+        if not moved:
+            return 0
+        # Into the cold segment first, so a reader always finds the row in one of them
+        self.cold.add(moved)
+        ids = {apt_id for apt_id, _ in moved}
+        for owner in {apt.patient_id for _, apt in moved}:
+            self.by_patient.discard(owner, ids)
+        for owner in {apt.doctor_id for _, apt in moved}:
+            self.by_doctor.discard(owner, ids)
+        for key in {(apt.doctor_id, apt.day) for _, apt in moved}:
+            left = [apt_id for apt_id in self.by_doctor_date[key] if apt_id not in ids]
+            if left:
+                self.by_doctor_date[key] = left
+            else:
+                del self.by_doctor_date[key]
+        for apt_id in ids:
+            del self.rows[apt_id]
+        return len(moved)
+
+    def patient_count(self, doctor_id):
+        """Number of distinct patients a doctor has seen or will see"""
+        return len(self.patients_by_doctor.get(doctor_id, ()))
+
+    def index_state(self):
+        """Copies of the secondary indexes, saved with a snapshot"""
+        return {
+            'by_patient': self.by_patient.copy(),
+            'by_doctor': self.by_doctor.copy(),
+            'by_doctor_date': copy_lists(self.by_doctor_date),
+            'patients_by_doctor': copy_lists(self.patients_by_doctor),
+            'occupancy': dict(self.occupancy),
+            'pending': list(self.pending),
+        }
+
+    @classmethod
+    def restore(cls, rows, indexes, commit=None, cold=None):
+        """Rebuild a repository from snapshot data without re-indexing"""
+        repo = cls(commit=commit, cold=cold)
+        repo.rows = rows
+        repo.seq = Sequence(max(max(rows, default=0), repo.cold.last_id()) + 1)
+        for name, index in indexes.items():
+            setattr(repo, name, index)
+        return repo
+
+
+# ============================================
+# Users
+# ============================================
+
+class UserRepository:
+    """Users table with unique indexes on username and email
+
+    Mirrors the UNIQUE constraints on USERS(username) and USERS(email).
+    Login and duplicate checks are dict lookups, and add() checks and
+    inserts under one lock so concurrent registrations cannot both claim
+    the same username or email. Empty emails are not indexed, the same
+    way a UNIQUE column allows several NULLs.
+    """
+
+    def __init__(self, rows=None, seq=None, commit=None):
+        self.rows = rows if rows is not None else {}
+        self.seq = seq or Sequence.after(self.rows)
+        self.commit = commit or self.apply
+        self.by_username = {}
+        self.by_email = {}
+        self._lock = threading.Lock()
+        for user_id, user in self.rows.items():
+            self._index(user_id, user)
+
+    def _index(self, user_id, user):
+        self.by_username[user['username']] = user_id
+        if user.get('email'):
+            self.by_email[user['email']] = user_id
+
+    def __contains__(self, user_id):
+        return user_id in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, user_id):
+        """Get user by id (None if missing)"""
+        return self.rows.get(user_id)
+
+    def find_by_username(self, username):
+        """(user_id, user) for a username, or (None, None)"""
+        user_id = self.by_username.get(username)
+        if user_id is None:
+            return None, None
+        return user_id, self.rows[user_id]
+
+    def username_taken(self, username):
+        return username in self.by_username
+
+    def email_taken(self, email):
+        return bool(email) and email in self.by_email
+
+    def add(self, user):
+        """Insert a new user and return its id
+
+        Raises DuplicateKeyError if the username or email is already used.
+        """
+        with self._lock:
+            if self.username_taken(user['username']):
+                raise DuplicateKeyError('username', user['username'])
+            if self.email_taken(user.get('email')):
+                raise DuplicateKeyError('email', user['email'])
+            user_id = self.seq.nextval()
+            self.commit('user', user_id, user)
+        return user_id
+
+    def apply(self, event, user_id, user):
+        self.insert(user_id, user)
+
+    def insert(self, user_id, user):
+        """Store and index a user with a known id (no lock, no event)"""
+        self.rows[user_id] = user
+        self._index(user_id, user)
+        self.seq.advance_past(user_id)
+
+
+# ============================================
+# Billing
+# ============================================
+
+PAYMENT_METHODS = ['CASH', 'CARD', 'UPI', 'INSURANCE']
+
+
+class PaymentError(Exception):
+    """Raised when a payment cannot be applied to a bill"""
+
+
+def bill_status(amount, paid):
+    """PENDING -> PARTIAL -> PAID depending on how much has been paid"""
+    if paid <= 0:
+        return 'PENDING'
+    return 'PAID' if paid >= amount else 'PARTIAL'
+
+
+class BillingLedger:
+    """Per-patient bills, payments and running balance
+
+    Does the job of fn_get_pending_amount without summing bills: the
+    outstanding balance is adjusted when a bill is issued or a payment
+    comes in, so reading it is one dict lookup. Each patient also gets an
+    append-only statement of charges and payments with the balance after
+    every line, and the bill history only touches that patient's bills.
+    """
+
+    def __init__(self):
+        self.bills_by_patient = KeysetIndex()
+        self.payments_by_bill = defaultdict(list)
+        self.balance = defaultdict(int)
+        self.statements = defaultdict(list)
+
+    @classmethod
+    def build(cls, bills, payments):
+        """Rebuild from the bill and payment tables (statements in date order)"""
+        ledger = cls()
+        paid_later = defaultdict(int)
+        for payment in payments.values():
+            paid_later[payment['bill_id']] += payment['amount']
+        postings = [(bill['date'], 0, bill_id) for bill_id, bill in bills.items()]
+        postings += [(payment['date'], 1, payment_id) for payment_id, payment in payments.items()]
+        for _, kind, row_id in sorted(postings):
+            if kind == 0:
+                bill = bills[row_id]
+                ledger.charge(row_id, bill, prepaid=round(bill['paid'] - paid_later[row_id], 2))
+            else:
+                ledger.credit(row_id, payments[row_id])
+        return ledger
+
+    def _post(self, patient_id, line):
+        self.balance[patient_id] = round(self.balance[patient_id] + line['charge'] - line['payment'], 2)
+        line['balance'] = self.balance[patient_id]
+        self.statements[patient_id].append(line)
+
+    def charge(self, bill_id, bill, prepaid=None):
+        self.bills_by_patient.add(bill.patient_id, bill.day, bill_id)
+        self._post(bill.patient_id, {
+            'date': bill.date, 'bill_id': bill_id, 'description': bill.description,
+            'charge': bill.amount, 'payment': bill.paid if prepaid is None else prepaid,
+        })
+
+    def credit(self, payment_id, payment):
+        self.payments_by_bill[payment['bill_id']].append(payment_id)
+        self._post(payment['patient_id'], {
+            'date': payment['date'], 'bill_id': payment['bill_id'],
+            'description': f"Payment ({payment['method']})", 'charge': 0, 'payment': payment['amount'],
+        })
+
+    def state(self):
+        # Copies; a statement line is not changed once posted
+        return {
+            'bills_by_patient': self.bills_by_patient.copy(),
+            'payments_by_bill': copy_lists(self.payments_by_bill),
+            'balance': self.balance.copy(),
+            'statements': copy_lists(self.statements),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        ledger = cls()
+        for name, value in state.items():
+            setattr(ledger, name, value)
+        return ledger
+
+
+# ============================================
+# Aggregates
+# ============================================
+
+RECENT_LIMIT = 50
+
+
+class DashboardStats:
+    """Admin dashboard totals, kept up to date from change events
+
+    Instead of summing every bill and copying the appointments table on
+    each page load, the totals are adjusted as changes happen:
+    appointments per status, money collected and still outstanding on the
+    bills, and a ring buffer with the ids of the last RECENT_LIMIT
+    appointments booked. Reading any of them does not depend on the size
+    of the tables.
+    """
+
+    def __init__(self, recent_limit=RECENT_LIMIT):
+        self.appointment_status = defaultdict(int)
+        self.billing = {'collected': 0, 'outstanding': 0}
+        self.recent = deque(maxlen=recent_limit)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, appointments, bills):
+        """Compute the totals from scratch (used when there is no saved copy)"""
+        stats = cls()
+        for apt_id, apt in appointments.items():
+            stats._on_appointment(apt_id, apt)
+        for bill_id, bill in bills.items():
+            stats._on_bill(bill_id, bill)
+        return stats
+
+    def update(self, event, *args):
+        """Fold one change event into the totals"""
+        handler = getattr(self, '_on_' + event, None)
+        if handler is not None:
+            with self._lock:
+                handler(*args)
+
+    def _on_appointment(self, apt_id, apt):
+        self.appointment_status[apt['status']] += 1
+        self.recent.append(apt_id)
+
+    def _on_import(self, kind, rows):
+        if kind == 'appointments':
+            for apt_id, apt in rows:
+                self._on_appointment(apt_id, apt)
+
+    def _on_appointment_status(self, apt_id, old, new):
+        self.appointment_status[old] -= 1
+        self.appointment_status[new] += 1
+
+    def _on_bill(self, bill_id, bill):
+        # Bills issued (or imported) already paid count as collected
+        self._collect(bill['paid'], bill['amount'])
+
+    def _on_payment(self, payment_id, payment):
+        self._collect(payment['amount'], 0)
+
+    def _collect(self, paid, charged):
+        billing = self.billing
+        billing['collected'] = round(billing['collected'] + paid, 2)
+        billing['outstanding'] = round(billing['outstanding'] + charged - paid, 2)
+
+    def status_counts(self):
+        with self._lock:
+            return {status: n for status, n in self.appointment_status.items() if n}
+
+    def revenue(self):
+        with self._lock:
+            return dict(self.billing)
+
+    def recent_ids(self, limit):
+        """Ids of the last `limit` appointments, oldest first (None if not kept)"""
+        if limit > self.recent.maxlen:
+            return None
+        with self._lock:
+            ids = list(self.recent)
+        return ids[-limit:] if limit else []
+
+    def state(self):
+        with self._lock:
+            return {
+                'appointment_status': dict(self.appointment_status),
+                'billing': dict(self.billing),
+                'recent': list(self.recent),
+            }
+
+    @classmethod
+    def from_state(cls, state, bills):
+        stats = cls()
+        stats.appointment_status.update(state['appointment_status'])
+        if 'billing' in state:
+            stats.billing.update(state['billing'])
+        else:
+            # Snapshots from when bill amounts were totalled per status
+            for bill_id, bill in bills.items():
+                stats._on_bill(bill_id, bill)
+        stats.recent.extend(state['recent'])
+        return stats
+
+# ============================================
+# Unit of Work
+# ============================================
+
+class TransitionError(Exception):
+    """Raised when a unit of work's status change is no longer allowed"""
+
+    def __init__(self, apt_id, current, status):
+        super().__init__(f'appointment {apt_id} is {current}, cannot become {status}')
+        self.apt_id = apt_id
+        self.current = current
+        self.status = status
+
+
+class Staged:
+    """Id of a row added in a unit of work, set once the unit commits"""
+
+    __slots__ = ('id',)
+
+    def __init__(self):
+        self.id = None
+
+
+def resolved(row):
+    """A staged row with its Staged values replaced by their ids (a copy if it had any)"""
+    if Staged not in map(type, row.values()):
+        return row
+    return {name: value.id if type(value) is Staged else value for name, value in row.items()}
+
+
+def resolved_row(cls, row):
+    """A staged row as a `cls` row with its Staged values replaced by their ids
+
+    One copy, straight from the staged dict, where as_row(cls, resolved(row))
+    would copy a row holding a Staged value twice.
+    """
+    converted = cls.from_dict(row)
+    if Staged in map(type, row.values()):
+        for name, value in row.items():
+            if type(value) is Staged:
+                setattr(converted, name, value.id)
+    return converted
+
+
+class UnitOfWork:
+    """Writes staged in memory and committed together by the store
+
+        with store.unit_of_work() as uow:
+            uow.transition_appointment(apt_id, 'COMPLETED', allowed=('SCHEDULED',))
+            record = uow.add_record({...})
+            uow.add_prescription({'record_id': record, ...})
+            uow.add_bill({...})
+
+    Nothing reaches the store until the block ends. Then every write is
+    applied under one lock acquisition (memory) or in one transaction
+    (SQLite), and published as a single ('batch', changes) event. An
+    exception inside the block, or a TransitionError at commit, leaves the
+    store untouched. The Staged value returned by add_* can be used as a
+    column of later writes and holds the new row's id after the commit.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.ops = []
+        self.committed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def transition_appointment(self, apt_id, status, allowed):
+        self.ops.append(('appointment_status', apt_id, status, tuple(allowed)))
+
+    def _add(self, table, row):
+        ref = Staged()
+        self.ops.append((table, ref, row))
+        return ref
+
+    def add_record(self, record):
+        return self._add('record', record)
+
+    def add_prescription(self, prescription):
+        return self._add('prescription', prescription)
+
+    def add_bill(self, bill):
+        return self._add('bill', bill)
+
+    def commit(self):
+        if self.committed:
+            raise RuntimeError('unit of work already committed')
+        try:
+            self.store.commit_unit(self.ops)
+        except BaseException:
+            for op in self.ops:
+                if type(op[1]) is Staged:
+                    op[1].id = None
+            raise
+        self.committed = True
+
+
+# ============================================
+# Repository Interface
+# ============================================
+
+class Store:
+    """Repository interface used by the Flask routes
+
+    Rows are plain dicts in the shape the templates expect, and listings
+    return (id, row) pairs. Inserts return the new id and raise
+    DuplicateKeyError when a unique key (username, email, slot,
+    department name) is already taken. MemoryStore keeps everything in
+    dicts; sqlite_store.SqliteStore implements the same methods on top
+    of the schema in sql/01_create_tables.sql.
+    """
+
+    name = None
+
+    # Users
+    def find_user(self, username):
+        """(user_id, user) for a username, or (None, None)"""
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def register_patient(self, user, patient):
+        """Create a PATIENT user and its patient row, return (user_id, patient_id)"""
+        raise NotImplementedError
+
+    def add_doctor(self, user, doctor):
+        """Create a DOCTOR user and its doctor row, return (user_id, doctor_id)"""
+        raise NotImplementedError
+
+    # Reference data
+    def departments(self):
+        """{dept_id: department}"""
+        raise NotImplementedError
+
+    def add_department(self, dept):
+        raise NotImplementedError
+
+    def doctors(self):
+        """{doctor_id: doctor}"""
+        raise NotImplementedError
+
+    def get_doctor(self, doctor_id):
+        raise NotImplementedError
+
+    def toggle_doctor(self, doctor_id):
+        """Flip a doctor's availability, return the new value (None if missing)"""
+        raise NotImplementedError
+
+    def doctor_counts(self):
+        """{dept_id: number of doctors}"""
+        raise NotImplementedError
+
+    def get_patient(self, patient_id):
+        raise NotImplementedError
+
+    def get_patients(self, patient_ids):
+        """{patient_id: patient} for a batch of ids"""
+        raise NotImplementedError
+
+    def patient_ids(self, doctor_ids=None):
+        """Sorted ids of every patient, or of those with an appointment with one of `doctor_ids`"""
+        raise NotImplementedError
+
+    # Appointments
+    def get_appointment(self, apt_id):
+        raise NotImplementedError
+
+    def book_appointment(self, apt):
+        """Insert an appointment if its slot is free, return its id"""
+        raise NotImplementedError
+
+    def add_appointments(self, apts):
+        """Bulk-load historical appointments (no slot checks)"""
+        raise NotImplementedError
+
+    def set_appointment_status(self, apt_id, status):
+        raise NotImplementedError
+
+    def transition_appointment(self, apt_id, status, allowed):
+        """Compare-and-set status change, False if current status not in allowed"""
+        raise NotImplementedError
+
+    def appointments_for_patient(self, patient_id):
+        raise NotImplementedError
+
+    def appointments_for_doctor(self, doctor_id):
+        raise NotImplementedError
+
+    def appointments_for_doctor_on(self, doctor_id, date):
+        raise NotImplementedError
+
+    # Keyset pagination: each *_page_* method returns (rows, cursor) with the
+    # newest dates first; `before` is the cursor from the previous page and
+    # the cursor is None on the last page.
+    def appointments_page_for_patient(self, patient_id, limit, before=None):
+        raise NotImplementedError
+
+    def appointments_page_for_doctor(self, doctor_id, limit, before=None):
+        raise NotImplementedError
+
+    def doctor_patient_count(self, doctor_id):
+        raise NotImplementedError
+
+    def free_slots(self, doctor_id, date):
+        raise NotImplementedError
+
+    def recent_appointments(self, limit):
+        """Last `limit` appointments in booking order"""
+        raise NotImplementedError
+
+    def appointment_status_counts(self):
+        """{appointment status: number of appointments}"""
+        raise NotImplementedError
+
+    # Housekeeping (see sweeper.py)
+    def open_appointments(self):
+        """(apt_id, date, time) of every SCHEDULED or IN_PROGRESS appointment"""
+        raise NotImplementedError
+
+    def archive_appointments(self, before):
+        """Move closed appointments dated before `before` out of the hot tables
+
+        They stay readable through every appointment method. Returns the
+        number moved.
+        """
+        raise NotImplementedError
+
+    # Bulk import (see importer.py)
+    def import_rows(self, kind, rows):
+        """Insert one chunk of validated rows of a bulk import
+
+        kind is 'patients' or 'doctors', with (user, patient / doctor) pairs
+        as for register_patient() and add_doctor(), or 'appointments', with
+        appointment dicts. Returns one result per row: (user_id, patient_id /
+        doctor_id), the apt_id, or the DuplicateKeyError that rejected it (a
+        taken username or email, or for an appointment that is not
+        cancelled a slot held by another one, in the store or earlier in
+        the import).
+        Listeners are not told about each row; call it inside bulk_import().
+        """
+        raise NotImplementedError
+
+    @contextmanager
+    def bulk_import(self):
+        """Context manager around the import_rows() calls of one import
+
+        Index upkeep the chunks skip is done once on exit, and listeners
+        get ('reset',) so they reload.
+        """
+        raise NotImplementedError
+
+    # Medical records
+    def add_record(self, record):
+        raise NotImplementedError
+
+    def add_prescription(self, prescription):
+        raise NotImplementedError
+
+    def records_for_patient(self, patient_id):
+        raise NotImplementedError
+
+    def records_page_for_patient(self, patient_id, limit, before=None):
+        raise NotImplementedError
+
+    def record_count(self, patient_id):
+        raise NotImplementedError
+
+    def prescriptions_for_record(self, record_id):
+        raise NotImplementedError
+
+    def prescriptions_for_records(self, record_ids):
+        """{record_id: [prescription, ...]} for a batch of records"""
+        raise NotImplementedError
+
+    # Bills
+    def add_bill(self, bill):
+        raise NotImplementedError
+
+    def bills_for_patient(self, patient_id):
+        raise NotImplementedError
+
+    def bills_page_for_patient(self, patient_id, limit, before=None):
+        raise NotImplementedError
+
+    def get_bill(self, bill_id):
+        """Bill row with 'paid' (amount paid so far), or None"""
+        raise NotImplementedError
+
+    def pending_amount(self, patient_id):
+        """Outstanding balance: unpaid part of the patient's bills"""
+        raise NotImplementedError
+
+    def pay_bill(self, bill_id, payment):
+        """Record a (possibly partial) payment and move the bill to PARTIAL/PAID
+
+        `payment` has amount, method, date and reference. Returns the
+        payment id; raises PaymentError if the bill is already paid or the
+        amount is not between 0 and what is still due.
+        """
+        raise NotImplementedError
+
+    def payments_for_bill(self, bill_id):
+        raise NotImplementedError
+
+    def statement_for_patient(self, patient_id):
+        """Charges and payments in posting order, each with the running balance"""
+        raise NotImplementedError
+
+    # Admin totals
+    def counts(self):
+        """{'doctors': n, 'patients': n, 'appointments': n}"""
+        raise NotImplementedError
+
+    def revenue(self):
+        """{'collected': paid to date, 'outstanding': billed and not paid yet} over every bill"""
+        raise NotImplementedError
+
+    # Unit of work
+    def unit_of_work(self):
+        """New UnitOfWork that commits through commit_unit()"""
+        return UnitOfWork(self)
+
+    def commit_unit(self, ops):
+        """Apply the staged writes of a UnitOfWork all together, or none of them
+
+        Sets each Staged id as its row is inserted. Raises TransitionError
+        if a staged status change is not allowed from the current status.
+        """
+        raise NotImplementedError
+
+    # Reports
+    def subscribe(self, listener):
+        """Call listener(event, *args) after every change
+
+        Backends publish at least ('appointment', apt_id, apt),
+        ('appointment_status', apt_id, old, new), ('bill', bill_id, bill),
+        ('payment', payment_id, payment), ('bill_status', bill_id, old, new,
+        amount), ('patient', patient_id, patient), ('doctor', doctor_id,
+        doctor) and ('department', dept_id, dept). A unit of work is
+        published as one ('batch', changes) event, `changes` being a list
+        of (event, args) pairs. The end of a bulk import is published as
+        ('reset',), MemoryStore also publishing its chunks as ('import',
+        kind, rows).
+
+        A store shared by several worker processes also feeds listeners
+        the other workers' changes (see poll_changes), and publishes
+        ('reset',) if it missed some, after which listeners reload.
+        """
+        raise NotImplementedError
+
+    def poll_changes(self):
+        """Feed the changes other processes committed to the listeners, return how many
+
+        Nothing to do for a store only one process writes to.
+        """
+        return 0
+
+    def report_rows(self):
+        """Appointment and bill columns for reports.py, read consistently
+
+        {'appointments': {'id', 'doctor_id', 'day', 'state'}, 'bills': {'id',
+        'appointment_id', 'day', 'amount', 'paid', 'state'}, 'last_payment':
+        highest payment id}, each column a list in the same row order, with
+        days as ordinals, states as AppointmentStatus / BillStatus values
+        and 0 for a bill without an appointment.
+        """
+        raise NotImplementedError
+
+    # Search
+    def search_rows(self):
+        """Patient, doctor and department names for search.py, read consistently
+
+        {'patients': {'id', 'name', 'phone'}, 'doctors': {'id', 'name',
+        'specialization', 'dept_id'}, 'departments': {dept_id: name}}, each
+        column a list in the same row order.
+        """
+        raise NotImplementedError
+
+
+# ============================================
+# In-Memory Backend
+# ============================================
+
+# Bumped whenever the shape of a derived index changes: snapshots with
+# another layout keep their tables and get their indexes rebuilt on load
+INDEX_LAYOUT = 3
+
+
+class MemoryStore(Store):
+    """Dict-backed store (the original mock tables) with in-memory indexes
+
+    Every change is described by a small event tuple, e.g.
+    ('appointment', apt_id, apt) or ('appointment_status', apt_id, old, new).
+    Writers apply() the event and then pass it to the subscribers while
+    still holding their write lock, so subscribers (the journal) see
+    changes in the order they were applied. apply() also maintains the
+    dashboard aggregates, and replaying the same events through it
+    rebuilds the tables and the aggregates.
+    """
+
+    name = 'memory'
+
+    def __init__(self, users=None, departments=None, doctors=None, patients=None):
+        self.listeners = []
+        self.users = UserRepository(users if users is not None else {}, commit=self._commit)
+        self.appointments = AppointmentRepository({}, commit=self._commit)
+        self.stats = DashboardStats()
+        self.ledger = BillingLedger()
+        self.dept_rows = departments if departments is not None else {}
+        self.doctor_rows = doctors if doctors is not None else {}
+        self.patient_rows = patients if patients is not None else {}
+        self.record_rows = {}
+        self.prescription_rows = {}
+        self.bill_rows = {}
+        self.payment_rows = {}
+        self.records_by_patient = KeysetIndex()
+        self.prescriptions_by_record = defaultdict(list)
+        self._reset_sequences()
+        self._lock = threading.Lock()
+
+    def _reset_sequences(self):
+        self.dept_seq = Sequence.after(self.dept_rows)
+        self.doctor_seq = Sequence.after(self.doctor_rows)
+        self.patient_seq = Sequence.after(self.patient_rows)
+        self.record_seq = Sequence.after(self.record_rows)
+        self.prescription_seq = Sequence.after(self.prescription_rows)
+        self.bill_seq = Sequence.after(self.bill_rows)
+        self.payment_seq = Sequence.after(self.payment_rows)
+
+    # Change events
+    def subscribe(self, listener):
+        """Call listener(event, *args) after every change"""
+        self.listeners.append(listener)
+
+    def _commit(self, event, *args):
+        """Apply one change and publish it (caller holds the write lock)"""
+        self.apply(event, *args)
+        for listener in self.listeners:
+            listener(event, *args)
+
+    def apply(self, event, *args):
+        """Apply a change event without publishing it (journal replay)"""
+        getattr(self, '_apply_' + event)(*args)
+        self.stats.update(event, *args)
+
+    def _apply_batch(self, changes):
+        for event, args in changes:
+            self.apply(event, *args)
+
+    def _apply_user(self, user_id, user):
+        self.users.insert(user_id, user)
+
+    def _apply_patient(self, patient_id, patient):
+        self.patient_rows[patient_id] = patient
+        self.patient_seq.advance_past(patient_id)
+
+    def _apply_doctor(self, doctor_id, doctor):
+        self.doctor_rows[doctor_id] = doctor
+        self.doctor_seq.advance_past(doctor_id)
+
+    def _apply_doctor_available(self, doctor_id, available):
+        self.doctor_rows[doctor_id]['available'] = available
+
+    def _apply_department(self, dept_id, dept):
+        self.dept_rows[dept_id] = dept
+        self.dept_seq.advance_past(dept_id)
+
+    def _apply_appointment(self, apt_id, apt):
+        self.appointments.insert(apt_id, apt)
+
+    def _apply_appointment_status(self, apt_id, old, new):
+        self.appointments._set_status(self.appointments.rows[apt_id], new)
+
+    def _apply_archive(self, before_day):
+        self.appointments.archive(before_day)
+
+    def _apply_import(self, kind, rows):
+        if kind == 'appointments':
+            self.appointments.load(rows)
+            return
+        table, seq = (self.patient_rows, self.patient_seq) if kind == 'patients' else (self.doctor_rows, self.doctor_seq)
+        for user_id, user, row_id, row in rows:
+            self.users.insert(user_id, user)
+            table[row_id] = row
+        if rows:
+            seq.advance_past(rows[-1][2])
+
+    def _apply_reset(self):
+        # End of a bulk import
+        self.appointments.build_keys()
+
+    # Journals written before the row types hold dicts, hence as_row()
+    def _apply_record(self, record_id, record):
+        record = self.record_rows[record_id] = as_row(MedicalRecord, record)
+        self.records_by_patient.add(record.patient_id, record.day, record_id)
+        self.record_seq.advance_past(record_id)
+
+    def _apply_prescription(self, prescription_id, prescription):
+        prescription = self.prescription_rows[prescription_id] = as_row(Prescription, prescription)
+        self.prescriptions_by_record[prescription.record_id].append(prescription_id)
+        self.prescription_seq.advance_past(prescription_id)
+
+    def _apply_bill(self, bill_id, bill):
+        bill = self.bill_rows[bill_id] = as_row(Bill, bill)
+        self.bill_seq.advance_past(bill_id)
+        self.ledger.charge(bill_id, bill)
+
+    def _apply_payment(self, payment_id, payment):
+        bill = self.bill_rows[payment['bill_id']]
+        bill.paid = round(bill.paid + payment['amount'], 2)
+        self.payment_rows[payment_id] = payment
+        self.payment_seq.advance_past(payment_id)
+        self.ledger.credit(payment_id, payment)
+
+    def _apply_bill_status(self, bill_id, old, new, amount):
+        self.bill_rows[bill_id].state = BillStatus[new]
+
+    @contextmanager
+    def write_barrier(self):
+        """Hold every write lock, so no change is half-applied inside the block"""
+        locks = self.appointments.lock_for.all() + [self.users._lock, self._lock]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def snapshot_state(self):
+        """All tables and derived indexes as one picklable dict
+
+        Taken under write_barrier(), it is a copy later writes do not
+        touch, so it can be pickled after the barrier is released. Tables
+        are copied as dicts of the same rows, except the rows that can
+        still change in place (appointment status, payments on a bill not
+        paid in full, doctor availability), which are copied too.
+        """
+        return {
+            'layout': INDEX_LAYOUT,
+            'users': dict(self.users.rows),
+            'departments': dict(self.dept_rows),
+            'doctors': {doctor_id: dict(doctor) for doctor_id, doctor in self.doctor_rows.items()},
+            'patients': dict(self.patient_rows),
+            'appointments': {apt_id: apt.copy() for apt_id, apt in self.appointments.rows.items()},
+            'cold_appointments': self.appointments.cold.copy(),
+            'records': dict(self.record_rows),
+            'prescriptions': dict(self.prescription_rows),
+            'bills': {bill_id: bill if bill.paid >= bill.amount else bill.copy()
+                      for bill_id, bill in self.bill_rows.items()},
+            'payments': dict(self.payment_rows),
+            'appointment_indexes': self.appointments.index_state(),
+            'record_indexes': {
+                'records_by_patient': self.records_by_patient.copy(),
+                'prescriptions_by_record': copy_lists(self.prescriptions_by_record),
+            },
+            'stats': self.stats.state(),
+            'ledger': self.ledger.state(),
+        }
+
+    def restore(self, state):
+        """Replace every table with the contents of a snapshot_state() dict
+
+        The saved indexes are used as they are when their layout matches
+        this version, otherwise they are rebuilt from the tables.
+        """
+        self.users = UserRepository(state['users'], commit=self._commit)
+        self.dept_rows = state['departments']
+        self.doctor_rows = state['doctors']
+        self.patient_rows = state['patients']
+        self.record_rows = state['records']
+        self.prescription_rows = state['prescriptions']
+        self.bill_rows = state['bills']
+        self.payment_rows = state['payments']
+        if state.get('layout') == INDEX_LAYOUT:
+            self.appointments = AppointmentRepository.restore(
+                state['appointments'], state['appointment_indexes'], commit=self._commit,
+                cold=state.get('cold_appointments'))
+            self.records_by_patient = state['record_indexes']['records_by_patient']
+            self.prescriptions_by_record = state['record_indexes']['prescriptions_by_record']
+            self.stats = DashboardStats.from_state(state['stats'], self.bill_rows)
+            self.ledger = BillingLedger.from_state(state['ledger'])
+        else:
+            self._convert_rows()
+            self._reindex(state['appointments'], state.get('cold_appointments'))
+        self._reset_sequences()
+
+    def _convert_rows(self):
+        # Snapshots taken before the row types hold dict rows
+        for rows, cls in ((self.record_rows, MedicalRecord), (self.prescription_rows, Prescription),
+                          (self.bill_rows, Bill)):
+            for row_id, row in rows.items():
+                rows[row_id] = as_row(cls, row)
+
+    def _reindex(self, appointments, cold=None):
+        """Rebuild every derived index from the tables"""
+        self.appointments = AppointmentRepository(appointments, commit=self._commit, cold=cold)
+        self.records_by_patient = KeysetIndex()
+        self.prescriptions_by_record = defaultdict(list)
+        for record_id, record in self.record_rows.items():
+            self.records_by_patient.add(record.patient_id, record.day, record_id)
+        for prescription_id, prescription in self.prescription_rows.items():
+            self.prescriptions_by_record[prescription.record_id].append(prescription_id)
+        self.ledger = BillingLedger.build(self.bill_rows, self.payment_rows)
+        self.stats = DashboardStats.build(self.appointments, self.bill_rows)
+
+    # Users
+    def find_user(self, username):
+        return self.users.find_by_username(username)
+
+    def get_user(self, user_id):
+        return self.users.rows.get(user_id)
+
+    def register_patient(self, user, patient):
+        patient_id = self.patient_seq.nextval()
+        user_id = self.users.add(dict(user, patient_id=patient_id))
+        with self._lock:
+            self._commit('patient', patient_id, dict(patient, user_id=user_id))
+        return user_id, patient_id
+
+    def add_doctor(self, user, doctor):
+        doctor_id = self.doctor_seq.nextval()
+        user_id = self.users.add(dict(user, doctor_id=doctor_id))
+        with self._lock:
+            self._commit('doctor', doctor_id, dict(doctor, user_id=user_id))
+        return user_id, doctor_id
+
+    # Reference data
+    def departments(self):
+        return self.dept_rows
+
+    def add_department(self, dept):
+        with self._lock:
+            if any(d['name'] == dept['name'] for d in self.dept_rows.values()):
+                raise DuplicateKeyError('department', dept['name'])
+            dept_id = self.dept_seq.nextval()
+            self._commit('department', dept_id, dept)
+        return dept_id
+
+    def doctors(self):
+        return self.doctor_rows
+
+    def get_doctor(self, doctor_id):
+        return self.doctor_rows.get(doctor_id)
+
+    def toggle_doctor(self, doctor_id):
+        with self._lock:
+            doctor = self.doctor_rows.get(doctor_id)
+            if doctor is None:
+                return None
+            self._commit('doctor_available', doctor_id, not doctor['available'])
+            return doctor['available']
+
+    def doctor_counts(self):
+        counts = defaultdict(int)
+        for doctor in self.doctor_rows.values():
+            counts[doctor['dept_id']] += 1
+        return counts
+
+    def get_patient(self, patient_id):
+        return self.patient_rows.get(patient_id)
+
+    def get_patients(self, patient_ids):
+        rows = self.patient_rows
+        return {pid: rows[pid] for pid in patient_ids if pid in rows}
+
+    def patient_ids(self, doctor_ids=None):
+        if doctor_ids is None:
+            return sorted(self.patient_rows)
+        by_doctor = self.appointments.patients_by_doctor
+        return sorted(set().union(*(by_doctor.get(doctor_id, ()) for doctor_id in doctor_ids)))
+
+    # Appointments
+    def get_appointment(self, apt_id):
+        return self.appointments.get(apt_id)
+
+    def book_appointment(self, apt):
+        return self.appointments.book(apt)
+
+    def add_appointments(self, apts):
+        for apt in apts:
+            self.appointments.add(apt)
+
+    def set_appointment_status(self, apt_id, status):
+        self.appointments.set_status(apt_id, status)
+
+    def transition_appointment(self, apt_id, status, allowed):
+        return self.appointments.transition(apt_id, status, allowed)
+
+    def appointments_for_patient(self, patient_id):
+        return self.appointments.for_patient(patient_id)
+
+    def appointments_for_doctor(self, doctor_id):
+        return self.appointments.for_doctor(doctor_id)
+
+    def appointments_page_for_patient(self, patient_id, limit, before=None):
+        return self.appointments.page_for_patient(patient_id, limit, before)
+
+    def appointments_page_for_doctor(self, doctor_id, limit, before=None):
+        return self.appointments.page_for_doctor(doctor_id, limit, before)
+
+    def appointments_for_doctor_on(self, doctor_id, date):
+        return self.appointments.for_doctor_on(doctor_id, date)
+
+    def doctor_patient_count(self, doctor_id):
+        return self.appointments.patient_count(doctor_id)
+
+    def free_slots(self, doctor_id, date):
+        return self.appointments.free_slots(doctor_id, date)
+
+    def recent_appointments(self, limit):
+        ids = self.stats.recent_ids(limit)
+        if ids is not None:
+            return self.appointments._fetch(ids)
+        recent = list(islice(reversed(self.appointments.rows.items()), limit))
+        recent.reverse()
+        if len(self.appointments.cold):
+            # Booking order is id order across both segments
+            archived = sorted(self.appointments.cold.items(), key=itemgetter(0))
+            recent = sorted(archived[-limit:] + recent, key=itemgetter(0))[-limit:] if limit else []
+        return recent
+
+    def appointment_status_counts(self):
+        return self.stats.status_counts()
+
+    # Housekeeping
+    def open_appointments(self):
+        return self.appointments.open_appointments()
+
+    def archive_appointments(self, before):
+        with self.write_barrier():
+            moved = len(self.appointments.cold)
+            self._commit('archive', day_number(before))
+            return len(self.appointments.cold) - moved
+
+    # Bulk import
+    def import_rows(self, kind, rows):
+        if kind == 'appointments':
+            return self._import_appointments(rows)
+        key, seq = ('patient_id', self.patient_seq) if kind == 'patients' else ('doctor_id', self.doctor_seq)
+        users = self.users
+        results, added, usernames, emails = [], [], set(), set()
+        with users._lock, self._lock:
+            for user, row in rows:
+                username, email = user['username'], user.get('email')
+                if users.username_taken(username) or username in usernames:
+                    results.append(DuplicateKeyError('username', username))
+                    continue
+                if email and (users.email_taken(email) or email in emails):
+                    results.append(DuplicateKeyError('email', email))
+                    continue
+                usernames.add(username)
+                if email:
+                    emails.add(email)
+                user_id, row_id = users.seq.nextval(), seq.nextval()
+                added.append((user_id, dict(user, **{key: row_id}), row_id, dict(row, user_id=user_id)))
+                results.append((user_id, row_id))
+            if added:
+                self._commit('import', kind, added)
+        return results
+
+    def _import_appointments(self, rows):
+        apts = self.appointments
+        rows = [as_row(Appointment, apt) for apt in rows]
+        locks = apts.lock_for.ordered({apt.doctor_id for apt in rows})
+        for lock in locks:
+            lock.acquire()
+        try:
+            # Earlier chunks are in the occupancy bitmaps already; `taken`
+            # adds this chunk's rows as they are accepted
+            taken, added, results = {}, [], []
+            for apt in rows:
+                if apt.state != AppointmentStatus.CANCELLED:
+                    key = (apt.doctor_id, apt.day)
+                    if not apts._slot_free(apt.doctor_id, apt.day, apt.slot) or taken.get(key, 0) >> apt.slot & 1:
+                        results.append(DuplicateKeyError('slot', (apt.doctor_id, apt.date, apt.time)))
+                        continue
+                    taken[key] = taken.get(key, 0) | 1 << apt.slot
+                apt_id = apts.seq.nextval()
+                added.append((apt_id, apt))
+                results.append(apt_id)
+            if added:
+                self._commit('import', 'appointments', added)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        return results
+
+    @contextmanager
+    def bulk_import(self):
+        try:
+            yield self
+        finally:
+            # The key indexes get the imported appointments in one sort
+            with self.write_barrier():
+                self._commit('reset')
+
+    # Unit of work
+    def commit_unit(self, ops):
+        tables = {
+            'record': (self.record_seq, MedicalRecord),
+            'prescription': (self.prescription_seq, Prescription),
+            'bill': (self.bill_seq, Bill),
+        }
+        apts = self.appointments
+        doctors = {apts.get(op[1]).doctor_id for op in ops if op[0] == 'appointment_status'}
+        locks = self.appointments.lock_for.ordered(doctors) + [self._lock]
+        for lock in locks:
+            lock.acquire()
+        try:
+            # Everything is checked and converted before the first change
+            changes = []
+            statuses = {}
+            for op in ops:
+                if op[0] == 'appointment_status':
+                    _, apt_id, status, allowed = op
+                    if apt_id not in apts.rows:
+                        # Archived appointments are closed for good
+                        raise TransitionError(apt_id, apts.get(apt_id).status, status)
+                    current = statuses.get(apt_id) or apts.rows[apt_id].status
+                    if current not in allowed:
+                        raise TransitionError(apt_id, current, status)
+                    statuses[apt_id] = status
+                    changes.append(('appointment_status', (apt_id, current, status)))
+                else:
+                    table, ref, row = op
+                    seq, cls = tables[table]
+                    ref.id = seq.nextval()
+                    changes.append((table, (ref.id, resolved_row(cls, row))))
+            if changes:
+                self._commit('batch', changes)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    # Medical records
+    def add_record(self, record):
+        record = as_row(MedicalRecord, record)
+        with self._lock:
+            record_id = self.record_seq.nextval()
+            self._commit('record', record_id, record)
+        return record_id
+
+    def add_prescription(self, prescription):
+        prescription = as_row(Prescription, prescription)
+        with self._lock:
+            prescription_id = self.prescription_seq.nextval()
+            self._commit('prescription', prescription_id, prescription)
+        return prescription_id
+
+    def records_for_patient(self, patient_id):
+        rows = self.record_rows
+        return [(rec_id, rows[rec_id]) for rec_id in self.records_by_patient.ids(patient_id)]
+
+    def records_page_for_patient(self, patient_id, limit, before=None):
+        rows = self.record_rows
+        ids, key = self.records_by_patient.page(patient_id, limit, day_key(before))
+        return [(rec_id, rows[rec_id]) for rec_id in ids], day_cursor(key)
+
+    def record_count(self, patient_id):
+        return self.records_by_patient.count(patient_id)
+
+    def prescriptions_for_record(self, record_id):
+        rows = self.prescription_rows
+        return [rows[p_id] for p_id in self.prescriptions_by_record.get(record_id, ())]
+
+    def prescriptions_for_records(self, record_ids):
+        return {rec_id: self.prescriptions_for_record(rec_id) for rec_id in record_ids}
+
+    # Bills
+    def add_bill(self, bill):
+        bill = as_row(Bill, bill)
+        with self._lock:
+            bill_id = self.bill_seq.nextval()
+            self._commit('bill', bill_id, bill)
+        return bill_id
+
+    def bills_for_patient(self, patient_id):
+        rows = self.bill_rows
+        return [(bill_id, rows[bill_id]) for bill_id in self.ledger.bills_by_patient.ids(patient_id)]
+
+    def bills_page_for_patient(self, patient_id, limit, before=None):
+        rows = self.bill_rows
+        ids, key = self.ledger.bills_by_patient.page(patient_id, limit, day_key(before))
+        return [(bill_id, rows[bill_id]) for bill_id in ids], day_cursor(key)
+
+    def get_bill(self, bill_id):
+        return self.bill_rows.get(bill_id)
+
+    def pending_amount(self, patient_id):
+        return self.ledger.balance.get(patient_id, 0)
+
+    def pay_bill(self, bill_id, payment):
+        with self._lock:
+            bill = self.bill_rows.get(bill_id)
+            if bill is None:
+                raise PaymentError(f'Bill #{bill_id} not found')
+            due = round(bill['amount'] - bill['paid'], 2)
+            if due <= 0:
+                raise PaymentError(f'Bill #{bill_id} is already paid')
+            if not 0 < payment['amount'] <= due:
+                raise PaymentError(f'Amount must be more than 0 and at most {due}')
+            payment_id = self.payment_seq.nextval()
+            self._commit('payment', payment_id, dict(payment, bill_id=bill_id, patient_id=bill['patient_id']))
+            status = bill_status(bill['amount'], bill['paid'])
+            if status != bill['status']:
+                self._commit('bill_status', bill_id, bill['status'], status, bill['amount'])
+        return payment_id
+
+    def payments_for_bill(self, bill_id):
+        rows = self.payment_rows
+        return [(payment_id, rows[payment_id]) for payment_id in self.ledger.payments_by_bill.get(bill_id, ())]
+
+    def statement_for_patient(self, patient_id):
+        return list(self.ledger.statements.get(patient_id, ()))
+
+    # Admin totals
+    def counts(self):
+        return {
+            'doctors': len(self.doctor_rows),
+            'patients': len(self.patient_rows),
+            'appointments': len(self.appointments),
+        }
+
+    def revenue(self):
+        return self.stats.revenue()
+
+    # Reports
+    def report_rows(self):
+        # Lists of values the rows already hold: no per-row tuples for the
+        # garbage collector to walk on a large table
+        with self.write_barrier():
+            archived = list(self.appointments.cold.items())
+            apts = [apt for _, apt in archived] + list(self.appointments.rows.values())
+            bills = self.bill_rows.values()
+            return {
+                'appointments': {
+                    'id': [apt_id for apt_id, _ in archived] + list(self.appointments.rows),
+                    'doctor_id': [apt.doctor_id for apt in apts],
+                    'day': [apt.day for apt in apts],
+                    'state': [apt.state for apt in apts],
+                },
+                'bills': {
+                    'id': list(self.bill_rows),
+                    'appointment_id': [bill.appointment_id or 0 for bill in bills],
+                    'day': [bill.day for bill in bills],
+                    'amount': [bill.amount for bill in bills],
+                    'paid': [bill.paid for bill in bills],
+                    'state': [bill.state for bill in bills],
+                },
+                'last_payment': max(self.payment_rows, default=0),
+            }
+
+    # Search
+    def search_rows(self):
+        with self.write_barrier():
+            patients = self.patient_rows.values()
+            doctors = self.doctor_rows.values()
+            return {
+                'patients': {
+                    'id': list(self.patient_rows),
+                    'name': [p['name'] for p in patients],
+                    'phone': [p.get('phone', '') for p in patients],
+                },
+                'doctors': {
+                    'id': list(self.doctor_rows),
+                    'name': [d['name'] for d in doctors],
+                    'specialization': [d['specialization'] for d in doctors],
+                    'dept_id': [d['dept_id'] for d in doctors],
+                },
+                'departments': {dept_id: d['name'] for dept_id, d in self.dept_rows.items()},
+            }
@@ -0,0 +1,167 @@
+"""
+Smart Healthcare Management System - Appointment Sweeper
+Background housekeeping of the appointments table
+
+- No-shows: every open (SCHEDULED / IN_PROGRESS) appointment sits in a
+  heap ordered by its slot time plus a grace period. The sweeper thread
+  sleeps until the earliest one is due and marks it NO_SHOW, unless it was
+  completed or cancelled meanwhile (the status change is compare-and-set,
+  so stale heap entries are simply skipped)
+- Archiving: once a day, closed appointments older than the horizon are
+  moved to the store's compressed cold segment, see
+  MemoryStore.archive_appointments
+
+The heap is loaded from store.open_appointments() and kept up to date
+from the store's change events, so a sweep never scans the table.
+"""
+
+import time
+import heapq
+import threading
+import traceback
+from datetime import date, datetime, timedelta
+
+OPEN_STATUSES = ('SCHEDULED', 'IN_PROGRESS')
+
+
+def slot_start(day, slot_time):
+    """Epoch seconds of an appointment's slot (end of the day if the time is not a slot time)"""
+    try:
+        return datetime.strptime(f'{day} {slot_time}', '%Y-%m-%d %I:%M %p').timestamp()
+    except (TypeError, ValueError):
+        return (datetime.fromisoformat(day) + timedelta(days=1)).timestamp()
+
+
+class Sweeper:
+    """Thread closing past-due appointments and archiving old ones
+
+    no_show_after: seconds after the slot time before an open appointment
+    becomes a no-show. archive_after_days: age in days after which closed
+    appointments are archived (0 = never). on_close(apt_id) is called for
+    every appointment marked NO_SHOW, e.g. to audit it.
+    """
+
+    # Longest sleep, so changes from other processes are picked up
+    MAX_WAIT = 60.0
+    ARCHIVE_INTERVAL = 24 * 3600
+
+    def __init__(self, store, no_show_after=7200, archive_after_days=365, on_close=None):
+        self.store = store
+        self.no_show_after = no_show_after
+        self.archive_after_days = archive_after_days
+        self.on_close = on_close
+        self.closed = 0
+        self.archived = 0
+        self._heap = []
+        self._reopened = []
+        self._stale = True
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = None
+        self._next_archive = 0.0
+        store.subscribe(self._on_change)
+
+    # Change events (called by writers, so only queue the work)
+    def _on_change(self, event, *args):
+        if event == 'batch':
+            for change, change_args in args[0]:
+                self._on_change(change, *change_args)
+        elif event == 'appointment':
+            apt_id, apt = args
+            if apt['status'] in OPEN_STATUSES:
+                self._push(apt_id, apt['date'], apt['time'])
+        elif event == 'appointment_status':
+            apt_id, old, new = args
+            if new in OPEN_STATUSES and old not in OPEN_STATUSES:
+                with self._lock:
+                    self._reopened.append(apt_id)
+        elif event == 'reset':
+            self._stale = True
+
+    def _push(self, apt_id, day, slot_time):
+        due = slot_start(day, slot_time) + self.no_show_after
+        with self._lock:
+            first = not self._heap or due < self._heap[0][0]
+            heapq.heappush(self._heap, (due, apt_id))
+        if first:
+            self._wake.set()
+
+    def _load(self):
+        self._stale = False
+        heap = [(slot_start(day, slot_time) + self.no_show_after, apt_id)
+                for apt_id, day, slot_time in self.store.open_appointments()]
+        heapq.heapify(heap)
+        with self._lock:
+            self._heap = heap
+            self._reopened = []
+
+    # Work
+    def sweep(self, now=None):
+        """Mark every open appointment due by `now` NO_SHOW, return how many"""
+        if self._stale:
+            self._load()
+        with self._lock:
+            reopened, self._reopened = self._reopened, []
+        for apt_id in reopened:
+            apt = self.store.get_appointment(apt_id)
+            if apt is not None:
+                self._push(apt_id, apt['date'], apt['time'])
+        now = time.time() if now is None else now
+        closed = 0
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, apt_id = heapq.heappop(self._heap)
+            if self.store.transition_appointment(apt_id, 'NO_SHOW', OPEN_STATUSES):
+                closed += 1
+                if self.on_close:
+                    self.on_close(apt_id)
+        self.closed += closed
+        return closed
+
+    def archive(self, today=None):
+        """Archive closed appointments older than the horizon, return how many"""
+        if not self.archive_after_days:
+            return 0
+        before = (today or date.today()) - timedelta(days=self.archive_after_days)
+        moved = self.store.archive_appointments(before.isoformat())
+        self.archived += moved
+        return moved
+
+    def pending(self):
+        """Heap entries not swept yet (some may be closed already)"""
+        with self._lock:
+            return len(self._heap)
+
+    # Thread
+    def start(self):
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='appointment-sweeper', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop:
+            try:
+                self.store.poll_changes()
+                self.sweep()
+                if time.time() >= self._next_archive:
+                    self._next_archive = time.time() + self.ARCHIVE_INTERVAL
+                    self.archive()
+            except Exception:
+                # e.g. a locked database: try again on the next round
+                traceback.print_exc()
+            # Cleared before reading the heap, so an earlier appointment
+            # pushed from here on ends the wait
+            self._wake.clear()
+            with self._lock:
+                wait = self._heap[0][0] - time.time() if self._heap else self.MAX_WAIT
+            self._wake.wait(min(max(wait, 0.0), self.MAX_WAIT))
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,307 @@
+"""
+Smart Healthcare Management System - Background Tasks
+Persistent task queue and a bounded worker pool for side effects
+
+- Routes submit() a task by name with JSON arguments and return at once;
+  the task is a row in a small SQLite table, so it survives a restart
+- A fixed number of worker threads claim due tasks oldest first and run
+  the handler registered under that name
+- A handler that raises is retried after retry_delay, 2 * retry_delay,
+  4 * retry_delay... seconds, and marked FAILED after max_attempts
+- Tasks a crash left RUNNING go back to PENDING on start()
+- Several worker processes can share one queue file: a task is claimed
+  in a write transaction, so exactly one process runs it
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import traceback
+from datetime import datetime
+
+TASK_STATUSES = ('PENDING', 'RUNNING', 'DONE', 'FAILED')
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS TASKS (
+        task_id     INTEGER PRIMARY KEY,
+        name        TEXT NOT NULL,
+        args        TEXT NOT NULL,
+        status      TEXT NOT NULL DEFAULT 'PENDING',
+        attempts    INTEGER NOT NULL DEFAULT 0,
+        run_at      REAL NOT NULL,
+        created_at  TEXT NOT NULL,
+        finished_at TEXT,
+        last_error  TEXT,
+        owner       INTEGER
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_task_due ON TASKS(status, run_at)',
+]
+
+TASK_COLUMNS = ('id', 'name', 'args', 'status', 'attempts', 'created_at', 'finished_at', 'last_error')
+
+
+def now_iso():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by another user
+    return True
+
+# ============================================
+# Queue
+# ============================================
+
+class TaskQueue:
+    """TASKS table in a SQLite file (':memory:' keeps nothing across restarts)
+
+    One connection is shared by every thread under a lock; each
+    operation is a statement or two, so the lock is held only briefly.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode = WAL')
+            self._conn.execute('PRAGMA synchronous = NORMAL')
+        for stmt in SCHEMA:
+            self._conn.execute(stmt)
+        if 'owner' not in {row[1] for row in self._conn.execute('PRAGMA table_info(TASKS)')}:
+            # Queue file from before tasks recorded the process running them
+            self._conn.execute('ALTER TABLE TASKS ADD COLUMN owner INTEGER')
+        self._lock = threading.Lock()
+
+    def put(self, name, args, delay=0):
+        with self._lock:
+            cur = self._conn.execute(
+                'INSERT INTO TASKS (name, args, run_at, created_at) VALUES (?, ?, ?, ?)',
+                (name, json.dumps(args), time.time() + delay, now_iso()))
+        return cur.lastrowid
+
+    def claim(self):
+        """(id, name, args, attempt) of the oldest due task, marked RUNNING (None if none is due)"""
+        with self._lock:
+            # IMMEDIATE takes the write lock before the read, so another
+            # process cannot claim the same task in between
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    '''SELECT task_id, name, args, attempts FROM TASKS
+                       WHERE status = 'PENDING' AND run_at <= ? ORDER BY run_at LIMIT 1''',
+                    (time.time(),)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE TASKS SET status = 'RUNNING', attempts = attempts + 1, owner = ? WHERE task_id = ?",
+                        (os.getpid(), row[0]))
+            finally:
+                self._conn.execute('COMMIT')
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2]), row[3] + 1
+
+    def next_due(self):
+        """Seconds until the next pending task is due (None if there is none)"""
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(run_at) FROM TASKS WHERE status = 'PENDING'").fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def done(self, task_id):
+        self._finish(task_id, 'DONE', None)
+
+    def fail(self, task_id, error):
+        self._finish(task_id, 'FAILED', error)
+
+    def _finish(self, task_id, status, error):
+        with self._lock:
+            self._conn.execute('UPDATE TASKS SET status = ?, finished_at = ?, last_error = ? WHERE task_id = ?',
+                               (status, now_iso(), error, task_id))
+
+    def retry(self, task_id, delay, error):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE TASKS SET status = 'PENDING', run_at = ?, last_error = ? WHERE task_id = ?",
+                (time.time() + delay, error, task_id))
+
+    def recover(self):
+        """Put tasks that were RUNNING when their process stopped back in the queue
+
+        Tasks another live process is running are left to it.
+        """
+        with self._lock:
+            owners = [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT owner FROM TASKS WHERE status = 'RUNNING'")]
+            recovered = 0
+            for owner in owners:
+                if owner is None or owner == os.getpid() or not process_alive(owner):
+                    recovered += self._conn.execute(
+                        "UPDATE TASKS SET status = 'PENDING' WHERE status = 'RUNNING' AND owner IS ?",
+                        (owner,)).rowcount
+            return recovered
+
+    def prune(self, keep_seconds):
+        """Delete DONE tasks finished more than keep_seconds ago"""
+        cutoff = datetime.fromtimestamp(time.time() - keep_seconds).isoformat(timespec='seconds')
+        with self._lock:
+            return self._conn.execute("DELETE FROM TASKS WHERE status = 'DONE' AND finished_at < ?",
+                                      (cutoff,)).rowcount
+
+    def counts(self):
+        """{status: number of tasks}"""
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM TASKS GROUP BY status').fetchall()
+        counts = dict.fromkeys(TASK_STATUSES, 0)
+        counts.update(rows)
+        return counts
+
+    def recent(self, limit, status=None):
+        """Newest tasks first, as dicts"""
+        where, params = ('WHERE status = ?', (status, limit)) if status else ('', (limit,))
+        with self._lock:
+            rows = self._conn.execute(
+                f'''SELECT task_id, name, args, status, attempts, created_at, finished_at, last_error
+                    FROM TASKS {where} ORDER BY task_id DESC LIMIT ?''', params).fetchall()
+        return [dict(zip(TASK_COLUMNS, row[:2] + (json.loads(row[2]),) + row[3:])) for row in rows]
+
+    def get(self, task_id):
+        with self._lock:
+            row = self._conn.execute(
+                '''SELECT task_id, name, args, status, attempts, created_at, finished_at, last_error
+                   FROM TASKS WHERE task_id = ?''', (task_id,)).fetchone()
+        return dict(zip(TASK_COLUMNS, row[:2] + (json.loads(row[2]),) + row[3:])) if row else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# ============================================
+# Executor
+# ============================================
+
+class TaskExecutor:
+    """Fixed pool of worker threads running the tasks of a TaskQueue
+
+        @executor.task('send_email')
+        def send_email(to, subject, body): ...
+
+        executor.submit('send_email', to=..., subject=..., body=...)
+    """
+
+    # Done tasks are kept this long for the status endpoint
+    KEEP_DONE_SECONDS = 24 * 3600
+
+    def __init__(self, queue, workers=2, max_attempts=5, retry_delay=1.0, on_finish=None):
+        self.queue = queue
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # on_finish(name, outcome, seconds), e.g. for metrics
+        self.on_finish = on_finish
+        self.handlers = {}
+        self._threads = []
+        self._running = 0
+        self._wake = threading.Condition()
+        self._stop = False
+        self._finished = 0
+
+    def task(self, name):
+        """Decorator registering a handler under `name`"""
+        def register(handler):
+            self.handlers[name] = handler
+            return handler
+        return register
+
+    def submit(self, name, delay=0, **args):
+        """Queue a task, return its id (the caller does not wait for it)"""
+        # Queued under the condition, so an idle worker either sees the
+        # task in next_due() or is already waiting for this notify
+        with self._wake:
+            task_id = self.queue.put(name, args, delay)
+            self._wake.notify()
+        return task_id
+
+    def start(self):
+        self.queue.recover()
+        self._stop = False
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'task-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        """Let the workers finish their current task and exit"""
+        with self._wake:
+            self._stop = True
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def drain(self, timeout=10.0):
+        """Wait until no task is due or running (True) or the timeout passes (False)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._wake:
+                idle = self._running == 0
+            if idle and self.queue.next_due() != 0.0:
+                return True
+            time.sleep(0.005)
+        return False
+
+    def _work(self):
+        while True:
+            with self._wake:
+                if self._stop:
+                    return
+                # Counted before the claim, so drain() never sees a claimed
+                # task that is not running yet
+                self._running += 1
+            claimed = None
+            try:
+                claimed = self.queue.claim()
+                if claimed is not None:
+                    self._run(*claimed)
+            finally:
+                with self._wake:
+                    self._running -= 1
+            if claimed is None:
+                with self._wake:
+                    wait = self.queue.next_due()
+                    if not self._stop and wait != 0.0:
+                        self._wake.wait(1.0 if wait is None else min(wait, 1.0))
+
+    def _run(self, task_id, name, args, attempt):
+        handler = self.handlers.get(name)
+        if handler is None:
+            self.queue.fail(task_id, f'no handler for task {name!r}')
+            self._finished_one(name, 'failed', 0.0)
+            return
+        t0 = time.perf_counter()
+        try:
+            handler(**args)
+        except Exception:
+            error = traceback.format_exc(limit=3)
+            if attempt >= self.max_attempts:
+                self.queue.fail(task_id, error)
+                outcome = 'failed'
+            else:
+                self.queue.retry(task_id, self.retry_delay * 2 ** (attempt - 1), error)
+                outcome = 'retried'
+        else:
+            self.queue.done(task_id)
+            outcome = 'done'
+        self._finished_one(name, outcome, time.perf_counter() - t0)
+
+    def _finished_one(self, name, outcome, seconds):
+        if self.on_finish is not None:
+            self.on_finish(name, outcome, seconds)
+        self._finished += 1
+        if self._finished % 1000 == 0:
+            self.queue.prune(self.KEEP_DONE_SECONDS)
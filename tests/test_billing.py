@@ -0,0 +1,80 @@
+"""
+Admin dashboard revenue after partial payments, on both stores
+
+Run with `python -m unittest discover tests` (or pytest)
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import create_app
+
+
+class DashboardRevenueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='healthcare-test-billing-')
+        self.apps = []
+
+    def tearDown(self):
+        for app in self.apps:
+            services = app.extensions['healthcare']
+            if services.sweeper is not None:
+                services.sweeper.stop()
+            services.tasks.stop()
+            services.audit_log.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def create_app(self, backend):
+        app = create_app({
+            'STORE_BACKEND': backend,
+            'SQLITE_PATH': os.path.join(self.directory, f'{backend}.db'),
+            'AUDIT_DIR': os.path.join(self.directory, f'{backend}-audit'),
+            'RECEIPT_DIR': os.path.join(self.directory, 'receipts'),
+            'TASK_QUEUE_PATH': ':memory:',
+            'TEMPLATE_CACHE': False,
+        })
+        self.apps.append(app)
+        return app
+
+    def login(self, app, username, password):
+        client = app.test_client()
+        response = client.post('/login', data={'username': username, 'password': password})
+        self.assertEqual(response.status_code, 302)
+        return client
+
+    def test_partial_payment(self):
+        for backend in ('memory', 'sqlite'):
+            with self.subTest(backend=backend):
+                app = self.create_app(backend)
+                patient = self.login(app, 'patient_raj', 'pat123')
+                admin = self.login(app, 'admin1', 'admin123')
+                store = app.extensions['healthcare'].store
+                self.assertEqual(store.revenue(), {'collected': 0, 'outstanding': 0})
+
+                bill = {'appointment_id': None, 'patient_id': 1, 'date': '2024-01-02', 'description': 'Consultation'}
+                store.add_bill(dict(bill, amount=500, status='PAID'))
+                bill_id = store.add_bill(dict(bill, amount=800, status='PENDING'))
+                response = patient.post(f'/patient/pay-bill/{bill_id}', data={'amount': '300', 'method': 'UPI'})
+                self.assertEqual(response.status_code, 302)
+                self.assertEqual(store.get_bill(bill_id)['status'], 'PARTIAL')
+
+                # Paid so far: the PAID bill and the payment; still due: the rest of the partly paid bill
+                self.assertEqual(store.revenue(), {'collected': 800, 'outstanding': 500})
+                page = admin.get('/admin/dashboard').get_data(as_text=True)
+                self.assertRegex(page, r'₹800(\.0)?</span>\s*<span class="stat-label">Revenue \(Paid\)')
+                self.assertRegex(page, r'₹500(\.0)?</span>\s*<span class="stat-label">Pending Payments')
+
+                patient.post(f'/patient/pay-bill/{bill_id}', data={'amount': '500', 'method': 'CARD'})
+                self.assertEqual(store.get_bill(bill_id)['status'], 'PAID')
+                self.assertEqual(store.revenue(), {'collected': 1300, 'outstanding': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+importer.py run from the command line while the app serves the same
+SQLite store and audit directory
+
+Run with `python -m unittest discover tests` (or pytest)
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import create_app
+from audit import index_path, read_index, segment_numbers, worker_directories
+
+PATIENTS_CSV = '''username,password,first_name,last_name,dob,phone
+cli_one,pw,Zorba,Quill,1990-01-01,5550001
+cli_two,pw,Zelda,Quill,1991-02-02,5550002
+'''
+
+# Doctor 1 at 09:00 AM on 2030-03-04 is booked through the app first
+APPOINTMENTS_CSV = '''patient_username,doctor_id,date,time,status
+cli_one,1,2030-03-04,09:00 AM,COMPLETED
+cli_one,1,2030-03-04,09:30 AM,COMPLETED
+cli_two,1,2030-03-04,09:30 AM,COMPLETED
+cli_two,1,2030-03-04,09:30 AM,CANCELLED
+'''
+
+
+class ImportCommandLineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='healthcare-test-import-')
+        self.settings = {
+            'STORE_BACKEND': 'sqlite',
+            'SQLITE_PATH': os.path.join(self.directory, 'healthcare.db'),
+            'AUDIT_DIR': os.path.join(self.directory, 'audit'),
+            'RECEIPT_DIR': os.path.join(self.directory, 'receipts'),
+            'TASK_QUEUE_PATH': ':memory:',
+            'TEMPLATE_CACHE': False,
+        }
+        self.app = create_app(self.settings)
+        self.services = self.app.extensions['healthcare']
+        self.admin = self.login('admin1', 'admin123')
+        self.patient = self.login('patient_raj', 'pat123')
+
+    def tearDown(self):
+        services = self.services
+        if services.sweeper is not None:
+            services.sweeper.stop()
+        services.tasks.stop()
+        services.audit_log.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def login(self, username, password):
+        client = self.app.test_client()
+        response = client.post('/login', data={'username': username, 'password': password})
+        self.assertEqual(response.status_code, 302)
+        return client
+
+    def run_importer(self, kind, text):
+        path = os.path.join(self.directory, f'{kind}.csv')
+        with open(path, 'w') as f:
+            f.write(text)
+        env = {name: value for name, value in os.environ.items() if not name.startswith('HEALTHCARE_')}
+        env.update(HEALTHCARE_STORE='sqlite', HEALTHCARE_SQLITE_PATH=self.settings['SQLITE_PATH'],
+                   HEALTHCARE_AUDIT_DIR=self.settings['AUDIT_DIR'],
+                   HEALTHCARE_RECEIPT_DIR=self.settings['RECEIPT_DIR'], HEALTHCARE_TEMPLATE_CACHE='0')
+        return subprocess.run([sys.executable, os.path.join(ROOT, 'importer.py'), kind, path],
+                              cwd=self.directory, env=env, capture_output=True, text=True, timeout=60)
+
+    def audit_trail(self, patient_id):
+        response = self.admin.get(f'/api/admin/audit/{patient_id}?limit=100')
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['entries']
+
+    def test_import_into_live_store(self):
+        # The app's store, background threads and audit log are running
+        self.assertEqual(self.patient.get('/patient/dashboard').status_code, 200)
+        response = self.patient.post('/patient/book-appointment', data={
+            'doctor_id': '1', 'appointment_date': '2030-03-04', 'appointment_time': '09:00 AM', 'reason': 'x'})
+        self.assertEqual(response.status_code, 302)
+        reads_before = len(self.audit_trail(1))
+
+        result = self.run_importer('patients', PATIENTS_CSV)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('2 imported, 0 rejected', result.stdout)
+
+        # The app sees the new patients, its search index included
+        response = self.admin.get('/api/search/patients?q=quill')
+        names = sorted(match['name'] for match in response.get_json())
+        self.assertEqual(names, ['Zelda Quill', 'Zorba Quill'])
+        patient_id = next(match['id'] for match in response.get_json() if match['name'] == 'Zorba Quill')
+
+        result = self.run_importer('appointments', APPOINTMENTS_CSV)
+        self.assertEqual(result.returncode, 1)
+        self.assertIn('2 imported, 2 rejected', result.stdout)
+        self.assertIn("line 2: slot already exists: (1, '2030-03-04', '09:00 AM')", result.stderr)
+        self.assertIn("line 4: slot already exists: (1, '2030-03-04', '09:30 AM')", result.stderr)
+        self.assertEqual(self.services.store.free_slots(1, '2030-03-04')[:2], ['10:00 AM', '10:30 AM'])
+
+        # The import's audit entries are in a log of its own, merged into the app's queries
+        imports = [path for path in worker_directories(self.settings['AUDIT_DIR'])
+                   if os.path.basename(path).startswith('import-')]
+        self.assertEqual(len(imports), 1)
+        created = [entry for entry in self.audit_trail(patient_id) if entry['action'] == 'CREATE']
+        self.assertEqual([(entry['changed_by'], entry['role']) for entry in created], [('import', 'SYSTEM')])
+
+        # The app's own log carries on, and every index line of both is whole
+        self.assertEqual(self.patient.get('/patient/records').status_code, 200)
+        self.assertGreater(len(self.audit_trail(1)), reads_before)
+        self.services.audit_log.flush()
+        for path in [self.settings['AUDIT_DIR']] + imports:
+            for number in segment_numbers(path):
+                with open(index_path(path, number)) as f:
+                    lines = f.read().splitlines()
+                self.assertEqual(len(read_index(index_path(path, number))), len(lines))
+                self.assertTrue(all(json.loads(line)['patients'] for line in lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+"""
+Several processes booking the same slots on one SQLite database
+
+Each process runs its own app as one worker of serve.py would (shared
+store, CHANGES feed polled before every request).
+
+Run with `python -m unittest discover tests` (or pytest)
+"""
+
+import os
+import sys
+import random
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from store import SLOT_TIMES
+
+WORKERS = 4
+DOCTORS = (1, 2)
+DAYS = ('2031-05-05', '2031-05-06')
+
+
+def slots():
+    return [(doctor_id, day, slot_time) for doctor_id in DOCTORS for day in DAYS for slot_time in SLOT_TIMES]
+
+
+def book_slots(settings, worker_id, start, done, results):
+    """Worker process: try every slot in its own order, then read the free slots back"""
+    from app import create_app
+    app = create_app(dict(settings, WORKER_ID=worker_id))
+    services = app.extensions['healthcare']
+    try:
+        client = app.test_client()
+        client.post('/login', data={'username': 'patient_raj', 'password': 'pat123'})
+        order = slots()
+        random.Random(worker_id).shuffle(order)
+        booked = []
+        start.wait()
+        for doctor_id, day, slot_time in order:
+            response = client.post('/patient/book-appointment', data={
+                'doctor_id': str(doctor_id), 'appointment_date': day, 'appointment_time': slot_time, 'reason': 'x'})
+            if response.headers['Location'].endswith('/patient/appointments'):
+                booked.append((doctor_id, day, slot_time))
+        # Bookings made by the other processes reach this one through the feed
+        done.wait()
+        free = {(doctor_id, day): client.get(f'/api/available-slots/{doctor_id}/{day}').get_json()
+                for doctor_id in DOCTORS for day in DAYS}
+        results.put((worker_id, booked, free))
+    finally:
+        if services.sweeper is not None:
+            services.sweeper.stop()
+        services.tasks.stop()
+        services.audit_log.close()
+
+
+class MultiProcessBookingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='healthcare-test-multiprocess-')
+        self.path = os.path.join(self.directory, 'healthcare.db')
+        self.settings = {
+            'STORE_BACKEND': 'sqlite',
+            'SQLITE_PATH': self.path,
+            'AUDIT_DIR': os.path.join(self.directory, 'audit'),
+            'RECEIPT_DIR': os.path.join(self.directory, 'receipts'),
+            'TASK_QUEUE_PATH': ':memory:',
+            'TEMPLATE_CACHE': False,
+            'WORKERS': WORKERS,
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_one_booking_per_slot(self):
+        context = multiprocessing.get_context('spawn')
+        start, done, results = context.Barrier(WORKERS), context.Barrier(WORKERS), context.Queue()
+        processes = [context.Process(target=book_slots, args=(self.settings, worker_id, start, done, results))
+                     for worker_id in range(WORKERS)]
+        for process in processes:
+            process.start()
+        try:
+            answers = [results.get(timeout=120) for _ in processes]
+        finally:
+            for process in processes:
+                process.join(30)
+                if process.is_alive():
+                    process.terminate()
+        self.assertEqual([process.exitcode for process in processes], [0] * WORKERS)
+
+        # Every slot went to exactly one process
+        booked = sorted(slot for _, slots_booked, _ in answers for slot in slots_booked)
+        self.assertEqual(booked, sorted(slots()))
+        with sqlite3.connect(self.path) as conn:
+            rows = conn.execute(
+                '''SELECT doctor_id, appointment_date, appointment_time, COUNT(*) FROM APPOINTMENTS
+                   WHERE appointment_date IN (?, ?) AND status != 'CANCELLED'
+                   GROUP BY doctor_id, appointment_date, appointment_time''', DAYS).fetchall()
+        self.assertEqual(sorted(row[:3] for row in rows), sorted(slots()))
+        self.assertEqual({row[3] for row in rows}, {1})
+
+        # And every process sees them all taken
+        for worker_id, _, free in answers:
+            self.assertEqual(free, {(doctor_id, day): [] for doctor_id in DOCTORS for day in DAYS}, worker_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
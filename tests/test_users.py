@@ -0,0 +1,97 @@
+"""
+Concurrent registrations of one username or email, on both stores
+
+Run with `python -m unittest discover tests` (or pytest)
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import create_app
+from store import DuplicateKeyError
+
+THREADS = 16
+
+
+class ConcurrentRegistrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='healthcare-test-users-')
+        self.apps = []
+
+    def tearDown(self):
+        for app in self.apps:
+            services = app.extensions['healthcare']
+            if services.sweeper is not None:
+                services.sweeper.stop()
+            services.tasks.stop()
+            services.audit_log.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def create_store(self, backend):
+        app = create_app({
+            'STORE_BACKEND': backend,
+            'SQLITE_PATH': os.path.join(self.directory, f'{backend}.db'),
+            'AUDIT_DIR': os.path.join(self.directory, f'{backend}-audit'),
+            'RECEIPT_DIR': os.path.join(self.directory, 'receipts'),
+            'TASK_QUEUE_PATH': ':memory:',
+            'TEMPLATE_CACHE': False,
+        })
+        self.apps.append(app)
+        return app.extensions['healthcare'].store
+
+    def register_at_once(self, store, user):
+        """Register user(n) from THREADS threads released together: (user_ids, errors)"""
+        start = threading.Barrier(THREADS)
+        user_ids, errors = [], []
+
+        def register(n):
+            start.wait()
+            try:
+                user_id, _ = store.register_patient(dict(user(n), password='pw', role='PATIENT', name='Same Name'), {
+                    'name': 'Same Name', 'dob': '1990-01-01', 'gender': 'Female', 'phone': '5550000',
+                    'blood_group': 'O+', 'address': 'Street, Pune',
+                })
+                user_ids.append(user_id)
+            except DuplicateKeyError as e:
+                errors.append(e.field)
+
+        threads = [threading.Thread(target=register, args=(n,)) for n in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return user_ids, errors
+
+    def test_same_username(self):
+        for backend in ('memory', 'sqlite'):
+            with self.subTest(backend=backend):
+                store = self.create_store(backend)
+                user_ids, errors = self.register_at_once(
+                    store, lambda n: {'username': 'same_user', 'email': f'same_user_{n}@email.com'})
+                self.assertEqual(len(user_ids), 1)
+                self.assertEqual(errors, ['username'] * (THREADS - 1))
+                self.assertEqual(store.find_user('same_user')[0], user_ids[0])
+
+    def test_same_email(self):
+        for backend in ('memory', 'sqlite'):
+            with self.subTest(backend=backend):
+                store = self.create_store(backend)
+                user_ids, errors = self.register_at_once(
+                    store, lambda n: {'username': f'same_email_{n}', 'email': 'same_email@email.com'})
+                self.assertEqual(len(user_ids), 1)
+                self.assertEqual(errors, ['email'] * (THREADS - 1))
+                registered = [n for n in range(THREADS) if store.find_user(f'same_email_{n}')[0] is not None]
+                self.assertEqual(len(registered), 1)
+                self.assertEqual(store.find_user(f'same_email_{registered[0]}')[0], user_ids[0])
+
+
+if __name__ == '__main__':
+    unittest.main()